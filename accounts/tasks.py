@@ -3,15 +3,34 @@
 import requests
 from datetime import datetime, timezone, timedelta
 import traceback
-from shapely.geometry import Point, Polygon # For point-in-polygon checks
+import numpy as np
+import shapely # For point-in-polygon checks
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db.models import Subquery, OuterRef
 from .models import UserLocationHistory # From accounts.models
+from subscriptions.alert_snapshot import get_alert_snapshot
+from subscriptions.zone_geometry import get_zone_geometry_index, get_alert_geometries
 
 User = get_user_model()
 
+def find_locations_in_polygons(polygons, longitudes, latitudes):
+    """
+    Boolean array: which (longitude, latitude) points lie inside any of polygons.
+    The points go into an STRtree and every polygon is queried against it in one
+    vectorized call; GEOS prepares each polygon once and tests only the points in
+    its bounding box, instead of every point against every polygon.
+    """
+    inside = np.zeros(len(longitudes), dtype=bool)
+    if not polygons or not len(longitudes):
+        return inside
+    tree = shapely.STRtree(shapely.points(longitudes, latitudes))
+    _, point_indices = tree.query(polygons, predicate='contains') # (polygon index, point index) pairs
+    inside[point_indices] = True
+    return inside
+
+
 def check_locations_against_warnings():
     """
     A Django Q task that checks the latest location of each user against active NWS
@@ -20,44 +39,46 @@ def check_locations_against_warnings():
     start_time = datetime.now(timezone.utc)
     print(f"[{start_time.isoformat()}] TASK_FAMILY_MAP: Running task: check_locations_against_warnings")
 
-    # 1. Fetch all active NWS warnings with polygon geometries
+    # 1. Fetch all active NWS warnings with their polygons (or, for zone-based ones, their zone boundaries)
+    warning_events = [
+        "Tornado Warning",
+        "Severe Thunderstorm Warning",
+        "Flash Flood Warning",
+        "Extreme Wind Warning"
+        # Add other high-priority warning types as needed
+    ]
     active_warning_polygons = []
-    try:
-        # We fetch for severe thunderstorm, tornado, and flash flood warnings. You can add more.
-        # event_types = "SVR,TOR,FFW" # This would be ideal but NWS API might not filter by multiple events this way
-        # For now, we fetch all active alerts and filter them.
-        nws_alerts_url = "https://api.weather.gov/alerts/active?status=actual&message_type=alert"
-        user_agent = getattr(settings, 'ADMIN_EMAIL_FOR_NWS_USER_AGENT', 'DjangoWeatherApp/1.0')
-        headers = {'User-Agent': user_agent, 'Accept': 'application/geo+json'}
-
-        print("TASK_FAMILY_MAP: Fetching active NWS alerts...")
-        response = requests.get(nws_alerts_url, headers=headers, timeout=60)
-        response.raise_for_status()
-        alerts_data = response.json()
-
-        warning_events = [
-            "Tornado Warning", 
-            "Severe Thunderstorm Warning", 
-            "Flash Flood Warning",
-            "Extreme Wind Warning"
-            # Add other high-priority warning types as needed
-        ]
-
-        for alert in alerts_data.get('features', []):
-            if (alert.get('geometry') and 
-                alert.get('properties', {}).get('event') in warning_events):
-                # NWS Polygons are often a list containing a list of coordinate pairs
-                # e.g., "geometry": { "type": "Polygon", "coordinates": [[ [-95, 36], ... ]]}
-                coords = alert['geometry']['coordinates'][0] 
-                if len(coords) >= 4: # Need at least 4 points for a valid polygon (first and last are same)
-                    active_warning_polygons.append(Polygon(coords))
-
-        print(f"TASK_FAMILY_MAP: Found {len(active_warning_polygons)} active high-priority warning polygons.")
-
-    except Exception as e:
-        print(f"TASK_FAMILY_MAP_ERROR: Could not fetch or process NWS alert polygons: {e}")
-        traceback.print_exc()
-        return # Exit the task if we can't get alerts
+    alert_snapshot = get_alert_snapshot()
+    if alert_snapshot is not None:
+        # The shared national snapshot (subscriptions/alert_snapshot.py), refreshed every minute
+        active_warning_polygons = alert_snapshot.shapes_for_events(set(warning_events))
+        print(f"TASK_FAMILY_MAP: Found {len(active_warning_polygons)} active high-priority warning polygons in the alert snapshot.")
+    else:
+        try:
+            # No fresh snapshot, so ask NWS directly.
+            # event_types = "SVR,TOR,FFW" # This would be ideal but NWS API might not filter by multiple events this way
+            # For now, we fetch all active alerts and filter them.
+            nws_alerts_url = "https://api.weather.gov/alerts/active?status=actual&message_type=alert"
+            user_agent = getattr(settings, 'ADMIN_EMAIL_FOR_NWS_USER_AGENT', 'DjangoWeatherApp/1.0')
+            headers = {'User-Agent': user_agent, 'Accept': 'application/geo+json'}
+
+            print("TASK_FAMILY_MAP: Fetching active NWS alerts...")
+            response = requests.get(nws_alerts_url, headers=headers, timeout=60)
+            response.raise_for_status()
+            alerts_data = response.json()
+
+            zone_index = get_zone_geometry_index() # Boundaries for warnings issued by zone (subscriptions/zone_geometry.py)
+            for alert in alerts_data.get('features', []):
+                if alert.get('properties', {}).get('event') in warning_events:
+                    # Whole (Multi)Polygon, or the alert's zone boundaries when it has no geometry
+                    active_warning_polygons.extend(get_alert_geometries(alert, zone_index))
+
+            print(f"TASK_FAMILY_MAP: Found {len(active_warning_polygons)} active high-priority warning polygons.")
+
+        except Exception as e:
+            print(f"TASK_FAMILY_MAP_ERROR: Could not fetch or process NWS alert polygons: {e}")
+            traceback.print_exc()
+            return # Exit the task if we can't get alerts
 
     # 2. Get the latest location for every user who is sharing their location
     # We find the ID of the most recent history record for each user.
@@ -67,26 +88,21 @@ def check_locations_against_warnings():
 
     # Then we get the full objects for those latest records.
     # We only need to check locations updated in the last, say, 30 minutes.
-    recent_time_filter = timezone.now() - timedelta(minutes=30)
-    latest_user_locations = UserLocationHistory.objects.filter(
+    recent_time_filter = datetime.now(timezone.utc) - timedelta(minutes=30)
+    latest_user_locations = list(UserLocationHistory.objects.filter(
         pk=Subquery(latest_locations_subquery.values('pk')[:1]),
         timestamp__gte=recent_time_filter
-    ).select_related('user')
-
-    print(f"TASK_FAMILY_MAP: Found {latest_user_locations.count()} recent user location updates to check.")
+    ).values_list('pk', 'longitude', 'latitude')) # Only what the check needs, no model instances
 
-    # 3. Check each location against the warning polygons
-    users_in_warned_area_pks = set()
-    for loc_history in latest_user_locations:
-        user_point = Point(loc_history.longitude, loc_history.latitude)
-        is_warned = False
-        for polygon in active_warning_polygons:
-            if polygon.contains(user_point):
-                is_warned = True
-                break # Stop checking polygons if we found one
+    print(f"TASK_FAMILY_MAP: Found {len(latest_user_locations)} recent user location updates to check.")
 
-        if is_warned:
-            users_in_warned_area_pks.add(loc_history.pk)
+    # 3. Check all locations against the warning polygons at once
+    checked_pks = [pk for pk, _, _ in latest_user_locations]
+    longitudes = np.array([longitude for _, longitude, _ in latest_user_locations], dtype=np.float64)
+    latitudes = np.array([latitude for _, _, latitude in latest_user_locations], dtype=np.float64)
+    in_warned_area = find_locations_in_polygons(active_warning_polygons, longitudes, latitudes)
+    users_in_warned_area_pks = [pk for pk, is_warned in zip(checked_pks, in_warned_area) if is_warned]
+    users_not_in_warned_area_pks = [pk for pk, is_warned in zip(checked_pks, in_warned_area) if not is_warned]
 
     print(f"TASK_FAMILY_MAP: Identified {len(users_in_warned_area_pks)} location records within warned areas.")
 
@@ -96,9 +112,7 @@ def check_locations_against_warnings():
 
     # Set is_in_warned_area to False for all other recent locations that were checked
     updated_false_count = UserLocationHistory.objects.filter(
-        pk__in=[loc.pk for loc in latest_user_locations] # The set of locations we checked
-    ).exclude(
-        pk__in=users_in_warned_area_pks # Exclude those we just marked as True
+        pk__in=users_not_in_warned_area_pks
     ).update(is_in_warned_area=False)
 
     print(f"TASK_FAMILY_MAP: Bulk update complete. Marked {updated_true_count} as warned, {updated_false_count} as not warned.")
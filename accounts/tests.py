@@ -1,3 +1,106 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase
+from shapely.geometry import MultiPolygon, Polygon, box
+
+from subscriptions.zone_geometry import (save_zone_geometries, _load_zone_geometry_file, get_alert_zone_keys,
+                                         get_alert_geometries)
+from .tasks import find_locations_in_polygons
+
+
+class FindLocationsInPolygonsTests(SimpleTestCase):
+    """accounts.tasks.find_locations_in_polygons: the point-in-warning check for every user location at once."""
+
+    # (longitude, latitude): Oklahoma City, Tulsa, Dallas, Denver
+    LONGITUDES = np.array([-97.52, -95.99, -96.80, -104.99])
+    LATITUDES = np.array([35.47, 36.15, 32.78, 39.74])
+
+    def test_points_inside_and_outside(self):
+        oklahoma_city_box = box(-98.0, 35.0, -97.0, 36.0)
+        inside = find_locations_in_polygons([oklahoma_city_box], self.LONGITUDES, self.LATITUDES)
+        self.assertEqual(inside.tolist(), [True, False, False, False])
+
+    def test_any_of_several_polygons(self):
+        # A triangle over Tulsa and a box over Denver; Dallas is in neither
+        tulsa_triangle = Polygon([(-96.5, 35.5), (-95.5, 35.5), (-96.0, 36.8)])
+        denver_box = box(-105.5, 39.5, -104.5, 40.0)
+        inside = find_locations_in_polygons([tulsa_triangle, denver_box], self.LONGITUDES, self.LATITUDES)
+        self.assertEqual(inside.tolist(), [False, True, False, True])
+
+    def test_multipolygon(self):
+        # One zone-based alert covering two separate areas
+        multi = MultiPolygon([box(-98.0, 35.0, -97.0, 36.0), box(-97.5, 32.5, -96.5, 33.0)])
+        inside = find_locations_in_polygons([multi], self.LONGITUDES, self.LATITUDES)
+        self.assertEqual(inside.tolist(), [True, False, True, False])
+
+    def test_overlapping_polygons_count_once(self):
+        inside = find_locations_in_polygons([box(-98.0, 35.0, -97.0, 36.0), box(-99.0, 34.0, -96.5, 37.0)],
+                                            self.LONGITUDES, self.LATITUDES)
+        self.assertEqual(inside.tolist(), [True, False, False, False])
+
+    def test_empty_inputs(self):
+        self.assertEqual(find_locations_in_polygons([], self.LONGITUDES, self.LATITUDES).tolist(), [False] * 4)
+        no_points = find_locations_in_polygons([box(-98.0, 35.0, -97.0, 36.0)], np.array([]), np.array([]))
+        self.assertEqual(no_points.shape, (0,))
+        self.assertEqual(no_points.dtype, bool)
+
+
+class ZoneGeometryTests(SimpleTestCase):
+    """subscriptions/zone_geometry.py: the zone boundary store the zone-based warning check reads."""
+
+    # Oklahoma City, Tulsa, Dallas, Denver, as in FindLocationsInPolygonsTests
+    LONGITUDES = FindLocationsInPolygonsTests.LONGITUDES
+    LATITUDES = FindLocationsInPolygonsTests.LATITUDES
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.zone_geometry_path = os.path.join(self.temp_dir, 'alerts', 'zone_geometries.npz')
+
+    def test_save_and_load_round_trip(self):
+        zones = [
+            ('county/OKC109', box(-97.7, 35.3, -97.1, 35.7)),
+            ('forecast/OKZ025', Polygon([(-98.0, 36.0), (-97.0, 36.0), (-97.5, 36.8)])),
+            ('fire/OKZ025', MultiPolygon([box(-98.0, 35.0, -97.0, 36.0), box(-96.0, 35.0, -95.5, 35.5)])),
+        ]
+        save_zone_geometries(zones, self.zone_geometry_path)
+        self.assertEqual(os.listdir(os.path.dirname(self.zone_geometry_path)), ['zone_geometries.npz']) # No temp file left
+        with np.load(self.zone_geometry_path, allow_pickle=False) as stored: # Plain arrays, no pickles
+            self.assertEqual(stored['wkb'].dtype, np.uint8)
+            self.assertEqual(stored['offsets'].tolist()[-1], stored['wkb'].size)
+
+        zone_index = _load_zone_geometry_file(self.zone_geometry_path)
+        self.assertEqual(zone_index.keys, [key for key, _ in zones])
+        for (key, geometry), loaded in zip(zones, zone_index.geometries):
+            with self.subTest(key=key):
+                self.assertTrue(loaded.equals(geometry))
+        self.assertEqual(len(zone_index.geometries_for_zones(['county/OKC109', 'county/TXC113'])), 1)
+
+    def test_empty_store(self):
+        save_zone_geometries([], self.zone_geometry_path)
+        zone_index = _load_zone_geometry_file(self.zone_geometry_path)
+        self.assertEqual((zone_index.keys, zone_index.geometries), ([], []))
+
+    def test_alert_zone_keys(self):
+        # Trimmed snapshot features, raw NWS features, then only UGC codes (C = county, Z = forecast zone)
+        self.assertEqual(get_alert_zone_keys({'properties': {'affected_zones': ['county/OKC109']}}), ['county/OKC109'])
+        raw_feature = {'properties': {'affectedZones': ['https://api.weather.gov/zones/forecast/OKZ025']}}
+        self.assertEqual(get_alert_zone_keys(raw_feature), ['forecast/OKZ025'])
+        self.assertEqual(get_alert_zone_keys({'properties': {'ugc': ['OKC109', 'OKZ025']}}),
+                         ['county/OKC109', 'forecast/OKZ025'])
+        self.assertEqual(get_alert_zone_keys({'properties': {'geocode': {'UGC': ['OKZ025']}}}), ['forecast/OKZ025'])
+        self.assertEqual(get_alert_zone_keys({'properties': {'ugc': ['OK', 'OKC1090', 'OKX109']}}), []) # Malformed
+        self.assertEqual(get_alert_zone_keys({'properties': {}}), [])
+
+    def test_alert_geometries_from_zones(self):
+        save_zone_geometries([('county/OKC109', box(-97.7, 35.3, -97.1, 35.7))], self.zone_geometry_path)
+        zone_index = _load_zone_geometry_file(self.zone_geometry_path)
+        zone_only_alert = {'geometry': None, 'properties': {'ugc': ['OKC109', 'OKC143']}}
+        geometries = get_alert_geometries(zone_only_alert, zone_index)
+        self.assertEqual(len(geometries), 1)
+        inside = find_locations_in_polygons(geometries, self.LONGITUDES, self.LATITUDES)
+        self.assertEqual(inside.tolist(), [True, False, False, False])
+        self.assertEqual(get_alert_geometries(zone_only_alert, None), [])
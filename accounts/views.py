@@ -545,7 +545,7 @@ def should_track_location_view(request):
         # Use the same logic as your background task to check for alerts near this point
         user_agent = getattr(settings, 'ADMIN_EMAIL_FOR_NWS_USER_AGENT', 'DjangoWeatherApp/1.0')
         # You would need to import your helper functions for this to work
-        from subscriptions.tasks import fetch_alerts_by_zone_or_point 
+        from subscriptions.tasks import fetch_alerts_by_zone_or_point
 
         # We check for any high-priority warnings (e.g., Tornado, Severe Thunderstorm)
         # You can customize this list
@@ -554,7 +554,8 @@ def should_track_location_view(request):
             "Extreme Wind Warning", "Tornado Watch", "Severe Thunderstorm Watch"
         ]
 
-        # Fetch alerts by point using the last known coordinates
+        # Fetch alerts by point using the last known coordinates. No zone lookup: a moving user's
+        # coordinates are new every time, and the snapshot's point check covers zone-only alerts too.
         active_alerts = fetch_alerts_by_zone_or_point(None, last_location.latitude, last_location.longitude, user_agent)
 
         should_track = False
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Plan, Subscription, NotifiedAlert
+from .models import Plan, Subscription, NotifiedAlert, NWSPointZone
 
 
 @admin.register(Plan)
@@ -18,3 +18,9 @@ class NotifiedAlertAdmin(admin.ModelAdmin):
     list_filter = ('user',)
     search_fields = ('user__username', 'nws_alert_id')
     readonly_fields = ('sent_at',)
+
+@admin.register(NWSPointZone)
+class NWSPointZoneAdmin(admin.ModelAdmin):
+    list_display = ('latitude', 'longitude', 'county_zone', 'forecast_zone', 'resolved_at')
+    search_fields = ('county_zone', 'forecast_zone')
+    readonly_fields = ('resolved_at',)
@@ -0,0 +1,212 @@
+# subscriptions/alert_snapshot.py
+#
+# One national snapshot of active NWS alerts, shared by every consumer.
+#
+# The push task, the family-map warning check, the alerts page, the navbar and
+# the location-tracking check each used to query api.weather.gov/alerts/active
+# on their own (per location, per request, per user). Now ingest_active_alerts,
+# scheduled every minute, pulls the national feed with a conditional request
+# (If-None-Match / If-Modified-Since, so an unchanged feed is a cheap 304),
+# trims each alert to the fields we use and writes the result atomically to
+# get_snapshot_path():
+#     {'fetched_at', 'etag', 'last_modified', 'features': [GeoJSON alert features]}
+# The file's mtime is the time of the last successful check (a 304 touches it).
+#
+# Readers call get_alert_snapshot(), which keeps the parsed AlertSnapshot in
+# process memory (reloaded when the file is replaced) with the alerts indexed
+# by zone id (UGC code) and their shapes built once into an STRtree. Alerts
+# without a polygon get the boundaries of their zones from the local zone
+# store (subscriptions/zone_geometry.py), so point checks cover every alert. If the snapshot is
+# missing or older than SNAPSHOT_MAX_AGE_SECONDS it returns None and callers
+# fall back to asking NWS directly.
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+import requests
+from django.conf import settings
+
+from .zone_geometry import get_zone_key, get_zone_geometry_index, get_alert_geometries
+
+NWS_ACTIVE_ALERTS_URL = "https://api.weather.gov/alerts/active?status=actual"
+SNAPSHOT_MAX_AGE_SECONDS = 10 * 60
+SNAPSHOT_STAT_INTERVAL_SECONDS = 15 # How often a process checks whether the file was replaced
+KEPT_ALERT_PROPERTIES = ('id', 'event', 'headline', 'severity', 'description', 'areaDesc',
+                         'sent', 'onset', 'expires', 'ends', 'messageType', 'senderName')
+
+_snapshot_in_memory = {'checked_at': 0.0, 'file_id': None, 'snapshot': None}
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot_path():
+    return getattr(settings, 'NWS_ALERT_SNAPSHOT_PATH', None) or os.path.join(settings.MEDIA_ROOT, 'alerts', 'active_alerts.json')
+
+
+def get_alert_user_agent():
+    admin_email = getattr(settings, 'ADMIN_EMAIL_FOR_NWS_USER_AGENT', "your_app_contact@example.com")
+    return f"({getattr(settings, 'APP_NAME_DISPLAY', 'YourWeatherApp')}/1.0 AlertSnapshot; {admin_email})"
+
+
+def get_alert_details(feature):
+    """The alert dict fetch_alerts_by_zone_or_point() has always returned, from a snapshot feature."""
+    props = feature['properties']
+    return {
+        'id': props.get('id'),
+        'event': props.get('event', 'Weather Alert'),
+        'headline': props.get('headline', 'Check weather app for details.'),
+        'severity': props.get('severity'),
+    }
+
+
+def _trim_alert_feature(feature):
+    props = feature.get('properties', {})
+    trimmed_props = {key: props.get(key) for key in KEPT_ALERT_PROPERTIES}
+    trimmed_props['ugc'] = props.get('geocode', {}).get('UGC', [])
+    trimmed_props['affected_zones'] = [get_zone_key(zone_url) for zone_url in props.get('affectedZones') or []]
+    return {'type': 'Feature', 'id': feature.get('id'), 'geometry': feature.get('geometry'), 'properties': trimmed_props}
+
+
+class AlertSnapshot:
+    """The parsed snapshot, with alerts indexed by zone and (lazily) by geometry."""
+
+    def __init__(self, data, checked_at):
+        self.fetched_at = data.get('fetched_at')
+        self.checked_at = checked_at # Unix time of the last successful check
+        self.features = [feature for feature in data.get('features', []) if feature['properties'].get('id')]
+        self.features_by_zone = {}
+        for feature in self.features:
+            for zone_id in feature['properties'].get('ugc') or []:
+                self.features_by_zone.setdefault(zone_id, []).append(feature)
+        self._shapes = None
+        self._shapes_lock = threading.Lock()
+
+    def _get_shapes(self):
+        """
+        (STRtree of alert shapes, [feature of each shape]) for every alert with a polygon
+        or stored zone boundaries, built on first use.
+        """
+        with self._shapes_lock:
+            if self._shapes is None:
+                import shapely
+                zone_index = get_zone_geometry_index()
+                shapes, shape_features = [], []
+                for feature in self.features:
+                    try:
+                        alert_shapes = get_alert_geometries(feature, zone_index)
+                    except Exception as e: # One malformed polygon shouldn't hide the rest
+                        print(f"  ALERT_SNAPSHOT: Skipping geometry of {feature['properties'].get('id')}: {e}")
+                        continue
+                    shapes.extend(alert_shapes)
+                    shape_features.extend([feature] * len(alert_shapes))
+                self._shapes = (shapely.STRtree(shapes), shape_features)
+            return self._shapes
+
+    def features_for_zone(self, zone_id):
+        return list(self.features_by_zone.get(zone_id, []))
+
+    def features_at_point(self, latitude, longitude, zone_ids=()):
+        """Alerts whose polygon (or zone boundary) contains the point, plus those issued for any of zone_ids."""
+        import shapely
+        tree, shape_features = self._get_shapes()
+        shape_indices = tree.query(shapely.Point(float(longitude), float(latitude)), predicate='within')
+        matches = {}
+        for i in sorted(shape_indices):
+            matches.setdefault(shape_features[i]['properties']['id'], shape_features[i])
+        for zone_id in zone_ids:
+            for feature in self.features_by_zone.get(zone_id, []):
+                matches.setdefault(feature['properties']['id'], feature)
+        return list(matches.values())
+
+    def shapes_for_events(self, events=None):
+        """The shapes (polygons or zone boundaries) of every alert whose event is in events (None = all)."""
+        tree, shape_features = self._get_shapes()
+        return [tree.geometries[i] for i, feature in enumerate(shape_features)
+                if events is None or feature['properties'].get('event') in events]
+
+def _load_snapshot_file(snapshot_path):
+    stat = os.stat(snapshot_path)
+    with open(snapshot_path) as f:
+        return AlertSnapshot(json.load(f), stat.st_mtime)
+
+
+def get_alert_snapshot():
+    """The current AlertSnapshot, or None if there's none fresher than SNAPSHOT_MAX_AGE_SECONDS."""
+    now = time.monotonic()
+    with _snapshot_lock:
+        if now - _snapshot_in_memory['checked_at'] >= SNAPSHOT_STAT_INTERVAL_SECONDS:
+            _snapshot_in_memory['checked_at'] = now
+            snapshot_path = get_snapshot_path()
+            try:
+                stat = os.stat(snapshot_path)
+                file_id = (stat.st_ino, stat.st_size) # os.replace() gives a new inode; a 304 touch doesn't
+                if file_id != _snapshot_in_memory['file_id']:
+                    _snapshot_in_memory['snapshot'] = _load_snapshot_file(snapshot_path)
+                    _snapshot_in_memory['file_id'] = file_id
+                elif _snapshot_in_memory['snapshot'] is not None:
+                    _snapshot_in_memory['snapshot'].checked_at = stat.st_mtime
+            except (OSError, ValueError) as e:
+                if not isinstance(e, FileNotFoundError):
+                    print(f"  ALERT_SNAPSHOT: Could not read {snapshot_path}: {e}")
+                _snapshot_in_memory['snapshot'], _snapshot_in_memory['file_id'] = None, None
+        snapshot = _snapshot_in_memory['snapshot']
+
+    if snapshot is None or time.time() - snapshot.checked_at > SNAPSHOT_MAX_AGE_SECONDS:
+        return None
+    return snapshot
+
+
+def ingest_active_alerts():
+    """
+    Scheduled task: refreshes the national snapshot from NWS with a conditional request.
+    Returns 'updated', 'not_modified' or 'failed'.
+    """
+    start_time = datetime.now(timezone.utc)
+    snapshot_path = get_snapshot_path()
+    nws_headers = {'User-Agent': get_alert_user_agent(), 'Accept': 'application/geo+json'}
+
+    previous = {}
+    try:
+        with open(snapshot_path) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if previous.get('etag'):
+        nws_headers['If-None-Match'] = previous['etag']
+    if previous.get('last_modified'):
+        nws_headers['If-Modified-Since'] = previous['last_modified']
+
+    try:
+        response = requests.get(NWS_ACTIVE_ALERTS_URL, headers=nws_headers, timeout=60)
+        if response.status_code == 304:
+            os.utime(snapshot_path) # Still current as of now
+            print(f"[{start_time.isoformat()}] ALERT_SNAPSHOT: Not modified since {previous.get('fetched_at')}.")
+            return 'not_modified'
+        response.raise_for_status()
+        features = [_trim_alert_feature(feature) for feature in response.json().get('features', [])]
+    except Exception as e:
+        print(f"[{start_time.isoformat()}] ALERT_SNAPSHOT_ERROR: Could not refresh active alerts: {e}")
+        return 'failed'
+
+    snapshot_data = {
+        'fetched_at': start_time.isoformat(),
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'features': features,
+    }
+    temp_path = f"{snapshot_path}.tmp.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            json.dump(snapshot_data, f)
+        os.replace(temp_path, snapshot_path)
+    except OSError as e:
+        print(f"  ALERT_SNAPSHOT_ERROR: Could not write {snapshot_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return 'failed'
+
+    print(f"[{start_time.isoformat()}] ALERT_SNAPSHOT: {len(features)} active alert(s) "
+          f"({sum(1 for feature in features if feature['geometry'])} with polygons) written to {snapshot_path}.")
+    return 'updated'
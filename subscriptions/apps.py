@@ -9,6 +9,8 @@ class SubscriptionsConfig(AppConfig):
     name = 'subscriptions'
 
     def ready(self):
+        import subscriptions.signals # noqa: F401 (connects the NWS zone lookup on SavedLocation save)
+
         # --- Schedule the push notification task ---
         # Make sure these imports are within ready() or at file top
         from django_q.tasks import schedule, Schedule # Import Schedule model
@@ -51,3 +53,74 @@ class SubscriptionsConfig(AppConfig):
             print("If this is not the first run, check your database and django_q setup.")
 
         # --- End Task Scheduling ---
+
+        # --- Daily NWS zone cache refresh (subscriptions/nws_zones.py) ---
+        zone_task_path = 'subscriptions.nws_zones.refresh_nws_point_zones'
+        zone_schedule_name = 'Refresh NWS Zone Cache'
+        try:
+            zone_schedule_obj = Schedule.objects.get(name=zone_schedule_name)
+            if zone_schedule_obj.func != zone_task_path or zone_schedule_obj.schedule_type != Schedule.DAILY:
+                zone_schedule_obj.func = zone_task_path
+                zone_schedule_obj.schedule_type = Schedule.DAILY
+                zone_schedule_obj.save()
+                print(f"UPDATED task '{zone_schedule_name}' to run daily.")
+        except Schedule.DoesNotExist:
+            schedule(
+                zone_task_path,
+                name=zone_schedule_name,
+                schedule_type=Schedule.DAILY,
+                repeats=-1,
+                next_run=timezone.now() + timedelta(minutes=15)
+            )
+            print(f"Scheduled task '{zone_schedule_name}' to run daily.")
+        except Exception as e:
+            print(f"Could not schedule task '{zone_schedule_name}' due to an error: {e}")
+
+        # --- National active-alerts snapshot (subscriptions/alert_snapshot.py) ---
+        snapshot_task_path = 'subscriptions.alert_snapshot.ingest_active_alerts'
+        snapshot_schedule_name = 'Ingest Active NWS Alerts'
+        snapshot_interval_minutes = 1
+        try:
+            snapshot_schedule_obj = Schedule.objects.get(name=snapshot_schedule_name)
+            if (snapshot_schedule_obj.func != snapshot_task_path or
+                snapshot_schedule_obj.schedule_type != Schedule.MINUTES or
+                snapshot_schedule_obj.minutes != snapshot_interval_minutes):
+                snapshot_schedule_obj.func = snapshot_task_path
+                snapshot_schedule_obj.schedule_type = Schedule.MINUTES
+                snapshot_schedule_obj.minutes = snapshot_interval_minutes
+                snapshot_schedule_obj.save()
+                print(f"UPDATED task '{snapshot_schedule_name}' to run every {snapshot_interval_minutes} minute(s).")
+        except Schedule.DoesNotExist:
+            schedule(
+                snapshot_task_path,
+                name=snapshot_schedule_name,
+                schedule_type=Schedule.MINUTES,
+                minutes=snapshot_interval_minutes,
+                repeats=-1,
+                next_run=timezone.now()
+            )
+            print(f"Scheduled task '{snapshot_schedule_name}' to run every {snapshot_interval_minutes} minute(s).")
+        except Exception as e:
+            print(f"Could not schedule task '{snapshot_schedule_name}' due to an error: {e}")
+
+        # --- Weekly NWS zone boundary refresh (subscriptions/zone_geometry.py) ---
+        zone_geometry_task_path = 'subscriptions.zone_geometry.refresh_zone_geometries'
+        zone_geometry_schedule_name = 'Refresh NWS Zone Boundaries'
+        try:
+            zone_geometry_schedule_obj = Schedule.objects.get(name=zone_geometry_schedule_name)
+            if zone_geometry_schedule_obj.func != zone_geometry_task_path or zone_geometry_schedule_obj.schedule_type != Schedule.WEEKLY:
+                zone_geometry_schedule_obj.func = zone_geometry_task_path
+                zone_geometry_schedule_obj.schedule_type = Schedule.WEEKLY
+                zone_geometry_schedule_obj.save()
+                print(f"UPDATED task '{zone_geometry_schedule_name}' to run weekly.")
+        except Schedule.DoesNotExist:
+            schedule(
+                zone_geometry_task_path,
+                name=zone_geometry_schedule_name,
+                schedule_type=Schedule.WEEKLY,
+                repeats=-1,
+                next_run=timezone.now() + timedelta(minutes=5) # First run soon, so zone-only alerts get shapes
+            )
+            print(f"Scheduled task '{zone_geometry_schedule_name}' to run weekly.")
+        except Exception as e:
+            print(f"Could not schedule task '{zone_geometry_schedule_name}' due to an error: {e}")
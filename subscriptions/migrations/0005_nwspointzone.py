@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0004_plan_is_purchasable_plan_is_visible_on_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NWSPointZone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=3, max_digits=7)),
+                ('longitude', models.DecimalField(decimal_places=3, max_digits=8)),
+                ('county_zone', models.CharField(blank=True, default='', max_length=10)),
+                ('forecast_zone', models.CharField(blank=True, default='', max_length=10)),
+                ('resolved_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('latitude', 'longitude'), name='unique_nws_point_zone')],
+            },
+        ),
+    ]
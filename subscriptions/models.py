@@ -99,3 +99,29 @@ class NotifiedAlert(models.Model):
 
     def __str__(self):
         return f"Alert {self.nws_alert_id} sent to {self.user.username} at {self.sent_at}"
+
+
+class NWSPointZone(models.Model):
+    """
+    Cached NWS /points lookup: the county and forecast zones of a coordinate, rounded to
+    3 decimals (~100 m). Zones essentially never change, so entries are reused for
+    nws_zones.ZONE_CACHE_TTL_DAYS and refreshed in the background (see subscriptions/nws_zones.py).
+    """
+    latitude = models.DecimalField(max_digits=7, decimal_places=3)
+    longitude = models.DecimalField(max_digits=8, decimal_places=3)
+    county_zone = models.CharField(max_length=10, blank=True, default='') # e.g. 'OKC109'
+    forecast_zone = models.CharField(max_length=10, blank=True, default='') # e.g. 'OKZ025'
+    resolved_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['latitude', 'longitude'], name='unique_nws_point_zone'),
+        ]
+
+    def __str__(self):
+        return f"({self.latitude}, {self.longitude}) -> {self.alert_zone or 'no zone'}"
+
+    @property
+    def alert_zone(self):
+        """The zone alerts are fetched for: the county, else the forecast zone."""
+        return self.county_zone or self.forecast_zone or None
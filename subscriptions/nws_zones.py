@@ -0,0 +1,119 @@
+# subscriptions/nws_zones.py
+#
+# Persistent lat/lon -> NWS zone cache (the NWSPointZone table).
+#
+# Every alert check used to start with an api.weather.gov/points call to find
+# a location's zone: the push task for every saved location every 10 minutes,
+# the navbar, the alerts page. A location's county/forecast zone essentially
+# never changes, so the answer is kept per rounded coordinate:
+#   - resolve_point_zone() answers from the table while the entry is younger
+#     than ZONE_CACHE_TTL_DAYS and only calls /points for new or stale ones
+#     (a stale entry is still used if NWS can't be reached),
+#   - saving a SavedLocation queues its lookup (subscriptions/signals.py), so
+#     the alert task normally finds it already cached,
+#   - refresh_nws_point_zones, scheduled daily, re-resolves stale entries of
+#     saved locations, fills in saved locations that have none and deletes
+#     stale entries no saved location uses (page lookups of other coordinates),
+#     so the table and the refresher's work stay bounded by SavedLocation.
+# Location history points (moving users) never go through here; they're
+# checked against the alert snapshot by point.
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from .models import NWSPointZone
+
+ZONE_CACHE_TTL_DAYS = 30
+COORD_QUANTUM = Decimal('0.001') # Matches NWSPointZone's decimal_places
+REFRESH_BATCH_SIZE = 200 # /points lookups per refresher run
+
+
+def round_coords(latitude, longitude):
+    return (Decimal(str(latitude)).quantize(COORD_QUANTUM, rounding=ROUND_HALF_UP),
+            Decimal(str(longitude)).quantize(COORD_QUANTUM, rounding=ROUND_HALF_UP))
+
+
+def get_zone_user_agent():
+    admin_email = getattr(settings, 'ADMIN_EMAIL_FOR_NWS_USER_AGENT', "your_app_contact@example.com")
+    return f"({getattr(settings, 'APP_NAME_DISPLAY', 'YourWeatherApp')}/1.0 ZoneLookup; {admin_email})"
+
+
+def fetch_nws_zones(latitude, longitude, task_user_agent):
+    """Calls NWS /points. Returns {'county_zone', 'forecast_zone'} ('' when absent), or None on failure."""
+    nws_points_url = f"https://api.weather.gov/points/{latitude},{longitude}"
+    nws_headers = {'User-Agent': task_user_agent, 'Accept': 'application/geo+json'}
+    try:
+        points_response = requests.get(nws_points_url, headers=nws_headers, timeout=10)
+        points_response.raise_for_status()
+        properties = points_response.json().get('properties', {})
+    except Exception as e:
+        print(f"  NWS_ZONES: /points lookup failed for ({latitude},{longitude}): {e}")
+        return None
+    return {
+        'county_zone': (properties.get('county') or '').split('/')[-1],
+        'forecast_zone': (properties.get('forecastZone') or '').split('/')[-1],
+    }
+
+
+def resolve_point_zone(latitude, longitude, task_user_agent=None, refresh=False):
+    """
+    The NWSPointZone for a coordinate, from the cache when it's fresh (and refresh is False),
+    else looked up and saved. Returns None if it's unknown and NWS can't be reached.
+    """
+    rounded_lat, rounded_lon = round_coords(latitude, longitude)
+    point_zone = NWSPointZone.objects.filter(latitude=rounded_lat, longitude=rounded_lon).first()
+    fresh_after = timezone.now() - timedelta(days=ZONE_CACHE_TTL_DAYS)
+    if point_zone is not None and not refresh and point_zone.resolved_at >= fresh_after:
+        return point_zone
+
+    zones = fetch_nws_zones(rounded_lat, rounded_lon, task_user_agent or get_zone_user_agent())
+    if zones is None:
+        return point_zone # Stale beats nothing; zones hardly ever change
+    point_zone, _ = NWSPointZone.objects.update_or_create(
+        latitude=rounded_lat, longitude=rounded_lon,
+        defaults={**zones, 'resolved_at': timezone.now()})
+    return point_zone
+
+
+def resolve_point_zone_task(latitude, longitude):
+    """Django Q entry point (queued when a location is saved)."""
+    resolve_point_zone(latitude, longitude)
+
+
+def refresh_nws_point_zones():
+    """
+    Scheduled task: re-resolves saved locations' entries older than the TTL and resolves
+    saved locations with no entry yet, up to REFRESH_BATCH_SIZE lookups per run. Stale
+    entries no saved location uses are deleted rather than refreshed.
+    """
+    from accounts.models import SavedLocation
+
+    start_time = timezone.now()
+    print(f"[{start_time.isoformat()}] TASK_INFO: Running task: refresh_nws_point_zones")
+    task_user_agent = get_zone_user_agent()
+
+    saved_coords = {round_coords(latitude, longitude)
+                    for latitude, longitude in SavedLocation.objects.values_list('latitude', 'longitude').distinct()}
+    cached_coords = set(NWSPointZone.objects.values_list('latitude', 'longitude'))
+    to_resolve = sorted(saved_coords - cached_coords)
+
+    stale_before = start_time - timedelta(days=ZONE_CACHE_TTL_DAYS)
+    unused_ids = []
+    for point_zone_id, latitude, longitude in (NWSPointZone.objects.filter(resolved_at__lt=stale_before)
+                                               .order_by('resolved_at').values_list('id', 'latitude', 'longitude')):
+        if (latitude, longitude) in saved_coords:
+            to_resolve.append((latitude, longitude))
+        else:
+            unused_ids.append(point_zone_id)
+    deleted_count, _ = NWSPointZone.objects.filter(id__in=unused_ids).delete()
+
+    resolved = 0
+    for latitude, longitude in to_resolve[:REFRESH_BATCH_SIZE]:
+        point_zone = resolve_point_zone(latitude, longitude, task_user_agent, refresh=True)
+        if point_zone is not None and point_zone.resolved_at >= start_time:
+            resolved += 1
+    print(f"TASK_INFO: refresh_nws_point_zones resolved {resolved} of {min(len(to_resolve), REFRESH_BATCH_SIZE)} "
+          f"coordinate(s) ({len(to_resolve)} needed it), deleted {deleted_count} stale one(s) no saved location uses.")
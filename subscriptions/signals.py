@@ -0,0 +1,23 @@
+# subscriptions/signals.py
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from accounts.models import SavedLocation
+from .models import NWSPointZone
+from .nws_zones import round_coords
+
+
+@receiver(post_save, sender=SavedLocation)
+def queue_saved_location_zone_lookup(sender, instance, **kwargs):
+    """
+    Queues the NWS zone lookup of a saved (new or moved) location, so the alert task
+    finds it cached. Runs on the Django Q cluster to keep the /points call out of the request.
+    """
+    rounded_lat, rounded_lon = round_coords(instance.latitude, instance.longitude)
+    if NWSPointZone.objects.filter(latitude=rounded_lat, longitude=rounded_lon).exists():
+        return
+    try:
+        from django_q.tasks import async_task
+        async_task('subscriptions.nws_zones.resolve_point_zone_task', str(instance.latitude), str(instance.longitude))
+    except Exception as e: # The daily refresher picks it up otherwise
+        print(f"SIGNAL: Could not queue NWS zone lookup for saved location {instance.pk}: {e}")
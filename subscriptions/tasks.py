@@ -8,41 +8,42 @@ import json
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db.models import Q
+from django.urls import reverse
 from push_notifications.models import WebPushDevice
 
 # Assuming SavedLocation and Profile are in accounts.models
 # Adjust if your Profile model is elsewhere or not directly used here
 from accounts.models import SavedLocation, Profile
 from .models import NotifiedAlert, Subscription # From subscriptions.models
+from .nws_zones import resolve_point_zone
+from .alert_snapshot import get_alert_snapshot, get_alert_details
 
 User = get_user_model()
 
 # --- Helper function to get NWS Zone ---
 def get_nws_zone_for_coords(latitude, longitude, task_user_agent):
-    """Helper to get the NWS county or forecast zone for given coordinates."""
-    nws_points_url = f"https://api.weather.gov/points/{latitude},{longitude}"
-    nws_headers = {'User-Agent': task_user_agent, 'Accept': 'application/geo+json'}
-    target_alert_zone = None
-    try:
-        points_response = requests.get(nws_points_url, headers=nws_headers, timeout=10) # Shorter timeout for util
-        points_response.raise_for_status()
-        points_data = points_response.json()
-        county_zone_url = points_data.get('properties', {}).get('county')
-        if county_zone_url:
-            target_alert_zone = county_zone_url.split('/')[-1]
-        else: 
-            forecast_zone_url = points_data.get('properties', {}).get('forecastZone')
-            if forecast_zone_url:
-                target_alert_zone = forecast_zone_url.split('/')[-1]
-        return target_alert_zone
-    except Exception as e:
-        # print(f"NAVBAR_UTIL: Error getting NWS zone for ({latitude},{longitude}): {e}") # Optional: log differently
-        return None
+    """
+    Helper to get the NWS county or forecast zone for given coordinates.
+    Answered from the NWSPointZone cache; only new or stale coordinates call NWS /points (see nws_zones.py).
+    """
+    point_zone = resolve_point_zone(latitude, longitude, task_user_agent)
+    return point_zone.alert_zone if point_zone is not None else None
 
 
 # --- Helper function to fetch alerts ---
 def fetch_alerts_by_zone_or_point(zone_id, latitude, longitude, task_user_agent):
-    """Fetches alerts by zone if zone_id is provided, otherwise by point as a fallback."""
+    """
+    Fetches alerts by zone if zone_id is provided, otherwise by point as a fallback.
+    Read from the national alert snapshot (alert_snapshot.py); NWS is only queried when there's no fresh snapshot.
+    """
+    snapshot = get_alert_snapshot()
+    if snapshot is not None:
+        if zone_id:
+            features = snapshot.features_for_zone(zone_id)
+        else:
+            features = snapshot.features_at_point(latitude, longitude)
+        return [get_alert_details(feature) for feature in features]
+
     active_alerts_details = []
     nws_headers = {
         'User-Agent': task_user_agent,
@@ -83,160 +84,198 @@ def fetch_alerts_by_zone_or_point(zone_id, latitude, longitude, task_user_agent)
         traceback.print_exc()
     return []
 
-def check_weather_alerts_and_send_pushes():
-    start_time = datetime.now(timezone.utc)
-    print(f"[{start_time.isoformat()}] TASK_INFO: Running task: check_weather_alerts_and_send_pushes")
-
+def get_task_user_agent():
     admin_email_for_ua = getattr(settings, 'VAPID_ADMIN_EMAIL', "default_admin@example.com")
     if admin_email_for_ua.startswith("mailto:"): # Strip mailto if present from PUSH_NOTIFICATIONS_SETTINGS
         admin_email_for_ua = admin_email_for_ua[len("mailto:"):]
-    
-    app_name_display = getattr(settings, 'APP_NAME_DISPLAY', 'MyWeatherApp') 
-    task_user_agent = f'{app_name_display}/1.0 (AlertCheckerTaskContact; {admin_email_for_ua})'
 
+    app_name_display = getattr(settings, 'APP_NAME_DISPLAY', 'MyWeatherApp')
+    return f'{app_name_display}/1.0 (AlertCheckerTaskContact; {admin_email_for_ua})'
+
+
+def get_monitored_locations_by_user():
+    """
+    Returns [(user, [SavedLocation, ...]), ...] for every user with an active push device:
+    subscribers (and superusers) get up to 3 locations with notifications on, free users their
+    default location if it has notifications on.
+    """
     users_to_check = User.objects.filter(
         Q(subscription__status__in=['active', 'trialing']) | Q(is_superuser=True),
         webpushdevice__active=True # Ensures user has at least one active push device
     ).distinct().prefetch_related(
-        'profile__saved_locations', 
-        'webpushdevice_set',      
-        'subscription'            
+        'profile__saved_locations',
+        'webpushdevice_set',
+        'subscription'
     )
 
     print(f"TASK_INFO: Found {users_to_check.count()} user(s) with active push devices to check for alerts.")
 
+    monitored = []
     for user in users_to_check:
-        print(f"\nTASK_INFO: Processing user: {user.username} (ID: {user.id})")
-        
         is_subscriber = user.is_superuser
         if not is_subscriber:
             try:
                 if hasattr(user, 'subscription') and user.subscription and user.subscription.is_active():
                     is_subscriber = True
             except Subscription.DoesNotExist:
-                pass 
+                pass
             except AttributeError: # If user.subscription doesn't exist
                 print(f"  TASK_WARNING: User {user.username} has no 'subscription' attribute.")
             except Exception as e_sub_check:
                 print(f"  TASK_ERROR: Error checking subscription status for {user.username}: {e_sub_check}")
 
-        print(f"  TASK_INFO: User {user.username} is_subscriber status: {is_subscriber}")
         locations_to_monitor = []
-        
         if hasattr(user, 'profile') and user.profile:
+            # Filtered in Python so the prefetched saved_locations are used (no query per user)
+            notify_locations = [loc for loc in user.profile.saved_locations.all() if loc.receive_notifications]
             if is_subscriber:
-                locations_to_monitor = user.profile.saved_locations.filter(receive_notifications=True).order_by('pk')[:3]
-                print(f"  TASK_INFO: Subscriber {user.username}: Checking {locations_to_monitor.count()} saved locations set for notifications (max 3).")
-            else: 
-                default_loc = user.profile.saved_locations.filter(is_default=True, receive_notifications=True).first()
-                if default_loc:
-                    locations_to_monitor = [default_loc]
-                    print(f"  TASK_INFO: Free tier user {user.username}: Checking default location (alerts ON): {default_loc.location_name}")
-                else:
-                    print(f"  TASK_INFO: Free tier user {user.username}: No default location set for notifications.")
+                locations_to_monitor = sorted(notify_locations, key=lambda loc: loc.pk)[:3]
+            else:
+                locations_to_monitor = [loc for loc in notify_locations if loc.is_default][:1]
         else:
             print(f"  TASK_WARNING: User {user.username} has no profile or profile attribute.")
 
-        if not locations_to_monitor:
-            print(f"  TASK_INFO: No locations to monitor for {user.username}.")
-            continue
+        print(f"  TASK_INFO: User {user.username} (ID: {user.id}, subscriber: {is_subscriber}): {len(locations_to_monitor)} location(s) to monitor.")
+        if locations_to_monitor:
+            monitored.append((user, locations_to_monitor))
+    return monitored
+
+
+def get_alert_area_key(zone_id, latitude, longitude):
+    """('zone', id), or ('point', lat, lon) when the zone is unknown (fetch_alerts_by_zone_or_point's fallback)."""
+    if zone_id:
+        return ('zone', zone_id)
+    return ('point', str(latitude), str(longitude))
+
 
-        user_devices = user.webpushdevice_set.filter(active=True) # Get active devices again, just in case
-        if not user_devices.exists(): # Should have been caught by initial users_to_check query, but good to double check
-            print(f"  TASK_INFO: User {user.username} has no active push devices (re-checked). Skipping.")
-            continue
+def group_locations_by_alert_area(monitored, task_user_agent):
+    """
+    Phase 1: resolves the NWS zone of every monitored location, once per distinct coordinate
+    (normally straight from the NWSPointZone cache).
+    Returns ({area_key: (zone_id, latitude, longitude)}, {location pk: area_key}).
+    """
+    zone_by_coords = {}
+    areas = {}
+    area_by_location = {}
+    for user, locations in monitored:
+        for loc_instance in locations:
+            coords = (str(loc_instance.latitude), str(loc_instance.longitude))
+            if coords not in zone_by_coords:
+                zone_by_coords[coords] = get_nws_zone_for_coords(loc_instance.latitude, loc_instance.longitude, task_user_agent)
+            zone_id = zone_by_coords[coords]
+            area_key = get_alert_area_key(zone_id, loc_instance.latitude, loc_instance.longitude)
+            areas.setdefault(area_key, (zone_id, loc_instance.latitude, loc_instance.longitude))
+            area_by_location[loc_instance.pk] = area_key
+    return areas, area_by_location
+
+
+def fetch_alerts_for_areas(areas, task_user_agent):
+    """Phase 2: looks up each zone's (or unzoned point's) active alerts once. Returns {area_key: [alert, ...]}."""
+    return {area_key: fetch_alerts_by_zone_or_point(zone_id, latitude, longitude, task_user_agent)
+            for area_key, (zone_id, latitude, longitude) in areas.items()}
+
+
+def get_alert_click_url():
+    click_url = "/weather/"
+    try:
+        # Ensure SITE_DOMAIN in settings.py is like "https://yourdomain.com" (no trailing slash)
+        click_url = f"{settings.SITE_DOMAIN.rstrip('/')}{reverse('weather:weather_page')}" # Ensure no double slashes
+    except Exception as e_url:
+        print(f"    TASK_ERROR: Could not reverse 'weather:weather_page' URL for push: {e_url}. Using fallback URL '/'.")
+    return click_url
+
+
+def send_alert_push(user, user_devices, loc_instance, alert, click_url):
+    """Sends one alert to a user's devices and records it. Returns True if it was sent."""
+    nws_alert_id = alert['id']
+    payload_dict = {
+        "head": f"{alert.get('event')} for: {loc_instance.location_type_label or loc_instance.location_name}",
+        "body": alert.get('headline', 'Check app for details.'),
+        "icon": settings.STATIC_URL.rstrip('/') + "/images/icons/Icon_192.png",
+        "url": click_url,
+        "sound": settings.STATIC_URL.rstrip('/') + "/sounds/danger.mp3"
+    }
+    json_string_payload = json.dumps(payload_dict)
 
-        nws_alerts_pushed_this_session_for_user = set()
+    print(f"    TASK_INFO: Attempting to send push to {user.username} with payload: {json_string_payload}")
+    try:
+        user_devices.send_message(json_string_payload)
 
-        for loc_instance in locations_to_monitor:
-            print(f"  TASK_INFO: Checking location: {loc_instance.location_name} (Lat: {loc_instance.latitude}, Lon: {loc_instance.longitude}) for user {user.username}")
-            
-            zone_id = get_nws_zone_for_coords(loc_instance.latitude, loc_instance.longitude, task_user_agent)
-            current_nws_alerts = fetch_alerts_by_zone_or_point(zone_id, loc_instance.latitude, loc_instance.longitude, task_user_agent)
+        NotifiedAlert.objects.create(
+            user=user,
+            nws_alert_id=nws_alert_id,
+            saved_location=loc_instance
+        )
+        print(f"      TASK_SUCCESS: Push sent and DB record created for {user.username}, NWS ID {nws_alert_id} (Location: {loc_instance.location_name})")
+        return True
+    except Exception as e_send_message:
+        print(f"    TASK_ERROR: !!! FAILED to send push to {user.username} for NWS ID {nws_alert_id}: {e_send_message}")
+        print(f"    --- Traceback for push sending failure IN TASK (NWS ID: {nws_alert_id}): ---")
+        traceback.print_exc() # This prints the full traceback for the error
+        print(f"    --- End traceback for push sending failure IN TASK (NWS ID: {nws_alert_id}) ---")
+        return False
 
-            if not current_nws_alerts:
-                print(f"    TASK_INFO: No active NWS alerts for {loc_instance.location_name}.")
-                continue 
 
-            for alert in current_nws_alerts:
+def fan_out_alerts(monitored, area_by_location, alerts_by_area):
+    """
+    Phase 3: sends each user the new alerts of their locations' areas. An alert is pushed once
+    per user, however many of their locations it covers, and never again once recorded in NotifiedAlert.
+    Returns the number of pushes sent.
+    """
+    all_alert_ids = {alert['id'] for alerts in alerts_by_area.values() for alert in alerts if alert.get('id')}
+    if not all_alert_ids:
+        return 0
+    # One query for what has already been sent, instead of one per (user, alert)
+    already_notified = set(NotifiedAlert.objects
+                           .filter(user__in=[user for user, _ in monitored], nws_alert_id__in=all_alert_ids)
+                           .values_list('user_id', 'nws_alert_id'))
+
+    click_url = get_alert_click_url()
+    pushes_sent = 0
+    for user, locations in monitored:
+        user_devices = None
+        for loc_instance in locations:
+            for alert in alerts_by_area.get(area_by_location[loc_instance.pk], []):
                 nws_alert_id = alert.get('id')
-                if not nws_alert_id:
-                    print("    TASK_WARNING: Skipping alert with no ID.")
-                    continue 
-
-                if nws_alert_id in nws_alerts_pushed_this_session_for_user:
-                    print(f"    TASK_INFO: NWS ID {nws_alert_id} (event: {alert.get('event')}) already processed for {user.username} in this run for another of their locations.")
-                    continue 
-
-                if NotifiedAlert.objects.filter(user=user, nws_alert_id=nws_alert_id).exists():
-                    print(f"    TASK_INFO: Alert {nws_alert_id} (event: {alert.get('event')}) already notified to {user.username} previously.")
-                    continue 
-                
+                if not nws_alert_id or (user.id, nws_alert_id) in already_notified:
+                    continue
+
                 print(f"    TASK_INFO: NEW NWS Alert for {user.username}: {alert.get('event')} (ID: {nws_alert_id}) for saved location: {loc_instance.location_name}")
-                
-                click_url = "/weather/" 
-                try:
-                    # Ensure SITE_DOMAIN in settings.py is like "https://yourdomain.com" (no trailing slash)
-                    click_url = f"{settings.SITE_DOMAIN.rstrip('/')}{reverse('weather:weather_page')}" # Ensure no double slashes
-                except Exception as e_url:
-                    print(f"    TASK_ERROR: Could not reverse 'weather:weather_page' URL for push: {e_url}. Using fallback URL '/'.")
-
-                payload_dict = {
-                    "head": f"{alert.get('event')} for: {loc_instance.location_type_label or loc_instance.location_name}",
-                    "body": alert.get('headline', 'Check app for details.'),
-                    "icon": settings.STATIC_URL.rstrip('/') + "/images/icons/Icon_192.png", 
-                    "url": click_url,
-                    "sound": settings.STATIC_URL.rstrip('/') + "/sounds/danger.mp3"  
-                }
-                json_string_payload = json.dumps(payload_dict)
-
-                print(f"    TASK_INFO: Attempting to send push to {user.username} with payload: {json_string_payload}")
-
-                # --- START: DEBUG BLOCK TO CHECK PUSH_NOTIFICATIONS_SETTINGS ---
-                task_push_settings_dict_at_runtime = "PUSH_NOTIFICATIONS_SETTINGS_NOT_FOUND_ON_SETTINGS_OBJECT_IN_TASK"
-                private_key_val_at_runtime = "PRIVATE_KEY_NOT_CHECKED_OR_FOUND_IN_TASK"
-                
-                print(f"    TASK_EXECUTION_DEBUG: --- Entering PUSH_NOTIFICATIONS_SETTINGS check in task for user {user.username} ---")
-                if hasattr(settings, 'PUSH_NOTIFICATIONS_SETTINGS'):
-                    task_push_settings_dict_at_runtime = settings.PUSH_NOTIFICATIONS_SETTINGS
-                    print(f"    TASK_EXECUTION_DEBUG: settings.PUSH_NOTIFICATIONS_SETTINGS IS available to task.")
-                    print(f"    TASK_EXECUTION_DEBUG: Type of settings.PUSH_NOTIFICATIONS_SETTINGS: {type(task_push_settings_dict_at_runtime)}")
-                    print(f"    TASK_EXECUTION_DEBUG: Full settings.PUSH_NOTIFICATIONS_SETTINGS dict as seen by task: {task_push_settings_dict_at_runtime}") 
-                    
-                    if isinstance(task_push_settings_dict_at_runtime, dict):
-                        if "VAPID_PRIVATE_KEY" in task_push_settings_dict_at_runtime: # Check for exact key string
-                            private_key_val_at_runtime = task_push_settings_dict_at_runtime.get("VAPID_PRIVATE_KEY")
-                            print(f"    TASK_EXECUTION_DEBUG: 'VAPID_PRIVATE_KEY' key IS IN dict. Value starts with: {str(private_key_val_at_runtime)[:20] if private_key_val_at_runtime else 'EMPTY or None'}")
-                        else:
-                            print(f"    TASK_EXECUTION_DEBUG: 'VAPID_PRIVATE_KEY' KEY IS MISSING from PUSH_NOTIFICATIONS_SETTINGS dict when checked by task!")
-                    else:
-                        print(f"    TASK_EXECUTION_DEBUG: settings.PUSH_NOTIFICATIONS_SETTINGS is not a dictionary when checked by task!")
-                else:
-                    print(f"    TASK_EXECUTION_DEBUG: settings.PUSH_NOTIFICATIONS_SETTINGS attribute itself IS MISSING when checked by task!")
-                print(f"    TASK_EXECUTION_DEBUG: --- Finished PUSH_NOTIFICATIONS_SETTINGS check in task ---")
-                # --- END: DEBUG BLOCK ---
-
-                try:
-                    # This is line 246 from your traceback in message #200
-                    user_devices.send_message(json_string_payload) 
-                    
-                    NotifiedAlert.objects.create(
-                        user=user,
-                        nws_alert_id=nws_alert_id,
-                        saved_location=loc_instance 
-                    )
-                    print(f"      TASK_SUCCESS: Push sent and DB record created for {user.username}, NWS ID {nws_alert_id} (Location: {loc_instance.location_name})")
-                    nws_alerts_pushed_this_session_for_user.add(nws_alert_id)
-                except Exception as e_send_message:
-                    print(f"    TASK_ERROR: !!! FAILED to send push to {user.username} for NWS ID {nws_alert_id}: {e_send_message}")
-                    print(f"    --- Traceback for push sending failure IN TASK (NWS ID: {nws_alert_id}): ---")
-                    traceback.print_exc() # This prints the full traceback for the error
-                    print(f"    --- End traceback for push sending failure IN TASK (NWS ID: {nws_alert_id}) ---")
-        
-        print(f"  TASK_INFO: Finished processing locations for {user.username}")
+                if user_devices is None:
+                    user_devices = user.webpushdevice_set.filter(active=True)
+                # Marked either way so a failed send isn't retried for this user's other locations in this run
+                already_notified.add((user.id, nws_alert_id))
+                if send_alert_push(user, user_devices, loc_instance, alert, click_url):
+                    pushes_sent += 1
+    return pushes_sent
+
+
+def check_weather_alerts_and_send_pushes():
+    """
+    Pushes new NWS alerts to users for their monitored saved locations, in three phases so the
+    work (and NWS traffic, when there's no alert snapshot) scales with distinct zones rather than users x locations:
+      1. group every monitored location by NWS zone (cached per coordinate, see nws_zones.py),
+      2. fetch each zone's active alerts once,
+      3. fan the alerts back out to the users whose locations are in those zones.
+    """
+    start_time = datetime.now(timezone.utc)
+    print(f"[{start_time.isoformat()}] TASK_INFO: Running task: check_weather_alerts_and_send_pushes")
+    task_user_agent = get_task_user_agent()
+
+    monitored = get_monitored_locations_by_user()
+    if not monitored:
+        print("TASK_INFO: No locations to monitor.")
+        return
+
+    areas, area_by_location = group_locations_by_alert_area(monitored, task_user_agent)
+    location_count = sum(len(locations) for _, locations in monitored)
+    print(f"TASK_INFO: {location_count} location(s) of {len(monitored)} user(s) fall in {len(areas)} alert zone(s)/point(s).")
+
+    alerts_by_area = fetch_alerts_for_areas(areas, task_user_agent)
+    pushes_sent = fan_out_alerts(monitored, area_by_location, alerts_by_area)
 
     end_time = datetime.now(timezone.utc)
-    print(f"[{end_time.isoformat()}] TASK_INFO: Task finished. Duration: {end_time - start_time}")
+    print(f"[{end_time.isoformat()}] TASK_INFO: Task finished. {pushes_sent} push(es) sent. Duration: {end_time - start_time}")
 
 
 #####################################################################################
@@ -251,59 +290,35 @@ def fetch_and_determine_alert_priority_for_navbar(latitude, longitude):
     
     user_agent_string = f"(UnfortunateNeighborApp/1.0 NavbarAlertCheck; {admin_email})"
 
-    zone_id = _get_nws_zone_for_coords_util(latitude, longitude, user_agent_string)
-
-    nws_alerts_api_url = ""
-    if zone_id:
-        nws_alerts_api_url = f"https://api.weather.gov/alerts/active?zone={zone_id}"
-    else:
-        nws_alerts_api_url = f"https://api.weather.gov/alerts/active?point={latitude},{longitude}"
+    zone_id = get_nws_zone_for_coords(latitude, longitude, user_agent_string)
 
     highest_priority_status = None
-    alert_count = 0
     current_priority_level = 0  # 3: Warning, 2: Watch, 1: Advisory/Statement
 
-    try:
-        nws_headers = {'User-Agent': user_agent_string, 'Accept': 'application/geo+json'}
-        response = requests.get(nws_alerts_api_url, headers=nws_headers, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        features = data.get('features', [])
-        
-        alert_count = len(features)
-        if not features:
-            return {'status': None, 'count': 0}
-
-        for alert in features:
-            properties = alert.get('properties', {})
-            event_type = properties.get('event', '').lower()
-            # NWS 'severity' can be: 'Extreme', 'Severe', 'Moderate', 'Minor', 'Unknown'
-            # 'event' (like "Tornado Warning") is often more direct for W/W/A classification
-
-            is_warning = 'warning' in event_type
-            is_watch = 'watch' in event_type
-            is_advisory = 'advisory' in event_type or 'statement' in event_type # e.g. Special Weather Statement
-
-            if is_warning:
-                if current_priority_level < 3:
-                    highest_priority_status = 'warning'
-                    current_priority_level = 3
-            elif is_watch:
-                if current_priority_level < 2:
-                    highest_priority_status = 'watch'
-                    current_priority_level = 2
-            elif is_advisory:
-                if current_priority_level < 1:
-                    highest_priority_status = 'advisory'
-                    current_priority_level = 1
-            
-    except requests.exceptions.RequestException as e:
-        # print(f"NAVBAR_UTIL: Error fetching NWS alerts: {e}") # Optional: log differently
-        return {'status': None, 'count': 0} 
-    except json.JSONDecodeError as e:
-        # print(f"NAVBAR_UTIL: Error decoding NWS JSON: {e}") # Optional: log differently
-        return {'status': None, 'count': 0}
-    
+    # From the alert snapshot when there is one (see fetch_alerts_by_zone_or_point)
+    active_alerts = fetch_alerts_by_zone_or_point(zone_id, latitude, longitude, user_agent_string)
+    alert_count = len(active_alerts)
+    for alert in active_alerts:
+        event_type = (alert.get('event') or '').lower()
+        # 'event' (like "Tornado Warning") is more direct than 'severity' for W/W/A classification
+
+        is_warning = 'warning' in event_type
+        is_watch = 'watch' in event_type
+        is_advisory = 'advisory' in event_type or 'statement' in event_type # e.g. Special Weather Statement
+
+        if is_warning:
+            if current_priority_level < 3:
+                highest_priority_status = 'warning'
+                current_priority_level = 3
+        elif is_watch:
+            if current_priority_level < 2:
+                highest_priority_status = 'watch'
+                current_priority_level = 2
+        elif is_advisory:
+            if current_priority_level < 1:
+                highest_priority_status = 'advisory'
+                current_priority_level = 1
+
     return {'status': highest_priority_status, 'count': alert_count}
 
 
@@ -1,3 +1,339 @@
-from django.test import TestCase
+import os
+import time
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from push_notifications.models import WebPushDevice
+
+from accounts.models import SavedLocation
+from .models import NotifiedAlert, NWSPointZone
+from .tasks import group_locations_by_alert_area, fetch_alerts_for_areas, fan_out_alerts
+from . import alert_snapshot, zone_geometry
+from .alert_snapshot import SNAPSHOT_MAX_AGE_SECONDS, get_alert_snapshot, ingest_active_alerts
+from .zone_geometry import save_zone_geometries
+from .nws_zones import ZONE_CACHE_TTL_DAYS, resolve_point_zone, refresh_nws_point_zones
+
+User = get_user_model()
+
+SEND_MESSAGE = 'push_notifications.models.WebPushDeviceQuerySet.send_message'
+
+
+class AlertFanOutTests(TestCase):
+    """subscriptions/tasks.py: alerts are looked up once per zone and pushed once per user."""
+
+    def setUp(self):
+        self.alice = self.make_user('alice')
+        self.bob = self.make_user('bob')
+        # Alice's home and work are both in OKC001; so is Bob's home, and Bob's cabin is in OKC002
+        self.alice_home = self.make_location(self.alice, 'Home', '35.470000', '-97.520000')
+        self.alice_work = self.make_location(self.alice, 'Work', '35.480000', '-97.510000')
+        self.bob_home = self.make_location(self.bob, 'Home', '35.470000', '-97.520000')
+        self.bob_cabin = self.make_location(self.bob, 'Cabin', '34.500000', '-95.000000')
+        self.monitored = [(self.alice, [self.alice_home, self.alice_work]), (self.bob, [self.bob_home, self.bob_cabin])]
+        self.zones = {
+            (Decimal('35.470000'), Decimal('-97.520000')): 'OKC001',
+            (Decimal('35.480000'), Decimal('-97.510000')): 'OKC001',
+            (Decimal('34.500000'), Decimal('-95.000000')): 'OKC002',
+        }
+
+    def make_user(self, username):
+        user = User.objects.create_user(username=username, email=f"{username}@example.com", password='x')
+        WebPushDevice.objects.create(user=user, registration_id=f"https://push.example.com/{username}",
+                                     p256dh='key', auth='auth', browser='CHROME', active=True)
+        return user
+
+    def make_location(self, user, name, latitude, longitude):
+        return SavedLocation.objects.create(profile=user.profile, location_name=name,
+                                            latitude=Decimal(latitude), longitude=Decimal(longitude))
+
+    def resolve_point_zone(self, latitude, longitude, task_user_agent):
+        return mock.Mock(alert_zone=self.zones[(latitude, longitude)])
+
+    def group(self):
+        with mock.patch('subscriptions.tasks.resolve_point_zone', side_effect=self.resolve_point_zone) as resolve:
+            areas, area_by_location = group_locations_by_alert_area(self.monitored, 'test-agent')
+        return areas, area_by_location, resolve
+
+    def test_zone_resolved_once_per_coordinate(self):
+        areas, area_by_location, resolve = self.group()
+        self.assertEqual(resolve.call_count, 3) # Alice's and Bob's homes share coordinates
+        self.assertEqual(sorted(areas), [('zone', 'OKC001'), ('zone', 'OKC002')])
+        self.assertEqual(area_by_location[self.bob_home.pk], ('zone', 'OKC001'))
+        self.assertEqual(area_by_location[self.bob_cabin.pk], ('zone', 'OKC002'))
+
+    def test_location_without_zone_falls_back_to_its_point(self):
+        self.zones[(Decimal('34.500000'), Decimal('-95.000000'))] = None
+        areas, area_by_location, _ = self.group()
+        self.assertEqual(area_by_location[self.bob_cabin.pk], ('point', '34.500000', '-95.000000'))
+        self.assertEqual(areas[('point', '34.500000', '-95.000000')], (None, Decimal('34.500000'), Decimal('-95.000000')))
+
+    def test_one_fetch_per_zone(self):
+        areas, _, _ = self.group()
+        with mock.patch('subscriptions.tasks.fetch_alerts_by_zone_or_point', return_value=[]) as fetch:
+            fetch_alerts_for_areas(areas, 'test-agent')
+        self.assertEqual(sorted(call.args[0] for call in fetch.call_args_list), ['OKC001', 'OKC002'])
+
+    def fan_out(self, alerts_by_zone, send_side_effect=None):
+        _, area_by_location, _ = self.group()
+        alerts_by_area = {('zone', zone_id): alerts for zone_id, alerts in alerts_by_zone.items()}
+        with mock.patch(SEND_MESSAGE, side_effect=send_side_effect) as send_message:
+            pushes_sent = fan_out_alerts(self.monitored, area_by_location, alerts_by_area)
+        return pushes_sent, send_message
+
+    def notified(self):
+        return sorted(NotifiedAlert.objects.values_list('user__username', 'nws_alert_id'))
+
+    def test_one_push_per_user_per_alert(self):
+        tornado_warning = {'id': 'urn:warning', 'event': 'Tornado Warning', 'headline': 'Take cover'}
+        pushes_sent, send_message = self.fan_out({'OKC001': [tornado_warning], 'OKC002': [tornado_warning]})
+        # Alice has two locations and Bob both zones under it, but each hears about it once
+        self.assertEqual(pushes_sent, 2)
+        self.assertEqual(send_message.call_count, 2)
+        self.assertEqual(self.notified(), [('alice', 'urn:warning'), ('bob', 'urn:warning')])
+
+    def test_already_notified_is_skipped(self):
+        NotifiedAlert.objects.create(user=self.alice, nws_alert_id='urn:warning', saved_location=self.alice_home)
+        alerts = [{'id': 'urn:warning', 'event': 'Tornado Warning'}, {'id': 'urn:watch', 'event': 'Tornado Watch'}]
+        pushes_sent, _ = self.fan_out({'OKC001': alerts})
+        self.assertEqual(pushes_sent, 3)
+        self.assertEqual(self.notified(), [('alice', 'urn:warning'), ('alice', 'urn:watch'),
+                                           ('bob', 'urn:warning'), ('bob', 'urn:watch')])
+
+    def test_failed_send_is_retried_next_run(self):
+        alerts = {'OKC001': [{'id': 'urn:warning', 'event': 'Tornado Warning'}]}
+        self.monitored = self.monitored[:1] # Alice: two locations in the zone
+        pushes_sent, send_message = self.fan_out(alerts, send_side_effect=Exception('push service down'))
+        self.assertEqual(pushes_sent, 0)
+        self.assertEqual(send_message.call_count, 1) # Not retried for Alice's other location in the same run
+        self.assertEqual(self.notified(), [])
+
+        pushes_sent, send_message = self.fan_out(alerts)
+        self.assertEqual(pushes_sent, 1)
+        self.assertEqual(self.notified(), [('alice', 'urn:warning')])
+
+    def test_no_alerts(self):
+        pushes_sent, send_message = self.fan_out({'OKC001': [], 'OKC002': []})
+        self.assertEqual(pushes_sent, 0)
+        send_message.assert_not_called()
+
+
+def make_alert_feature(alert_id, event, geometry=None, ugc=(), affected_zones=()):
+    """An alert as the NWS feed has it (before _trim_alert_feature)."""
+    return {
+        'id': alert_id, 'type': 'Feature', 'geometry': geometry,
+        'properties': {
+            'id': alert_id, 'event': event, 'headline': f"{event} headline", 'severity': 'Severe',
+            'geocode': {'UGC': list(ugc)},
+            'affectedZones': [f"https://api.weather.gov/zones/{zone}" for zone in affected_zones],
+            'parameters': {'NotKept': ['dropped by the trim']},
+        },
+    }
+
+
+def make_square(west, south, size=1.0):
+    return {'type': 'Polygon', 'coordinates': [[[west, south], [west + size, south], [west + size, south + size],
+                                                [west, south + size], [west, south]]]}
+
+
+# A warning polygon around Oklahoma City and a watch issued for two zones only, with no polygon
+FIXTURE_ALERT_FEED = {'features': [
+    make_alert_feature('urn:warning', 'Tornado Warning', geometry=make_square(-98.0, 35.0), ugc=['OKC109']),
+    make_alert_feature('urn:watch', 'Tornado Watch', ugc=['OKC109', 'OKC143'],
+                       affected_zones=['county/OKC109', 'county/OKC143']),
+]}
+FIXTURE_ZONES = [('county/OKC109', (-97.7, 35.3)), ('county/OKC143', (-96.2, 35.9))] # (key, south-west corner)
+
+
+def make_response(status_code, feed=None, headers=None):
+    response = mock.Mock(status_code=status_code, headers=headers or {})
+    response.json.return_value = feed
+    if status_code >= 400:
+        response.raise_for_status.side_effect = Exception(f"HTTP {status_code}")
+    return response
+
+
+class AlertSnapshotTests(SimpleTestCase):
+    """subscriptions/alert_snapshot.py: the national alert snapshot file and its in-memory index."""
+
+    def setUp(self):
+        from shapely.geometry import box
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.snapshot_path = os.path.join(self.temp_dir, 'alerts', 'active_alerts.json')
+        zone_geometry_path = os.path.join(self.temp_dir, 'alerts', 'zone_geometries.npz')
+        settings_override = override_settings(NWS_ALERT_SNAPSHOT_PATH=self.snapshot_path,
+                                              NWS_ZONE_GEOMETRY_PATH=zone_geometry_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        save_zone_geometries([(key, box(west, south, west + 0.4, south + 0.4)) for key, (west, south) in FIXTURE_ZONES],
+                             zone_geometry_path)
+        for in_memory in (alert_snapshot._snapshot_in_memory, zone_geometry._zone_index_in_memory):
+            in_memory.update(checked_at=float('-inf'), file_id=None)
+        alert_snapshot._snapshot_in_memory['snapshot'] = None
+        zone_geometry._zone_index_in_memory['index'] = None
+
+    def ingest(self, response):
+        with mock.patch('subscriptions.alert_snapshot.requests.get', return_value=response) as get:
+            result = ingest_active_alerts()
+        return result, get.call_args.kwargs['headers']
+
+    def read_snapshot(self):
+        alert_snapshot._snapshot_in_memory['checked_at'] = float('-inf') # Skip the stat interval
+        return get_alert_snapshot()
+
+    def age_snapshot_file(self, seconds):
+        past = time.time() - seconds
+        os.utime(self.snapshot_path, (past, past))
+
+    def test_ingest_writes_a_trimmed_snapshot(self):
+        result, _ = self.ingest(make_response(200, FIXTURE_ALERT_FEED, {'ETag': '"v1"'}))
+        self.assertEqual(result, 'updated')
+        snapshot = self.read_snapshot()
+        self.assertEqual([feature['id'] for feature in snapshot.features], ['urn:warning', 'urn:watch'])
+        watch = snapshot.features[1]['properties']
+        self.assertEqual(watch['ugc'], ['OKC109', 'OKC143'])
+        self.assertEqual(watch['affected_zones'], ['county/OKC109', 'county/OKC143'])
+        self.assertNotIn('parameters', watch)
+
+    def test_not_modified_touches_the_file(self):
+        self.ingest(make_response(200, FIXTURE_ALERT_FEED, {'ETag': '"v1"', 'Last-Modified': 'Sun, 01 Jun 2025 12:00:00 GMT'}))
+        snapshot = self.read_snapshot()
+        self.age_snapshot_file(SNAPSHOT_MAX_AGE_SECONDS + 60)
+        self.assertIsNone(self.read_snapshot())
+
+        result, request_headers = self.ingest(make_response(304))
+        self.assertEqual(result, 'not_modified')
+        self.assertEqual(request_headers['If-None-Match'], '"v1"')
+        self.assertEqual(request_headers['If-Modified-Since'], 'Sun, 01 Jun 2025 12:00:00 GMT')
+        self.assertAlmostEqual(os.path.getmtime(self.snapshot_path), time.time(), delta=5)
+        self.assertIs(self.read_snapshot(), snapshot) # Fresh again, without being re-parsed
+
+    def test_reloaded_when_the_file_is_replaced(self):
+        self.ingest(make_response(200, FIXTURE_ALERT_FEED, {'ETag': '"v1"'}))
+        self.assertEqual(len(self.read_snapshot().features), 2)
+        self.ingest(make_response(200, {'features': FIXTURE_ALERT_FEED['features'][:1]}, {'ETag': '"v2"'}))
+        self.assertEqual([feature['id'] for feature in self.read_snapshot().features], ['urn:warning'])
+
+    def test_none_when_too_old_or_missing(self):
+        self.assertIsNone(self.read_snapshot())
+        self.ingest(make_response(200, FIXTURE_ALERT_FEED))
+        self.age_snapshot_file(SNAPSHOT_MAX_AGE_SECONDS - 60)
+        self.assertIsNotNone(self.read_snapshot())
+        self.age_snapshot_file(SNAPSHOT_MAX_AGE_SECONDS + 60)
+        self.assertIsNone(self.read_snapshot())
+
+    def test_failed_refresh_keeps_the_last_snapshot(self):
+        self.ingest(make_response(200, FIXTURE_ALERT_FEED))
+        result, _ = self.ingest(make_response(503))
+        self.assertEqual(result, 'failed')
+        self.assertEqual(len(self.read_snapshot().features), 2)
+
+    def test_features_for_zone(self):
+        self.ingest(make_response(200, FIXTURE_ALERT_FEED))
+        snapshot = self.read_snapshot()
+        self.assertEqual([feature['id'] for feature in snapshot.features_for_zone('OKC109')], ['urn:warning', 'urn:watch'])
+        self.assertEqual([feature['id'] for feature in snapshot.features_for_zone('OKC143')], ['urn:watch'])
+        self.assertEqual(snapshot.features_for_zone('TXC113'), [])
+
+    def test_features_at_point(self):
+        self.ingest(make_response(200, FIXTURE_ALERT_FEED))
+        snapshot = self.read_snapshot()
+        at_point = lambda latitude, longitude, **kwargs: [feature['id'] for feature in
+                                                          snapshot.features_at_point(latitude, longitude, **kwargs)]
+        self.assertEqual(at_point(35.5, -97.5), ['urn:warning', 'urn:watch']) # In the polygon and OKC109's boundary
+        self.assertEqual(at_point(35.2, -97.9), ['urn:warning']) # In the polygon only
+        self.assertEqual(at_point(36.0, -96.1), ['urn:watch']) # OKC143, zone-only alert
+        self.assertEqual(at_point(40.0, -100.0), [])
+        self.assertEqual(at_point(40.0, -100.0, zone_ids=['OKC143']), ['urn:watch'])
+
+
+def make_points_response(county_zone, forecast_zone):
+    response = mock.Mock(status_code=200)
+    response.json.return_value = {'properties': {
+        'county': f"https://api.weather.gov/zones/county/{county_zone}",
+        'forecastZone': f"https://api.weather.gov/zones/forecast/{forecast_zone}",
+    }}
+    return response
+
+
+class NWSPointZoneTests(TestCase):
+    """subscriptions/nws_zones.py: the lat/lon -> zone cache in front of NWS /points."""
+
+    def setUp(self):
+        points_patch = mock.patch('subscriptions.nws_zones.requests.get', return_value=make_points_response('OKC109', 'OKZ025'))
+        self.points_get = points_patch.start()
+        self.addCleanup(points_patch.stop)
+
+    def make_stale(self, point_zone):
+        NWSPointZone.objects.filter(pk=point_zone.pk).update(
+            resolved_at=timezone.now() - timedelta(days=ZONE_CACHE_TTL_DAYS + 1))
+
+    def test_lookup_is_cached(self):
+        point_zone = resolve_point_zone(35.4676, -97.5164, 'test-agent')
+        self.assertEqual((point_zone.county_zone, point_zone.forecast_zone, point_zone.alert_zone), ('OKC109', 'OKZ025', 'OKC109'))
+        self.assertEqual(self.points_get.call_count, 1)
+        self.assertEqual(self.points_get.call_args.args[0], 'https://api.weather.gov/points/35.468,-97.516')
+
+        self.assertEqual(resolve_point_zone(35.4676, -97.5164, 'test-agent').pk, point_zone.pk)
+        self.assertEqual(self.points_get.call_count, 1) # TTL hit
+
+    def test_coordinates_are_rounded(self):
+        # Within the same 0.001 degree cell: one entry, one lookup (Decimals from SavedLocation too)
+        first = resolve_point_zone(35.46751, -97.51649)
+        second = resolve_point_zone(Decimal('35.467900'), Decimal('-97.516400'))
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual((first.latitude, first.longitude), (Decimal('35.468'), Decimal('-97.516')))
+        self.assertEqual(self.points_get.call_count, 1)
+        resolve_point_zone(35.4694, -97.5164)
+        self.assertEqual(NWSPointZone.objects.count(), 2)
+
+    def test_stale_entry_is_refreshed(self):
+        point_zone = resolve_point_zone(35.4676, -97.5164)
+        self.make_stale(point_zone)
+        self.points_get.return_value = make_points_response('OKC027', 'OKZ026')
+        refreshed = resolve_point_zone(35.4676, -97.5164)
+        self.assertEqual(refreshed.pk, point_zone.pk)
+        self.assertEqual(refreshed.alert_zone, 'OKC027')
+        self.assertGreater(refreshed.resolved_at, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.points_get.call_count, 2)
+
+    def test_stale_entry_is_used_when_nws_fails(self):
+        point_zone = resolve_point_zone(35.4676, -97.5164)
+        self.make_stale(point_zone)
+        self.points_get.side_effect = Exception('api.weather.gov is down')
+        self.assertEqual(resolve_point_zone(35.4676, -97.5164).alert_zone, 'OKC109')
+        self.assertIsNone(resolve_point_zone(40.0, -100.0)) # Never resolved: nothing to fall back on
+        self.assertFalse(NWSPointZone.objects.filter(latitude=Decimal('40.000')).exists())
+
+    def test_missing_county_falls_back_to_forecast_zone(self):
+        self.points_get.return_value.json.return_value = {'properties': {'county': None,
+                                                                         'forecastZone': 'https://api.weather.gov/zones/forecast/OKZ025'}}
+        self.assertEqual(resolve_point_zone(35.4676, -97.5164).alert_zone, 'OKZ025')
+
+    def test_refresher_keeps_to_saved_locations(self):
+        user = User.objects.create_user(username='carol', email='carol@example.com', password='x')
+        SavedLocation.objects.create(profile=user.profile, location_name='Home',
+                                     latitude=Decimal('35.467600'), longitude=Decimal('-97.516400'))
+        SavedLocation.objects.create(profile=user.profile, location_name='Work',
+                                     latitude=Decimal('36.153900'), longitude=Decimal('-95.992800'))
+        saved_stale = resolve_point_zone(35.4676, -97.5164)
+        unused_stale = resolve_point_zone(32.7767, -96.7970) # e.g. a page lookup of someone else's coordinates
+        unused_fresh = resolve_point_zone(39.7392, -104.9903)
+        self.make_stale(saved_stale)
+        self.make_stale(unused_stale)
+        self.points_get.reset_mock()
+
+        refresh_nws_point_zones()
+        looked_up = sorted(call.args[0] for call in self.points_get.call_args_list)
+        self.assertEqual(looked_up, ['https://api.weather.gov/points/35.468,-97.516', # Stale, saved
+                                     'https://api.weather.gov/points/36.154,-95.993']) # Saved, never resolved
+        cached = set(NWSPointZone.objects.values_list('latitude', 'longitude'))
+        self.assertEqual(cached, {(Decimal('35.468'), Decimal('-97.516')), (Decimal('36.154'), Decimal('-95.993')),
+                                  (unused_fresh.latitude, unused_fresh.longitude)})
+        self.assertFalse(NWSPointZone.objects.filter(pk=unused_stale.pk).exists())
@@ -0,0 +1,189 @@
+# subscriptions/zone_geometry.py
+#
+# Local store of NWS zone boundaries, so alerts issued for zones rather than
+# a polygon (most watches and advisories: 'geometry': null plus a list of
+# affectedZones) can still be matched against a point without an HTTP call
+# per alert or per zone.
+#
+# refresh_zone_geometries, scheduled weekly (zones change a few times a year),
+# downloads every county, forecast and fire zone with its boundary from
+# api.weather.gov/zones, simplifies each boundary by ZONE_SIMPLIFY_TOLERANCE_DEG
+# and writes them atomically to one compact .npz (get_zone_geometry_path()):
+#     keys     'forecast/OKZ025', 'county/OKC109', ... (the end of the zone URL)
+#     wkb      every geometry's WKB, concatenated (uint8)
+#     offsets  where each one starts and ends in wkb
+# No pickles, so loading it is just np.load() and one shapely.from_wkb().
+#
+# get_zone_geometry_index() keeps the loaded ZoneGeometryIndex in process
+# memory (reloaded when the file is replaced) and get_alert_geometries()
+# turns any alert feature (raw NWS or snapshot-trimmed) into shapes: its own
+# polygon when it has one, else the boundaries of its zones.
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+from django.conf import settings
+
+NWS_ZONES_URL = "https://api.weather.gov/zones"
+ZONE_TYPES = ('county', 'forecast', 'fire') # Land zones alerts are issued for; marine ones don't matter for user locations
+ZONE_SIMPLIFY_TOLERANCE_DEG = 0.005 # ~500 m, well under the accuracy of a zone-based alert
+ZONE_INDEX_STAT_INTERVAL_SECONDS = 5 * 60 # How often a process checks whether the file was replaced
+UGC_ZONE_TYPES = {'C': 'county', 'Z': 'forecast'} # For alerts that only carry UGC codes
+
+_zone_index_in_memory = {'checked_at': float('-inf'), 'file_id': None, 'index': None}
+_zone_index_lock = threading.Lock()
+
+
+def get_zone_geometry_path():
+    return getattr(settings, 'NWS_ZONE_GEOMETRY_PATH', None) or os.path.join(settings.MEDIA_ROOT, 'alerts', 'zone_geometries.npz')
+
+
+def get_zone_key(zone_url):
+    """'https://api.weather.gov/zones/forecast/OKZ025' -> 'forecast/OKZ025'."""
+    return '/'.join(zone_url.rstrip('/').split('/')[-2:])
+
+
+def get_alert_zone_keys(feature):
+    """Zone keys of an alert, from affectedZones (raw or trimmed), else its UGC codes."""
+    props = feature.get('properties', {})
+    if props.get('affected_zones'):
+        return list(props['affected_zones'])
+    if props.get('affectedZones'):
+        return [get_zone_key(zone_url) for zone_url in props['affectedZones']]
+    ugc_codes = props.get('ugc') or props.get('geocode', {}).get('UGC', [])
+    return [f"{UGC_ZONE_TYPES[code[2]]}/{code}" for code in ugc_codes if len(code) == 6 and code[2] in UGC_ZONE_TYPES]
+
+
+class ZoneGeometryIndex:
+    """Simplified zone boundaries by zone key."""
+
+    def __init__(self, keys, geometries):
+        self.keys = keys
+        self.geometries = geometries
+        self.geometries_by_key = dict(zip(keys, geometries))
+
+    def geometries_for_zones(self, zone_keys):
+        return [self.geometries_by_key[key] for key in zone_keys if key in self.geometries_by_key]
+
+
+def _load_zone_geometry_file(zone_geometry_path):
+    import shapely
+    with np.load(zone_geometry_path, allow_pickle=False) as stored:
+        keys = [str(key) for key in stored['keys']]
+        wkb_buffer = stored['wkb'].tobytes()
+        offsets = stored['offsets']
+    geometries = shapely.from_wkb([wkb_buffer[offsets[i]:offsets[i + 1]] for i in range(len(keys))])
+    return ZoneGeometryIndex(keys, list(geometries))
+
+
+def get_zone_geometry_index():
+    """The current ZoneGeometryIndex, or None if zone boundaries haven't been downloaded yet."""
+    now = time.monotonic()
+    with _zone_index_lock:
+        if now - _zone_index_in_memory['checked_at'] >= ZONE_INDEX_STAT_INTERVAL_SECONDS:
+            _zone_index_in_memory['checked_at'] = now
+            zone_geometry_path = get_zone_geometry_path()
+            try:
+                stat = os.stat(zone_geometry_path)
+                file_id = (stat.st_ino, stat.st_size, stat.st_mtime)
+                if file_id != _zone_index_in_memory['file_id']:
+                    _zone_index_in_memory['index'] = _load_zone_geometry_file(zone_geometry_path)
+                    _zone_index_in_memory['file_id'] = file_id
+            except FileNotFoundError:
+                _zone_index_in_memory['index'], _zone_index_in_memory['file_id'] = None, None
+            except (OSError, ValueError, KeyError, ImportError) as e: # Keep the last good index
+                print(f"  ZONE_GEOMETRY: Could not read {zone_geometry_path}: {e}")
+        return _zone_index_in_memory['index']
+
+
+def get_alert_geometries(feature, zone_index=None):
+    """
+    Shapes covering an alert: its own (Multi)Polygon if it has one, else the stored
+    boundaries of its zones (empty if they aren't in zone_index, or there's no index).
+    """
+    from shapely.geometry import shape
+    import shapely
+    geometry = feature.get('geometry')
+    if geometry:
+        polygon = shape(geometry)
+        if not polygon.is_valid: # Self-intersecting warning polygons do happen; GEOS predicates can raise on them
+            polygon = shapely.make_valid(polygon)
+        return [] if polygon.is_empty else [polygon]
+    if zone_index is None:
+        return []
+    return zone_index.geometries_for_zones(get_alert_zone_keys(feature))
+
+
+def fetch_zone_geometries(zone_type, task_user_agent):
+    """[(zone key, simplified shapely geometry)] for every zone of one type, from NWS."""
+    from shapely.geometry import shape
+    import shapely
+    nws_headers = {'User-Agent': task_user_agent, 'Accept': 'application/geo+json'}
+    response = requests.get(NWS_ZONES_URL, params={'type': zone_type, 'include_geometry': 'true'},
+                            headers=nws_headers, timeout=300)
+    response.raise_for_status()
+    zones = []
+    for feature in response.json().get('features', []):
+        if not feature.get('geometry') or not feature.get('id'):
+            continue
+        try:
+            geometry = shapely.make_valid(shape(feature['geometry']))
+            geometry = shapely.simplify(geometry, ZONE_SIMPLIFY_TOLERANCE_DEG, preserve_topology=True)
+        except Exception as e: # One bad boundary shouldn't lose the rest
+            print(f"  ZONE_GEOMETRY: Skipping zone {feature.get('id')}: {e}")
+            continue
+        if not geometry.is_empty:
+            zones.append((get_zone_key(feature['id']), geometry))
+    return zones
+
+
+def save_zone_geometries(zones, zone_geometry_path):
+    """Writes [(zone key, geometry)] to zone_geometry_path atomically."""
+    import shapely
+    wkb_list = shapely.to_wkb([geometry for _, geometry in zones])
+    offsets = np.zeros(len(wkb_list) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(wkb) for wkb in wkb_list])
+    os.makedirs(os.path.dirname(zone_geometry_path), exist_ok=True)
+    temp_path = f"{zone_geometry_path}.tmp.{os.getpid()}.npz"
+    try:
+        np.savez_compressed(temp_path, keys=np.array([key for key, _ in zones]),
+                            wkb=np.frombuffer(b''.join(wkb_list), dtype=np.uint8), offsets=offsets)
+        os.replace(temp_path, zone_geometry_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def refresh_zone_geometries():
+    """
+    Scheduled task: re-downloads all ZONE_TYPES boundaries and replaces the store.
+    Keeps the old file if any zone type fails to download. Returns the zone count, or None.
+    """
+    from .alert_snapshot import get_alert_user_agent
+
+    start_time = datetime.now(timezone.utc)
+    print(f"[{start_time.isoformat()}] TASK_INFO: Running task: refresh_zone_geometries")
+    task_user_agent = get_alert_user_agent()
+    zones = []
+    for zone_type in ZONE_TYPES:
+        try:
+            type_zones = fetch_zone_geometries(zone_type, task_user_agent)
+        except Exception as e:
+            print(f"  ZONE_GEOMETRY_ERROR: Could not download {zone_type} zones: {e}")
+            return None
+        print(f"  ZONE_GEOMETRY: {len(type_zones)} {zone_type} zone(s).")
+        zones.extend(type_zones)
+
+    zone_geometry_path = get_zone_geometry_path()
+    try:
+        save_zone_geometries(zones, zone_geometry_path)
+    except OSError as e:
+        print(f"  ZONE_GEOMETRY_ERROR: Could not write {zone_geometry_path}: {e}")
+        return None
+    print(f"TASK_INFO: refresh_zone_geometries wrote {len(zones)} zone(s) to {zone_geometry_path} "
+          f"({os.path.getsize(zone_geometry_path) / 1e6:.1f} MB) in {datetime.now(timezone.utc) - start_time}.")
+    return len(zones)
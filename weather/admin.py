@@ -1,3 +1,24 @@
 from django.contrib import admin
+from .models import ModelCycle, ModelFrame, LocationGridCell
 
-# Register your models here.
+
+@admin.register(ModelCycle)
+class ModelCycleAdmin(admin.ModelAdmin):
+    list_display = ('model_key', 'run_date', 'run_hour', 'status', 'created_at', 'updated_at')
+    list_filter = ('model_key', 'status')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(ModelFrame)
+class ModelFrameAdmin(admin.ModelAdmin):
+    list_display = ('cycle', 'param', 'fhr', 'status', 'attempts', 'updated_at')
+    list_filter = ('status', 'cycle__model_key', 'param')
+    search_fields = ('param', 'error')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(LocationGridCell)
+class LocationGridCellAdmin(admin.ModelAdmin):
+    list_display = ('location', 'grid_key', 'row', 'col', 'distance_km', 'updated_at')
+    list_filter = ('grid_key',)
+    readonly_fields = ('updated_at',)
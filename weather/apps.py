@@ -24,8 +24,8 @@ class WeatherConfig(AppConfig):
             # --- GFS Plot Generation Task ---
             gfs_task_path = 'weather.tasks.automated_gfs_plot_generation'
             gfs_schedule_name = 'Generate GFS Model Plots'
-            gfs_desired_interval_hours = 3 
-            gfs_interval_minutes = gfs_desired_interval_hours * 60 # Interval in minutes
+            # Frequent ingestion ticks; each one only renders newly posted forecast hours (weather/ingestion.py)
+            gfs_interval_minutes = getattr(settings, 'MODEL_INGEST_POLL_MINUTES', 5)
 
             try:
                 print(f"  Attempting to get/update schedule for GFS task: '{gfs_schedule_name}'")
@@ -34,17 +34,17 @@ class WeatherConfig(AppConfig):
 
                 # Check if update is needed
                 if (gfs_schedule_obj.minutes != gfs_interval_minutes or
-                    gfs_schedule_obj.schedule_type != Schedule.HOURLY or 
+                    gfs_schedule_obj.schedule_type != Schedule.MINUTES or 
                     gfs_schedule_obj.func != gfs_task_path):
 
                     print(f"    Updating GFS schedule '{gfs_schedule_name}'...")
                     gfs_schedule_obj.func = gfs_task_path
-                    gfs_schedule_obj.minutes = gfs_interval_minutes # Use minutes for HOURLY type
-                    gfs_schedule_obj.schedule_type = Schedule.HOURLY
+                    gfs_schedule_obj.minutes = gfs_interval_minutes
+                    gfs_schedule_obj.schedule_type = Schedule.MINUTES
                     gfs_schedule_obj.repeats = -1
                     gfs_schedule_obj.next_run = timezone.now() + timedelta(minutes=gfs_interval_minutes) 
                     gfs_schedule_obj.save()
-                    print(f"    SUCCESS: UPDATED GFS task '{gfs_schedule_name}' to run every {gfs_desired_interval_hours} hour(s) (as {gfs_interval_minutes} minutes).")
+                    print(f"    SUCCESS: UPDATED GFS task '{gfs_schedule_name}' to run every {gfs_interval_minutes} minutes.")
                 else:
                     print(f"    GFS Task '{gfs_schedule_name}' already scheduled correctly.")
             except Schedule.DoesNotExist:
@@ -52,12 +52,12 @@ class WeatherConfig(AppConfig):
                 schedule(
                     gfs_task_path, 
                     name=gfs_schedule_name, 
-                    schedule_type=Schedule.HOURLY,
-                    minutes=gfs_interval_minutes, # Use minutes for HOURLY type
+                    schedule_type=Schedule.MINUTES,
+                    minutes=gfs_interval_minutes,
                     repeats=-1,
                     next_run=timezone.now() + timedelta(minutes=5) # Initial run in 5 mins
                 )
-                print(f"    SUCCESS: Scheduled new GFS task '{gfs_schedule_name}' to run every {gfs_desired_interval_hours} hour(s) (as {gfs_interval_minutes} minutes).")
+                print(f"    SUCCESS: Scheduled new GFS task '{gfs_schedule_name}' to run every {gfs_interval_minutes} minutes.")
             except Exception as e:
                 print(f"    ERROR: Could not schedule or update GFS plot task '{gfs_schedule_name}': {e}")
                 # print(traceback.format_exc()) # Uncomment for full traceback during debug
@@ -66,8 +66,7 @@ class WeatherConfig(AppConfig):
             print(f"\n  Attempting to schedule/update NAM task...")
             nam_task_path = 'weather.tasks.automated_nam_plot_generation'
             nam_schedule_name = 'Generate NAM Model Plots'
-            nam_desired_interval_hours = 3 
-            nam_interval_minutes = nam_desired_interval_hours * 60
+            nam_interval_minutes = getattr(settings, 'MODEL_INGEST_POLL_MINUTES', 5)
 
             try:
                 print(f"  NAM Task: Trying to get schedule named '{nam_schedule_name}'")
@@ -76,18 +75,18 @@ class WeatherConfig(AppConfig):
 
                 update_needed = False
                 if nam_schedule_obj.func != nam_task_path: update_needed = True
-                if nam_schedule_obj.schedule_type != Schedule.HOURLY: update_needed = True
+                if nam_schedule_obj.schedule_type != Schedule.MINUTES: update_needed = True
                 if nam_schedule_obj.minutes != nam_interval_minutes: update_needed = True
 
                 if update_needed:
                     print(f"    NAM Task: Updating schedule for '{nam_schedule_name}'...")
                     nam_schedule_obj.func = nam_task_path
                     nam_schedule_obj.minutes = nam_interval_minutes 
-                    nam_schedule_obj.schedule_type = Schedule.HOURLY
+                    nam_schedule_obj.schedule_type = Schedule.MINUTES
                     nam_schedule_obj.repeats = -1
                     nam_schedule_obj.next_run = timezone.now() + timedelta(minutes=nam_interval_minutes, seconds=30) # Stagger
                     nam_schedule_obj.save()
-                    print(f"    SUCCESS: UPDATED NAM task '{nam_schedule_name}' to run every {nam_desired_interval_hours} hour(s) (as {nam_interval_minutes} minutes).")
+                    print(f"    SUCCESS: UPDATED NAM task '{nam_schedule_name}' to run every {nam_interval_minutes} minutes.")
                 else:
                     print(f"    NAM Task '{nam_schedule_name}' already scheduled correctly.")
             except Schedule.DoesNotExist:
@@ -95,12 +94,12 @@ class WeatherConfig(AppConfig):
                 schedule(
                     nam_task_path, 
                     name=nam_schedule_name, 
-                    schedule_type=Schedule.HOURLY, 
+                    schedule_type=Schedule.MINUTES, 
                     minutes=nam_interval_minutes,    
                     repeats=-1,
                     next_run=timezone.now() + timedelta(minutes=1) # Initial run in 10 mins
                 )
-                print(f"    SUCCESS: Scheduled new NAM task '{nam_schedule_name}' to run every {nam_desired_interval_hours} hour(s) (as {nam_interval_minutes} minutes).")
+                print(f"    SUCCESS: Scheduled new NAM task '{nam_schedule_name}' to run every {nam_interval_minutes} minutes.")
             except Exception as e:
                 print(f"    ERROR: Could not schedule or update NAM plot task '{nam_schedule_name}': {e}")
                 # print(traceback.format_exc()) # Uncomment for full traceback during debug
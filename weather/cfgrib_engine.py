@@ -0,0 +1,121 @@
+# weather/cfgrib_engine.py
+#
+# cfgrib/xarray decode engine, an alternative to pygrib (see grib_processing.decode_grib_file).
+#
+# The pygrib engine reads one message at a time. This one opens a forecast
+# hour's (subsetted) GRIB file with cfgrib, every requested parameter as one
+# variable of a single lazy xarray Dataset backed by dask chunks. cfgrib builds
+# its eccodes index of the file once and every parameter reuses it. Nothing is
+# decoded until the extractor crops a field; only the cropped window is then
+# materialised, straight into float32.
+#
+# CfgribMessage wraps a variable in the few parts of the pygrib message API
+# that grid_cache and extract_param_field use, so the rest of the pipeline
+# (grid cache, transforms, field store, renderers) doesn't care which engine
+# decoded the field.
+#
+# Which engine a model uses is set by MODEL_PLOT_SETTINGS[model]['decode_engine'],
+# or overridden with settings.MODEL_DECODE_ENGINES = {'nam': 'cfgrib', ...}.
+# 'manage.py benchmark_grib_engines' compares the two on fixture files.
+import glob
+import os
+
+import numpy as np
+
+from .grid_cache import GRID_DEFINITION_KEYS
+from .model_params import get_param_selector
+
+# Coordinates kept on each variable; the per-parameter level/time scalars would clash when merged
+KEPT_COORDS = ('latitude', 'longitude')
+
+# cfgrib only copies its own default set of GRIB keys into attrs (no Ni/Nj on a
+# lambert grid, for one). Asking for every grid key makes get_grid_definition see
+# what pygrib sees, so both engines share one grid cache entry per grid.
+READ_KEYS = list(GRID_DEFINITION_KEYS)
+
+
+class CfgribMessage:
+    """One variable of a cfgrib Dataset, looking enough like a pygrib message for the extractor."""
+
+    def __init__(self, data_array):
+        self.data_array = data_array
+        self.attrs = data_array.attrs
+
+    def __getitem__(self, key):
+        try:
+            return self.attrs[f"GRIB_{key}"]
+        except KeyError:
+            raise KeyError(key)
+
+    def has_key(self, key):
+        return f"GRIB_{key}" in self.attrs
+
+    @property
+    def name(self):
+        return self.attrs.get('GRIB_name', self.data_array.name)
+
+    @property
+    def units(self):
+        return self.attrs.get('GRIB_units') or self.attrs.get('units')
+
+    @property
+    def values(self):
+        """The lazy (dask) array; slicing it and converting to numpy decodes only what's needed."""
+        return self.data_array.data
+
+    def latlons(self):
+        lats = np.asarray(self.data_array['latitude'].values)
+        lons = np.asarray(self.data_array['longitude'].values)
+        if lats.ndim == 1: # Regular lat/lon grids come with 1D coordinates
+            lons, lats = np.meshgrid(lons, lats)
+        return lats, lons
+
+
+def get_cfgrib_index_path(local_grib_filename):
+    """
+    Index path template for cfgrib. cfgrib adds the filter keys to the index keys, so
+    parameters filtered on topLevel/bottomLevel need a different index than the rest;
+    {short_hash} (filled in by cfgrib from the index keys) gives each key set its own
+    file instead of every parameter rebuilding one shared index.
+    """
+    return f"{local_grib_filename}.cfgrib.{{short_hash}}.idx"
+
+
+def open_forecast_hour_dataset(local_grib_filename, param_details_list, for_console_output=None):
+    """
+    Opens every requested parameter of a GRIB file as one lazy Dataset, one variable per
+    output_file_prefix. Parameters that can't be found are left out (and logged).
+    Remove the index file (get_cfgrib_index_path) along with the GRIB file.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    import xarray as xr
+
+    data_vars = {}
+    for param_details in param_details_list:
+        prefix = param_details.get('output_file_prefix')
+        criteria = get_param_selector(param_details)['criteria']
+        if criteria is None:
+            continue
+        try:
+            # Same index path template for every parameter, so the file is only indexed once per key set
+            param_dataset = xr.open_dataset(local_grib_filename, engine='cfgrib', chunks={},
+                                            backend_kwargs={'filter_by_keys': criteria, 'read_keys': READ_KEYS,
+                                                            'indexpath': get_cfgrib_index_path(local_grib_filename)})
+        except Exception as e:
+            for_console_output(f"      ERROR (cfgrib): Could not open {prefix} with {criteria}: {e}")
+            continue
+        if not param_dataset.data_vars:
+            for_console_output(f"      ERROR (cfgrib): Could not find GRIB message for {param_details.get('plot_title_param_name', 'N/A')} with criteria {criteria}")
+            continue
+
+        data_array = next(iter(param_dataset.data_vars.values()))
+        extra_coords = [coord for coord in data_array.coords if coord not in KEPT_COORDS and coord not in data_array.dims]
+        data_vars[prefix] = data_array.drop_vars(extra_coords)
+
+    return xr.Dataset(data_vars)
+
+
+def remove_cfgrib_index(local_grib_filename):
+    for index_path in glob.glob(f"{glob.escape(local_grib_filename)}.cfgrib.*.idx"):
+        os.remove(index_path)
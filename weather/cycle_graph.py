@@ -0,0 +1,249 @@
+# weather/cycle_graph.py
+#
+# Optional dask execution of a model cycle (settings.MODEL_CYCLE_EXECUTORS = {'nam': 'dask'}).
+#
+# render_pool.py runs a cycle on two hand-sized pools (download threads, render
+# processes) glued together with semaphores. Here the whole cycle is one dask
+# graph instead:
+#     download(fhr) -> decode+transform+derive(fhr) -> render(fhr, param) for every param
+# run by dask's local multiprocessing scheduler on spawned worker processes, so
+# every core is kept busy with whatever stage is ready and dask's ordering
+# finishes an hour's renders before starting far-ahead downloads.
+#
+# Shared work stays shared: decode writes each field to the field store and the
+# render tasks memory-map it from there, so no field is pickled between
+# processes, and the grid cache, map templates and colormap tables are built
+# once per worker process and reused for every task it runs.
+#
+# Memory is bounded by the number of worker processes: each runs one task at a
+# time and the scheduler only holds small task results. The worker count is the
+# core count capped by MODEL_DASK_MEMORY_BUDGET_MB / the estimated peak of one
+# task (from the model's cached grid size).
+#
+# Downloads are chained into MODEL_MAX_CONCURRENT_DOWNLOADS lanes so we don't
+# hammer NOMADS. Every task records how long it took; the cycle logs per-stage
+# totals when it finishes.
+import os
+import time
+import tempfile
+import traceback
+
+from django.conf import settings
+
+from .grib_fetch import download_grib_file
+from .grib_processing import (
+    MODEL_PLOT_SETTINGS,
+    format_model_forecast_hour,
+    get_params_needing_plots,
+    decode_grib_file,
+    store_decoded_fields,
+    render_model_plot,
+)
+from .grid_cache import list_model_grid_keys, load_model_grid
+from .field_store import load_field
+from .model_params import is_derived_param
+from .derived_fields import get_grib_params_to_decode, compute_derived_fields
+from .render_pool import get_max_render_workers, get_max_concurrent_downloads, _make_render_executor
+
+DEFAULT_MEMORY_BUDGET_MB = 4096
+RENDER_TASK_BASE_MB = 300 # A worker's matplotlib/cartopy figure and map template
+DECODED_GRID_COPIES = 3 # Full-grid float64 values from the GRIB + cropped float32 + transform headroom
+STAGES = ('download', 'decode', 'render')
+
+
+def get_cycle_executor(model_key):
+    """'pool' (render_pool.py) or 'dask' (this module) for a model."""
+    return getattr(settings, 'MODEL_CYCLE_EXECUTORS', {}).get(model_key, 'pool')
+
+
+def estimate_task_memory_mb(model_key):
+    """Peak memory of one task, from the largest cached grid of the model (base cost if none is cached yet)."""
+    largest_cell_count = 0
+    for grid_key in list_model_grid_keys(model_key):
+        try:
+            full_rows, full_cols = load_model_grid(grid_key).metadata['full_shape']
+        except (FileNotFoundError, KeyError, ValueError):
+            continue
+        largest_cell_count = max(largest_cell_count, full_rows * full_cols)
+    return RENDER_TASK_BASE_MB + largest_cell_count * 8 * DECODED_GRID_COPIES / (1024 * 1024)
+
+
+def get_dask_worker_count(model_key):
+    budget_mb = getattr(settings, 'MODEL_DASK_MEMORY_BUDGET_MB', DEFAULT_MEMORY_BUDGET_MB)
+    return max(1, min(get_max_render_workers(), int(budget_mb // estimate_task_memory_mb(model_key))))
+
+
+# --- Graph tasks (module level so they pickle to the worker processes) ---
+def _download_task(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list, previous_download=None):
+    """
+    Downloads one hour's GRIB subset to a temp file. previous_download is unused; it only
+    chains downloads into lanes.
+    """
+    started = time.perf_counter()
+    model_settings = MODEL_PLOT_SETTINGS[model_key]
+    grib_url = model_settings['url_template'].format(run_date=run_date_str, run_hour=model_run_hour_str, fhr=current_fhr_fmt)
+    temp_grib_dir = os.path.join(settings.MEDIA_ROOT, 'grib_temp')
+    os.makedirs(temp_grib_dir, exist_ok=True)
+    temp_fd, local_grib_filename = tempfile.mkstemp(prefix=f"{model_key}_{run_date_str}_{model_run_hour_str}_{current_fhr_fmt}_", suffix='.grb2', dir=temp_grib_dir)
+    os.close(temp_fd)
+
+    result = {'fhr': current_fhr_fmt, 'grib_path': local_grib_filename, 'message_positions': {}, 'error': None}
+    try:
+        result['message_positions'] = download_grib_file(grib_url, param_details_list, local_grib_filename,
+                                                         timeout=model_settings['download_timeout'], for_console_output=print)
+    except Exception as e:
+        print(f"    ERROR (cycle_graph): Downloading {model_settings['display_name']} F{current_fhr_fmt}: {e} (URL: {grib_url})")
+        os.remove(local_grib_filename)
+        result.update(grib_path=None, error=str(e))
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def _decode_task(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list, grib_params, download):
+    """
+    Decodes (and transforms) the hour's GRIB params, derives its derived params (derived_fields.py)
+    and puts each field in the field store. download is None when every GRIB input was already stored.
+    Returns {'fhr', 'fields': {prefix: field or None}, 'stored': {prefix: bool}, 'error', 'seconds', 'download_seconds'}.
+    Stored fields are dropped from 'fields' so they don't travel back through the scheduler.
+    """
+    started = time.perf_counter()
+    result = {'fhr': current_fhr_fmt, 'fields': {}, 'stored': {}, 'error': None, 'download_seconds': None}
+    fields = {}
+    if download is not None:
+        result.update(error=download['error'], download_seconds=download['seconds'])
+    if download is not None and download['grib_path'] is not None:
+        try:
+            fields = decode_grib_file(model_key, download['grib_path'], grib_params, download['message_positions'], for_console_output=print)
+        except Exception as e:
+            traceback.print_exc()
+            result['error'] = str(e)
+        finally:
+            os.remove(download['grib_path'])
+    stored = store_decoded_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, grib_params, fields, print)
+
+    derived_params = [param_details for param_details in param_details_list if is_derived_param(param_details)]
+    if derived_params:
+        derived_fields = compute_derived_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, derived_params, fields, print)
+        stored |= store_decoded_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, derived_params, derived_fields, print)
+        fields.update(derived_fields)
+
+    for param_details in param_details_list:
+        prefix = param_details.get('output_file_prefix')
+        result['stored'][prefix] = prefix in stored
+        result['fields'][prefix] = None if prefix in stored else fields.get(prefix)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def _render_task(model_key, run_date_str, model_run_hour_str, param_details, output_image_full_path, decoded):
+    """Renders one (hour, param), reading the field from the store when decode put it there."""
+    started = time.perf_counter()
+    prefix = param_details.get('output_file_prefix')
+    result = {'fhr': decoded['fhr'], 'param': prefix, 'success': False, 'skipped': False, 'image_path': None, 'error': None}
+    try:
+        field = decoded['fields'].get(prefix)
+        if decoded['stored'].get(prefix):
+            stored_field = load_field(model_key, run_date_str, model_run_hour_str, prefix, decoded['fhr'])
+            field = {'values': stored_field.decode(), 'grid_key': stored_field.grid_key, 'units': stored_field.metadata.get('units')}
+        if field is None:
+            result['error'] = decoded['error'] or "GRIB download or decode failed"
+        else:
+            published_image_path = render_model_plot(model_key, run_date_str, model_run_hour_str, decoded['fhr'], param_details, field, output_image_full_path, print)
+            result.update(success=True, image_path=published_image_path)
+    except Exception as e:
+        traceback.print_exc()
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def render_model_cycle_dask(
+    model_key, run_date_str, model_run_hour_str,
+    forecast_hours_to_generate, parameters_to_plot,
+    for_console_output=None
+):
+    """
+    Drop-in for render_pool.render_model_cycle that runs the cycle as one dask graph.
+    Returns the same list of {'fhr', 'param', 'success', 'skipped', 'image_path', 'error'} dicts.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    import dask
+    from dask import delayed
+
+    model_name = MODEL_PLOT_SETTINGS[model_key]['display_name']
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, 'model_plots'), exist_ok=True)
+
+    job_results = []
+    download_lanes = [None] * max(1, get_max_concurrent_downloads())
+    render_tasks = []
+    decode_tasks = []
+    for hour_number, fhr_str in enumerate(forecast_hours_to_generate):
+        try:
+            fhr_fmt = format_model_forecast_hour(model_key, fhr_str)
+        except ValueError as e:
+            for_console_output(f"    ERROR: Invalid forecast hour '{fhr_str}' for {model_name}: {e}")
+            job_results.extend({'fhr': fhr_str, 'param': p.get('output_file_prefix'), 'success': False, 'skipped': False,
+                                'image_path': None, 'error': str(e)} for p in parameters_to_plot)
+            continue
+
+        existing_results, params_to_generate = get_params_needing_plots(
+            parameters_to_plot, run_date_str, model_run_hour_str, fhr_fmt, for_console_output)
+        job_results.extend({'fhr': fhr_fmt, 'param': prefix, 'success': True, 'skipped': True, 'image_path': image_path, 'error': None}
+                           for prefix, (_, image_path) in existing_results.items())
+        if not params_to_generate:
+            continue
+
+        params_for_hour = [param_details for param_details, _ in params_to_generate]
+        grib_params = get_grib_params_to_decode(model_key, run_date_str, model_run_hour_str, fhr_fmt, params_for_hour)
+        download = None
+        if grib_params:
+            lane = hour_number % len(download_lanes)
+            download = delayed(_download_task, pure=False)(model_key, run_date_str, model_run_hour_str, fhr_fmt,
+                                                           grib_params, download_lanes[lane])
+            download_lanes[lane] = download
+        decoded = delayed(_decode_task, pure=False)(model_key, run_date_str, model_run_hour_str, fhr_fmt,
+                                                    params_for_hour, grib_params, download)
+        decode_tasks.append(decoded)
+        for param_details, output_image_full_path in params_to_generate:
+            render_tasks.append(delayed(_render_task, pure=False)(model_key, run_date_str, model_run_hour_str,
+                                                                  param_details, output_image_full_path, decoded))
+
+    if not render_tasks:
+        return job_results
+
+    worker_count = get_dask_worker_count(model_key)
+    for_console_output(f"  [cycle_graph] {model_name} {run_date_str} {model_run_hour_str}Z: {len(decode_tasks)} hour(s), "
+                       f"{len(render_tasks)} render task(s) on {worker_count} worker process(es), "
+                       f"{len(download_lanes)} download lane(s) (~{estimate_task_memory_mb(model_key):.0f} MB per task)")
+
+    start_time = time.monotonic()
+    worker_pool = _make_render_executor(worker_count, for_console_output)
+    if worker_pool is None:
+        render_results, decode_results = dask.compute(render_tasks, decode_tasks, scheduler='sync')
+    else:
+        with worker_pool:
+            render_results, decode_results = dask.compute(render_tasks, decode_tasks, scheduler='processes', pool=worker_pool)
+    wall_seconds = time.monotonic() - start_time
+
+    for result in render_results:
+        job_results.append({key: result[key] for key in ('fhr', 'param', 'success', 'skipped', 'image_path', 'error')})
+        status = "OK" if result['success'] else f"FAILED ({result['error']})"
+        for_console_output(f"    [cycle_graph] {model_name} {result['param']} F{result['fhr']}: {status}")
+
+    stage_seconds = {
+        'download': [result['download_seconds'] for result in decode_results if result['download_seconds'] is not None],
+        'decode': [result['seconds'] for result in decode_results],
+        'render': [result['seconds'] for result in render_results],
+    }
+    for stage in STAGES:
+        durations = stage_seconds[stage]
+        if durations:
+            for_console_output(f"  [cycle_graph] stage {stage:8s}: {len(durations)} task(s), total {sum(durations):.1f}s, "
+                               f"mean {sum(durations) / len(durations):.2f}s, max {max(durations):.2f}s")
+    succeeded = sum(1 for result in render_results if result['success'])
+    busy_seconds = sum(sum(durations) for durations in stage_seconds.values())
+    for_console_output(f"  [cycle_graph] {model_name} {run_date_str} {model_run_hour_str}Z finished in {wall_seconds:.1f}s "
+                       f"({busy_seconds / wall_seconds if wall_seconds else 0:.1f} workers busy on average): "
+                       f"{succeeded} OK, {len(render_results) - succeeded} failed.")
+    return job_results
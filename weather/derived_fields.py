@@ -0,0 +1,180 @@
+# weather/derived_fields.py
+#
+# Derived products: fields NOMADS doesn't provide, computed from decoded fields
+# of the same (run, fhr), e.g. the Significant Tornado Parameter or 0-6 km bulk
+# shear.
+#
+# A derived parameter is an ordinary registry entry (model_params.py) with
+#     'derived': a key of DERIVED_PRODUCTS
+#     'inputs':  codes of the fields the product needs, in the order its function takes them
+# so it's claimed, rendered, stored, tiled and sampled like any other parameter.
+# Inputs can be GRIB parameters (plotted or in MODEL_DERIVED_INPUTS) or other
+# derived products.
+#
+# Inputs come from the fields decoded for the hour, else the field store, so a
+# product whose inputs are already stored needs no download at all, and
+# get_grib_params_to_decode() only adds inputs the store doesn't have yet.
+# Computed products go into the field store too; together with the per-call
+# cache that makes each product computed once per (run, fhr), however many
+# other products use it.
+#
+# Product functions are vectorized NumPy on float32 arrays (NaN = missing),
+# working in place on their own result array where they can.
+import numpy as np
+
+from .field_store import load_field
+from .model_params import is_derived_param, get_param_by_code
+
+KT_PER_MS = 1.943844
+LCL_METERS_PER_DEGF_SPREAD = 125 * 5 / 9 # LCL height ~ 125 m per degC of dew point depression
+
+
+def _dewpoint_depression(t2m, dewp2m):
+    return t2m - dewp2m
+
+
+def _bulk_shear(u_shear, v_shear):
+    """Magnitude of a shear vector (m/s) in knots."""
+    shear = np.hypot(u_shear, v_shear)
+    shear *= np.float32(KT_PER_MS)
+    return shear
+
+
+def _significant_tornado_parameter(sbcape, srh_1km, shear_6km_kt, t2m, dewp2m):
+    """
+    Fixed-layer STP (Thompson et al. 2003), with surface-based CAPE and an LCL height
+    estimated from the 2m dew point depression:
+        (CAPE / 1500) * ((2000 - LCL) / 1000) * (SRH 0-1km / 150) * (shear 0-6km / 20 m/s)
+    The LCL term is 1 below 1000 m and 0 above 2000 m; the shear term is 0 below
+    12.5 m/s and capped at 1.5 (30 m/s).
+    """
+    lcl_term = t2m - dewp2m
+    lcl_term *= np.float32(-LCL_METERS_PER_DEGF_SPREAD / 1000)
+    lcl_term += np.float32(2.0)
+    np.clip(lcl_term, 0.0, 1.0, out=lcl_term)
+
+    shear_term = shear_6km_kt / np.float32(KT_PER_MS * 20)
+    with np.errstate(invalid='ignore'):
+        shear_term[shear_term < 12.5 / 20] = 0.0
+    np.minimum(shear_term, np.float32(1.5), out=shear_term)
+
+    stp = sbcape / np.float32(1500)
+    stp *= srh_1km
+    stp /= np.float32(150)
+    stp *= lcl_term
+    stp *= shear_term
+    np.maximum(stp, np.float32(0.0), out=stp) # Left-moving (negative SRH) storms aren't what the plot is for
+    return stp
+
+
+# 'input_units': units each input must be in, by position (None = any)
+DERIVED_PRODUCTS = {
+    'dewpoint_depression': {'function': _dewpoint_depression, 'units': 'degF', 'input_units': ('degF', 'degF')},
+    # NCEP labels VUCSH/VVCSH 's**-1', but over a fixed layer they hold the bulk wind difference in m/s
+    'bulk_shear': {'function': _bulk_shear, 'units': 'kt', 'input_units': (None, None)},
+    'stp': {'function': _significant_tornado_parameter, 'units': 'dimensionless',
+            'input_units': (None, None, 'kt', 'degF', 'degF')},
+}
+
+
+def _get_input_params(model_key, param_details):
+    input_params = []
+    for code in param_details.get('inputs', ()):
+        input_param = get_param_by_code(model_key, code)
+        if input_param is None:
+            raise ValueError(f"Derived parameter {param_details['output_file_prefix']} needs unknown input '{code}'")
+        input_params.append(input_param)
+    return input_params
+
+
+def get_grib_params_to_decode(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list):
+    """
+    The GRIB parameters to download and decode for these params of one (run, fhr): the
+    non-derived ones, plus the inputs of derived ones that aren't in the field store yet.
+    """
+    grib_params = {}
+    pending = list(param_details_list)
+    seen = set()
+    while pending:
+        param_details = pending.pop(0)
+        prefix = param_details['output_file_prefix']
+        if prefix in seen:
+            continue
+        seen.add(prefix)
+        if not is_derived_param(param_details):
+            grib_params[prefix] = param_details
+            continue
+        for input_param in _get_input_params(model_key, param_details):
+            if load_field(model_key, run_date_str, model_run_hour_str, input_param['output_file_prefix'], current_fhr_fmt) is None:
+                pending.append(input_param)
+    return list(grib_params.values())
+
+
+def _load_stored_field(model_key, run_date_str, model_run_hour_str, output_file_prefix, current_fhr_fmt):
+    stored_field = load_field(model_key, run_date_str, model_run_hour_str, output_file_prefix, current_fhr_fmt)
+    if stored_field is None:
+        return None
+    return {'values': stored_field.decode(), 'grid_key': stored_field.grid_key, 'units': stored_field.metadata.get('units')}
+
+
+def compute_derived_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list, fields, for_console_output=None):
+    """
+    Computes the derived params in param_details_list for one (run, fhr). Inputs are taken from
+    fields ({prefix: field} decoded for this hour), else the field store.
+    Returns {prefix: field dict like extract_param_field()'s, or None if it couldn't be computed}
+    for every derived param asked for and every derived input computed along the way.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    available = dict(fields)
+    computed = {}
+
+    def get_field(param_details, in_progress=()):
+        prefix = param_details['output_file_prefix']
+        if available.get(prefix) is not None:
+            return available[prefix]
+        if prefix in computed:
+            return computed[prefix]
+        field = _load_stored_field(model_key, run_date_str, model_run_hour_str, prefix, current_fhr_fmt)
+        if field is None and is_derived_param(param_details):
+            if prefix in in_progress:
+                raise ValueError(f"Derived parameter {prefix} depends on itself")
+            field = compute(param_details, in_progress + (prefix,))
+            computed[prefix] = field
+        available[prefix] = field
+        return field
+
+    def compute(param_details, in_progress):
+        product = DERIVED_PRODUCTS[param_details['derived']]
+        input_params = _get_input_params(model_key, param_details)
+        input_fields = [get_field(input_param, in_progress) for input_param in input_params]
+
+        missing = [input_param['code'] for input_param, field in zip(input_params, input_fields) if field is None]
+        if missing:
+            for_console_output(f"    ERROR: Can't derive {param_details['plot_title_param_name']} F{current_fhr_fmt}: missing {missing}")
+            return None
+        if len({field['grid_key'] for field in input_fields}) > 1:
+            for_console_output(f"    ERROR: Can't derive {param_details['plot_title_param_name']} F{current_fhr_fmt}: inputs are on different grids")
+            return None
+        for input_param, field, expected_units in zip(input_params, input_fields, product['input_units']):
+            if expected_units is not None and field.get('units') != expected_units:
+                for_console_output(f"    ERROR: Can't derive {param_details['plot_title_param_name']} F{current_fhr_fmt}: "
+                                   f"{input_param['code']} is in '{field.get('units')}', not '{expected_units}'")
+                return None
+
+        values = product['function'](*[field['values'] for field in input_fields])
+        for_console_output(f"    INFO: Derived {param_details['plot_title_param_name']} F{current_fhr_fmt} from {list(param_details['inputs'])}")
+        return {'values': values.astype(np.float32, copy=False), 'grid_key': input_fields[0]['grid_key'], 'units': product['units']}
+
+    results = {}
+    for param_details in param_details_list:
+        if not is_derived_param(param_details):
+            continue
+        try:
+            results[param_details['output_file_prefix']] = get_field(param_details)
+        except Exception as e:
+            for_console_output(f"    ERROR: Deriving {param_details.get('plot_title_param_name', 'N/A')} F{current_fhr_fmt}: {e}")
+            results[param_details['output_file_prefix']] = None
+    for prefix, field in computed.items():
+        results.setdefault(prefix, field)
+    return results
@@ -0,0 +1,172 @@
+# weather/field_store.py
+#
+# Compact on-disk store of decoded model fields.
+#
+# The values we extract from a GRIB message used to be thrown away once the plot
+# was drawn. Every field is now also saved as one small file per
+# (model, run, param, fhr):
+#     MEDIA_ROOT/field_store/<model>/<YYYYMMDD>_<HH>z/<prefix>_f<fhr>.fld
+# laid out as
+#     b'WXFIELD1' | uint32 header length | JSON header (padded) | raw C-order array
+# with the array starting on a 64-byte boundary, so readers can np.memmap it and
+# slice just the rows/columns they need without reading the rest.
+#
+# Encodings:
+#   'quantized16' (default): uint16 q with value = offset + q * scale and
+#                            65535 meaning missing. ~(max-min)/65534 precision.
+#   'float16':               half floats, NaN for missing. Only for fields whose
+#                            values stay well inside +-65504.
+# A param config can pick one with 'store_encoding'.
+# The stored values are the same ones we plot (cropped to the map extent, unit
+# conversions applied), on the grid described by grid_key (see grid_cache.py).
+import os
+import json
+import shutil
+import struct
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+
+FIELD_FILE_MAGIC = b'WXFIELD1'
+DATA_ALIGNMENT_BYTES = 64
+QUANTIZED_MISSING = np.iinfo(np.uint16).max
+DEFAULT_ENCODING = 'quantized16'
+ENCODING_DTYPES = {'quantized16': '<u2', 'float16': '<f2'}
+
+
+def field_store_enabled():
+    return getattr(settings, 'MODEL_FIELD_STORE_ENABLED', True)
+
+
+def get_run_store_dir(model_key, run_date_str, model_run_hour_str):
+    return os.path.join(settings.MEDIA_ROOT, 'field_store', model_key, f"{run_date_str}_{model_run_hour_str}z")
+
+
+def get_field_path(model_key, run_date_str, model_run_hour_str, output_file_prefix, current_fhr_fmt):
+    return os.path.join(get_run_store_dir(model_key, run_date_str, model_run_hour_str),
+                        f"{output_file_prefix}_f{current_fhr_fmt}.fld")
+
+
+def _encode_values(values, encoding):
+    """Returns (encoded array, header fields needed to decode it)."""
+    data = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+    missing = ~np.isfinite(data)
+
+    if encoding == 'float16':
+        encoded = data.astype('<f2')
+        encoded[missing] = np.nan
+        return encoded, {}
+
+    if encoding != 'quantized16':
+        raise ValueError(f"Unknown field store encoding '{encoding}'")
+    if missing.all():
+        return np.full(data.shape, QUANTIZED_MISSING, dtype='<u2'), {'offset': 0.0, 'scale': 1.0}
+
+    value_min, value_max = float(np.nanmin(data)), float(np.nanmax(data))
+    scale = (value_max - value_min) / (QUANTIZED_MISSING - 1) or 1.0
+    quantized = np.rint((np.where(missing, value_min, data) - value_min) / scale)
+    encoded = np.clip(quantized, 0, QUANTIZED_MISSING - 1).astype('<u2')
+    encoded[missing] = QUANTIZED_MISSING
+    return encoded, {'offset': value_min, 'scale': scale}
+
+
+def store_field(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details, field, for_console_output=None):
+    """
+    Saves one extracted field (as returned by extract_param_field) to the store.
+    Written to a temp file and renamed into place, so readers never see a partial file.
+    Returns the file path.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    encoding = param_details.get('store_encoding', DEFAULT_ENCODING)
+    encoded, decode_fields = _encode_values(field['values'], encoding)
+    header = {
+        'model': model_key,
+        'run_date': run_date_str,
+        'run_hour': model_run_hour_str,
+        'fhr': current_fhr_fmt,
+        'param': param_details['output_file_prefix'],
+        'units': field.get('units'),
+        'grid_key': field['grid_key'],
+        'shape': list(encoded.shape),
+        'dtype': ENCODING_DTYPES[encoding],
+        'encoding': encoding,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        **decode_fields,
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_length = len(FIELD_FILE_MAGIC) + 4
+    padding = -(prefix_length + len(header_bytes)) % DATA_ALIGNMENT_BYTES
+    header_bytes += b' ' * padding
+
+    field_path = get_field_path(model_key, run_date_str, model_run_hour_str, param_details['output_file_prefix'], current_fhr_fmt)
+    os.makedirs(os.path.dirname(field_path), exist_ok=True)
+    temp_path = f"{field_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(temp_path, 'wb') as f:
+        f.write(FIELD_FILE_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(np.ascontiguousarray(encoded).tobytes())
+    os.replace(temp_path, field_path)
+
+    for_console_output(f"    INFO (field_store): Stored {header['param']} F{current_fhr_fmt} ({encoding}, "
+                       f"{os.path.getsize(field_path) / 1024:.0f} KB) at {field_path}")
+    return field_path
+
+
+class StoredField:
+    """A stored field, memory-mapped. .raw is the encoded array; decode() gives float32 values."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(FIELD_FILE_MAGIC))
+            if magic != FIELD_FILE_MAGIC:
+                raise ValueError(f"{path} is not a field store file")
+            (header_length,) = struct.unpack('<I', f.read(4))
+            self.metadata = json.loads(f.read(header_length).decode('utf-8'))
+        data_offset = len(FIELD_FILE_MAGIC) + 4 + header_length
+        self.raw = np.memmap(path, dtype=self.metadata['dtype'], mode='r',
+                             offset=data_offset, shape=tuple(self.metadata['shape']))
+
+    @property
+    def grid_key(self):
+        return self.metadata['grid_key']
+
+    def decode(self, rows=slice(None), cols=slice(None)):
+        """Decodes (a slice of) the field to float32, with NaN where the data is missing."""
+        encoded = self.raw[rows, cols]
+        if self.metadata['encoding'] == 'float16':
+            return np.asarray(encoded, dtype=np.float32)
+        values = encoded.astype(np.float32) * np.float32(self.metadata['scale']) + np.float32(self.metadata['offset'])
+        values[encoded == QUANTIZED_MISSING] = np.nan
+        return values
+
+    def decode_points(self, rows, cols):
+        """Decodes the values at many (row, col) cells in one gather; NaN where missing."""
+        encoded = self.raw[np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)]
+        if self.metadata['encoding'] == 'float16':
+            return encoded.astype(np.float32)
+        values = encoded.astype(np.float32) * np.float32(self.metadata['scale']) + np.float32(self.metadata['offset'])
+        values[encoded == QUANTIZED_MISSING] = np.nan
+        return values
+
+    def value_at(self, row, col):
+        value = self.decode(slice(row, row + 1), slice(col, col + 1))[0, 0]
+        return None if np.isnan(value) else float(value)
+
+
+def load_field(model_key, run_date_str, model_run_hour_str, output_file_prefix, current_fhr_fmt):
+    """Returns the StoredField for (model, run, param, fhr), or None if it isn't stored."""
+    try:
+        return StoredField(get_field_path(model_key, run_date_str, model_run_hour_str, output_file_prefix, current_fhr_fmt))
+    except FileNotFoundError:
+        return None
+
+
+def delete_run_fields(model_key, run_date_str, model_run_hour_str):
+    """Removes every stored field of a run (used when the ingestion expires a cycle)."""
+    shutil.rmtree(get_run_store_dir(model_key, run_date_str, model_run_hour_str), ignore_errors=True)
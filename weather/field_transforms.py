@@ -0,0 +1,92 @@
+# weather/field_transforms.py
+#
+# Declarative, in-place value transforms for extracted model fields.
+#
+# Unit conversion used to be an if/else per parameter in the extractor, done as
+# `(data - 273.15) * 9/5 + 32`, which allocates three full-grid temporaries, and
+# min/max/mean were computed on every frame just for a debug line. A param
+# config now declares what should happen to its values and
+# apply_field_transforms() does it on the float32 array the extractor already
+# owns, with in-place ufuncs only:
+#
+#   'fill_values':         raw values that mean "missing" (-> NaN)
+#   'unit_conversion':     a key of UNIT_CONVERSIONS, e.g. 'K_to_degF'
+#                          ('needs_conversion_to_F': True is still understood)
+#   'scale', 'offset':     value * scale + offset, after any unit conversion
+#   'output_units':        units label for the result of scale/offset
+#   'valid_range':         (min, max); values outside it become missing
+#   'clip_to_plot_levels': clip to [plot_levels[0], plot_levels[-1]]
+#
+# Steps run in that order. Field statistics are only logged when
+# settings.MODEL_PROFILING is on.
+import numpy as np
+from django.conf import settings
+
+# value_out = value_in * scale + offset, applied only if the GRIB units match from_units
+UNIT_CONVERSIONS = {
+    'K_to_degF': {'from_units': 'K', 'to_units': 'degF', 'scale': 9 / 5, 'offset': -459.67},
+    'K_to_degC': {'from_units': 'K', 'to_units': 'degC', 'scale': 1.0, 'offset': -273.15},
+    'Pa_to_hPa': {'from_units': 'Pa', 'to_units': 'hPa', 'scale': 0.01, 'offset': 0.0},
+    'm/s_to_kt': {'from_units': 'm s**-1', 'to_units': 'kt', 'scale': 1.943844, 'offset': 0.0},
+}
+
+
+def profiling_enabled():
+    return getattr(settings, 'MODEL_PROFILING', False)
+
+
+def get_unit_conversion_name(param_details):
+    if param_details.get('unit_conversion'):
+        return param_details['unit_conversion']
+    if param_details.get('needs_conversion_to_F', False): # Older configs
+        return 'K_to_degF'
+    return None
+
+
+def apply_field_transforms(values, param_details, source_units, for_console_output=None):
+    """
+    Applies a param config's transforms to a float32 array, in place (NaN marks missing values).
+    Returns (values, units), where units describes the transformed values.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    units = source_units
+    param_name = param_details.get('plot_title_param_name', param_details.get('output_file_prefix', 'N/A'))
+
+    fill_values = param_details.get('fill_values')
+    if fill_values:
+        values[np.isin(values, fill_values)] = np.nan
+
+    conversion_name = get_unit_conversion_name(param_details)
+    if conversion_name:
+        conversion = UNIT_CONVERSIONS[conversion_name]
+        if source_units == conversion['from_units']:
+            values *= np.float32(conversion['scale'])
+            values += np.float32(conversion['offset'])
+            units = conversion['to_units']
+        else:
+            for_console_output(f"      WARNING: '{conversion_name}' conversion asked for {param_name}, but the GRIB units are "
+                               f"'{source_units}', not '{conversion['from_units']}'. Keeping raw data.")
+
+    scale, offset = param_details.get('scale'), param_details.get('offset')
+    if scale is not None and scale != 1:
+        values *= np.float32(scale)
+    if offset:
+        values += np.float32(offset)
+    if (scale is not None or offset) and param_details.get('output_units'):
+        units = param_details['output_units']
+
+    valid_range = param_details.get('valid_range')
+    if valid_range is not None:
+        with np.errstate(invalid='ignore'): # Comparisons with NaN
+            values[(values < valid_range[0]) | (values > valid_range[1])] = np.nan
+
+    plot_levels = param_details.get('plot_levels')
+    if param_details.get('clip_to_plot_levels') and plot_levels is not None and len(plot_levels) > 0:
+        np.clip(values, plot_levels[0], plot_levels[-1], out=values) # NaN stays NaN
+
+    if profiling_enabled() and values.size > 0:
+        with np.errstate(invalid='ignore'):
+            for_console_output(f"      PROFILE: {param_name} ({units}) min: {np.nanmin(values):.2f}, max: {np.nanmax(values):.2f}, "
+                               f"mean: {np.nanmean(values):.2f}, missing: {int(np.isnan(values).sum())}, shape: {values.shape}")
+    return values, units
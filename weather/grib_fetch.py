@@ -0,0 +1,278 @@
+# weather/grib_fetch.py
+#
+# Byte-range GRIB subsetting using the NOMADS .idx inventory files.
+#
+# Every NOMADS GRIB2 file is published next to a small text inventory
+# (<grib url>.idx) with one line per message:
+#     "<msg num>:<byte offset>:d=<YYYYMMDDHH>:<VAR>:<level>:<forecast>:"
+# A message ends where the next one starts, so we can work out the byte range
+# for just the messages we want to plot and ask the server for those bytes with
+# an HTTP Range request. GRIB2 messages are self contained, so the downloaded
+# pieces concatenated together are themselves a valid GRIB2 file for pygrib.
+#
+# The .idx also tells us where each wanted message ends up in that file, so the
+# decoder can jump straight to it (grbs.message(n)) instead of searching.
+import requests
+import os
+import bisect
+
+# pygrib shortName -> wgrib2/NOMADS variable abbreviation used in .idx files.
+# A param config can override this with 'idx_variable'.
+GRIB_SHORT_NAME_TO_IDX_VARIABLE = {
+    '2t': 'TMP',
+    '2d': 'DPT',
+    't': 'TMP',
+    'cape': 'CAPE',
+    'cin': 'CIN',
+    'refc': 'REFC',
+    'hlcy': 'HLCY',
+    'ltng': 'LTNG',
+    'prmsl': 'PRMSL',
+    'gh': 'HGT',
+    '10u': 'UGRD',
+    '10v': 'VGRD',
+    'u': 'UGRD',
+    'v': 'VGRD',
+    'vucsh': 'VUCSH',
+    'vvcsh': 'VVCSH',
+}
+
+IDX_REQUEST_TIMEOUT_SECONDS = 30
+RANGE_REQUEST_TIMEOUT_SECONDS = 120
+# Ranges closer together than this are fetched as one request; re-downloading
+# a few small messages in between is cheaper than another round trip.
+RANGE_MERGE_GAP_BYTES = 256 * 1024
+
+
+def parse_grib_idx(idx_text):
+    """
+    Parses the text of a NOMADS .idx inventory into a list of dicts, in file order:
+        {'message_number', 'start_byte', 'end_byte', 'variable', 'level', 'forecast'}
+    'end_byte' is inclusive, or None for the last message (read to end of file).
+    """
+    entries = []
+    for line in idx_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.split(':')
+        if len(parts) < 6:
+            continue
+        try:
+            start_byte = int(parts[1])
+        except ValueError:
+            continue
+        entries.append({
+            'message_number': parts[0], # "12", or "12.2" for a sub-message
+            'start_byte': start_byte,
+            'end_byte': None,
+            'variable': parts[3],
+            'level': parts[4],
+            'forecast': parts[5],
+        })
+
+    # Sub-messages share their parent's offset, so each range ends just before
+    # the next entry that starts at a *later* offset.
+    entries.sort(key=lambda entry: entry['start_byte'])
+    unique_offsets = sorted({entry['start_byte'] for entry in entries})
+    for entry in entries:
+        offset_position = bisect.bisect_right(unique_offsets, entry['start_byte'])
+        if offset_position < len(unique_offsets):
+            entry['end_byte'] = unique_offsets[offset_position] - 1
+    return entries
+
+
+def get_idx_level_for_param(param_details):
+    """
+    Builds the .idx level text (e.g. '2 m above ground', '3000-0 m above ground')
+    for a param config from its pygrib typeOfLevel/level keys.
+    A param config can override this with 'idx_level'.
+    """
+    if param_details.get('idx_level'):
+        return param_details['idx_level']
+
+    type_of_level = param_details.get('grib_type_of_level')
+    level = param_details.get('grib_level')
+
+    if type_of_level == 'surface':
+        return 'surface'
+    if type_of_level == 'heightAboveGround':
+        return f"{level} m above ground"
+    if type_of_level == 'heightAboveGroundLayer':
+        top_level = param_details.get('grib_top_level', level)
+        bottom_level = param_details.get('grib_bottom_level', 0)
+        return f"{top_level}-{bottom_level} m above ground"
+    if type_of_level == 'isobaricInhPa':
+        return f"{level} mb"
+    if type_of_level in ('atmosphere', 'atmosphereSingleLayer', 'entireAtmosphere'):
+        # GFS writes "entire atmosphere", NAM "entire atmosphere (considered as a single layer)"
+        return 'entire atmosphere'
+    if type_of_level == 'meanSea':
+        return 'mean sea level'
+    return None
+
+
+def find_idx_entries_for_param(idx_entries, param_details):
+    """
+    Returns the .idx entries that match a param config.
+    Only the first match is returned, mirroring selected_messages[0] in grib_processing.
+    Registry params (model_params.py) carry their .idx variable/level precompiled in 'selector'.
+    """
+    selector = param_details.get('selector')
+    if selector:
+        idx_variable, idx_level = selector['idx_variable'], selector['idx_level']
+    else:
+        idx_variable = param_details.get('idx_variable') or \
+            GRIB_SHORT_NAME_TO_IDX_VARIABLE.get(param_details.get('grib_short_name'))
+        idx_level = get_idx_level_for_param(param_details)
+    if not idx_variable or not idx_level:
+        return []
+
+    for entry in idx_entries:
+        if entry['variable'] != idx_variable:
+            continue
+        # "entire atmosphere" has to match "entire atmosphere (considered as a single layer)" too
+        if entry['level'] == idx_level or entry['level'].startswith(idx_level + ' ('):
+            return [entry]
+    return []
+
+
+def merge_byte_ranges(idx_entries, max_gap_bytes=RANGE_MERGE_GAP_BYTES):
+    """
+    Turns a list of .idx entries into a sorted list of (start_byte, end_byte) ranges,
+    merging ranges that touch or are closer than max_gap_bytes.
+    """
+    ranges = sorted({(entry['start_byte'], entry['end_byte']) for entry in idx_entries},
+                    key=lambda byte_range: byte_range[0])
+    merged = []
+    for start_byte, end_byte in ranges:
+        if merged:
+            previous_start, previous_end = merged[-1]
+            if previous_end is None:
+                continue # Previous range already runs to end of file
+            if start_byte <= previous_end + 1 + max_gap_bytes:
+                new_end = None if end_byte is None else max(previous_end, end_byte)
+                merged[-1] = (previous_start, new_end)
+                continue
+        merged.append((start_byte, end_byte))
+    return merged
+
+
+def get_message_positions(idx_entries, byte_ranges, entries_by_prefix):
+    """
+    Works out where each wanted message lands in a file made of byte_ranges concatenated
+    in order. Returns {prefix: 1-based message number, as pygrib's grbs.message() counts}.
+    Merged ranges can hold messages nobody asked for; those are counted too.
+    """
+    position_by_message_number = {}
+    position = 0
+    for start_byte, end_byte in byte_ranges:
+        for entry in idx_entries: # Sorted by start_byte (parse_grib_idx)
+            if entry['start_byte'] < start_byte or (end_byte is not None and entry['start_byte'] > end_byte):
+                continue
+            position += 1
+            position_by_message_number[entry['message_number']] = position
+    return {prefix: position_by_message_number[entry['message_number']]
+            for prefix, entry in entries_by_prefix.items() if entry['message_number'] in position_by_message_number}
+
+
+def fetch_grib_idx(grib_url, for_console_output=None, session=None):
+    """Downloads and parses <grib_url>.idx. Returns a list of entries, or None on failure."""
+    if for_console_output is None:
+        for_console_output = print
+    http = session or requests
+
+    idx_url = f"{grib_url}.idx"
+    try:
+        response = http.get(idx_url, timeout=IDX_REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        for_console_output(f"    WARNING: Could not fetch GRIB index {idx_url}: {e}")
+        return None
+    return parse_grib_idx(response.text)
+
+
+def download_grib_subset(grib_url, param_details_list, local_grib_filename, for_console_output=None, session=None):
+    """
+    Downloads only the GRIB messages needed for param_details_list into local_grib_filename,
+    using the .idx inventory and HTTP Range requests.
+
+    Returns (success, message_positions) where message_positions is {prefix: message number
+    in the downloaded file} for every param found. If the .idx can't be read or none of the
+    params are found in it, returns (False, {}) so the caller can fall back to a full download.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    http = session or requests
+
+    idx_entries = fetch_grib_idx(grib_url, for_console_output, session=session)
+    if not idx_entries:
+        return False, {}
+
+    wanted_entries = []
+    entries_by_prefix = {}
+    for param_details in param_details_list:
+        param_entries = find_idx_entries_for_param(idx_entries, param_details)
+        if param_entries:
+            wanted_entries.extend(param_entries)
+            entries_by_prefix[param_details.get('output_file_prefix')] = param_entries[0]
+        else:
+            for_console_output(f"    WARNING: No .idx entry found for {param_details.get('plot_title_param_name', 'N/A')} "
+                               f"(variable '{param_details.get('idx_variable') or GRIB_SHORT_NAME_TO_IDX_VARIABLE.get(param_details.get('grib_short_name'))}', "
+                               f"level '{get_idx_level_for_param(param_details)}')")
+
+    if not wanted_entries:
+        return False, {}
+
+    byte_ranges = merge_byte_ranges(wanted_entries)
+    total_bytes_downloaded = 0
+    try:
+        with open(local_grib_filename, 'wb') as f:
+            for start_byte, end_byte in byte_ranges:
+                range_header = f"bytes={start_byte}-{'' if end_byte is None else end_byte}"
+                response = http.get(grib_url, headers={'Range': range_header}, stream=True,
+                                    timeout=RANGE_REQUEST_TIMEOUT_SECONDS)
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # Server ignored the Range header and is sending the whole file; don't write it.
+                    response.close()
+                    raise requests.exceptions.RequestException(
+                        f"Server returned HTTP {response.status_code} instead of 206 for Range request")
+                for chunk in response.iter_content(chunk_size=8192*4):
+                    f.write(chunk)
+                    total_bytes_downloaded += len(chunk)
+    except (requests.exceptions.RequestException, OSError) as e:
+        for_console_output(f"    WARNING: Byte-range download failed for {grib_url}: {e}")
+        if os.path.exists(local_grib_filename):
+            os.remove(local_grib_filename)
+        return False, {}
+
+    for_console_output(f"    SUCCESS: Downloaded {len(wanted_entries)} GRIB message(s) in {len(byte_ranges)} range request(s) "
+                       f"({total_bytes_downloaded / 1024:.0f} KB) from {grib_url}")
+    return True, get_message_positions(idx_entries, byte_ranges, entries_by_prefix)
+
+
+def download_grib_file(grib_url, param_details_list, local_grib_filename, timeout=180, for_console_output=None):
+    """
+    Downloads the GRIB messages for param_details_list, preferring the .idx byte-range
+    subset and falling back to streaming the whole file if that isn't possible (no .idx,
+    no 206, or none of the params in it).
+    Returns {prefix: message number in the local file} when the subset was used, else {}.
+    A param missing from the .idx is left out of the subset and of the returned positions
+    (it isn't in the local file, so it fails on its own) rather than costing a full download.
+    Raises requests.exceptions.RequestException if the full download fails.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    subset_ok, message_positions = download_grib_subset(grib_url, param_details_list, local_grib_filename, for_console_output)
+    if subset_ok:
+        return message_positions
+
+    for_console_output(f"    INFO: Falling back to full GRIB download from {grib_url}")
+    response = requests.get(grib_url, stream=True, timeout=timeout)
+    response.raise_for_status()
+    with open(local_grib_filename, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=8192*4):
+            f.write(chunk)
+    return {}
@@ -5,23 +5,40 @@ import pygrib
 import numpy as np
 import matplotlib
 matplotlib.use('Agg') # Use non-interactive backend for scripts/tasks
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 from datetime import datetime, timedelta, timezone
 from django.conf import settings # For MEDIA_ROOT and MEDIA_URL
 import traceback
+import tempfile
+
+from .grib_fetch import download_grib_file
+from .map_templates import get_map_template
+from .grid_cache import get_model_grid, load_model_grid
+from .model_tiles import tiles_enabled, render_field_tiles
+from .plot_output import get_published_plot_path
+from .field_store import field_store_enabled, store_field
+from .field_transforms import apply_field_transforms, profiling_enabled
+from .model_params import GRIB_INDEX_KEYS, build_grib_select_criteria, get_param_selector, is_derived_param
+from .derived_fields import get_grib_params_to_decode, compute_derived_fields
 
 # --- Helper function to determine latest GFS run details ---
-def get_latest_gfs_rundate_and_hour(for_console_output=None):
+def get_latest_gfs_rundate_and_hour(for_console_output=None, use_availability_probe=True):
     """
     Determines a recent GFS run date (YYYYMMDD) and hour string ('00', '06', '12', '18') 
-    that is likely available on NOMADS.
+    that is available on NOMADS.
+    Asks run_discovery (cached HEAD probes of the .idx files) first and only falls back
+    to a wall-clock guess if NOMADS can't be reached.
     'for_console_output' is a callable for logging (e.g., print or self.stdout.write).
     """
     if for_console_output is None:
         for_console_output = print 
 
+    if use_availability_probe:
+        from .run_discovery import discover_latest_model_run # Imported here; run_discovery imports this module
+        discovery = discover_latest_model_run('gfs', for_console_output)
+        if discovery:
+            for_console_output(f"  DEBUG (get_latest_gfs_rundate_and_hour): Probed GFS Run: Date={discovery['run_date']}, Hour={discovery['run_hour']}Z")
+            return discovery['run_date'], discovery['run_hour']
+
     now_utc = datetime.now(timezone.utc)
     target_time_for_run = now_utc - timedelta(hours=7) # Approx. 7-hour offset
     
@@ -43,14 +60,22 @@ def get_latest_gfs_rundate_and_hour(for_console_output=None):
     return run_date_str, run_hour_str
 
 
-def get_latest_nam_rundate_and_hour(for_console_output=None):
+def get_latest_nam_rundate_and_hour(for_console_output=None, use_availability_probe=True):
     """
     Determines a recent NAM run date (YYYYMMDD) and hour string ('00', '06', '12', '18') 
-    that is likely available on NOMADS. NAM has a shorter availability delay.
+    that is available on NOMADS, probing first like get_latest_gfs_rundate_and_hour.
+    The fallback guess uses a shorter delay since NAM is posted sooner.
     """
     if for_console_output is None:
         for_console_output = print
 
+    if use_availability_probe:
+        from .run_discovery import discover_latest_model_run
+        discovery = discover_latest_model_run('nam', for_console_output)
+        if discovery:
+            for_console_output(f"  DEBUG (get_latest_nam_rundate_and_hour): Probed NAM Run: Date={discovery['run_date']}, Hour={discovery['run_hour']}Z")
+            return discovery['run_date'], discovery['run_hour']
+
     now_utc = datetime.now(timezone.utc)
     # NAM data might be available a bit sooner than GFS, try a ~5 hour offset
     target_time_for_run = now_utc - timedelta(hours=5) 
@@ -75,622 +100,483 @@ def get_latest_nam_rundate_and_hour(for_console_output=None):
 # --- END NEW FUNCTION for NAM run time ---
 
 
-# --- Main function to generate a GFS parameter plot ---
-def generate_gfs_parameter_plot(
-    run_date_str, model_run_hour_str, forecast_hour_str_arg, # Argument from task/command
-    param_details, 
-    for_console_output=None
-):
-    if for_console_output is None:
-        for_console_output = print
-
-    current_fhr_fmt = "" # This will be the formatted "006", "012", etc.
-    try:
-        fhr_int = int(forecast_hour_str_arg)
-        if not (0 <= fhr_int <= 384):
-             raise ValueError("Forecast hour out of typical GFS range.")
-        current_fhr_fmt = f"{fhr_int:03d}" 
-    except ValueError as e:
-        for_console_output(f"    ERROR: Invalid forecast_hour_str_arg '{forecast_hour_str_arg}': {e}")
-        return False, None
+# --- Per-model settings shared by the download/decode/plot stages ---
+MODEL_PLOT_SETTINGS = {
+    'gfs': {
+        'display_name': 'GFS',
+        'max_forecast_hour': 384,
+        'fhr_digits': 3, # gfs.tHHz.pgrb2.0p25.fFFF
+        'url_template': "https://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod/gfs.{run_date}/{run_hour}/atmos/gfs.t{run_hour}z.pgrb2.0p25.f{fhr}",
+        'forecast_hours': [f"{h:03d}" for h in range(0, 144, 3)], # Hours we plot, in posting order
+        'download_timeout': 180,
+        'map_extent': [-125, -65, 23, 50],
+        'land_facecolor': 'lightgray',
+        'watermark_text': "unfortunateneighbor.com", # <<< REPLACE THIS WITH YOUR ACTUAL SITE/COMPANY NAME
+        'watermark_alpha': 0.9,
+        'decode_engine': 'pygrib', # Or 'cfgrib' (see cfgrib_engine.py)
+    },
+    'nam': {
+        'display_name': 'NAM',
+        'max_forecast_hour': 84, # NAM awphys CONUS typically out to F84
+        'fhr_digits': 2, # NAM uses 2 digits for FF in awphysFF (e.g., 00, 01, ... 84)
+        # NAM CONUS nest (awphys files). Other NAM products/nests use different file naming.
+        'url_template': "https://nomads.ncep.noaa.gov/pub/data/nccf/com/nam/prod/nam.{run_date}/nam.t{run_hour}z.awphys{fhr}.tm00.grib2",
+        # Hourly out to F36, then 3-hourly out to F84 for awphys products
+        'forecast_hours': [f"{h:02d}" for h in range(0, 37)] + [f"{h:02d}" for h in range(39, 85, 3)],
+        'download_timeout': 120,
+        'map_extent': [-125, -65, 23, 52], # Roughly CONUS, good for the NAM CONUS nest
+        'land_facecolor': 'white',
+        'watermark_text': "myweathersite.com", # <<< *** REPLACE THIS ***
+        'watermark_alpha': 0.6,
+        'decode_engine': 'pygrib',
+    },
+}
+
+
+def format_model_forecast_hour(model_key, forecast_hour_str_arg):
+    """
+    Validates a forecast hour for a model and returns it formatted the way the
+    model's NOMADS file names expect ("006" for GFS, "06" for NAM).
+    Raises ValueError if it's not a number or out of range.
+    """
+    model_settings = MODEL_PLOT_SETTINGS[model_key]
+    fhr_int = int(forecast_hour_str_arg)
+    if not (0 <= fhr_int <= model_settings['max_forecast_hour']):
+        raise ValueError(f"Forecast hour for {model_settings['display_name']} out of range (0-{model_settings['max_forecast_hour']}).")
+    return f"{fhr_int:0{model_settings['fhr_digits']}d}"
 
-    for_console_output(f"    DEBUG (generate_plot): Init for Param='{param_details.get('plot_title_param_name', 'N/A')}', Run='{run_date_str}/{model_run_hour_str}Z', FHR_ARG='{forecast_hour_str_arg}', Using Formatted FHR='{current_fhr_fmt}'")
 
-    gfs_url = f"https://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod/gfs.{run_date_str}/{model_run_hour_str}/atmos/gfs.t{model_run_hour_str}z.pgrb2.0p25.f{current_fhr_fmt}"
-    
-    file_prefix = param_details.get('output_file_prefix', 'gfs_unknown')
-    # Define temporary GRIB filename using current_fhr_fmt to ensure it's unique FOR THIS CALL
-    local_grib_filename = f"{file_prefix}_{run_date_str}_{model_run_hour_str}_{current_fhr_fmt}_temp.grb2"
-    
+def get_model_plot_output_path(param_details, run_date_str, model_run_hour_str, current_fhr_fmt):
+    """Returns (output_image_name, output_image_full_path) for a plot."""
+    file_prefix = param_details.get('output_file_prefix', 'model_unknown')
     output_image_name = f"{file_prefix}_{run_date_str}_{model_run_hour_str}z_f{current_fhr_fmt}.png"
-    output_image_full_path = os.path.join(settings.MEDIA_ROOT, 'model_plots', output_image_name)
-    
-    for_console_output(f"    DEBUG (generate_plot): Temp GRIB path to be used: {local_grib_filename}")
-    for_console_output(f"    DEBUG (generate_plot): Output PNG path: {output_image_full_path}")
-    
-    os.makedirs(os.path.dirname(output_image_full_path), exist_ok=True)
+    return output_image_name, os.path.join(settings.MEDIA_ROOT, 'model_plots', output_image_name)
+
+
+def grib_message_matches(grib_message, select_criteria):
+    """True if a message has every key/value of a grbs.select() criteria dict."""
+    for key, wanted_value in select_criteria.items():
+        try:
+            if grib_message[key] != wanted_value:
+                return False
+        except (RuntimeError, KeyError): # Key not present in this message
+            return False
+    return True
 
-    if os.path.exists(output_image_full_path):
-        for_console_output(f"    INFO: Plot image {output_image_name} already exists. Skipping generation for F{current_fhr_fmt}.")
-        if os.path.exists(local_grib_filename): # Clean up old temp file if it exists for some reason
-             os.remove(local_grib_filename)
-        return True, output_image_full_path
 
-    for_console_output(f"  Attempting {param_details.get('plot_title_param_name', 'N/A')} GFS F{current_fhr_fmt} (Run {run_date_str} {model_run_hour_str}Z): Downloading from {gfs_url}")
+def open_grib_index(local_grib_filename, for_console_output=None):
+    """An eccodes index of a GRIB file on GRIB_INDEX_KEYS, or None if it can't be built."""
+    if for_console_output is None:
+        for_console_output = print
     try:
-        response = requests.get(gfs_url, stream=True, timeout=180)
-        response.raise_for_status()
-        with open(local_grib_filename, 'wb') as f: # Use the unique local_grib_filename
-            for chunk in response.iter_content(chunk_size=8192*4):
-                f.write(chunk)
-        for_console_output(f"    SUCCESS: Downloaded GFS data for F{current_fhr_fmt} to {local_grib_filename}") 
-    except requests.exceptions.RequestException as e:
-        for_console_output(f"    ERROR: Downloading GRIB file for {param_details.get('plot_title_param_name', 'N/A')} F{current_fhr_fmt}: {e}")
-        return False, None # Temp file cleaned in finally
+        return pygrib.index(local_grib_filename, *GRIB_INDEX_KEYS)
     except Exception as e:
-        for_console_output(f"    ERROR: Unexpected error during download for F{current_fhr_fmt}: {e}")
-        return False, None # Temp file cleaned in finally
+        for_console_output(f"    WARNING: Could not index {local_grib_filename} on {GRIB_INDEX_KEYS}: {e}")
+        return None
 
+
+def select_grib_message(grbs, param_details, for_console_output=None, message_position=None, grib_index=None):
+    """
+    Returns the first GRIB message in an open pygrib file matching a param config, or None.
+    Uses the param's compiled selector (model_params.py), cheapest way first:
+      1. its known message number in the file (from the .idx, see grib_fetch.py),
+      2. a lookup in grib_index (open_grib_index()) on (shortName, typeOfLevel, level),
+      3. grbs.select(), a scan of the file, only for selectors the index can't answer.
+    Candidates from 1 and 2 are checked against the full criteria.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    selector = get_param_selector(param_details)
+    select_criteria = selector['criteria']
+    if select_criteria is None:
+        build_grib_select_criteria(param_details, for_console_output) # Logs what's missing
+        return None
+
+    if message_position is not None:
+        try:
+            grib_message = grbs.message(message_position)
+            if grib_message_matches(grib_message, select_criteria):
+                return grib_message
+            for_console_output(f"      WARNING: GRIB message {message_position} doesn't match {select_criteria}; searching the file instead.")
+        except (OSError, ValueError, RuntimeError) as e:
+            for_console_output(f"      WARNING: Could not read GRIB message {message_position}: {e}; searching the file instead.")
+        grbs.seek(0)
+
+    if grib_index is not None and selector['index_values'] is not None:
+        try:
+            candidates = grib_index.select(**dict(zip(GRIB_INDEX_KEYS, selector['index_values'])))
+        except ValueError: # No messages with these keys
+            candidates = []
+        for grib_message in candidates:
+            if grib_message_matches(grib_message, select_criteria):
+                return grib_message
+        for_console_output(f"      ERROR: Could not find GRIB message for {param_details.get('plot_title_param_name', 'N/A')} with criteria {select_criteria}")
+        return None
+
+    for_console_output(f"      Attempting grbs.select() with criteria: {select_criteria}")
     try:
-        for_console_output(f"    Processing GRIB file: {local_grib_filename}")
-        grbs = pygrib.open(local_grib_filename) # Open the unique local_grib_filename
-        
-        # Your existing grbs.select() call:
-        select_criteria = { # Build criteria dictionary
-            'level': param_details['grib_level'],
-            'typeOfLevel': param_details['grib_type_of_level']
-        }
-        if 'select_by_name' in param_details and param_details['select_by_name']:
-            select_criteria['name'] = param_details['select_by_name']
-        elif 'grib_short_name' in param_details and param_details['grib_short_name']:
-            select_criteria['shortName'] = param_details['grib_short_name']
+        selected_messages = grbs.select(**select_criteria)
+    except ValueError as e: # pygrib raises ValueError when there are no matches
+        if "no matches found" in str(e).lower():
+            selected_messages = []
         else:
-            for_console_output(f"      ERROR: Neither 'select_by_name' nor 'grib_short_name' provided in param_details for {param_details.get('plot_title_param_name')}")
-            grbs.close()
-            return False, None
+            raise
 
-        # Add topLevel and bottomLevel to criteria if they are in param_details
-        if 'grib_top_level' in param_details and param_details['grib_top_level'] is not None:
-            select_criteria['topLevel'] = param_details['grib_top_level']
-        if 'grib_bottom_level' in param_details and param_details['grib_bottom_level'] is not None:
-            select_criteria['bottomLevel'] = param_details['grib_bottom_level']
+    if not selected_messages:
+        for_console_output(f"      ERROR: Could not find GRIB message for {param_details.get('plot_title_param_name', 'N/A')} with criteria {select_criteria}")
+        return None
 
-        for_console_output(f"      Attempting grbs.select() with criteria: {select_criteria}")
-        selected_messages = grbs.select(**select_criteria)
+    grib_message = selected_messages[0]
+    for_console_output(f"      SUCCESS: Found GRIB message for {param_details.get('plot_title_param_name', 'N/A')}: {grib_message.name} (L{grib_message.level} {grib_message.typeOfLevel})")
+    return grib_message
 
 
+def extract_param_field(model_key, grib_message, param_details, for_console_output=None):
+    """
+    Pulls the data and units out of a GRIB message, cropped to the model's map area, and
+    applies the param config's declared transforms (unit conversion, masking, clipping; see
+    field_transforms.py) in place.
+    The lat/lon coordinates come from the shared grid cache (see grid_cache.py).
+    Returns a dict: {'values', 'grid_key', 'units'}. 'values' is a float32 array with NaN for
+    missing data and 'units' describes it.
+    """
+    if for_console_output is None:
+        for_console_output = print
 
+    model_grid = get_model_grid(model_key, grib_message, MODEL_PLOT_SETTINGS[model_key]['map_extent'], for_console_output)
+    # The only copy made of the data: cropped, float32, missing -> NaN. Transforms then work on it in place.
+    data_values = model_grid.crop(grib_message.values, dtype=np.float32)
+    original_units = getattr(grib_message, 'units', None) or 'N/A'
 
+    data_values, values_units = apply_field_transforms(data_values, param_details, original_units, for_console_output)
 
+    if profiling_enabled():
+        current_plot_levels = param_details.get('plot_levels')
+        if hasattr(current_plot_levels, 'tolist'): # Convert numpy array to list for cleaner printing
+            current_plot_levels = current_plot_levels.tolist()
+        for_console_output(f"      PROFILE: GRIB units: {original_units}, plot levels: {current_plot_levels}")
 
+    return {'values': data_values, 'grid_key': model_grid.grid_key, 'units': values_units}
 
 
+def render_model_plot(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details, field, output_image_full_path, for_console_output=None):
+    """
+    Draws one model field onto this worker's cached CONUS map template and saves it as a PNG,
+    then writes the field's XYZ map tiles (see model_tiles.py) if tiles are enabled.
+    Returns the PNG's content-addressed path (see plot_output.py).
+    """
+    if for_console_output is None:
+        for_console_output = print
+    model_settings = MODEL_PLOT_SETTINGS[model_key]
+
+    for_console_output(f"    Generating {model_settings['display_name']} plot for {param_details['plot_title_param_name']} F{current_fhr_fmt}...")
+    map_template = get_map_template(model_key, model_settings)
+    model_grid = load_model_grid(field['grid_key'])
+
+    for_console_output(f"    DEBUG: Attempting to savefig to: {output_image_full_path}")
+    published_image_path = map_template.render_frame(
+        field['grid_key'], model_grid.plot_lons, model_grid.plot_lats, field['values'],
+        title=f"{model_settings['display_name']} {param_details['plot_title_param_name']}\nRun: {run_date_str} {model_run_hour_str}Z - Forecast: F{current_fhr_fmt}",
+        colorbar_label=param_details['plot_unit_label'],
+        output_image_full_path=output_image_full_path,
+        plot_cmap=param_details.get('plot_cmap', 'jet'),
+        plot_levels=param_details.get('plot_levels'),
+    )
+    for_console_output(f"    SUCCESS: Plot for {model_settings['display_name']} {param_details['plot_title_param_name']} F{current_fhr_fmt} saved to {published_image_path}")
+
+    if tiles_enabled():
+        try:
+            render_field_tiles(run_date_str, model_run_hour_str, current_fhr_fmt, param_details, field, for_console_output)
+        except Exception as e: # The PNG is already saved; missing tiles shouldn't fail the frame
+            for_console_output(f"    ERROR: Tile rendering failed for {param_details['plot_title_param_name']} F{current_fhr_fmt}: {e}")
+            traceback.print_exc()
+    return published_image_path
 
-            # --- END DEBUG BLOCK --
 
+# --- Per-(run, forecast hour) pipeline stage ---
+def get_params_needing_plots(param_details_list, run_date_str, model_run_hour_str, current_fhr_fmt, for_console_output=None):
+    """
+    Splits param configs into plots that already exist and ones that still need generating.
+    Returns (existing_results, params_to_generate) where existing_results is
+    {prefix: (True, content-addressed path)} and params_to_generate is a list of (param_details, output_image_full_path).
+    """
+    if for_console_output is None:
+        for_console_output = print
 
-        selected_messages = grbs.select(
-            shortName=param_details['grib_short_name'],
-            level=param_details['grib_level'],
-            typeOfLevel=param_details['grib_type_of_level']
-        )
-        
-        grib_message = None
-        if selected_messages:
-            grib_message = selected_messages[0]
-            for_console_output(f"    Found GRIB message for {param_details.get('plot_title_param_name', 'N/A')}: {grib_message.name} (level {grib_message.level} {grib_message.typeOfLevel})")
-        
-        if not grib_message:
-            for_console_output(f"    ERROR: Could not find GRIB message for {param_details['plot_title_param_name']} (shortName '{param_details['grib_short_name']}', level {param_details['grib_level']}, typeOfLevel '{param_details['grib_type_of_level']}') in file for F{current_fhr_fmt}.")
-            grbs.close() 
-            return False, None
+    existing_results = {}
+    params_to_generate = []
+    for param_details in param_details_list:
+        output_image_name, output_image_full_path = get_model_plot_output_path(param_details, run_date_str, model_run_hour_str, current_fhr_fmt)
+        if os.path.exists(output_image_full_path):
+            for_console_output(f"    INFO: Plot image {output_image_name} already exists. Skipping.")
+            existing_results[param_details.get('output_file_prefix')] = (True, get_published_plot_path(output_image_full_path))
+        else:
+            params_to_generate.append((param_details, output_image_full_path))
+    return existing_results, params_to_generate
 
-        data_values = grib_message.values
-        lats, lons = grib_message.latlons()
-        
-        plot_data_values = data_values # Initialize with original values
-        original_units = grib_message.units if hasattr(grib_message, 'units') else 'N/A'
 
-        if param_details.get('needs_conversion_to_F', False):
-            if hasattr(grib_message, 'units') and grib_message.units == 'K':
-                plot_data_values = (data_values - 273.15) * 9/5 + 32 # K to °F
-                for_console_output(f"      SUCCESS: Converted data from K to °F for {param_details['plot_title_param_name']}.")
-            else:
-                for_console_output(f"      WARNING: 'needs_conversion_to_F' is True, but original units are '{original_units}', not 'K'. Plotting raw data: {np.min(plot_data_values):.2f} to {np.max(plot_data_values):.2f}")
+DECODE_ENGINES = ('pygrib', 'cfgrib')
 
-        # --- ENSURE THESE DEBUG LINES ARE PRESENT ---
-        for_console_output(f"      DEBUG: Original GRIB message units: {original_units}")
-        # Ensure numpy (np) is imported in your grib_processing.py for these np functions
-        if 'np' in globals() and plot_data_values is not None and hasattr(plot_data_values, 'min'): 
-            for_console_output(f"      DEBUG: Plotting data (should be in °F if converted) min: {np.min(plot_data_values):.2f}, max: {np.max(plot_data_values):.2f}, mean: {np.mean(plot_data_values):.2f}")
-        else: 
-            for_console_output(f"      DEBUG: plot_data_values type: {type(plot_data_values)}. np not available or not array-like for min/max/mean.")
 
-        current_plot_levels = param_details.get('plot_levels')
-        current_plot_levels_for_log = current_plot_levels
-        if hasattr(current_plot_levels, 'tolist'): # Convert numpy array to list for cleaner printing
-            current_plot_levels_for_log = current_plot_levels.tolist()
-        for_console_output(f"      DEBUG: Plot levels being used: {current_plot_levels_for_log}")
-        # --- END OF DEBUG LINES TO ENSURE ---
+def get_decode_engine(model_key):
+    """'pygrib' or 'cfgrib' for a model: settings.MODEL_DECODE_ENGINES, else MODEL_PLOT_SETTINGS."""
+    engine = getattr(settings, 'MODEL_DECODE_ENGINES', {}).get(model_key) or \
+        MODEL_PLOT_SETTINGS[model_key].get('decode_engine', 'pygrib')
+    return engine if engine in DECODE_ENGINES else 'pygrib'
 
-  
 
-        grbs.close()
-        for_console_output(f"    GRIB data processed for {param_details['plot_title_param_name']} F{current_fhr_fmt}.")
-
-        for_console_output(f"    Generating plot for {param_details['plot_title_param_name']} F{current_fhr_fmt}...")
-        fig = plt.figure(figsize=(12, 9))
-        ax = plt.axes(projection=ccrs.PlateCarree())
-        ax.set_extent([-125, -65, 23, 50], crs=ccrs.PlateCarree())
-
-        ax.add_feature(cfeature.LAND, facecolor='lightgray', edgecolor='gray', zorder=0) # Light gray land with gray edge
-        ax.add_feature(cfeature.OCEAN, facecolor='lightblue', edgecolor='silver', zorder=0)   # White ocean with silver edge
-
-        ax.add_feature(cfeature.COASTLINE, linewidth=0.8, edgecolor='black', zorder=2)
-        ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.6, facecolor='', edgecolor='black', zorder=2)
-        ax.add_feature(cfeature.STATES, linestyle=':', linewidth=0.6, edgecolor='darkgray', zorder=2)
-        
-        plot_levels_val = param_details.get('plot_levels')
-        plot_cmap_val = param_details.get('plot_cmap', 'jet')
-
-        if plot_levels_val is not None and hasattr(plot_levels_val, '__len__') and len(plot_levels_val) > 0 : # Check if it's a list/array and has items
-            vmin_val = plot_levels_val[0]
-            vmax_val = plot_levels_val[-1]
-            mesh = plt.pcolormesh(lons, lats, plot_data_values, 
-                                  transform=ccrs.PlateCarree(), cmap=plot_cmap_val,
-                                  vmin=vmin_val, vmax=vmax_val, shading='gouraud', zorder=1) 
-            cb = plt.colorbar(mesh, ax=ax, orientation='horizontal', label=param_details['plot_unit_label'], 
-                              pad=0.05, shrink=0.7, aspect=30, extend='both')
-        else: 
-            mesh = plt.pcolormesh(lons, lats, plot_data_values, 
-                                  transform=ccrs.PlateCarree(), cmap=plot_cmap_val, shading='gouraud', zorder=1)
-            cb = plt.colorbar(mesh, ax=ax, orientation='horizontal', label=param_details['plot_unit_label'], 
-                              pad=0.05, shrink=0.7, aspect=30)
-        
-        cb.ax.tick_params(labelsize=8) 
-        ax.set_title(f"GFS {param_details['plot_title_param_name']}\nRun: {run_date_str} {model_run_hour_str}Z - Forecast: F{current_fhr_fmt}", fontsize=12)
-        
-        watermark_text = "unfortunateneighbor.com" # <<< REPLACE THIS WITH YOUR ACTUAL SITE/COMPANY NAME
-        fig.text(0.98, 0.02, watermark_text, fontsize=20, color='black', alpha=0.9,
-                 ha='right', va='bottom', transform=fig.transFigure, zorder=10)
-        
-        for_console_output(f"    DEBUG: Attempting to savefig to: {output_image_full_path}")
-        plt.savefig(output_image_full_path, bbox_inches='tight', pad_inches=0.1, dpi=150)
-        plt.close(fig)
-        for_console_output(f"    SUCCESS: Plot for {param_details['plot_title_param_name']} F{current_fhr_fmt} saved to {output_image_full_path}")
-        return True, output_image_full_path
-    
-    except ImportError:
-        for_console_output("    ERROR: Plotting library or pygrib missing or 'Agg' backend issue.")
-        return False, None
+def _decode_fields_pygrib(model_key, local_grib_filename, param_details_list, message_positions, for_console_output):
+    """Opens the file once with pygrib and extracts each param's message. Returns {prefix: field or None}."""
+    model_name = MODEL_PLOT_SETTINGS[model_key]['display_name']
+    fields = {param_details.get('output_file_prefix'): None for param_details in param_details_list}
+    try:
+        grbs = pygrib.open(local_grib_filename)
     except Exception as e:
-        for_console_output(f"    ERROR: During GRIB processing or plotting for {param_details['plot_title_param_name']} F{current_fhr_fmt}: {e}")
-        traceback.print_exc()
-        return False, None
+        for_console_output(f"    ERROR: Could not open {model_name} GRIB file {local_grib_filename}: {e}")
+        return fields
+
+    # Only a full download (no message numbers known) needs an index. In a .idx subset a
+    # param without a position wasn't in the .idx, so it isn't in the file either.
+    grib_index = None
+    if not message_positions:
+        grib_index = open_grib_index(local_grib_filename, for_console_output)
+    try:
+        for param_details in param_details_list:
+            if message_positions and param_details.get('output_file_prefix') not in message_positions:
+                for_console_output(f"    ERROR: {param_details.get('plot_title_param_name', 'N/A')} isn't in the downloaded subset (no .idx entry).")
+                continue
+            try:
+                grib_message = select_grib_message(grbs, param_details, for_console_output,
+                                                   message_position=message_positions.get(param_details.get('output_file_prefix')),
+                                                   grib_index=grib_index)
+                if grib_message is None:
+                    continue
+                fields[param_details.get('output_file_prefix')] = extract_param_field(model_key, grib_message, param_details, for_console_output)
+            except Exception as e:
+                # One bad parameter shouldn't stop the rest of this forecast hour
+                for_console_output(f"    ERROR: During {model_name} GRIB processing for {param_details.get('plot_title_param_name', 'N/A')}: {e}")
+                traceback.print_exc()
     finally:
-        if os.path.exists(local_grib_filename): # Ensure cleanup of the unique temporary GRIB file
-            os.remove(local_grib_filename)
-            for_console_output(f"    INFO: Cleaned up temporary GRIB file: {local_grib_filename}")
+        grbs.close()
+        if grib_index is not None:
+            grib_index.close()
+    return fields
 
 
-######################################################################################################################################################
+def _decode_fields_cfgrib(model_key, local_grib_filename, param_details_list, for_console_output):
+    """Opens every param as one lazy cfgrib Dataset and extracts each. Returns {prefix: field or None}."""
+    from .cfgrib_engine import CfgribMessage, open_forecast_hour_dataset, remove_cfgrib_index
 
-def generate_nam_parameter_plot(
-    run_date_str, model_run_hour_str, forecast_hour_str_arg, 
-    param_details, # Dictionary with NAM parameter specifics
-    for_console_output=None
-):
+    model_name = MODEL_PLOT_SETTINGS[model_key]['display_name']
+    fields = {param_details.get('output_file_prefix'): None for param_details in param_details_list}
+    try:
+        dataset = open_forecast_hour_dataset(local_grib_filename, param_details_list, for_console_output)
+        try:
+            for param_details in param_details_list:
+                prefix = param_details.get('output_file_prefix')
+                if prefix not in dataset.data_vars:
+                    continue
+                try:
+                    fields[prefix] = extract_param_field(model_key, CfgribMessage(dataset[prefix]), param_details, for_console_output)
+                except Exception as e:
+                    for_console_output(f"    ERROR: During {model_name} cfgrib processing for {param_details.get('plot_title_param_name', 'N/A')}: {e}")
+                    traceback.print_exc()
+        finally:
+            dataset.close()
+    finally:
+        remove_cfgrib_index(local_grib_filename)
+    return fields
+
+
+def decode_grib_file(model_key, local_grib_filename, param_details_list, message_positions=None, engine=None, for_console_output=None):
+    """
+    Extracts every param config's field from a local GRIB file with the model's decode engine
+    (or the one given). Falls back to pygrib if cfgrib/xarray aren't installed.
+    Returns {prefix: field dict from extract_param_field(), or None if that parameter failed}.
+    """
     if for_console_output is None:
         for_console_output = print
+    engine = engine or get_decode_engine(model_key)
 
-    current_fhr_fmt = "" 
-    try:
-        fhr_int = int(forecast_hour_str_arg)
-        if not (0 <= fhr_int <= 84): # NAM awphys CONUS typically out to F84
-             raise ValueError("Forecast hour for NAM out of range (0-84).")
-        current_fhr_fmt = f"{fhr_int:02d}" # NAM often uses 2 digits for FF in awphysFF (e.g., 00, 01, ... 84)
-    except ValueError as e:
-        for_console_output(f"    ERROR: Invalid forecast_hour_str_arg '{forecast_hour_str_arg}' for NAM: {e}")
-        return False, None
+    if engine == 'cfgrib':
+        try:
+            import cfgrib, xarray # noqa: F401 (only checking they're installed)
+        except ImportError:
+            for_console_output("    WARNING: cfgrib/xarray not installed; decoding with pygrib.")
+        else:
+            return _decode_fields_cfgrib(model_key, local_grib_filename, param_details_list, for_console_output)
+    return _decode_fields_pygrib(model_key, local_grib_filename, param_details_list, message_positions or {}, for_console_output)
 
-    for_console_output(f"    DEBUG (generate_nam_plot): Plotting for Param='{param_details.get('plot_title_param_name', 'N/A')}', Run='{run_date_str}/{model_run_hour_str}Z', FHR_ARG='{forecast_hour_str_arg}', Using Formatted FHR='{current_fhr_fmt}'")
 
-    # NAM URL structure - for NAM CONUS nest (awphys files)
-    # Example: nam.t<HH>z.awphys<FF>.tm00.grib2 (FF is 2-digit FHR for this product type)
-    nam_url = f"https://nomads.ncep.noaa.gov/pub/data/nccf/com/nam/prod/nam.{run_date_str}/nam.t{model_run_hour_str}z.awphys{current_fhr_fmt}.tm00.grib2"
-    # Note: Other NAM products or nests might have different file naming (e.g., 'firewx', 'nests/alaska/', etc.)
-    # and different forecast hour formatting (sometimes 3 digits for other products).
-    # This example targets the common 'awphys' CONUS files.
+def store_decoded_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list, fields, for_console_output=None):
+    """Puts each decoded field of param_details_list in the field store (if enabled). Returns the prefixes stored."""
+    if for_console_output is None:
+        for_console_output = print
+    stored = set()
+    if not field_store_enabled():
+        return stored
+    for param_details in param_details_list:
+        field = fields.get(param_details.get('output_file_prefix'))
+        if field is None:
+            continue
+        try:
+            store_field(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details, field, for_console_output)
+            stored.add(param_details.get('output_file_prefix'))
+        except Exception as e: # Storing is a side product; the plot can still be drawn
+            for_console_output(f"    WARNING: Could not store {param_details.get('output_file_prefix')} F{current_fhr_fmt} in the field store: {e}")
+    return stored
 
-    file_prefix = param_details.get('output_file_prefix', 'nam_unknown') # e.g., 'nam_refc'
-    local_grib_filename = f"{file_prefix}_{run_date_str}_{model_run_hour_str}_{current_fhr_fmt}_temp.grb2"
 
-    output_image_name = f"{file_prefix}_{run_date_str}_{model_run_hour_str}z_f{current_fhr_fmt}.png"
-    output_image_full_path = os.path.join(settings.MEDIA_ROOT, 'model_plots', output_image_name) 
+def download_and_extract_forecast_hour(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list, for_console_output=None):
+    """
+    Downloads the GRIB messages for every param config of one (run, fhr) in a single
+    .idx subset request, decodes the file ONCE (see decode_grib_file) and extracts each field.
+    Derived params (see derived_fields.py) are then computed from the decoded and stored
+    fields; only their inputs missing from the field store are added to the download.
+    The temp GRIB file is removed before returning; each field is kept in the field store
+    (see field_store.py) so later uses don't need the GRIB again.
+
+    Returns {prefix: field dict from extract_param_field(), or None if that parameter failed}.
+    """
+    if for_console_output is None:
+        for_console_output = print
 
-    for_console_output(f"    DEBUG (generate_nam_plot): Temp GRIB path: {local_grib_filename}")
-    for_console_output(f"    DEBUG (generate_nam_plot): Output PNG path: {output_image_full_path}")
+    fields = {param_details.get('output_file_prefix'): None for param_details in param_details_list}
+    grib_params = get_grib_params_to_decode(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list)
+    if grib_params:
+        fields.update(_download_and_decode_forecast_hour(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, grib_params, for_console_output))
+        store_decoded_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, grib_params, fields, for_console_output)
+
+    derived_params = [param_details for param_details in param_details_list if is_derived_param(param_details)]
+    if derived_params:
+        derived_fields = compute_derived_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, derived_params, fields, for_console_output)
+        store_decoded_fields(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, derived_params, derived_fields, for_console_output)
+        fields.update(derived_fields)
+    return fields
+
+
+def _download_and_decode_forecast_hour(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details_list, for_console_output):
+    """The download + decode half of download_and_extract_forecast_hour(), for GRIB params only."""
+    model_settings = MODEL_PLOT_SETTINGS[model_key]
+    model_name = model_settings['display_name']
+    fields = {param_details.get('output_file_prefix'): None for param_details in param_details_list}
+
+    grib_url = model_settings['url_template'].format(run_date=run_date_str, run_hour=model_run_hour_str, fhr=current_fhr_fmt)
+    # One temp GRIB per (model, run, fhr) shared by every parameter; mkstemp keeps parallel downloads apart
+    temp_grib_dir = os.path.join(settings.MEDIA_ROOT, 'grib_temp')
+    os.makedirs(temp_grib_dir, exist_ok=True)
+    temp_fd, local_grib_filename = tempfile.mkstemp(prefix=f"{model_key}_{run_date_str}_{model_run_hour_str}_{current_fhr_fmt}_", suffix='.grb2', dir=temp_grib_dir)
+    os.close(temp_fd)
+
+    for_console_output(f"  Attempting {model_name} F{current_fhr_fmt} (Run {run_date_str} {model_run_hour_str}Z) for "
+                       f"{[p.get('plot_title_param_name', 'N/A') for p in param_details_list]}: Downloading from {grib_url}")
+    try:
+        try:
+            message_positions = download_grib_file(grib_url, param_details_list, local_grib_filename,
+                               timeout=model_settings['download_timeout'], for_console_output=for_console_output)
+            for_console_output(f"    SUCCESS: Downloaded {model_name} data for F{current_fhr_fmt} to {local_grib_filename}")
+        except requests.exceptions.RequestException as e:
+            for_console_output(f"    ERROR: Downloading {model_name} GRIB for F{current_fhr_fmt}: {e} (URL: {grib_url})")
+            return fields
+        except Exception as e:
+            for_console_output(f"    ERROR: Unexpected error during {model_name} download for F{current_fhr_fmt}: {e}")
+            return fields
+
+        for_console_output(f"    Processing {model_name} GRIB file ({get_decode_engine(model_key)}): {local_grib_filename}")
+        fields.update(decode_grib_file(model_key, local_grib_filename, param_details_list, message_positions, for_console_output=for_console_output))
+    finally:
+        if os.path.exists(local_grib_filename): # Ensure cleanup of the shared temporary GRIB file
+            os.remove(local_grib_filename)
+            for_console_output(f"    INFO: Cleaned up temporary {model_name} GRIB file: {local_grib_filename}")
+    return fields
 
-    os.makedirs(os.path.dirname(output_image_full_path), exist_ok=True)
 
-    if os.path.exists(output_image_full_path):
-        for_console_output(f"    INFO: NAM Plot image {output_image_name} already exists. Skipping.")
-        if os.path.exists(local_grib_filename): os.remove(local_grib_filename)
-        return True, output_image_full_path
+def process_model_forecast_hour(
+    model_key, run_date_str, model_run_hour_str, forecast_hour_str_arg,
+    param_details_list,
+    for_console_output=None
+):
+    """
+    Generates every requested parameter plot for one model run + forecast hour.
 
-    for_console_output(f"  Attempting NAM {param_details.get('plot_title_param_name', 'N/A')} F{current_fhr_fmt} (Run {run_date_str} {model_run_hour_str}Z): Downloading from {nam_url}")
-    try:
-        response = requests.get(nam_url, stream=True, timeout=120) # NAM files can also be large
-        response.raise_for_status()
-        with open(local_grib_filename, 'wb') as f: 
-            for chunk in response.iter_content(chunk_size=8192*4):
-                f.write(chunk)
-        for_console_output(f"    SUCCESS: Downloaded NAM data for F{current_fhr_fmt} to {local_grib_filename}") 
-    except requests.exceptions.RequestException as e:
-        for_console_output(f"    ERROR: Downloading NAM GRIB for F{current_fhr_fmt}: {e} (URL: {nam_url})")
-        return False, None # Temp file cleaned in finally
-    except Exception as e:
-        for_console_output(f"    ERROR: Unexpected error during NAM download for F{current_fhr_fmt}: {e}")
-        return False, None # Temp file cleaned in finally
+    The GRIB data for all parameters that still need a plot is downloaded ONCE
+    (only the needed messages, via the .idx byte ranges), opened once with pygrib,
+    and each parameter is extracted and then rendered.
 
-    try:
-        for_console_output(f"    Processing NAM GRIB file: {local_grib_filename}")
-        grbs = pygrib.open(local_grib_filename)
+    Returns a dict keyed by output_file_prefix: {prefix: (success, output_image_full_path or None)}
+    """
+    if for_console_output is None:
+        for_console_output = print
+    model_name = MODEL_PLOT_SETTINGS[model_key]['display_name']
 
-        # Optional: Add your GRIB message listing debug loop here if needed for NAM parameters
-        # print_grib_messages_debug(grbs, local_grib_filename, current_fhr_fmt, for_console_output)
-
-
-# --- THIS DEBUG BLOCK IS CRUCIAL ---
-
-        # --- START: NEW COMPREHENSIVE GRIB MESSAGE SEARCHING BLOCK ---
-        # Customize the 'current_search_parameter_name' for your log message
-        current_search_parameter_name = param_details.get('plot_title_param_name', 'Unknown Parameter')
-        for_console_output(f"    --- Searching ALL GRIB Messages in {local_grib_filename} for relevant keywords for '{current_search_parameter_name}' (F{current_fhr_fmt}) ---")
-        
-        found_potential_matches = False
-        # Define your keywords based on what you're currently debugging
-        # Example for when you are debugging Storm Relative Helicity:
-        # keywords_to_search = ['helicity', 'srh', 'hlcy', 'storm relative']
-        # Example for when you are debugging Dew Point:
-        # keywords_to_search = ['dewpoint', 'dew point', 'dpt', '2d', 'd2m']
-        # Example for when you are debugging UPHL:
-        # keywords_to_search = ['updraft', 'uphl', 'maxuh', 'helicity'] # Helicity is broad but UPHL contains it
-        # Example for when you are debugging Lightning:
-        # keywords_to_search = ['ltng', 'lightning']
-
-        # FOR THE CURRENT TEST, let's use a combined list if you're testing SRH or Dew Point again.
-        # Adjust this list based on the specific parameter you are trying to find in tasks.py!
-        if "Dew Point" in current_search_parameter_name:
-            keywords_to_search = ['dewpoint', 'dew point', 'dpt', '2d', 'd2m']
-        elif "Helicity" in current_search_parameter_name: # Catches both SRH and UPHL if UPHL title has "Helicity"
-            keywords_to_search = ['helicity', 'srh', 'hlcy', 'storm relative', 'uphl', 'updraft']
-        elif "Lightning" in current_search_parameter_name:
-            keywords_to_search = ['ltng', 'lightning']
-        else:
-            keywords_to_search = [] # Default to no keywords if param name doesn't give a hint
-            for_console_output(f"    INFO: No specific keywords defined for parameter '{current_search_parameter_name}'. Listing all messages might be too verbose if this happens.")
-
-
-        # Iterate through ALL messages in the GRIB file
-        for i, msg_debug in enumerate(grbs): 
-            msg_name_lower = ""
-            if hasattr(msg_debug, 'name') and isinstance(msg_debug.name, str):
-                msg_name_lower = msg_debug.name.lower()
-
-            msg_short_name_lower = ""
-            if hasattr(msg_debug, 'shortName') and isinstance(msg_debug.shortName, str):
-                msg_short_name_lower = msg_debug.shortName.lower()
-            
-            keyword_found_in_message = False
-            if not keywords_to_search: # If no keywords, don't try to match (or decide to print all, but that's verbose)
-                pass
-            else:
-                for keyword in keywords_to_search:
-                    if keyword in msg_name_lower or keyword in msg_short_name_lower:
-                        keyword_found_in_message = True
-                        break
-            
-            if keyword_found_in_message:
-                found_potential_matches = True
-                keys_to_print = [
-                    'name', 'shortName', 'paramId', 'units', 
-                    'level', 'typeOfLevel', 'levelName', 
-                    'topLevel', 'bottomLevel', 
-                    'discipline', 'parameterCategory', 'parameterNumber',
-                    'forecastTime', 'stepType', 'stepRange' 
-                ]
-                details = []
-                for key_to_print in keys_to_print:
-                    value_str = "N/A (key not present or error)" # Default if not found or error
-                    try:
-                        # pygrib messages often behave like dicts for key access for GRIB keys
-                        # or you can use specific methods if available (e.g., msg_debug.level)
-                        # Using __getitem__ (like msg_debug[key_to_print]) is often more direct for GRIB keys
-                        # but we'll try getattr first as it's more general for attributes/methods too.
-                        # However, the error comes from __getitem__ via __getattr__ in pygrib.
-                        
-                        # Let's try direct key access which pygrib often uses, and catch the specific error
-                        val = msg_debug[key_to_print] # Try accessing as a dictionary key
-                        if val is not None:
-                            value_str = f"{key_to_print}='{str(val)}'"
-                        else:
-                            value_str = f"{key_to_print}=None (explicitly)"
-                    except RuntimeError as e_grib:
-                        if "Key/value not found" in str(e_grib):
-                            value_str = f"{key_to_print}=N/A (key not found)"
-                        else:
-                            # For other RuntimeErrors from pygrib for this key
-                            value_str = f"{key_to_print}=ERROR_Runtime({str(e_grib)})" 
-                    except KeyError:
-                        # If it behaves purely like a dict and key is missing
-                        value_str = f"{key_to_print}=N/A (KeyError)"
-                    except Exception as e_other:
-                        # Catch any other unexpected errors for this specific key
-                        value_str = f"{key_to_print}=ERROR_Other({str(e_other)})"
-                    details.append(value_str)
-
-                
-                print_msg_line = f"    Potential Match (Msg Index {i+1}/{len(grbs)}): " + ", ".join(details) # Show total messages
-                for_console_output(print_msg_line)
-
-        if not found_potential_matches and keywords_to_search: # Only print if we were actually looking for keywords
-            for_console_output(f"    --- No GRIB messages found matching specified keywords {keywords_to_search} in the entire file. ---")
-        elif not keywords_to_search:
-             for_console_output(f"    --- No keywords specified for search; full GRIB scan for matches skipped. ---")
-
-        grbs.seek(0) # IMPORTANT: Rewind the GRIB file iterator for the actual grbs.select() call
-        for_console_output(f"    --- Finished searching. Attempting grbs.select() with current param_details. ---")
-        # --- END: NEW COMPREHENSIVE GRIB MESSAGE SEARCHING BLOCK ---
-
-        select_criteria = {}
-
-        if 'grib_level' in param_details:
-            select_criteria['level'] = param_details['grib_level']
-        else:
-            for_console_output(f"      ERROR: 'grib_level' missing in param_details for {param_details.get('plot_title_param_name')}")
-            if grbs: grbs.close()
-            return False, None # Essential to stop if basic criteria are missing
-            
-        if 'grib_type_of_level' in param_details:
-            select_criteria['typeOfLevel'] = param_details['grib_type_of_level']
-        else:
-            for_console_output(f"      ERROR: 'grib_type_of_level' missing in param_details for {param_details.get('plot_title_param_name')}")
-            if grbs: grbs.close()
-            return False, None # Essential to stop
-
-        # Prefer select_by_name if provided, otherwise use grib_short_name
-        if 'select_by_name' in param_details and param_details['select_by_name']:
-            select_criteria['name'] = param_details['select_by_name']
-            for_console_output(f"      Selecting by full name: '{param_details['select_by_name']}'")
-        elif 'grib_short_name' in param_details and param_details['grib_short_name']:
-            select_criteria['shortName'] = param_details['grib_short_name']
-            for_console_output(f"      Selecting by shortName: '{param_details['grib_short_name']}'")
-        else:
-            # If neither is provided, it's an error in param_details setup
-            for_console_output(f"      ERROR: Neither 'select_by_name' nor 'grib_short_name' key found or has value in param_details for {param_details.get('plot_title_param_name')}")
-            if grbs: grbs.close()
-            return False, None 
-
-        # Add topLevel and bottomLevel to criteria if they are in param_details and not None
-        if 'grib_top_level' in param_details and param_details['grib_top_level'] is not None:
-            select_criteria['topLevel'] = param_details['grib_top_level']
-        if 'grib_bottom_level' in param_details and param_details['grib_bottom_level'] is not None:
-            select_criteria['bottomLevel'] = param_details['grib_bottom_level']
-        
-        for_console_output(f"      Attempting grbs.select() with criteria: {select_criteria}")
+    results = {param_details.get('output_file_prefix'): (False, None) for param_details in param_details_list}
+
+    try:
+        current_fhr_fmt = format_model_forecast_hour(model_key, forecast_hour_str_arg)
+    except ValueError as e:
+        for_console_output(f"    ERROR: Invalid forecast_hour_str_arg '{forecast_hour_str_arg}' for {model_name}: {e}")
+        return results
+
+    existing_results, params_to_generate = get_params_needing_plots(param_details_list, run_date_str, model_run_hour_str, current_fhr_fmt, for_console_output)
+    results.update(existing_results)
+    if not params_to_generate:
+        return results
+
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, 'model_plots'), exist_ok=True)
+    fields = download_and_extract_forecast_hour(model_key, run_date_str, model_run_hour_str, current_fhr_fmt,
+                                                [p for p, _ in params_to_generate], for_console_output)
+
+    for param_details, output_image_full_path in params_to_generate:
+        field = fields.get(param_details.get('output_file_prefix'))
+        if field is None:
+            continue
         try:
-            selected_messages = grbs.select(**select_criteria)
-        except ValueError as e: # Catch "no matches found" specifically
-            if "no matches found" in str(e).lower(): # make case insensitive
-                 for_console_output(f"      ERROR from grbs.select(): no matches found for criteria {select_criteria}")
-                 selected_messages = [] # Ensure it's an empty list
-            else:
-                raise # Re-raise other ValueErrors
-        # --- END: ROBUST SELECTION CRITERIA LOGIC ---
-        
-        grib_message = None
-        if selected_messages:
-            grib_message = selected_messages[0]
-            for_console_output(f"      SUCCESS: Found GRIB message for {param_details.get('plot_title_param_name', 'N/A')} using criteria {select_criteria}")
-        else: 
-            # This handles the case where selected_messages is empty from the try-except block above
-            for_console_output(f"      ERROR: Could not find GRIB message for {param_details.get('plot_title_param_name', 'N/A')} with criteria {select_criteria} (select call returned no messages or 'no matches found' was caught).")
-            if grbs: grbs.close()
-            return False, None
-
-
-        # --- END DEBUG BLOCK ---
-
-
-        selected_messages = grbs.select(
-            shortName=param_details['grib_short_name'],
-            level=param_details['grib_level'],
-            typeOfLevel=param_details['grib_type_of_level']
-        )
-
-        grib_message = None
-        if selected_messages:
-            grib_message = selected_messages[0]
-            for_console_output(f"    Found GRIB message for NAM {param_details.get('plot_title_param_name', 'N/A')}: {grib_message.name} (L{grib_message.level} {grib_message.typeOfLevel})")
-
-        if not grib_message:
-            for_console_output(f"    ERROR: Could not find GRIB message for {param_details['plot_title_param_name']} (shortName '{param_details['grib_short_name']}', etc.) in NAM file for F{current_fhr_fmt}.")
-            grbs.close() 
-            return False, None
-
-        data_values = grib_message.values
-        lats, lons = grib_message.latlons()
-        # NAM data does not require Fahrenheit conversion for reflectivity or CAPE
-        plot_data_values = data_values 
-
-        plot_data_values = data_values # Initialize
-        original_units = "N/A"
-        if hasattr(grib_message, 'units') and grib_message.units is not None:
-            original_units = grib_message.units
-            
-        for_console_output(f"      PRINT_DEBUG_STEP_1: Original GRIB units = '{original_units}'")
-
-        if param_details.get('needs_conversion_to_F', False):
-            if original_units == 'K':
-                plot_data_values = (data_values - 273.15) * 9/5 + 32 # K to °F
-                for_console_output(f"      PRINT_DEBUG_STEP_2: Data converted from K to °F.")
-            else:
-                 for_console_output(f"      PRINT_DEBUG_STEP_2: WARNING - 'needs_conversion_to_F' is True, but original units '{original_units}' != 'K'. Using raw data.")
-        else:
-             for_console_output(f"      PRINT_DEBUG_STEP_2: No temperature conversion requested or applied.")
-            
-            # Ensure numpy (np) is imported at the top of grib_processing.py
-        if 'np' in globals() and hasattr(plot_data_values, 'shape') and plot_data_values.size > 0:
-            min_val = np.nanmin(plot_data_values)
-            max_val = np.nanmax(plot_data_values)
-            mean_val = np.nanmean(plot_data_values)
-            for_console_output(f"      PRINT_DEBUG_STEP_3: plot_data_values (post-conversion, for plotting) - Min={min_val:.2f}, Max={max_val:.2f}, Mean={mean_val:.2f}, Shape={plot_data_values.shape}")
-        else:
-            for_console_output(f"      PRINT_DEBUG_STEP_3: plot_data_values could not be analyzed (np not found, or data is None/empty). Type: {type(plot_data_values)}")
+            published_image_path = render_model_plot(model_key, run_date_str, model_run_hour_str, current_fhr_fmt,
+                                                     param_details, field, output_image_full_path, for_console_output)
+            results[param_details.get('output_file_prefix')] = (True, published_image_path)
+        except Exception as e:
+            for_console_output(f"    ERROR: During {model_name} plotting for {param_details.get('plot_title_param_name', 'N/A')} F{current_fhr_fmt}: {e}")
+            traceback.print_exc()
 
-        current_plot_levels = param_details.get('plot_levels')
-        current_plot_levels_for_log = "N/A"
-        if current_plot_levels is not None:
-            current_plot_levels_for_log = str(current_plot_levels.tolist() if hasattr(current_plot_levels, 'tolist') else current_plot_levels)
-        for_console_output(f"      PRINT_DEBUG_STEP_4: Plot levels being used: {current_plot_levels_for_log}")
-            
-   
+    return results
 
 
-        grbs.close()
-        for_console_output(f"    NAM GRIB data processed for {param_details['plot_title_param_name']} F{current_fhr_fmt}.")
-
-        for_console_output(f"    Generating NAM plot for {param_details['plot_title_param_name']} F{current_fhr_fmt}...")
-        fig = plt.figure(figsize=(12, 9)) 
-        ax = plt.axes(projection=ccrs.PlateCarree()) 
-
-        # NAM is North America focused, adjust default extent.
-        # These bounds roughly cover CONUS and are good for NAM CONUS nest.
-        ax.set_extent([-125, -65, 23, 52], crs=ccrs.PlateCarree()) 
-
-        ax.add_feature(cfeature.LAND, facecolor='white', edgecolor='gray', zorder=0) # Light gray land with gray edge
-        ax.add_feature(cfeature.OCEAN, facecolor='lightblue', edgecolor='silver', zorder=0)   # White ocean with silver edge
-
-
-        ax.add_feature(cfeature.COASTLINE, linewidth=0.8, edgecolor='black', zorder=2)
-        ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.6, edgecolor='black', zorder=2)
-        ax.add_feature(cfeature.STATES, linestyle=':', linewidth=0.6, edgecolor='darkgray', zorder=2)
-
-        plot_levels_val = param_details.get('plot_levels')
-        plot_cmap_val = param_details.get('plot_cmap', 'jet')
-
-        if plot_levels_val is not None and hasattr(plot_levels_val, '__len__') and len(plot_levels_val) > 0 :
-            vmin_val = plot_levels_val[0]
-            vmax_val = plot_levels_val[-1]
-            mesh = plt.pcolormesh(lons, lats, plot_data_values, 
-                                  transform=ccrs.PlateCarree(), cmap=plot_cmap_val,
-                                  vmin=vmin_val, vmax=vmax_val, shading='gouraud', zorder=1) 
-            cb = plt.colorbar(mesh, ax=ax, orientation='horizontal', label=param_details['plot_unit_label'], 
-                              pad=0.05, shrink=0.7, aspect=30, extend='both')
-        else: 
-            mesh = plt.pcolormesh(lons, lats, plot_data_values, 
-                                  transform=ccrs.PlateCarree(), cmap=plot_cmap_val, shading='gouraud', zorder=1)
-            cb = plt.colorbar(mesh, ax=ax, orientation='horizontal', label=param_details['plot_unit_label'], 
-                              pad=0.05, shrink=0.7, aspect=30)
-
-        cb.ax.tick_params(labelsize=8) 
-        ax.set_title(f"NAM {param_details['plot_title_param_name']}\nRun: {run_date_str} {model_run_hour_str}Z - Forecast: F{current_fhr_fmt}", fontsize=12)
-
-        # Add Watermark
-        watermark_text = "myweathersite.com" # <<< *** REPLACE THIS ***
-        fig.text(0.98, 0.02, watermark_text, fontsize=20, color='black', alpha=0.6,
-                 ha='right', va='bottom', transform=fig.transFigure, zorder=10)
-
-        for_console_output(f"    DEBUG: Attempting to savefig to: {output_image_full_path}")
-        plt.savefig(output_image_full_path, bbox_inches='tight', pad_inches=0.1, dpi=150)
-        plt.close(fig)
-        for_console_output(f"    SUCCESS: Plot for NAM {param_details['plot_title_param_name']} F{current_fhr_fmt} saved to {output_image_full_path}")
-        return True, output_image_full_path
-
-    except ImportError:
-        for_console_output("    ERROR: Plotting library or pygrib missing or 'Agg' backend issue.")
-        return False, None
-    except Exception as e:
-        for_console_output(f"    ERROR: During NAM GRIB processing or plotting for {param_details['plot_title_param_name']} F{current_fhr_fmt}: {e}")
-        traceback.print_exc()
-        return False, None
-    finally:
-        if os.path.exists(local_grib_filename):
-            os.remove(local_grib_filename)
-            for_console_output(f"    INFO: Cleaned up temporary NAM GRIB file: {local_grib_filename}")
-# --- END NEW FUNCTION for NAM plots ---
+# --- Single-parameter wrappers (used by management commands and older callers) ---
+def generate_gfs_parameter_plot(
+    run_date_str, model_run_hour_str, forecast_hour_str_arg, # Argument from task/command
+    param_details,
+    for_console_output=None
+):
+    results = process_model_forecast_hour('gfs', run_date_str, model_run_hour_str, forecast_hour_str_arg,
+                                          [param_details], for_console_output)
+    return results[param_details.get('output_file_prefix')]
+
+
+def generate_nam_parameter_plot(
+    run_date_str, model_run_hour_str, forecast_hour_str_arg,
+    param_details, # Dictionary with NAM parameter specifics
+    for_console_output=None
+):
+    results = process_model_forecast_hour('nam', run_date_str, model_run_hour_str, forecast_hour_str_arg,
+                                          [param_details], for_console_output)
+    return results[param_details.get('output_file_prefix')]
+
 
 # --- Helper function for views to find image details with fallback ---
 def get_gfs_image_details_with_fallback(requested_fhr_str, output_file_prefix, for_console_output=None):
+    """
+    Looks the plot up in the plot manifest (newest run that has it, else an older one)
+    instead of stat-ing expected file names.
+    """
     if for_console_output is None:
         for_console_output = print
+    from .plot_manifest import get_model_image_details # Imported here; plot_manifest needs the app registry
 
-    fhr_to_check = "006"; actual_fhr_for_return = "006"
     try:
-        fhr_int = int(requested_fhr_str)
-        actual_fhr_for_return = f"{fhr_int:03d}"
-        fhr_to_check = actual_fhr_for_return # Use validated FHR for checks
+        fhr_to_check = f"{int(requested_fhr_str):03d}"
     except ValueError:
         for_console_output(f"  Warning (get_image_details): Invalid requested_fhr '{requested_fhr_str}', using default '006'.")
-        actual_fhr_for_return = "006" # Keep fhr_to_check also as "006"
-
-    def get_run_cycle_parts(dt_object):
-        # ... (as before) ...
-        run_date = dt_object.strftime("%Y%m%d")
-        hour_val = dt_object.hour
-        if hour_val >= 18: run_h_str = "18"
-        elif hour_val >= 12: run_h_str = "12"
-        elif hour_val >= 6: run_h_str = "06"
-        else: run_h_str = "00"
-        return run_date, run_h_str
-
-    def construct_run_datetime_utc(date_str, hour_str):
-        try:
-            return datetime(
-                int(date_str[:4]), int(date_str[4:6]), int(date_str[6:8]),
-                int(hour_str), tzinfo=timezone.utc)
-        except ValueError: return None
+        fhr_to_check = "006"
 
-    # Attempt 1: Latest Expected Run
-    now_utc = datetime.now(timezone.utc)
-    latest_expected_run_time = now_utc - timedelta(hours=7) 
-    run_date_str, model_run_hour_str = get_run_cycle_parts(latest_expected_run_time)
-
-    expected_image_filename = f"{output_file_prefix}_{run_date_str}_{model_run_hour_str}z_f{fhr_to_check}.png"
-    full_image_filesystem_path = os.path.join(settings.MEDIA_ROOT, 'model_plots', expected_image_filename)
-
-    if os.path.exists(full_image_filesystem_path):
-        image_url = settings.MEDIA_URL + os.path.join('model_plots', expected_image_filename)
-        run_dt_utc = construct_run_datetime_utc(run_date_str, model_run_hour_str)
-        display_message = f"GFS Plot - F{fhr_to_check} (Run: {run_date_str} {model_run_hour_str}Z)"
-        return {
-            'image_exists': True, 'image_url': image_url, 'display_message': display_message,
-            'run_datetime_utc': run_dt_utc, 'actual_fhr': fhr_to_check
-        }
-
-    # Attempt 2: Previous Run
-    latest_run_start_dt = construct_run_datetime_utc(run_date_str, model_run_hour_str)
-    if latest_run_start_dt: # Check if latest_run_start_dt was successfully created
-        previous_expected_run_time = latest_run_start_dt - timedelta(hours=6)
-        prev_run_date_str, prev_model_run_hour_str = get_run_cycle_parts(previous_expected_run_time)
-
-        expected_image_filename_prev = f"{output_file_prefix}_{prev_run_date_str}_{prev_model_run_hour_str}z_f{fhr_to_check}.png"
-        full_image_filesystem_path_prev = os.path.join(settings.MEDIA_ROOT, 'model_plots', expected_image_filename_prev)
-
-        if os.path.exists(full_image_filesystem_path_prev):
-            image_url = settings.MEDIA_URL + os.path.join('model_plots', expected_image_filename_prev)
-            run_dt_utc = construct_run_datetime_utc(prev_run_date_str, prev_model_run_hour_str)
-            display_message = f"GFS Plot - F{fhr_to_check} (Previous Run: {prev_run_date_str} {prev_model_run_hour_str}Z - Latest not available)"
-            return {
-                'image_exists': True, 'image_url': image_url, 'display_message': display_message,
-                'run_datetime_utc': run_dt_utc, 'actual_fhr': fhr_to_check
-            }
-
-    # Fallback: No image found
-    run_dt_utc_targeted = construct_run_datetime_utc(run_date_str, model_run_hour_str) # The one we initially targeted
-    display_message = f"GFS Plot - F{fhr_to_check} (Target Run: {run_date_str} {model_run_hour_str}Z) not available."
-    return {
-        'image_exists': False, 'image_url': None, 'display_message': display_message,
-        'run_datetime_utc': run_dt_utc_targeted, 'actual_fhr': fhr_to_check
-    }
+    return get_model_image_details('gfs', output_file_prefix, fhr_to_check, model_label="GFS")
@@ -0,0 +1,239 @@
+# weather/grid_cache.py
+#
+# Lat/lon grid cache per model domain.
+#
+# grib_message.latlons() allocates two full 2D float64 arrays on every call, but
+# a model's grid never changes between forecast hours or parameters. The first
+# time we see a grid we compute its coordinates once, crop them to the map
+# extent we plot (the GFS grid is global, we only draw CONUS), wrap longitudes
+# to -180..180, and save everything as .npy files under MEDIA_ROOT/grid_cache.
+# Every later render memory-maps those files instead of recomputing them, and
+# the render worker processes share the same pages through the OS file cache.
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+from django.conf import settings
+
+# GRIB keys that (together with gridType) fully describe a grid's geometry.
+# Missing keys are simply left out of the definition.
+GRID_DEFINITION_KEYS = [
+    'Nx', 'Ny', 'Ni', 'Nj',
+    'latitudeOfFirstGridPointInDegrees', 'longitudeOfFirstGridPointInDegrees',
+    'latitudeOfLastGridPointInDegrees', 'longitudeOfLastGridPointInDegrees',
+    'iDirectionIncrementInDegrees', 'jDirectionIncrementInDegrees',
+    'DxInMetres', 'DyInMetres',
+    'LoVInDegrees', 'LaDInDegrees', 'Latin1InDegrees', 'Latin2InDegrees',
+    'iScansNegatively', 'jScansPositively',
+]
+
+# Extra margin (degrees) kept around the map extent when cropping, so the
+# gouraud-shaded mesh still reaches the map edges.
+CROP_MARGIN_DEGREES = 1.0
+
+EARTH_RADIUS_KM = 6371.0
+
+_loaded_grids = {}
+_loaded_grids_lock = threading.Lock()
+_grid_trees = {}
+_grid_trees_lock = threading.Lock()
+
+
+class ModelGrid:
+    """Cached coordinates for one model grid, cropped to the plotted map extent."""
+
+    def __init__(self, grid_key, metadata, plot_lats, plot_lons):
+        self.grid_key = grid_key
+        self.metadata = metadata
+        self.row_slice = slice(*metadata['row_bounds'])
+        self.col_slice = slice(*metadata['col_bounds'])
+        self.plot_lats = plot_lats # Memory-mapped, read only
+        self.plot_lons = plot_lons
+
+    def crop(self, values, dtype=None):
+        """
+        Crops a full-grid data array to this grid's plotted area as a compact copy (masks kept).
+        With a dtype the copy is a plain array of that dtype instead, NaN where values were masked,
+        made in a single pass.
+        """
+        cropped = values[self.row_slice, self.col_slice]
+        if dtype is None:
+            return cropped.copy()
+        if not isinstance(cropped, np.ndarray): # Lazy (dask) array from the cfgrib engine; missing is already NaN
+            return np.asarray(cropped, dtype=dtype)
+        compact = np.array(np.ma.getdata(cropped), dtype=dtype)
+        if np.ma.is_masked(cropped):
+            compact[np.ma.getmaskarray(cropped)] = np.nan
+        return compact
+
+
+def get_grid_cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'grid_cache')
+
+
+def get_grid_definition(grib_message):
+    """Reads the geometry-defining keys of a GRIB message into a plain dict."""
+    grid_definition = {'gridType': str(grib_message['gridType'])}
+    for key in GRID_DEFINITION_KEYS:
+        if grib_message.has_key(key):
+            value = grib_message[key]
+            if value is None: # Key exists but is 'missing' in this message
+                continue
+            if isinstance(value, np.generic): # cfgrib attrs can be numpy scalars; json.dumps can't take those
+                value = value.item()
+            # Round floats so tiny decoding differences don't create a new grid
+            grid_definition[key] = round(value, 6) if isinstance(value, float) else value
+    return grid_definition
+
+
+def make_grid_key(model_key, grid_definition, map_extent):
+    """Builds a stable key like 'nam_lambert_1799x1059_3f9c0a1b2d'."""
+    fingerprint = json.dumps({'grid': grid_definition, 'extent': list(map_extent)}, sort_keys=True)
+    digest = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:10]
+    nx = grid_definition.get('Nx', grid_definition.get('Ni', 'x'))
+    ny = grid_definition.get('Ny', grid_definition.get('Nj', 'y'))
+    return f"{model_key}_{grid_definition['gridType']}_{nx}x{ny}_{digest}"
+
+
+def save_npy_atomically(path, array):
+    temp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(temp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(temp_path, path)
+
+
+def _build_grid_files(grid_dir, grib_message, grid_definition, map_extent, for_console_output):
+    """Computes the grid's coordinates once and writes the cache files."""
+    for_console_output(f"    INFO (grid_cache): Building grid cache in {grid_dir}")
+    lats, lons = grib_message.latlons()
+    lons = np.where(lons > 180, lons - 360, lons) # GFS uses 0..360
+
+    west, east, south, north = map_extent
+    in_extent = ((lons >= west - CROP_MARGIN_DEGREES) & (lons <= east + CROP_MARGIN_DEGREES) &
+                 (lats >= south - CROP_MARGIN_DEGREES) & (lats <= north + CROP_MARGIN_DEGREES))
+    rows = np.flatnonzero(in_extent.any(axis=1))
+    cols = np.flatnonzero(in_extent.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        # Grid doesn't overlap the map at all; keep the whole grid rather than plotting nothing
+        row_bounds, col_bounds = [0, lats.shape[0]], [0, lats.shape[1]]
+    else:
+        row_bounds, col_bounds = [int(rows[0]), int(rows[-1]) + 1], [int(cols[0]), int(cols[-1]) + 1]
+
+    os.makedirs(grid_dir, exist_ok=True)
+    row_slice, col_slice = slice(*row_bounds), slice(*col_bounds)
+    save_npy_atomically(os.path.join(grid_dir, 'plot_lats.npy'), np.ascontiguousarray(lats[row_slice, col_slice]))
+    save_npy_atomically(os.path.join(grid_dir, 'plot_lons.npy'), np.ascontiguousarray(lons[row_slice, col_slice]))
+
+    metadata = {
+        'grid_definition': grid_definition,
+        'map_extent': list(map_extent),
+        'full_shape': list(lats.shape),
+        'row_bounds': row_bounds,
+        'col_bounds': col_bounds,
+    }
+    # meta.json is written last; its presence means the cache entry is complete
+    meta_temp_path = os.path.join(grid_dir, f"meta.json.tmp.{os.getpid()}.{threading.get_ident()}")
+    with open(meta_temp_path, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(meta_temp_path, os.path.join(grid_dir, 'meta.json'))
+
+
+def list_model_grid_keys(model_key):
+    """Keys of every complete grid cache entry built for a model."""
+    try:
+        entries = os.listdir(get_grid_cache_dir())
+    except FileNotFoundError:
+        return []
+    return sorted(entry for entry in entries
+                  if entry.startswith(f"{model_key}_") and
+                  os.path.exists(os.path.join(get_grid_cache_dir(), entry, 'meta.json')))
+
+
+def load_model_grid(grid_key):
+    """
+    Returns the ModelGrid for a key that has already been built (e.g. in a render worker).
+    Raises FileNotFoundError if it hasn't.
+    """
+    with _loaded_grids_lock:
+        if grid_key in _loaded_grids:
+            return _loaded_grids[grid_key]
+
+    grid_dir = os.path.join(get_grid_cache_dir(), grid_key)
+    with open(os.path.join(grid_dir, 'meta.json')) as f:
+        metadata = json.load(f)
+    model_grid = ModelGrid(
+        grid_key, metadata,
+        np.load(os.path.join(grid_dir, 'plot_lats.npy'), mmap_mode='r'),
+        np.load(os.path.join(grid_dir, 'plot_lons.npy'), mmap_mode='r'),
+    )
+    with _loaded_grids_lock:
+        _loaded_grids[grid_key] = model_grid
+    return model_grid
+
+
+def get_model_grid(model_key, grib_message, map_extent, for_console_output=None):
+    """
+    Returns the cached ModelGrid for the grid a GRIB message is on, building the
+    cache files the first time this grid is seen.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    grid_definition = get_grid_definition(grib_message)
+    grid_key = make_grid_key(model_key, grid_definition, map_extent)
+    try:
+        return load_model_grid(grid_key)
+    except FileNotFoundError:
+        pass
+
+    grid_dir = os.path.join(get_grid_cache_dir(), grid_key)
+    _build_grid_files(grid_dir, grib_message, grid_definition, map_extent, for_console_output)
+    return load_model_grid(grid_key)
+
+
+def lon_lats_to_unit_vectors(lons, lats):
+    """(n, 3) unit-sphere vectors for lon/lat arrays, so plain Euclidean nearest-neighbour works on the globe."""
+    lons_rad, lats_rad = np.radians(lons), np.radians(lats)
+    cos_lats = np.cos(lats_rad)
+    return np.column_stack([(cos_lats * np.cos(lons_rad)).ravel(),
+                            (cos_lats * np.sin(lons_rad)).ravel(),
+                            np.sin(lats_rad).ravel()])
+
+
+def get_grid_kdtree(grid_key):
+    """
+    KD-tree over a cached grid's (cropped) points, for nearest-grid-point lookups.
+    Built once per process and grid; point i of the tree is flat index i of the cropped grid.
+    """
+    from scipy.spatial import cKDTree
+
+    with _grid_trees_lock:
+        if grid_key in _grid_trees:
+            return _grid_trees[grid_key]
+
+    model_grid = load_model_grid(grid_key)
+    tree = cKDTree(lon_lats_to_unit_vectors(np.asarray(model_grid.plot_lons), np.asarray(model_grid.plot_lats)))
+    with _grid_trees_lock:
+        _grid_trees[grid_key] = tree
+    return tree
+
+
+def find_nearest_grid_cells(grid_key, lats, lons, max_distance_km=None):
+    """
+    Nearest cropped-grid cell for each lat/lon, in one vectorized KD-tree query.
+    Returns (rows, cols, distances_km) arrays; rows/cols are -1 where no grid point
+    is within max_distance_km (e.g. the point is outside the model domain).
+    """
+    model_grid = load_model_grid(grid_key)
+    tree = get_grid_kdtree(grid_key)
+    distance_bound = np.inf if max_distance_km is None else max_distance_km / EARTH_RADIUS_KM # Chord ~ arc at these distances
+
+    point_vectors = lon_lats_to_unit_vectors(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    chord_distances, flat_indexes = tree.query(point_vectors, distance_upper_bound=distance_bound)
+    found = np.isfinite(chord_distances)
+    rows, cols = np.divmod(np.where(found, flat_indexes, 0), model_grid.plot_lats.shape[1])
+    rows = np.where(found, rows, -1)
+    cols = np.where(found, cols, -1)
+    return rows, cols, np.where(found, chord_distances * EARTH_RADIUS_KM, np.inf)
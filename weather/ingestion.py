@@ -0,0 +1,319 @@
+# weather/ingestion.py
+#
+# Incremental, manifest-driven ingestion of model cycles.
+#
+# Instead of sweeping every forecast hour of a run every few hours, each model
+# cycle gets a ModelCycle row and one ModelFrame row per (param, fhr) plot. A
+# frequent tick asks run_discovery which hours NOMADS has posted, and only the
+# frames that are posted but not yet done get claimed and rendered. A tick with
+# nothing new costs a few HEAD requests and one small query, so plots show up
+# within a poll interval of NOMADS posting them.
+#
+# Frame states: pending -> running -> done | failed. Failed frames are retried
+# on later ticks until MAX_FRAME_ATTEMPTS; running frames whose tick died are
+# reclaimed once they are older than the task timeout (without charging them
+# an attempt: the tick was killed, the frame didn't fail). A tick claims at
+# most get_max_frames_per_tick() frames, so a cold cycle is worked through over
+# several ticks instead of one tick running past the timeout.
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ModelCycle, ModelFrame
+from .grib_processing import MODEL_PLOT_SETTINGS
+from .render_pool import render_model_cycle
+from .cycle_graph import get_cycle_executor, render_model_cycle_dask
+from .run_discovery import discover_latest_model_run
+from .plot_manifest import publish_plot_manifest
+from .field_store import delete_run_fields
+from .model_tiles import delete_run_tiles
+from .plot_output import delete_run_plots
+from .model_loops import delete_run_loop_animations
+from .model_params import get_model_parameters
+from .point_forecast import refresh_location_grid_cells, sample_frames_at_locations, delete_cycle_samples
+
+MAX_FRAME_ATTEMPTS = 3
+DEFAULT_MAX_FRAMES_PER_TICK = 120
+# Stop working on a superseded cycle this long after it was first seen
+CYCLE_EXPIRY_HOURS = 24
+
+
+def get_stale_claim_seconds():
+    """A 'running' frame older than the Django-Q task timeout belongs to a tick that died."""
+    return getattr(settings, 'Q_CLUSTER', {}).get('timeout', 800)
+
+
+def get_max_frames_per_tick():
+    """How many frames one tick claims (settings.MODEL_MAX_FRAMES_PER_TICK), so its renders fit in the task timeout."""
+    return getattr(settings, 'MODEL_MAX_FRAMES_PER_TICK', DEFAULT_MAX_FRAMES_PER_TICK)
+
+
+def sync_cycle_manifest(model_key, run_date_str, run_hour_str, posted_fhrs, parameters_to_plot):
+    """
+    Gets or creates the ModelCycle for a run, records which hours are posted, and
+    makes sure a ModelFrame exists for every (param, fhr) we plot. Returns the cycle.
+    """
+    cycle, created = ModelCycle.objects.get_or_create(
+        model_key=model_key, run_date=run_date_str, run_hour=run_hour_str)
+
+    known_posted_fhrs = set(cycle.posted_fhrs)
+    new_posted_fhrs = [fhr for fhr in posted_fhrs if fhr not in known_posted_fhrs]
+    if new_posted_fhrs:
+        cycle.posted_fhrs = cycle.posted_fhrs + new_posted_fhrs
+        if cycle.status == ModelCycle.STATUS_COMPLETE:
+            cycle.status = ModelCycle.STATUS_ACTIVE
+        cycle.save(update_fields=['posted_fhrs', 'status', 'updated_at'])
+
+    # Also runs for existing cycles so a parameter added to the config gets its frames
+    frames = [
+        ModelFrame(cycle=cycle, param=param_details['output_file_prefix'], fhr=fhr)
+        for fhr in MODEL_PLOT_SETTINGS[model_key]['forecast_hours']
+        for param_details in parameters_to_plot
+    ]
+    ModelFrame.objects.bulk_create(frames, ignore_conflicts=True)
+    return cycle
+
+
+def expire_old_cycles(model_key, newest_cycle=None, for_console_output=None):
+    """
+    Marks cycles that have been superseded for longer than CYCLE_EXPIRY_HOURS as expired
+    and deletes everything kept for them: decoded fields, location samples, plots (stable
+    and content-addressed names), map tiles and loop animations.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    expired_before = timezone.now() - timedelta(hours=CYCLE_EXPIRY_HOURS)
+    stale_cycles = ModelCycle.objects.filter(
+        model_key=model_key, status__in=[ModelCycle.STATUS_ACTIVE, ModelCycle.STATUS_COMPLETE],
+        created_at__lt=expired_before)
+    if newest_cycle is not None:
+        stale_cycles = stale_cycles.exclude(pk=newest_cycle.pk)
+
+    stale_runs = list(stale_cycles.values_list('pk', 'run_date', 'run_hour'))
+    expired_count = stale_cycles.update(status=ModelCycle.STATUS_EXPIRED)
+    if not stale_runs:
+        return expired_count
+
+    # Stop listing the expired runs before their files go (other processes pick it up within MANIFEST_MEMORY_TTL_SECONDS)
+    publish_plot_manifest(model_key, for_console_output)
+    prefixes_by_cycle = {}
+    for cycle_id, prefix in ModelFrame.objects.filter(cycle_id__in=[run[0] for run in stale_runs]).order_by().values_list('cycle_id', 'param').distinct():
+        prefixes_by_cycle.setdefault(cycle_id, []).append(prefix)
+    removed_plots = 0
+    for cycle_id, run_date_str, run_hour_str in stale_runs:
+        delete_run_fields(model_key, run_date_str, run_hour_str)
+        for output_file_prefix in prefixes_by_cycle.get(cycle_id, []):
+            removed_plots += delete_run_plots(output_file_prefix, run_date_str, run_hour_str)
+            delete_run_tiles(output_file_prefix, run_date_str, run_hour_str)
+            delete_run_loop_animations(output_file_prefix, run_date_str, run_hour_str)
+    delete_cycle_samples([cycle_id for cycle_id, _, _ in stale_runs])
+    for_console_output(f"  [ingestion] Expired {len(stale_runs)} {model_key.upper()} cycle(s); removed {removed_plots} plot file(s) and their tiles.")
+    return expired_count
+
+
+def claim_ready_frames(model_key, max_frames=None):
+    """
+    Claims up to max_frames (default get_max_frames_per_tick()) frames of active cycles
+    whose hour is posted and that still need rendering (pending, a retryable failure,
+    or an abandoned claim), oldest cycle and earliest hour first. Claimed frames are set
+    to 'running' so an overlapping tick won't pick them up too; the rest wait for the
+    next tick. Returns a list of (cycle, [frames]).
+    """
+    if max_frames is None:
+        max_frames = get_max_frames_per_tick()
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=get_stale_claim_seconds())
+    active_cycles = {cycle.pk: cycle for cycle in
+                     ModelCycle.objects.filter(model_key=model_key, status=ModelCycle.STATUS_ACTIVE)}
+    # Only hours already posted are worth locking; the rest of a fresh cycle stays free for other workers
+    posted_frames = Q()
+    for cycle in active_cycles.values():
+        if cycle.posted_fhrs:
+            posted_frames |= Q(cycle_id=cycle.pk, fhr__in=list(cycle.posted_fhrs))
+    if not posted_frames:
+        return []
+
+    needs_rendering = (
+        Q(status=ModelFrame.STATUS_PENDING) |
+        Q(status=ModelFrame.STATUS_FAILED, attempts__lt=MAX_FRAME_ATTEMPTS) |
+        Q(status=ModelFrame.STATUS_RUNNING, claimed_at__lt=stale_before)
+    )
+    claimed = {}
+    with transaction.atomic():
+        # Only unfinished frames are loaded, so a tick costs O(new frames) rather than a full sweep
+        candidate_frames = (ModelFrame.objects
+                            .select_for_update(skip_locked=True)
+                            .filter(needs_rendering, posted_frames)
+                            .order_by('cycle_id', 'fhr', 'param')[:max_frames])
+        claimed_frames = []
+        for frame in candidate_frames:
+            if frame.status != ModelFrame.STATUS_RUNNING: # A stale claim's tick was killed; it didn't fail
+                frame.attempts += 1
+            frame.status = ModelFrame.STATUS_RUNNING
+            frame.claimed_at = now
+            frame.updated_at = now # bulk_update() doesn't apply auto_now
+            claimed_frames.append(frame)
+            claimed.setdefault(frame.cycle_id, []).append(frame)
+        if claimed_frames:
+            ModelFrame.objects.bulk_update(claimed_frames, ['status', 'claimed_at', 'attempts', 'updated_at'])
+
+    return [(active_cycles[cycle_id], frames) for cycle_id, frames in claimed.items()]
+
+
+def render_cycle_frames(model_key, run_date_str, model_run_hour_str, fhrs, params, for_console_output):
+    """Runs render_model_cycle() on the render pool, or as a dask graph when the model's executor is 'dask'."""
+    if get_cycle_executor(model_key) == 'dask':
+        try:
+            return render_model_cycle_dask(model_key, run_date_str, model_run_hour_str, fhrs, params, for_console_output)
+        except ImportError as e:
+            for_console_output(f"  WARNING: dask is not available ({e}); rendering {model_key.upper()} on the render pool.")
+    return render_model_cycle(model_key, run_date_str, model_run_hour_str, fhrs, params, for_console_output=for_console_output)
+
+
+def render_claimed_frames(cycle, frames, parameters_to_plot, for_console_output=None):
+    """
+    Renders a cycle's claimed frames on the render pool and records each outcome.
+    Frames are grouped by their set of params so each group is one render_model_cycle() call
+    (normally a single group: every param of each newly posted hour).
+    Returns (done_count, failed_count).
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    params_by_prefix = {param_details['output_file_prefix']: param_details for param_details in parameters_to_plot}
+    frames_by_key = {}
+    params_by_fhr = {}
+    for frame in frames:
+        frames_by_key[(frame.fhr, frame.param)] = frame
+        params_by_fhr.setdefault(frame.fhr, set()).add(frame.param)
+
+    fhrs_by_param_group = {}
+    for fhr, prefixes in params_by_fhr.items():
+        fhrs_by_param_group.setdefault(frozenset(prefixes), []).append(fhr)
+
+    finished_frames = []
+    for prefixes, fhrs in fhrs_by_param_group.items():
+        group_params = [params_by_prefix[prefix] for prefix in prefixes if prefix in params_by_prefix]
+        if group_params:
+            job_results = render_cycle_frames(cycle.model_key, cycle.run_date, cycle.run_hour,
+                                              sorted(fhrs), group_params, for_console_output)
+        else:
+            job_results = []
+
+        for job in job_results:
+            frame = frames_by_key.get((job['fhr'], job['param']))
+            if frame is None:
+                continue
+            frame.status = ModelFrame.STATUS_DONE if job['success'] else ModelFrame.STATUS_FAILED
+            frame.error = '' if job['success'] else (job['error'] or 'Unknown error')
+            if job['image_path']:
+                frame.image_path = os.path.relpath(job['image_path'], settings.MEDIA_ROOT)
+            finished_frames.append(frame)
+
+    # Frames with no result (e.g. param no longer configured) fail rather than stay 'running'
+    finished_ids = {frame.pk for frame in finished_frames}
+    for frame in frames:
+        if frame.pk not in finished_ids:
+            frame.status = ModelFrame.STATUS_FAILED
+            frame.error = 'No render result (parameter not configured?)'
+            finished_frames.append(frame)
+
+    finished_at = timezone.now()
+    for frame in finished_frames:
+        frame.updated_at = finished_at # bulk_update() doesn't apply auto_now
+    ModelFrame.objects.bulk_update(finished_frames, ['status', 'error', 'image_path', 'updated_at'])
+    done_count = sum(1 for frame in finished_frames if frame.status == ModelFrame.STATUS_DONE)
+    return done_count, len(finished_frames) - done_count
+
+
+def update_cycle_status(cycle):
+    """
+    Marks a cycle complete once every hour is posted and no frame can still make progress.
+    Returns True if this call completed it.
+    """
+    all_fhrs_posted = set(MODEL_PLOT_SETTINGS[cycle.model_key]['forecast_hours']) <= set(cycle.posted_fhrs)
+    has_unfinished_frames = cycle.frames.filter(
+        Q(status__in=[ModelFrame.STATUS_PENDING, ModelFrame.STATUS_RUNNING]) |
+        Q(status=ModelFrame.STATUS_FAILED, attempts__lt=MAX_FRAME_ATTEMPTS)
+    ).exists()
+    if all_fhrs_posted and not has_unfinished_frames and cycle.status == ModelCycle.STATUS_ACTIVE:
+        cycle.status = ModelCycle.STATUS_COMPLETE
+        cycle.save(update_fields=['status', 'updated_at'])
+        return True
+    return False
+
+
+def queue_loop_animations(cycle, for_console_output):
+    """Builds the finished cycle's loop animations in a separate Django-Q task (weather/model_loops.py)."""
+    try:
+        from django_q.tasks import async_task
+        async_task('weather.model_loops.build_model_loop_animations', cycle.model_key, cycle.run_date, cycle.run_hour)
+    except Exception as e:
+        for_console_output(f"  WARNING (ingestion): Could not queue loop animations for {cycle.run_date} {cycle.run_hour}Z: {e}")
+
+
+def ingest_model_updates(model_key, parameters_to_plot=None, for_console_output=None):
+    """
+    One ingestion tick for a model: discover posted hours, update the manifest,
+    render only the frames that became ready since the last tick.
+    parameters_to_plot defaults to the model's parameters in the registry (model_params.py).
+    Returns a summary dict (stored by Django-Q as the task result).
+    """
+    if for_console_output is None:
+        for_console_output = print
+    if parameters_to_plot is None:
+        parameters_to_plot = get_model_parameters(model_key)
+    model_name = MODEL_PLOT_SETTINGS[model_key]['display_name']
+
+    discovery = discover_latest_model_run(model_key, for_console_output, use_cache=False) # A tick always wants a fresh look
+    newest_cycle = None
+    if discovery:
+        newest_cycle = sync_cycle_manifest(model_key, discovery['run_date'], discovery['run_hour'],
+                                           discovery['available_fhrs'], parameters_to_plot)
+        latest_complete_run = discovery.get('latest_complete_run')
+        if latest_complete_run and latest_complete_run != (discovery['run_date'], discovery['run_hour']):
+            # The previous cycle finished posting; let a tracked one pick up its last hours
+            previous_cycle = ModelCycle.objects.filter(
+                model_key=model_key, run_date=latest_complete_run[0], run_hour=latest_complete_run[1]).first()
+            if previous_cycle is not None:
+                sync_cycle_manifest(model_key, previous_cycle.run_date, previous_cycle.run_hour,
+                                    MODEL_PLOT_SETTINGS[model_key]['forecast_hours'], parameters_to_plot)
+    else:
+        for_console_output(f"  WARNING (ingestion): Could not discover a {model_name} cycle; only retrying known frames.")
+    expire_old_cycles(model_key, newest_cycle, for_console_output)
+
+    summary = {'model': model_key, 'run': None, 'claimed': 0, 'done': 0, 'failed': 0}
+    if newest_cycle is not None:
+        summary['run'] = f"{newest_cycle.run_date}{newest_cycle.run_hour}"
+
+    completed_cycles = []
+    for cycle, frames in claim_ready_frames(model_key):
+        for_console_output(f"  [ingestion] {model_name} {cycle.run_date} {cycle.run_hour}Z: {len(frames)} new frame(s) to render.")
+        done_count, failed_count = render_claimed_frames(cycle, frames, parameters_to_plot, for_console_output)
+        summary['claimed'] += len(frames)
+        summary['done'] += done_count
+        summary['failed'] += failed_count
+        if done_count:
+            try:
+                sample_frames_at_locations(cycle, frames, for_console_output)
+            except Exception as e:
+                for_console_output(f"  WARNING (ingestion): Could not sample saved locations: {e}")
+        if update_cycle_status(cycle):
+            completed_cycles.append(cycle)
+
+    if summary['claimed'] == 0:
+        for_console_output(f"  [ingestion] {model_name}: no newly posted frames.")
+    else:
+        publish_plot_manifest(model_key, for_console_output)
+        try:
+            # New grids (or locations saved since the last tick) get their cells now rather than on first request
+            refresh_location_grid_cells(model_key, for_console_output)
+        except Exception as e:
+            for_console_output(f"  WARNING (ingestion): Could not refresh location grid cells: {e}")
+        for cycle in completed_cycles:
+            queue_loop_animations(cycle, for_console_output)
+    return summary
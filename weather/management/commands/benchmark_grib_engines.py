@@ -0,0 +1,194 @@
+# weather/management/commands/benchmark_grib_engines.py
+#
+# Compares the pygrib and cfgrib decode engines (grib_processing.decode_grib_file)
+# on fixture GRIB files, so each model can be set to the faster one
+# (MODEL_PLOT_SETTINGS[model]['decode_engine'] / settings.MODEL_DECODE_ENGINES).
+#
+# Fixtures are ordinary GRIB2 files, by default weather/test_data/grib/<model>/*.grb2.
+# The committed ones are synthetic: one smooth field per decoded parameter, on the
+# model's real grid (--generate rewrites them, e.g. after adding a parameter).
+# They decode exactly like NOMADS files but compress far better, so timings are
+# on the low side; --fetch saves the current run's real subset next to them.
+#
+# Memory is the peak RSS growth of a fresh process doing one decode, which
+# unlike tracemalloc includes eccodes' own C allocations.
+import glob
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from weather.grib_fetch import download_grib_file
+from weather.grib_processing import (MODEL_PLOT_SETTINGS, DECODE_ENGINES, decode_grib_file, format_model_forecast_hour,
+                                     get_latest_gfs_rundate_and_hour, get_latest_nam_rundate_and_hour)
+from weather.model_params import get_grib_parameters, get_param_selector
+
+LATEST_RUN_FUNCTIONS = {'gfs': get_latest_gfs_rundate_and_hour, 'nam': get_latest_nam_rundate_and_hour}
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'test_data', 'grib')
+
+# Grid of each model's fixture: the grid the configured NOMADS product is on
+FIXTURE_GRIDS = {
+    'gfs': { # 0.25 degree global (pgrb2.0p25)
+        'gridDefinitionTemplateNumber': 0,
+        'Ni': 1440, 'Nj': 721,
+        'latitudeOfFirstGridPointInDegrees': 90.0, 'longitudeOfFirstGridPointInDegrees': 0.0,
+        'latitudeOfLastGridPointInDegrees': -90.0, 'longitudeOfLastGridPointInDegrees': 359.75,
+        'iDirectionIncrementInDegrees': 0.25, 'jDirectionIncrementInDegrees': 0.25,
+    },
+    'nam': { # 12 km CONUS Lambert conformal (awphys, grid 218)
+        'gridDefinitionTemplateNumber': 30,
+        'Nx': 614, 'Ny': 428,
+        'latitudeOfFirstGridPointInDegrees': 12.19, 'longitudeOfFirstGridPointInDegrees': 226.541,
+        'LaDInDegrees': 25.0, 'LoVInDegrees': 265.0, 'Latin1InDegrees': 25.0, 'Latin2InDegrees': 25.0,
+        'DxInMetres': 12191.0, 'DyInMetres': 12191.0, 'iScansNegatively': 0, 'jScansPositively': 1,
+    },
+}
+FIXTURE_BITS_PER_VALUE = 8
+
+
+def get_fixture_dir(model_key):
+    return os.path.join(FIXTURE_DIR, model_key)
+
+
+def get_default_fixture_path(model_key):
+    return os.path.join(get_fixture_dir(model_key), f"{model_key}_synthetic.grb2")
+
+
+def write_synthetic_fixture(model_key, fixture_path):
+    """Writes one GRIB2 message per decoded parameter of a model, matching its selector, on FIXTURE_GRIDS[model_key]."""
+    import eccodes
+    import numpy as np
+
+    os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+    with open(fixture_path, 'wb') as f:
+        for message_number, param_details in enumerate(get_grib_parameters(model_key)):
+            criteria = get_param_selector(param_details)['criteria']
+            handle = eccodes.codes_grib_new_from_samples('GRIB2')
+            try:
+                eccodes.codes_set(handle, 'centre', 7) # NCEP, whose local tables define refc, ltng, ...
+                for key, value in FIXTURE_GRIDS[model_key].items():
+                    eccodes.codes_set(handle, key, value)
+                # typeOfLevel and shortName are eccodes concepts: setting them sets the underlying product keys
+                eccodes.codes_set(handle, 'typeOfLevel', criteria['typeOfLevel'])
+                for key in ('level', 'topLevel', 'bottomLevel'):
+                    if key in criteria:
+                        eccodes.codes_set(handle, key, criteria[key])
+                eccodes.codes_set(handle, 'shortName', criteria['shortName'])
+
+                is_lat_lon = FIXTURE_GRIDS[model_key]['gridDefinitionTemplateNumber'] == 0
+                ny = eccodes.codes_get(handle, 'Nj' if is_lat_lon else 'Ny')
+                nx = eccodes.codes_get(handle, 'Ni' if is_lat_lon else 'Nx')
+                rows, cols = np.mgrid[0:ny, 0:nx]
+                values = np.sin(cols / 300.0 + message_number) * np.cos(rows / 200.0) * 50 + 280
+                eccodes.codes_set(handle, 'bitsPerValue', FIXTURE_BITS_PER_VALUE)
+                eccodes.codes_set_values(handle, values.ravel())
+                eccodes.codes_set(handle, 'packingType', 'grid_complex_spatial_differencing') # What NCEP uses
+                eccodes.codes_write(handle, f)
+            finally:
+                eccodes.codes_release(handle)
+
+
+def get_peak_rss_bytes():
+    """
+    This process's peak resident set size. On Linux that's VmHWM, which starts over
+    with each new program; ru_maxrss would carry over the peak of the process that
+    started us (it survives fork and exec). ru_maxrss is KB on Linux, bytes on macOS.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def measure_decode_peak_rss(model_key, grib_file, engine):
+    """
+    Runs in a fresh (spawned) process: peak RSS growth, in bytes, of one decode of grib_file.
+    The baseline is taken after importing the engine, so only the decode itself is counted.
+    """
+    import django
+    django.setup()
+    from weather.grib_processing import decode_grib_file
+    if engine == 'cfgrib':
+        import cfgrib, xarray # noqa: F401
+    else:
+        import pygrib # noqa: F401
+
+    baseline = get_peak_rss_bytes()
+    decode_grib_file(model_key, grib_file, get_grib_parameters(model_key), engine=engine,
+                     for_console_output=lambda *args, **kwargs: None)
+    return get_peak_rss_bytes() - baseline
+
+
+class Command(BaseCommand):
+    help = 'Times the pygrib and cfgrib engines decoding every configured parameter from fixture GRIB files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(MODEL_PLOT_SETTINGS), help='Model whose parameters to decode.')
+        parser.add_argument('files', nargs='*', help='GRIB files to decode. Default: every .grb2 in weather/test_data/grib/<model>/.')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per engine and file (after one warm-up run).')
+        parser.add_argument('--engines', nargs='+', choices=DECODE_ENGINES, default=list(DECODE_ENGINES))
+        parser.add_argument('--generate', action='store_true', help="First rewrite the model's synthetic fixture.")
+        parser.add_argument('--fetch', action='store_true', help="First save the latest run's subset as a fixture.")
+        parser.add_argument('--fhr', type=str, default='06', help='Forecast hour for --fetch (default 06).')
+
+    def handle(self, *args, **options):
+        model_key = options['model']
+        param_details_list = get_grib_parameters(model_key)
+
+        if options['generate']:
+            fixture_path = get_default_fixture_path(model_key)
+            write_synthetic_fixture(model_key, fixture_path)
+            self.stdout.write(self.style.SUCCESS(f"Wrote fixture {fixture_path}"))
+        if options['fetch']:
+            self._fetch_fixture(model_key, options['fhr'], param_details_list)
+
+        grib_files = options['files'] or sorted(glob.glob(os.path.join(get_fixture_dir(model_key), '*.grb2')))
+        if not grib_files:
+            raise CommandError(f"No fixture files. Pass some, or use --generate or --fetch to save one in {get_fixture_dir(model_key)}.")
+
+        quiet = lambda *args, **kwargs: None
+        spawn_context = multiprocessing.get_context('spawn') # A fresh interpreter, so its RSS is the decode's alone
+        for grib_file in grib_files:
+            self.stdout.write(self.style.NOTICE(f"{os.path.basename(grib_file)} ({os.path.getsize(grib_file) / 1024:.0f} KB)"))
+            for engine in options['engines']:
+                # Warm-up: builds the grid cache and imports the engine, which every real decode reuses
+                fields = decode_grib_file(model_key, grib_file, param_details_list, engine=engine, for_console_output=quiet)
+                decoded_count = sum(1 for field in fields.values() if field is not None)
+
+                durations = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    decode_grib_file(model_key, grib_file, param_details_list, engine=engine, for_console_output=quiet)
+                    durations.append(time.perf_counter() - started)
+
+                with spawn_context.Pool(1) as pool:
+                    peak_rss = pool.apply(measure_decode_peak_rss, (model_key, grib_file, engine))
+
+                self.stdout.write(f"  {engine:7s} {decoded_count}/{len(param_details_list)} params  "
+                                  f"median {statistics.median(durations) * 1000:8.1f} ms  "
+                                  f"min {min(durations) * 1000:8.1f} ms  "
+                                  f"peak RSS +{peak_rss / 1024 / 1024:7.1f} MB")
+
+    def _fetch_fixture(self, model_key, fhr, param_details_list):
+        try:
+            current_fhr_fmt = format_model_forecast_hour(model_key, fhr)
+        except ValueError as e:
+            raise CommandError(str(e))
+        run_date_str, model_run_hour_str = LATEST_RUN_FUNCTIONS[model_key](self.stdout.write)
+        model_settings = MODEL_PLOT_SETTINGS[model_key]
+        grib_url = model_settings['url_template'].format(run_date=run_date_str, run_hour=model_run_hour_str, fhr=current_fhr_fmt)
+
+        os.makedirs(get_fixture_dir(model_key), exist_ok=True)
+        fixture_path = os.path.join(get_fixture_dir(model_key), f"{model_key}_{run_date_str}_{model_run_hour_str}z_f{current_fhr_fmt}.grb2")
+        download_grib_file(grib_url, param_details_list, fixture_path, timeout=model_settings['download_timeout'],
+                           for_console_output=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Saved fixture {fixture_path}"))
@@ -0,0 +1,149 @@
+# weather/management/commands/scan_grib_messages.py
+#
+# Opt-in diagnostic for finding a parameter's GRIB selection keys.
+# Production decoding jumps straight to each message using the .idx inventory
+# (see grib_fetch.py); this command does the slow full-file keyword scan that
+# used to run on every NAM frame.
+import os
+import tempfile
+
+import pygrib
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from weather.grib_fetch import fetch_grib_idx, find_idx_entries_for_param
+from weather.grib_processing import MODEL_PLOT_SETTINGS, get_latest_gfs_rundate_and_hour, get_latest_nam_rundate_and_hour, format_model_forecast_hour
+from weather.model_params import MODEL_PARAMETERS, get_grib_parameters
+LATEST_RUN_FUNCTIONS = {'gfs': get_latest_gfs_rundate_and_hour, 'nam': get_latest_nam_rundate_and_hour}
+
+
+def log_grib_keyword_matches(grbs, param_details, for_console_output=None):
+    """
+    Debug helper: lists every message in an open pygrib file whose name/shortName
+    matches keywords for the parameter (used to find the right NAM selection keys).
+    Rewinds the file afterwards.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    current_search_parameter_name = param_details.get('plot_title_param_name', 'Unknown Parameter')
+    # Adjust these keyword lists based on the specific parameter you are trying to find in tasks.py!
+    if "Dew Point" in current_search_parameter_name:
+        keywords_to_search = ['dewpoint', 'dew point', 'dpt', '2d', 'd2m']
+    elif "Helicity" in current_search_parameter_name: # Catches both SRH and UPHL if UPHL title has "Helicity"
+        keywords_to_search = ['helicity', 'srh', 'hlcy', 'storm relative', 'uphl', 'updraft']
+    elif "Lightning" in current_search_parameter_name:
+        keywords_to_search = ['ltng', 'lightning']
+    else:
+        for_console_output(f"    --- No keywords specified for '{current_search_parameter_name}'; full GRIB scan for matches skipped. ---")
+        return
+
+    for_console_output(f"    --- Searching ALL GRIB Messages for relevant keywords for '{current_search_parameter_name}' ---")
+    keys_to_print = [
+        'name', 'shortName', 'paramId', 'units',
+        'level', 'typeOfLevel', 'levelName',
+        'topLevel', 'bottomLevel',
+        'discipline', 'parameterCategory', 'parameterNumber',
+        'forecastTime', 'stepType', 'stepRange'
+    ]
+    found_potential_matches = False
+    for i, msg_debug in enumerate(grbs):
+        msg_name_lower = msg_debug.name.lower() if isinstance(getattr(msg_debug, 'name', None), str) else ""
+        msg_short_name_lower = msg_debug.shortName.lower() if isinstance(getattr(msg_debug, 'shortName', None), str) else ""
+        if not any(keyword in msg_name_lower or keyword in msg_short_name_lower for keyword in keywords_to_search):
+            continue
+
+        found_potential_matches = True
+        details = []
+        for key_to_print in keys_to_print:
+            try:
+                val = msg_debug[key_to_print] # pygrib messages support GRIB key access like a dict
+                value_str = f"{key_to_print}='{val}'" if val is not None else f"{key_to_print}=None (explicitly)"
+            except RuntimeError as e_grib:
+                if "Key/value not found" in str(e_grib):
+                    value_str = f"{key_to_print}=N/A (key not found)"
+                else:
+                    value_str = f"{key_to_print}=ERROR_Runtime({e_grib})"
+            except KeyError:
+                value_str = f"{key_to_print}=N/A (KeyError)"
+            except Exception as e_other:
+                value_str = f"{key_to_print}=ERROR_Other({e_other})"
+            details.append(value_str)
+        for_console_output(f"    Potential Match (Msg Index {i+1}/{len(grbs)}): " + ", ".join(details))
+
+    if not found_potential_matches:
+        for_console_output(f"    --- No GRIB messages found matching specified keywords {keywords_to_search} in the entire file. ---")
+    grbs.seek(0) # IMPORTANT: Rewind the GRIB file iterator for the actual grbs.select() call
+
+
+class Command(BaseCommand):
+    help = ('Downloads a whole GFS/NAM GRIB file and lists the messages that look like each configured parameter, '
+            'plus what the .idx inventory resolves it to. Slow; for debugging parameter configs only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(MODEL_PARAMETERS), help='Model to scan.')
+        parser.add_argument('--fhr', type=str, default='06', help='Forecast hour (default 06).')
+        parser.add_argument('--param', type=str, default=None,
+                            help='Only this output_file_prefix (e.g. nam_srh_3km). Default: every configured parameter.')
+        parser.add_argument('--file', type=str, default=None,
+                            help='Scan a local GRIB file instead of downloading the latest run.')
+
+    def handle(self, *args, **options):
+        model_key = options['model']
+        param_details_list = [param_details for param_details in get_grib_parameters(model_key)
+                              if options['param'] in (None, param_details['output_file_prefix'])]
+        if not param_details_list:
+            raise CommandError(f"No {model_key.upper()} parameter with prefix '{options['param']}'.")
+
+        local_grib_filename = options['file']
+        downloaded = False
+        if local_grib_filename is None:
+            try:
+                current_fhr_fmt = format_model_forecast_hour(model_key, options['fhr'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            run_date_str, model_run_hour_str = LATEST_RUN_FUNCTIONS[model_key](self.stdout.write)
+            grib_url = MODEL_PLOT_SETTINGS[model_key]['url_template'].format(run_date=run_date_str, run_hour=model_run_hour_str, fhr=current_fhr_fmt)
+            self._log_idx_resolution(grib_url, param_details_list)
+
+            temp_grib_dir = os.path.join(settings.MEDIA_ROOT, 'grib_temp')
+            os.makedirs(temp_grib_dir, exist_ok=True)
+            temp_fd, local_grib_filename = tempfile.mkstemp(prefix=f"scan_{model_key}_", suffix='.grb2', dir=temp_grib_dir)
+            os.close(temp_fd)
+            downloaded = True
+            self.stdout.write(f"Downloading {grib_url} ...")
+            try:
+                response = requests.get(grib_url, stream=True, timeout=MODEL_PLOT_SETTINGS[model_key]['download_timeout'])
+                response.raise_for_status()
+                with open(local_grib_filename, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=8192*4):
+                        f.write(chunk)
+            except requests.exceptions.RequestException as e:
+                os.remove(local_grib_filename)
+                raise CommandError(f"Download failed: {e}")
+
+        try:
+            grbs = pygrib.open(local_grib_filename)
+            try:
+                for param_details in param_details_list:
+                    log_grib_keyword_matches(grbs, param_details, self.stdout.write)
+            finally:
+                grbs.close()
+        finally:
+            if downloaded and os.path.exists(local_grib_filename):
+                os.remove(local_grib_filename)
+
+    def _log_idx_resolution(self, grib_url, param_details_list):
+        idx_entries = fetch_grib_idx(grib_url, self.stdout.write)
+        if not idx_entries:
+            return
+        for param_details in param_details_list:
+            param_entries = find_idx_entries_for_param(idx_entries, param_details)
+            if param_entries:
+                entry = param_entries[0]
+                self.stdout.write(self.style.SUCCESS(
+                    f"{param_details['output_file_prefix']}: .idx message {entry['message_number']} "
+                    f"({entry['variable']}:{entry['level']}) at byte {entry['start_byte']}"))
+            else:
+                self.stdout.write(self.style.WARNING(f"{param_details['output_file_prefix']}: no .idx entry found"))
@@ -0,0 +1,215 @@
+# weather/map_templates.py
+#
+# Cached, reusable map figures for model plots.
+#
+# Building a cartopy map (projecting and drawing the Natural Earth land, ocean,
+# coastline, border and state shapes) costs far more than drawing the model
+# field itself, and every frame of a cycle uses the exact same map. A
+# MapTemplate builds the figure once per worker, draws the basemap layers once
+# and keeps them as two pre-rendered images (an underlay below the data and a
+# line overlay above it). Rendering a frame then only adds the data mesh,
+# colorbar and title, saves, and removes them again, so memory stays flat
+# across a 300-frame cycle.
+#
+# The data mesh is cached too (GridMesh, one per grid per template): the grid's
+# coordinates are projected to the map projection once instead of cartopy's
+# pcolormesh re-projecting them every frame, and the triangle geometry Agg
+# draws a gouraud mesh with is built on the first draw and reused. A frame
+# only sets the mesh's values, colormap and color limits.
+import threading
+
+import numpy as np
+from matplotlib.collections import QuadMesh
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+
+from .plot_output import save_figure_atomically
+
+FIGURE_SIZE_INCHES = (12, 9)
+FIGURE_DPI = 150
+# Fixed layout (figure fractions) so the map area never moves between frames
+MAP_AXES_RECT = [0.03, 0.17, 0.94, 0.76]
+COLORBAR_AXES_RECT = [0.185, 0.10, 0.63, 0.022] # ~shrink=0.7, aspect=30 of the map width
+
+_thread_local_templates = threading.local()
+
+
+class GridMesh(QuadMesh):
+    """
+    A gouraud-shaded QuadMesh on one model grid, in map projection coordinates, that
+    every frame on that grid reuses. Its triangle vertices only depend on the grid,
+    so they're computed on the first draw and kept; each draw only recomputes colors.
+    """
+
+    def __init__(self, projected_coordinates):
+        super().__init__(projected_coordinates, shading='gouraud', edgecolors='none', zorder=1)
+        self._triangles_source = None
+        self._triangles = None
+
+    def _get_triangles(self, coordinates):
+        # draw() passes self._coordinates unchanged under an affine transform (ours), so this builds once
+        if coordinates is not self._triangles_source:
+            p = np.ma.getdata(coordinates)
+            p_a, p_b, p_c, p_d = p[:-1, :-1], p[:-1, 1:], p[1:, 1:], p[1:, :-1]
+            p_center = (p_a + p_b + p_c + p_d) / 4.0
+            self._triangles = np.concatenate([
+                p_a, p_b, p_center,
+                p_b, p_c, p_center,
+                p_c, p_d, p_center,
+                p_d, p_a, p_center,
+            ], axis=2).reshape((-1, 3, 2))
+            self._triangles_source = coordinates
+        return self._triangles
+
+    def _convert_mesh_to_triangles(self, coordinates):
+        """Matplotlib's QuadMesh._convert_mesh_to_triangles with the vertex half cached."""
+        triangles = self._get_triangles(coordinates)
+        c = self.get_facecolor().reshape((*coordinates.shape[:2], 4))
+        z = self.get_array()
+        if np.ma.is_masked(z):
+            c[z.mask, 3] = np.nan
+        c_a, c_b, c_c, c_d = c[:-1, :-1], c[:-1, 1:], c[1:, 1:], c[1:, :-1]
+        c_center = (c_a + c_b + c_c + c_d) / 4.0
+        colors = np.concatenate([
+            c_a, c_b, c_center,
+            c_b, c_c, c_center,
+            c_c, c_d, c_center,
+            c_d, c_a, c_center,
+        ], axis=2).reshape((-1, 3, 4))
+        drawn = ~np.isnan(colors[..., 2, 3]) # Triangles touching a missing value are left out
+        if drawn.all():
+            return triangles, colors
+        return triangles[drawn], colors[drawn]
+
+
+class MapTemplate:
+    """A prebuilt CONUS map figure for one model that frames are drawn onto."""
+
+    def __init__(self, map_extent, land_facecolor, watermark_text, watermark_alpha):
+        self.map_extent = map_extent
+        self.data_crs = ccrs.PlateCarree()
+
+        # Plain Figure + Agg canvas (no pyplot) so templates in different threads don't share state
+        self.fig = Figure(figsize=FIGURE_SIZE_INCHES, dpi=FIGURE_DPI)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_axes(MAP_AXES_RECT, projection=ccrs.PlateCarree())
+        self.ax.set_extent(map_extent, crs=self.data_crs)
+        self.cax = self.fig.add_axes(COLORBAR_AXES_RECT)
+        self._grid_meshes = {} # grid_key -> GridMesh
+
+        self.fig.text(0.98, 0.02, watermark_text, fontsize=20, color='black', alpha=watermark_alpha,
+                      ha='right', va='bottom', transform=self.fig.transFigure, zorder=10)
+
+        self._rasterize_basemap(land_facecolor)
+
+    def _grab_map_pixels(self):
+        """Copies the map area out of the last canvas draw as an RGBA array."""
+        buffer = np.asarray(self.canvas.buffer_rgba())
+        bbox = self.ax.get_window_extent()
+        canvas_height = buffer.shape[0]
+        row_start = int(round(canvas_height - bbox.y1))
+        row_end = int(round(canvas_height - bbox.y0))
+        col_start = int(round(bbox.x0))
+        col_end = int(round(bbox.x1))
+        return buffer[row_start:row_end, col_start:col_end].copy()
+
+    def _rasterize_basemap(self, land_facecolor):
+        """Draws the Natural Earth layers once and swaps them for two static images."""
+        underlay_features = [
+            self.ax.add_feature(cfeature.LAND, facecolor=land_facecolor, edgecolor='gray', zorder=0),
+            self.ax.add_feature(cfeature.OCEAN, facecolor='lightblue', edgecolor='silver', zorder=0),
+        ]
+        overlay_features = [
+            self.ax.add_feature(cfeature.COASTLINE, linewidth=0.8, edgecolor='black', zorder=2),
+            self.ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.6, edgecolor='black', zorder=2),
+            self.ax.add_feature(cfeature.STATES, linestyle=':', linewidth=0.6, edgecolor='darkgray', zorder=2),
+        ]
+        self.cax.set_visible(False)
+
+        # Pass 1: land/ocean fill only
+        for artist in overlay_features:
+            artist.set_visible(False)
+        self.canvas.draw()
+        underlay_pixels = self._grab_map_pixels()
+
+        # Pass 2: coastline/border/state lines only, on a transparent background
+        for artist in underlay_features:
+            artist.set_visible(False)
+        for artist in overlay_features:
+            artist.set_visible(True)
+        self.fig.patch.set_alpha(0)
+        self.ax.patch.set_visible(False)
+        self.canvas.draw()
+        overlay_pixels = self._grab_map_pixels()
+
+        self.fig.patch.set_alpha(1)
+        self.ax.patch.set_visible(True)
+        for artist in underlay_features + overlay_features:
+            artist.remove()
+        self.cax.set_visible(True)
+
+        image_kwargs = {'extent': self.map_extent, 'transform': self.data_crs, 'origin': 'upper', 'interpolation': 'nearest'}
+        self.ax.imshow(underlay_pixels, zorder=0, **image_kwargs)
+        self.ax.imshow(overlay_pixels, zorder=2, **image_kwargs)
+        self.ax.set_extent(self.map_extent, crs=self.data_crs) # imshow resets the limits
+
+    def get_grid_mesh(self, grid_key, lons, lats):
+        """The template's GridMesh for a grid, projecting lons/lats the first time the grid is seen."""
+        if grid_key not in self._grid_meshes:
+            projected = self.ax.projection.transform_points(self.data_crs, np.asarray(lons, dtype=np.float64),
+                                                            np.asarray(lats, dtype=np.float64))
+            mesh = GridMesh(np.ascontiguousarray(projected[..., :2]))
+            mesh.set_visible(False)
+            self.ax.add_collection(mesh, autolim=False)
+            self._grid_meshes[grid_key] = mesh
+        return self._grid_meshes[grid_key]
+
+    def render_frame(self, grid_key, lons, lats, values, title, colorbar_label, output_image_full_path,
+                     plot_cmap='jet', plot_levels=None):
+        """
+        Draws one data field on grid grid_key (coordinates lons/lats) onto the template, saves it
+        (atomically, see plot_output.py), then hides it again. Returns the plot's content-addressed path.
+        """
+        colorbar_kwargs = {'orientation': 'horizontal', 'label': colorbar_label}
+        vmin = vmax = None # Scaled to the data
+        if plot_levels is not None and hasattr(plot_levels, '__len__') and len(plot_levels) > 0:
+            vmin, vmax = plot_levels[0], plot_levels[-1]
+            colorbar_kwargs['extend'] = 'both'
+
+        mesh = self.get_grid_mesh(grid_key, lons, lats)
+        mesh.set_cmap(plot_cmap)
+        mesh.set_norm(Normalize(vmin=vmin, vmax=vmax))
+        mesh.set_array(np.ma.masked_invalid(values)) # As pcolormesh does: missing values aren't drawn
+        mesh.set_visible(True)
+        try:
+            cb = self.fig.colorbar(mesh, cax=self.cax, **colorbar_kwargs)
+            cb.ax.tick_params(labelsize=8)
+            self.ax.set_title(title, fontsize=12)
+            return save_figure_atomically(self.fig, output_image_full_path, bbox_inches='tight', pad_inches=0.1, dpi=FIGURE_DPI)
+        finally:
+            mesh.set_visible(False)
+            if getattr(mesh, 'colorbar', None) is not None: # The next frame's colorbar shouldn't hear from this one
+                mesh.callbacks.disconnect(mesh.colorbar_cid)
+                mesh.colorbar = None
+            mesh.set_array(None)
+            self.cax.clear()
+            self.ax.set_title('')
+
+
+def get_map_template(model_key, model_settings):
+    """Returns this worker's (thread's) cached MapTemplate for a model, building it on first use."""
+    templates = getattr(_thread_local_templates, 'templates', None)
+    if templates is None:
+        templates = _thread_local_templates.templates = {}
+
+    if model_key not in templates:
+        templates[model_key] = MapTemplate(
+            model_settings['map_extent'],
+            model_settings['land_facecolor'],
+            model_settings['watermark_text'],
+            model_settings['watermark_alpha'],
+        )
+    return templates[model_key]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelCycle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_key', models.CharField(db_index=True, max_length=10)),
+                ('run_date', models.CharField(max_length=8)),
+                ('run_hour', models.CharField(max_length=2)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('complete', 'Complete'), ('expired', 'Expired')], db_index=True, default='active', max_length=10)),
+                ('posted_fhrs', models.JSONField(blank=True, default=list, help_text='Forecast hours seen on NOMADS so far.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-run_date', '-run_hour'],
+                'constraints': [models.UniqueConstraint(fields=('model_key', 'run_date', 'run_hour'), name='unique_model_cycle')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ModelFrame',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('param', models.CharField(max_length=50)),
+                ('fhr', models.CharField(max_length=3)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('image_path', models.CharField(blank=True, default='', max_length=255)),
+                ('error', models.TextField(blank=True, default='')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='frames', to='weather.modelcycle')),
+            ],
+            options={
+                'ordering': ['cycle', 'fhr', 'param'],
+                'constraints': [models.UniqueConstraint(fields=('cycle', 'param', 'fhr'), name='unique_model_frame')],
+            },
+        ),
+    ]
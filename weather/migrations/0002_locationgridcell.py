@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_userlocationhistory'),
+        ('weather', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationGridCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grid_key', models.CharField(db_index=True, max_length=100)),
+                ('row', models.IntegerField()),
+                ('col', models.IntegerField()),
+                ('distance_km', models.FloatField(blank=True, null=True)),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grid_cells', to='accounts.savedlocation')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('location', 'grid_key'), name='unique_location_grid_cell')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_userlocationhistory'),
+        ('weather', '0002_locationgridcell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationForecastValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('param', models.CharField(max_length=50)),
+                ('fhr', models.PositiveSmallIntegerField()),
+                ('valid_time', models.DateTimeField()),
+                ('value', models.FloatField()),
+                ('cycle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_values', to='weather.modelcycle')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecast_values', to='accounts.savedlocation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['param', 'valid_time'], name='location_value_param_time')],
+                'constraints': [models.UniqueConstraint(fields=('location', 'cycle', 'param', 'fhr'), name='unique_location_forecast_value')],
+            },
+        ),
+    ]
@@ -0,0 +1,165 @@
+# weather/model_loops.py
+#
+# Whole-loop responses for the model pages.
+#
+# Scrubbing the forecast slider used to cost one API request (and one
+# subscription check) per frame. build_model_loop() answers with every forecast
+# hour of a parameter's newest run at once, straight from the plot manifest, so
+# the page can prefetch the loop and animate it locally. Optionally the frames
+# can also be packed into one animated WebP, kept under MEDIA_ROOT/model_loops.
+# Encoding one means decoding every full-size frame, far too slow for a
+# request, so build_model_loop_animations runs as a Django-Q task once a cycle
+# completes (weather/ingestion.py) and views only hand out files that exist.
+import os
+import glob
+import hashlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone as django_utils_tz
+
+from .grib_processing import MODEL_PLOT_SETTINGS
+from .plot_manifest import get_plot_manifest, get_param_timeline
+from .model_params import get_model_parameters
+
+LOOP_ANIMATION_FRAME_MS = 500
+LOOP_ANIMATION_MAX_WIDTH = 1024 # Full size plots make a very large animation; scale them down
+LOOP_ANIMATION_QUALITY = 70
+
+
+def build_model_loop(model_key, output_file_prefix):
+    """
+    Returns the loop for a param's newest run:
+        {'run', 'run_datetime_utc', 'formatted_run_time_local', 'etag',
+         'frames': [{'fhr', 'available', 'image_url', 'image_path', 'etag', 'tile_url_template',
+                     'valid_time_utc', 'formatted_valid_time_local'}, ...]}
+    with one entry per configured forecast hour (available=False for hours not rendered yet).
+    """
+    run, rendered_frames = get_param_timeline(get_plot_manifest(model_key), output_file_prefix)
+    if run is None:
+        return {'run': None, 'run_datetime_utc': None, 'formatted_run_time_local': "Run: N/A", 'etag': 'empty', 'frames': []}
+
+    run_datetime_utc = datetime.fromisoformat(run['run_datetime_utc'])
+    rendered_by_fhr = {int(frame['fhr']): frame for frame in rendered_frames}
+    frames = []
+    for fhr in MODEL_PLOT_SETTINGS[model_key]['forecast_hours']:
+        valid_dt_utc = run_datetime_utc + timedelta(hours=int(fhr))
+        rendered_frame = rendered_by_fhr.get(int(fhr))
+        frames.append({
+            'fhr': fhr,
+            'available': rendered_frame is not None,
+            'image_url': rendered_frame['image_url'] if rendered_frame else None,
+            'image_path': rendered_frame['image_path'] if rendered_frame else None,
+            'etag': rendered_frame['etag'] if rendered_frame else None,
+            'tile_url_template': rendered_frame.get('tile_url_template') if rendered_frame else None,
+            'valid_time_utc': valid_dt_utc.isoformat(),
+            'formatted_valid_time_local': django_utils_tz.localtime(valid_dt_utc).strftime("%b %d, %-I:%M %p %Z"),
+        })
+
+    loop_etag = hashlib.sha1(
+        ":".join([run['run_datetime_utc']] + [frame['etag'] or '-' for frame in frames]).encode('utf-8')
+    ).hexdigest()[:16]
+    return {
+        'run': f"{run['run_date']} {run['run_hour']}Z",
+        'run_datetime_utc': run['run_datetime_utc'],
+        'formatted_run_time_local': django_utils_tz.localtime(run_datetime_utc).strftime("%b %d, %Y, %-I:%M %p %Z"),
+        'etag': loop_etag,
+        'frames': frames,
+    }
+
+
+def get_loop_animation_path(output_file_prefix, loop):
+    """
+    (file path, MEDIA_URL) of the loop's animated WebP. Named after the loop's ETag,
+    so a re-rendered or newly posted frame gives a new file.
+    """
+    run_label = loop['run'].replace(' ', '_').lower()
+    animation_name = f"{output_file_prefix}_{run_label}_{loop['etag']}.webp"
+    return (os.path.join(settings.MEDIA_ROOT, 'model_loops', animation_name),
+            settings.MEDIA_URL + f"model_loops/{animation_name}")
+
+
+def delete_run_loop_animations(output_file_prefix, run_date_str, model_run_hour_str):
+    """Removes every loop animation of a param's run (used when the ingestion expires a cycle)."""
+    run_animation_name = f"{output_file_prefix}_{run_date_str}_{model_run_hour_str}z_"
+    for animation_path in glob.glob(os.path.join(settings.MEDIA_ROOT, 'model_loops', glob.escape(run_animation_name) + '*.webp')):
+        try:
+            os.remove(animation_path)
+        except FileNotFoundError:
+            pass
+
+
+def get_loop_animation_url(output_file_prefix, loop):
+    """The MEDIA_URL of the loop's animated WebP if it has been built, else None. Never builds it."""
+    if loop['run'] is None:
+        return None
+    animation_path, animation_url = get_loop_animation_path(output_file_prefix, loop)
+    return animation_url if os.path.exists(animation_path) else None
+
+
+def build_loop_animation(output_file_prefix, loop, for_console_output=None):
+    """
+    Builds the animated WebP of the loop's available frames unless it already exists.
+    Returns its MEDIA_URL, or None if there's nothing to animate or it can't be built.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    available_frames = [frame for frame in loop['frames'] if frame['available']]
+    if not available_frames:
+        return None
+
+    animation_path, animation_url = get_loop_animation_path(output_file_prefix, loop)
+    animation_dir, animation_name = os.path.split(animation_path)
+    if os.path.exists(animation_path):
+        return animation_url
+
+    try:
+        from PIL import Image
+    except ImportError:
+        for_console_output("  WARNING (model_loops): Pillow is not installed; can't build loop animations.")
+        return None
+
+    images = []
+    temp_path = f"{animation_path}.tmp.{os.getpid()}"
+    try:
+        for frame in available_frames:
+            with Image.open(os.path.join(settings.MEDIA_ROOT, frame['image_path'])) as frame_image:
+                image = frame_image.convert('RGB')
+            if image.width > LOOP_ANIMATION_MAX_WIDTH:
+                scaled_height = round(image.height * LOOP_ANIMATION_MAX_WIDTH / image.width)
+                image = image.resize((LOOP_ANIMATION_MAX_WIDTH, scaled_height), Image.LANCZOS)
+            images.append(image)
+
+        os.makedirs(animation_dir, exist_ok=True)
+        images[0].save(temp_path, format='WEBP', save_all=True, append_images=images[1:],
+                       duration=LOOP_ANIMATION_FRAME_MS, loop=0, quality=LOOP_ANIMATION_QUALITY)
+        os.replace(temp_path, animation_path)
+    except OSError as e:
+        for_console_output(f"  ERROR (model_loops): Could not build loop animation {animation_name}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    for_console_output(f"  INFO (model_loops): Built loop animation {animation_name} from {len(images)} frame(s).")
+    return animation_url
+
+
+def build_model_loop_animations(model_key, run_date_str, run_hour_str, for_console_output=None):
+    """
+    Django-Q task, queued when a cycle completes: builds the loop animation of every
+    parameter whose newest run in the plot manifest is that cycle.
+    Returns the number of animations built or already present.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    run_label = f"{run_date_str} {run_hour_str}Z"
+    built = 0
+    for param_details in get_model_parameters(model_key):
+        loop = build_model_loop(model_key, param_details['output_file_prefix'])
+        if loop['run'] != run_label:
+            continue # A newer run is already being shown; its own completion builds its loop
+        if build_loop_animation(param_details['output_file_prefix'], loop, for_console_output):
+            built += 1
+    for_console_output(f"  INFO (model_loops): {built} {model_key.upper()} loop animation(s) ready for {run_label}.")
+    return built
@@ -0,0 +1,247 @@
+# weather/model_params.py
+#
+# The one registry of model parameters.
+#
+# Parameter definitions used to live in three places: the plot configs in
+# tasks.py, the AVAILABLE_*_PARAMETERS_CONFIG dicts in views.py, and the
+# selection keys rebuilt from them on every frame in grib_processing.py. Each
+# parameter is now defined once here, keyed by the 'code' the pages and APIs
+# use, and compiled once at import into a 'selector':
+#     {'criteria':     pygrib select()/index keys (see build_grib_select_criteria),
+#      'index_values': (shortName, typeOfLevel, level) for a GRIB_INDEX_KEYS lookup, or None,
+#      'idx_variable', 'idx_level': what to look for in the NOMADS .idx inventory}
+# so decoding a frame never has to scan a GRIB file for a parameter: the .idx
+# gives its message number in the downloaded file (grib_fetch.py), and a full
+# file falls back to a pygrib/eccodes index on GRIB_INDEX_KEYS.
+#
+# Besides the plot/GRIB keys each parameter has:
+#   'code':         the parameter code in URLs and APIs, e.g. 'sbcape'
+#   'name_display': name shown in the parameter selector
+# Transforms ('unit_conversion', 'valid_range', ...) are described in field_transforms.py.
+#
+# A parameter with 'derived' isn't read from the GRIB: it's computed from other
+# fields of the same (run, fhr) by derived_fields.py, and its 'inputs' name them
+# by 'code'. Inputs that aren't plotted themselves are listed in
+# MODEL_DERIVED_INPUTS; they're downloaded and kept in the field store only.
+import numpy as np
+
+from .grib_fetch import GRIB_SHORT_NAME_TO_IDX_VARIABLE, get_idx_level_for_param
+
+# Keys of the pygrib index used when a message's position in the file isn't known
+GRIB_INDEX_KEYS = ('shortName', 'typeOfLevel', 'level')
+
+GFS_PARAMETERS = [
+    {
+        'code': 't2m', 'name_display': '2m Temperature',
+        'grib_short_name': '2t', 'grib_level': 2, 'grib_type_of_level': 'heightAboveGround',
+        'output_file_prefix': 'gfs_t2m', 'plot_title_param_name': '2m Temperature',
+        'plot_unit_label': 'Temperature (deg F)', 'plot_cmap': 'jet',
+        'plot_levels': np.arange(0, 105, 5),
+        'unit_conversion': 'K_to_degF',
+    },
+    {
+        'code': 'sbcape', 'name_display': 'Surface CAPE',
+        'grib_short_name': 'cape', 'grib_level': 0, 'grib_type_of_level': 'surface', # Surface Based CAPE
+        'output_file_prefix': 'gfs_sbcape', 'plot_title_param_name': 'Surface CAPE',
+        'plot_unit_label': 'SBCAPE (J/kg)', 'plot_cmap': 'magma_r', # Or 'viridis', 'plasma'
+        'plot_levels': np.arange(0, 5001, 250), # Levels for CAPE
+    },
+    {
+        'code': 'refc', 'name_display': 'Sim. Comp. Reflectivity',
+        'grib_short_name': 'refc', 'grib_level': 0,
+        'grib_type_of_level': 'atmosphere', # Was 'entireAtmosphereConsideredAsASingleLayer'
+        'output_file_prefix': 'gfs_refc', 'plot_title_param_name': 'Sim. Comp. Reflectivity',
+        'plot_unit_label': 'Reflectivity (dBZ)', 'plot_cmap': 'turbo',
+        'plot_levels': np.arange(5, 76, 5),
+    },
+]
+
+NAM_PARAMETERS = [
+    {
+        'code': 'refc', 'name_display': 'Sim. Comp. Reflectivity',
+        'grib_short_name': 'refc', 'grib_level': 0,
+        'grib_type_of_level': 'atmosphereSingleLayer', # Was 'entireAtmosphereConsideredAsASingleLayer'
+        'output_file_prefix': 'nam_refc', 'plot_title_param_name': 'Sim. Comp. Reflectivity',
+        'plot_unit_label': 'Reflectivity (dBZ)', 'plot_cmap': 'gist_ncar',
+        'plot_levels': np.arange(5, 76, 5),
+    },
+    {
+        'code': 'sbcape', 'name_display': 'Surface CAPE',
+        'grib_short_name': 'cape', 'grib_level': 0, 'grib_type_of_level': 'surface',
+        'output_file_prefix': 'nam_sbcape', 'plot_title_param_name': 'Surface CAPE',
+        'plot_unit_label': 'SBCAPE (J/kg)', 'plot_cmap': 'magma_r',
+        'plot_levels': np.arange(0, 5001, 250),
+    },
+    {
+        'code': 'dewp2m', 'name_display': 'NAM 2m Dew Point',
+        'grib_short_name': '2d', 'grib_level': 2, 'grib_type_of_level': 'heightAboveGround',
+        'output_file_prefix': 'nam_dewp2m', 'plot_title_param_name': '2m Dew Point',
+        'plot_unit_label': 'Dew Point (°F)', 'plot_cmap': 'BuGn',
+        'plot_levels': np.arange(0, 91, 2), # 0°F to 90°F in steps of 2°F
+        'unit_conversion': 'K_to_degF',
+    },
+    {
+        # Storm Relative Helicity 0-3 km. Can also be selected with 'select_by_name': 'Storm relative helicity'
+        'code': 'nam_srh_3km', 'name_display': 'Storm Relative Helicity 0-3km',
+        'grib_short_name': 'hlcy', 'grib_level': 3000, 'grib_type_of_level': 'heightAboveGroundLayer',
+        'grib_top_level': 3000, 'grib_bottom_level': 0,
+        'output_file_prefix': 'nam_srh_3km', 'plot_title_param_name': 'NAM 3km Storm Relative Helicity',
+        'plot_unit_label': 'SRH (m²/s²)', # 'units' from GRIB dump is 'm**2 s**-2'
+        'plot_cmap': 'BuPu',
+        'plot_levels': np.arange(50, 601, 50),
+    },
+    {
+        'code': 'ltng_sfc', 'name_display': 'NAM Surface Lightning',
+        'grib_short_name': 'ltng', 'grib_level': 0, 'grib_type_of_level': 'surface',
+        'output_file_prefix': 'nam_ltng_sfc', 'plot_title_param_name': 'NAM Surface Lightning',
+        'plot_unit_label': 'Lightning Activity', 'plot_cmap': 'hot_r',
+        'plot_levels': np.arange(0, 11, 1), # GUESS: If it's an index or low count. Adjust based on data.
+    },
+    {
+        'code': 'stp', 'name_display': 'Significant Tornado Parameter',
+        'derived': 'stp', 'inputs': ('sbcape', 'srh_1km', 'shear_6km', 't2m', 'dewp2m'),
+        'output_file_prefix': 'nam_stp', 'plot_title_param_name': 'NAM Significant Tornado Parameter (fixed layer)',
+        'plot_unit_label': 'STP', 'plot_cmap': 'RdPu',
+        'plot_levels': np.arange(0.5, 10.5, 0.5),
+    },
+    {
+        'code': 'shear_6km', 'name_display': '0-6km Bulk Shear',
+        'derived': 'bulk_shear', 'inputs': ('ushr_6km', 'vshr_6km'),
+        'output_file_prefix': 'nam_shear_6km', 'plot_title_param_name': 'NAM 0-6km Bulk Shear',
+        'plot_unit_label': 'Bulk Shear (kt)', 'plot_cmap': 'YlGnBu',
+        'plot_levels': np.arange(20, 91, 5),
+    },
+    {
+        'code': 'dewp_depression', 'name_display': '2m Dew Point Depression',
+        'derived': 'dewpoint_depression', 'inputs': ('t2m', 'dewp2m'),
+        'output_file_prefix': 'nam_dewp_depression', 'plot_title_param_name': '2m Dew Point Depression',
+        'plot_unit_label': 'T - Td (°F)', 'plot_cmap': 'YlOrBr',
+        'plot_levels': np.arange(0, 41, 2),
+    },
+]
+
+# Fields only derived products use (see derived_fields.py)
+NAM_DERIVED_INPUTS = [
+    {
+        'code': 't2m', 'grib_short_name': '2t', 'grib_level': 2, 'grib_type_of_level': 'heightAboveGround',
+        'output_file_prefix': 'nam_t2m', 'plot_title_param_name': '2m Temperature',
+        'unit_conversion': 'K_to_degF',
+    },
+    {
+        'code': 'srh_1km', 'grib_short_name': 'hlcy', 'grib_level': 1000, 'grib_type_of_level': 'heightAboveGroundLayer',
+        'grib_top_level': 1000, 'grib_bottom_level': 0,
+        'output_file_prefix': 'nam_srh_1km', 'plot_title_param_name': 'Storm Relative Helicity 0-1km',
+    },
+    {
+        # Vertical u/v shear components; the .idx lists this layer bottom-first
+        'code': 'ushr_6km', 'grib_short_name': 'vucsh', 'grib_level': 6000, 'grib_type_of_level': 'heightAboveGroundLayer',
+        'grib_top_level': 6000, 'grib_bottom_level': 0, 'idx_level': '0-6000 m above ground',
+        'output_file_prefix': 'nam_ushr_6km', 'plot_title_param_name': '0-6km U Shear',
+    },
+    {
+        'code': 'vshr_6km', 'grib_short_name': 'vvcsh', 'grib_level': 6000, 'grib_type_of_level': 'heightAboveGroundLayer',
+        'grib_top_level': 6000, 'grib_bottom_level': 0, 'idx_level': '0-6000 m above ground',
+        'output_file_prefix': 'nam_vshr_6km', 'plot_title_param_name': '0-6km V Shear',
+    },
+]
+
+MODEL_PARAMETERS = {
+    'gfs': GFS_PARAMETERS,
+    'nam': NAM_PARAMETERS,
+}
+
+MODEL_DERIVED_INPUTS = {
+    'gfs': [],
+    'nam': NAM_DERIVED_INPUTS,
+}
+
+
+def build_grib_select_criteria(param_details, for_console_output=None):
+    """
+    Builds the grbs.select() criteria for a param config.
+    Prefers 'select_by_name' over 'grib_short_name'. Returns None if the config is incomplete.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    if 'grib_level' not in param_details or 'grib_type_of_level' not in param_details:
+        for_console_output(f"      ERROR: 'grib_level' or 'grib_type_of_level' missing in param_details for {param_details.get('plot_title_param_name')}")
+        return None
+
+    select_criteria = {
+        'level': param_details['grib_level'],
+        'typeOfLevel': param_details['grib_type_of_level']
+    }
+    if param_details.get('select_by_name'):
+        select_criteria['name'] = param_details['select_by_name']
+    elif param_details.get('grib_short_name'):
+        select_criteria['shortName'] = param_details['grib_short_name']
+    else:
+        for_console_output(f"      ERROR: Neither 'select_by_name' nor 'grib_short_name' provided in param_details for {param_details.get('plot_title_param_name')}")
+        return None
+
+    # Add topLevel and bottomLevel to criteria if they are in param_details and not None
+    if param_details.get('grib_top_level') is not None:
+        select_criteria['topLevel'] = param_details['grib_top_level']
+    if param_details.get('grib_bottom_level') is not None:
+        select_criteria['bottomLevel'] = param_details['grib_bottom_level']
+    return select_criteria
+
+
+def compile_param_selector(param_details, for_console_output=None):
+    """Works out once everything needed to find a parameter's message (see the module comment)."""
+    criteria = build_grib_select_criteria(param_details, for_console_output)
+    index_values = None
+    if criteria is not None and all(key in criteria for key in GRIB_INDEX_KEYS):
+        index_values = tuple(criteria[key] for key in GRIB_INDEX_KEYS)
+    return {
+        'criteria': criteria,
+        'index_values': index_values,
+        'idx_variable': param_details.get('idx_variable') or GRIB_SHORT_NAME_TO_IDX_VARIABLE.get(param_details.get('grib_short_name')),
+        'idx_level': get_idx_level_for_param(param_details),
+    }
+
+
+def get_param_selector(param_details):
+    """The compiled selector of a registry parameter, or one compiled now for an ad-hoc config."""
+    return param_details.get('selector') or compile_param_selector(param_details)
+
+
+def get_model_parameters(model_key):
+    """Every parameter plotted for a model, in display order."""
+    return MODEL_PARAMETERS[model_key]
+
+
+def get_param_configs(model_key):
+    """{code: param} for a model (what the views used to keep as AVAILABLE_*_PARAMETERS_CONFIG)."""
+    return {param_details['code']: param_details for param_details in MODEL_PARAMETERS.get(model_key, [])}
+
+
+def is_derived_param(param_details):
+    return bool(param_details.get('derived'))
+
+
+def get_grib_parameters(model_key):
+    """Every parameter decoded from the model's GRIB files: plotted ones and derived-product inputs."""
+    return [param_details for param_details in MODEL_PARAMETERS[model_key] + MODEL_DERIVED_INPUTS[model_key]
+            if not is_derived_param(param_details)]
+
+
+def get_param_by_code(model_key, code):
+    """A plotted parameter or derived-product input of a model by its code, or None."""
+    for param_details in MODEL_PARAMETERS.get(model_key, []) + MODEL_DERIVED_INPUTS.get(model_key, []):
+        if param_details['code'] == code:
+            return param_details
+    return None
+
+
+def get_param_by_prefix(model_key, output_file_prefix):
+    for param_details in MODEL_PARAMETERS.get(model_key, []):
+        if param_details['output_file_prefix'] == output_file_prefix:
+            return param_details
+    return None
+
+
+for _model_key in MODEL_PARAMETERS:
+    for _param_details in get_grib_parameters(_model_key):
+        _param_details['selector'] = compile_param_selector(_param_details)
@@ -0,0 +1,195 @@
+# weather/model_tiles.py
+#
+# Web-mercator XYZ tiles of model fields for the map client.
+#
+# The full-domain PNG is one fixed 12x9in image; zooming in only scales the
+# bitmap. Here each decoded field is also cut into 256px XYZ tiles at
+# MODEL_TILE_ZOOM_LEVELS, written under
+#     MEDIA_ROOT/model_tiles/<prefix>/<YYYYMMDD>_<HH>z/f<fhr>/<z>/<x>/<y>.png
+# so a Mapbox/Leaflet raster source can load just the visible tiles.
+#
+# Tiles are sampled nearest-neighbour straight from the model grid. Which grid
+# point every tile pixel takes its value from only depends on the grid and the
+# zoom, so that lookup (a KD-tree query over the grid's lat/lons) is done once
+# per grid and zoom and saved next to the grid cache as a memory-mapped .npy.
+# Rendering a frame's tiles is then just an array gather + colormap per tile.
+import os
+import shutil
+import functools
+import math
+import threading
+
+import numpy as np
+import matplotlib
+from django.conf import settings
+
+from .grid_cache import get_grid_cache_dir, load_model_grid, save_npy_atomically, lon_lats_to_unit_vectors, get_grid_kdtree
+
+TILE_SIZE = 256
+DEFAULT_TILE_ZOOM_LEVELS = [3, 4, 5, 6]
+TILE_ALPHA = 200 # Tiles are drawn over a basemap, so keep them a little see-through
+# Pixels farther than this many grid spacings from any grid point are left transparent
+MAX_SAMPLE_DISTANCE_GRID_SPACINGS = 1.5
+EARTH_RADIUS_M = 6371000.0
+
+_tile_indexes = {}
+_tile_indexes_lock = threading.Lock()
+
+
+def tiles_enabled():
+    return getattr(settings, 'MODEL_TILES_ENABLED', True)
+
+
+def get_tile_zoom_levels():
+    return getattr(settings, 'MODEL_TILE_ZOOM_LEVELS', DEFAULT_TILE_ZOOM_LEVELS)
+
+
+def get_frame_tile_dir(output_file_prefix, run_date_str, model_run_hour_str, current_fhr_fmt):
+    return os.path.join(settings.MEDIA_ROOT, 'model_tiles', output_file_prefix,
+                        f"{run_date_str}_{model_run_hour_str}z", f"f{current_fhr_fmt}")
+
+
+def delete_run_tiles(output_file_prefix, run_date_str, model_run_hour_str):
+    """Removes every tile of a param's run (used when the ingestion expires a cycle)."""
+    shutil.rmtree(os.path.join(settings.MEDIA_ROOT, 'model_tiles', output_file_prefix, f"{run_date_str}_{model_run_hour_str}z"),
+                  ignore_errors=True)
+
+
+def get_tile_url_template(output_file_prefix, run_date_str, model_run_hour_str, current_fhr_fmt):
+    """URL template for map clients, e.g. /media/model_tiles/gfs_t2m/20250608_12z/f006/{z}/{x}/{y}.png"""
+    return (f"{settings.MEDIA_URL}model_tiles/{output_file_prefix}/{run_date_str}_{model_run_hour_str}z/"
+            f"f{current_fhr_fmt}/{{z}}/{{x}}/{{y}}.png")
+
+
+def lon_lat_to_tile(lon, lat, zoom):
+    """Returns the (x, y) of the XYZ tile containing a point."""
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def get_tiles_for_extent(map_extent, zoom):
+    """Every (x, y) tile at a zoom that overlaps a [west, east, south, north] extent."""
+    west, east, south, north = map_extent
+    x_min, y_min = lon_lat_to_tile(west, north, zoom)
+    x_max, y_max = lon_lat_to_tile(east, south, zoom)
+    return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+def get_tile_pixel_lon_lats(x, y, zoom):
+    """2D lon/lat arrays (TILE_SIZE x TILE_SIZE) of a tile's pixel centres."""
+    n = 2 ** zoom
+    pixel_offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lons = (x + pixel_offsets) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * (y + pixel_offsets) / n))))
+    return np.meshgrid(lons, lats)
+
+
+def _estimate_grid_spacing_chord(grid_vectors, grid_shape):
+    """Typical distance (as a unit-sphere chord) between neighbouring grid points, measured mid-grid."""
+    rows, cols = grid_shape
+    middle = (rows // 2) * cols + cols // 2
+    neighbours = [middle + 1 if cols > 1 else middle, middle + cols if rows > 1 else middle]
+    distances = [np.linalg.norm(grid_vectors[middle] - grid_vectors[neighbour]) for neighbour in neighbours]
+    return max(distances) or (1000.0 / EARTH_RADIUS_M)
+
+
+def _build_tile_index(model_grid, zoom, index_path, tiles_path, for_console_output):
+    """KD-tree lookup from every tile pixel at a zoom to the nearest grid point."""
+    tiles = get_tiles_for_extent(model_grid.metadata['map_extent'], zoom)
+    for_console_output(f"    INFO (model_tiles): Building z{zoom} tile index ({len(tiles)} tiles) for {model_grid.grid_key}")
+
+    tree = get_grid_kdtree(model_grid.grid_key)
+    grid_point_count = tree.n
+    max_distance = MAX_SAMPLE_DISTANCE_GRID_SPACINGS * _estimate_grid_spacing_chord(tree.data, model_grid.plot_lats.shape)
+
+    # Missing pixels point one past the last grid point, which holds NaN at render time
+    tile_index = np.empty((len(tiles), TILE_SIZE, TILE_SIZE), dtype=np.int32)
+    for tile_number, (x, y) in enumerate(tiles):
+        pixel_lons, pixel_lats = get_tile_pixel_lon_lats(x, y, zoom)
+        distances, nearest = tree.query(lon_lats_to_unit_vectors(pixel_lons, pixel_lats),
+                                        distance_upper_bound=max_distance)
+        nearest[~np.isfinite(distances)] = grid_point_count # cKDTree already uses n for "no neighbour"
+        tile_index[tile_number] = nearest.reshape(TILE_SIZE, TILE_SIZE)
+
+    save_npy_atomically(tiles_path, np.array(tiles, dtype=np.int32).reshape(-1, 2))
+    save_npy_atomically(index_path, tile_index)
+
+
+def get_tile_index(grid_key, zoom, for_console_output=None):
+    """
+    Returns (tiles, tile_index) for a grid and zoom: tiles is an (n, 2) array of (x, y) and
+    tile_index[i] maps each pixel of tile i to a flat index into the grid's cropped values.
+    Built and saved on first use, memory-mapped afterwards.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    with _tile_indexes_lock:
+        if (grid_key, zoom) in _tile_indexes:
+            return _tile_indexes[(grid_key, zoom)]
+
+    grid_dir = os.path.join(get_grid_cache_dir(), grid_key)
+    index_path = os.path.join(grid_dir, f"tile_index_z{zoom}.npy")
+    tiles_path = os.path.join(grid_dir, f"tile_list_z{zoom}.npy")
+    if not (os.path.exists(index_path) and os.path.exists(tiles_path)):
+        _build_tile_index(load_model_grid(grid_key), zoom, index_path, tiles_path, for_console_output)
+
+    tile_index = (np.load(tiles_path), np.load(index_path, mmap_mode='r'))
+    with _tile_indexes_lock:
+        _tile_indexes[(grid_key, zoom)] = tile_index
+    return tile_index
+
+
+@functools.lru_cache(maxsize=None)
+def _get_colormap_lut(plot_cmap):
+    """256-entry RGBA uint8 lookup table for a matplotlib colormap name."""
+    colormap = matplotlib.colormaps[plot_cmap]
+    return (colormap(np.linspace(0.0, 1.0, 256)) * 255).astype(np.uint8)
+
+
+def render_field_tiles(run_date_str, model_run_hour_str, current_fhr_fmt, param_details, field, for_console_output=None):
+    """
+    Writes the XYZ tiles of one decoded field (as returned by extract_param_field).
+    Tiles with no data at all are skipped. Returns the number of tiles written.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    from PIL import Image
+
+    values = np.ma.filled(np.ma.asarray(field['values'], dtype=np.float32), np.nan).ravel()
+    values = np.append(values, np.float32(np.nan)) # Slot for "no grid point nearby"
+
+    plot_levels = param_details.get('plot_levels')
+    if plot_levels is not None and len(plot_levels) > 0:
+        vmin, vmax = float(plot_levels[0]), float(plot_levels[-1])
+    else:
+        vmin, vmax = float(np.nanmin(values)), float(np.nanmax(values))
+    value_range = (vmax - vmin) or 1.0
+    lut = _get_colormap_lut(param_details.get('plot_cmap', 'jet'))
+
+    tile_dir = get_frame_tile_dir(param_details['output_file_prefix'], run_date_str, model_run_hour_str, current_fhr_fmt)
+    tiles_written = 0
+    for zoom in get_tile_zoom_levels():
+        tiles, tile_index = get_tile_index(field['grid_key'], zoom, for_console_output)
+        for (x, y), pixel_index in zip(tiles, tile_index):
+            tile_values = values[pixel_index]
+            has_data = np.isfinite(tile_values)
+            if not has_data.any():
+                continue
+
+            lut_index = np.clip((np.nan_to_num(tile_values, nan=vmin) - vmin) / value_range * 255, 0, 255).astype(np.uint8)
+            rgba = lut[lut_index]
+            rgba[..., 3] = np.where(has_data, TILE_ALPHA, 0)
+
+            tile_path = os.path.join(tile_dir, str(zoom), str(x), f"{y}.png")
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            temp_path = f"{tile_path}.tmp.{os.getpid()}"
+            Image.fromarray(rgba, 'RGBA').save(temp_path, format='PNG')
+            os.replace(temp_path, tile_path)
+            tiles_written += 1
+
+    for_console_output(f"    SUCCESS: Wrote {tiles_written} tile(s) for {param_details['output_file_prefix']} F{current_fhr_fmt} to {tile_dir}")
+    return tiles_written
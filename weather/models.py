@@ -1,3 +1,115 @@
 from django.db import models
 
-# Create your models here.
+
+class ModelCycle(models.Model):
+    """
+    One model run (e.g. GFS 20250608 12Z) that the ingestion task is tracking.
+    Its ModelFrame rows are the manifest of which plots are done.
+    """
+    STATUS_ACTIVE = 'active'      # Still waiting for hours to be posted or rendered
+    STATUS_COMPLETE = 'complete'  # Every frame is done (or failed for good)
+    STATUS_EXPIRED = 'expired'    # Superseded and too old to keep working on
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_EXPIRED, 'Expired'),
+    ]
+
+    model_key = models.CharField(max_length=10, db_index=True) # 'gfs', 'nam'
+    run_date = models.CharField(max_length=8) # YYYYMMDD
+    run_hour = models.CharField(max_length=2) # HH
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_ACTIVE, db_index=True)
+    posted_fhrs = models.JSONField(default=list, blank=True, help_text="Forecast hours seen on NOMADS so far.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.model_key.upper()} {self.run_date} {self.run_hour}Z ({self.status})"
+
+    class Meta:
+        ordering = ['-run_date', '-run_hour']
+        constraints = [
+            models.UniqueConstraint(fields=['model_key', 'run_date', 'run_hour'], name='unique_model_cycle'),
+        ]
+
+
+class ModelFrame(models.Model):
+    """One (parameter, forecast hour) plot of a ModelCycle."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    cycle = models.ForeignKey(ModelCycle, on_delete=models.CASCADE, related_name='frames')
+    param = models.CharField(max_length=50) # output_file_prefix, e.g. 'gfs_t2m'
+    fhr = models.CharField(max_length=3) # Zero padded like the image file names ('006' GFS, '06' NAM)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    image_path = models.CharField(max_length=255, blank=True, default='') # Relative to MEDIA_ROOT
+    error = models.TextField(blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True) # When a tick started rendering it
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.cycle.model_key.upper()} {self.cycle.run_date} {self.cycle.run_hour}Z {self.param} F{self.fhr} ({self.status})"
+
+    class Meta:
+        ordering = ['cycle', 'fhr', 'param']
+        constraints = [
+            models.UniqueConstraint(fields=['cycle', 'param', 'fhr'], name='unique_model_frame'),
+        ]
+
+
+class LocationGridCell(models.Model):
+    """
+    The model grid cell nearest a SavedLocation, for point forecasts.
+    One row per (location, grid); the lat/lon it was computed for is kept so a
+    moved location gets recomputed.
+    """
+    location = models.ForeignKey('accounts.SavedLocation', on_delete=models.CASCADE, related_name='grid_cells')
+    grid_key = models.CharField(max_length=100, db_index=True) # See grid_cache.make_grid_key()
+    row = models.IntegerField() # Into the cropped grid; -1 if the location is outside it
+    col = models.IntegerField()
+    distance_km = models.FloatField(null=True, blank=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.location} @ {self.grid_key} [{self.row}, {self.col}]"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'grid_key'], name='unique_location_grid_cell'),
+        ]
+
+
+class LocationForecastValue(models.Model):
+    """
+    One model value sampled at a SavedLocation: (location, cycle, param, forecast hour) -> value.
+    Filled for every saved location as frames are ingested, so "CAPE over 2500 at any of my
+    locations in the next 24h" is a single indexed query.
+    """
+    location = models.ForeignKey('accounts.SavedLocation', on_delete=models.CASCADE, related_name='forecast_values')
+    cycle = models.ForeignKey(ModelCycle, on_delete=models.CASCADE, related_name='location_values')
+    param = models.CharField(max_length=50) # output_file_prefix, e.g. 'nam_sbcape'
+    fhr = models.PositiveSmallIntegerField()
+    valid_time = models.DateTimeField()
+    value = models.FloatField() # In the stored field's units; missing values aren't stored
+
+    def __str__(self):
+        return f"{self.location_id} {self.param} F{self.fhr:03d} = {self.value}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'cycle', 'param', 'fhr'], name='unique_location_forecast_value'),
+        ]
+        indexes = [
+            models.Index(fields=['param', 'valid_time'], name='location_value_param_time'),
+        ]
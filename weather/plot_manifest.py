@@ -0,0 +1,165 @@
+# weather/plot_manifest.py
+#
+# Index of the model plots that are available, for the views and API.
+#
+# The model pages used to rebuild the expected file name for every request and
+# os.path.exists() it (twice for GFS, to fall back to the previous run). The
+# ingestion manifest (ModelCycle/ModelFrame) already knows which frames are
+# done, so we turn it into one small dict per model:
+#     {'model', 'generated_at', 'runs': [newest first:
+#         {'run_date', 'run_hour', 'run_datetime_utc', 'status',
+#          'frames': {prefix: [{'fhr', 'valid_time_utc', 'image_url', 'image_path', 'etag', 'tile_url_template'}, ...]}}]}
+# Views read it from process memory (refreshed with one DB query every
+# MANIFEST_MEMORY_TTL_SECONDS), so answering a request needs no filesystem
+# calls. The ingestion task also publishes it as
+# MEDIA_ROOT/model_plots/<model>_manifest.json for clients that want the whole
+# timeline as a static file.
+import os
+import json
+import hashlib
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+from .models import ModelCycle, ModelFrame
+from .model_tiles import tiles_enabled, get_tile_url_template
+
+MANIFEST_MAX_RUNS = 4 # Newest runs kept in the manifest (the older ones are fallbacks)
+MANIFEST_MEMORY_TTL_SECONDS = 30
+
+_manifests_in_memory = {} # model_key -> (expires_at monotonic, manifest)
+_manifests_lock = threading.Lock()
+
+
+def get_manifest_file_path(model_key):
+    return os.path.join(settings.MEDIA_ROOT, 'model_plots', f"{model_key}_manifest.json")
+
+
+def build_plot_manifest(model_key):
+    """Builds the manifest dict for a model from the ModelCycle/ModelFrame tables."""
+    # Expired cycles' files are deleted (ingestion.expire_old_cycles), so they're never listed
+    cycles = list(ModelCycle.objects.filter(model_key=model_key)
+                  .exclude(status=ModelCycle.STATUS_EXPIRED)[:MANIFEST_MAX_RUNS]) # Newest first (Meta.ordering)
+    done_frames = (ModelFrame.objects
+                   .filter(cycle__in=cycles, status=ModelFrame.STATUS_DONE)
+                   .exclude(image_path='')
+                   .values_list('cycle_id', 'param', 'fhr', 'image_path', 'updated_at'))
+
+    frames_by_cycle = {}
+    for cycle_id, param, fhr, image_path, updated_at in done_frames:
+        frames_by_cycle.setdefault(cycle_id, []).append((param, fhr, image_path, updated_at))
+
+    runs = []
+    for cycle in cycles:
+        run_datetime_utc = datetime.strptime(f"{cycle.run_date}{cycle.run_hour}", "%Y%m%d%H").replace(tzinfo=timezone.utc)
+        frames = {}
+        for param, fhr, image_path, updated_at in sorted(frames_by_cycle.get(cycle.pk, []), key=lambda frame: int(frame[1])):
+            frames.setdefault(param, []).append({
+                'fhr': fhr,
+                'valid_time_utc': (run_datetime_utc + timedelta(hours=int(fhr))).isoformat(),
+                'image_url': settings.MEDIA_URL + image_path.replace(os.sep, '/'),
+                'image_path': image_path, # Relative to MEDIA_ROOT
+                # image_path is content-addressed (plot_output.py), so a re-render with new pixels changes both
+                'etag': hashlib.sha1(f"{image_path}:{updated_at.isoformat()}".encode('utf-8')).hexdigest()[:16],
+                'tile_url_template': get_tile_url_template(param, cycle.run_date, cycle.run_hour, fhr) if tiles_enabled() else None,
+            })
+        runs.append({
+            'run_date': cycle.run_date,
+            'run_hour': cycle.run_hour,
+            'run_datetime_utc': run_datetime_utc.isoformat(),
+            'status': cycle.status,
+            'frames': frames,
+        })
+
+    return {'model': model_key, 'generated_at': datetime.now(timezone.utc).isoformat(), 'runs': runs}
+
+
+def _remember_manifest(model_key, manifest):
+    with _manifests_lock:
+        _manifests_in_memory[model_key] = (time.monotonic() + MANIFEST_MEMORY_TTL_SECONDS, manifest)
+
+
+def publish_plot_manifest(model_key, for_console_output=None):
+    """
+    Rebuilds a model's manifest after an ingestion tick and writes it to its JSON file
+    atomically (temp file + os.replace), so readers never see a half-written file.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    manifest = build_plot_manifest(model_key)
+    manifest_path = get_manifest_file_path(model_key)
+    temp_path = f"{manifest_path}.tmp.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, manifest_path)
+    except OSError as e:
+        for_console_output(f"  WARNING (plot_manifest): Could not write {manifest_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    _remember_manifest(model_key, manifest)
+    return manifest
+
+
+def get_plot_manifest(model_key):
+    """Returns a model's manifest from process memory, rebuilding it from the DB when it's stale."""
+    with _manifests_lock:
+        cached = _manifests_in_memory.get(model_key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    manifest = build_plot_manifest(model_key)
+    _remember_manifest(model_key, manifest)
+    return manifest
+
+
+def get_param_timeline(manifest, output_file_prefix):
+    """
+    Returns (run, frames) for the newest run that has any frames of this param,
+    or (None, []) if none do.
+    """
+    for run in manifest['runs']:
+        frames = run['frames'].get(output_file_prefix)
+        if frames:
+            return run, frames
+    return None, []
+
+
+def get_model_image_details(model_key, output_file_prefix, fhr_str, model_label=None):
+    """
+    Finds the plot for (param, fhr) in the newest run that has it, falling back to older runs.
+    Returns the same dict shape the views have always used:
+        {'image_exists', 'image_url', 'display_message', 'run_datetime_utc', 'actual_fhr', 'actual_run_hour'}
+    """
+    model_label = model_label or model_key.upper()
+    manifest = get_plot_manifest(model_key)
+    fhr_int = int(fhr_str)
+
+    for run_index, run in enumerate(manifest['runs']):
+        for frame in run['frames'].get(output_file_prefix, []):
+            if int(frame['fhr']) != fhr_int:
+                continue
+            run_note = "Run" if run_index == 0 else "Previous Run"
+            return {
+                'image_exists': True,
+                'image_url': frame['image_url'],
+                'display_message': f"{model_label} Plot - F{frame['fhr']} ({run_note}: {run['run_date']} {run['run_hour']}Z)",
+                'run_datetime_utc': datetime.fromisoformat(run['run_datetime_utc']),
+                'actual_fhr': frame['fhr'],
+                'actual_run_hour': run['run_hour'],
+            }
+
+    newest_run = manifest['runs'][0] if manifest['runs'] else None
+    return {
+        'image_exists': False,
+        'image_url': None,
+        'display_message': f"{model_label} Plot - F{fhr_str} not available.",
+        'run_datetime_utc': datetime.fromisoformat(newest_run['run_datetime_utc']) if newest_run else None,
+        'actual_fhr': fhr_str,
+        'actual_run_hour': newest_run['run_hour'] if newest_run else '',
+    }
@@ -0,0 +1,132 @@
+# weather/plot_output.py
+#
+# How model plot PNGs are written and named.
+#
+# savefig() used to write straight to the public path, so a request could be
+# served a half-written PNG and a render that died midway left a corrupt file
+# that get_params_needing_plots() then skipped forever. Now every plot is
+# rendered to a temp file next to its destination and renamed into place
+# (os.replace is atomic on one filesystem), and named by its content:
+#
+#     model_plots/immutable/<plot name>_<sha256 prefix>.png   the frame, never rewritten
+#     model_plots/<plot name>.png                            hard link to the newest one
+#
+# The stable name keeps the "is this plot done?" checks and older callers
+# working. The manifest (and so the pages and APIs) hands out the immutable
+# URL, whose content can't change, so it's served with IMMUTABLE_CACHE_CONTROL
+# and browsers/CDNs never revalidate it. Whatever serves MEDIA_URL in
+# production should send that header for IMMUTABLE_PLOT_URL_PREFIX too.
+import os
+import glob
+import shutil
+import hashlib
+import tempfile
+
+from django.conf import settings
+
+IMMUTABLE_PLOT_DIR = os.path.join('model_plots', 'immutable') # Relative to MEDIA_ROOT
+IMMUTABLE_PLOT_URL_PREFIX = settings.MEDIA_URL + 'model_plots/immutable/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CONTENT_HASH_LENGTH = 20
+PUBLISHED_FILE_MODE = 0o644 # mkstemp creates 0600 files; the web server has to read them
+
+
+def get_content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:CONTENT_HASH_LENGTH]
+
+
+def get_immutable_plot_path(output_image_full_path, content_hash):
+    plot_name = os.path.splitext(os.path.basename(output_image_full_path))[0]
+    return os.path.join(settings.MEDIA_ROOT, IMMUTABLE_PLOT_DIR, f"{plot_name}_{content_hash}.png")
+
+
+def _make_temp_path(final_path):
+    """An unused temp file name in final_path's directory (so os.replace() stays on one filesystem)."""
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(final_path)}.", suffix='.tmp', dir=os.path.dirname(final_path))
+    os.close(temp_fd)
+    return temp_path
+
+
+def _link_atomically(source_path, final_path):
+    """Points final_path at source_path's content (hard link, else a copy) in one rename."""
+    temp_path = _make_temp_path(final_path)
+    try:
+        os.remove(temp_path)
+        try:
+            os.link(source_path, temp_path)
+        except OSError: # e.g. a filesystem without hard links
+            shutil.copyfile(source_path, temp_path)
+            os.chmod(temp_path, PUBLISHED_FILE_MODE)
+        os.replace(temp_path, final_path)
+        if os.path.lexists(temp_path): # rename() does nothing when both names are already links to the same file
+            os.remove(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def publish_plot_file(temp_path, output_image_full_path):
+    """
+    Moves a finished temp PNG to its content-addressed name and points the stable
+    output_image_full_path at it. Returns the content-addressed path.
+    """
+    immutable_path = get_immutable_plot_path(output_image_full_path, get_content_hash(temp_path))
+    os.makedirs(os.path.dirname(immutable_path), exist_ok=True)
+    if os.path.exists(immutable_path): # Same bytes rendered before
+        os.remove(temp_path)
+    else:
+        os.chmod(temp_path, PUBLISHED_FILE_MODE)
+        os.replace(temp_path, immutable_path)
+    _link_atomically(immutable_path, output_image_full_path)
+    return immutable_path
+
+
+def save_figure_atomically(fig, output_image_full_path, **savefig_kwargs):
+    """
+    fig.savefig() to a temp file, then publish_plot_file(). Nothing appears at either
+    path unless the PNG was written completely. Returns the content-addressed path.
+    """
+    temp_path = _make_temp_path(output_image_full_path)
+    try:
+        fig.savefig(temp_path, format='png', **savefig_kwargs)
+        return publish_plot_file(temp_path, output_image_full_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def get_published_plot_path(output_image_full_path):
+    """
+    The content-addressed path of an existing plot at its stable name (e.g. one rendered
+    before plots were content-addressed), publishing it there if needed.
+    """
+    immutable_path = get_immutable_plot_path(output_image_full_path, get_content_hash(output_image_full_path))
+    if not os.path.exists(immutable_path):
+        _link_atomically(output_image_full_path, immutable_path)
+    return immutable_path
+
+
+def delete_run_plots(output_file_prefix, run_date_str, model_run_hour_str):
+    """
+    Removes a param's plots of one run, under both their stable and content-addressed
+    names (they're hard links to each other, so only deleting both frees the space).
+    Returns the number of files removed.
+    """
+    run_plot_name = f"{output_file_prefix}_{run_date_str}_{model_run_hour_str}z_f"
+    run_plot_paths = (glob.glob(os.path.join(settings.MEDIA_ROOT, 'model_plots', glob.escape(run_plot_name) + '*.png')) +
+                      glob.glob(os.path.join(settings.MEDIA_ROOT, IMMUTABLE_PLOT_DIR, glob.escape(run_plot_name) + '*.png')))
+    removed = 0
+    for plot_path in run_plot_paths:
+        try:
+            os.remove(plot_path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
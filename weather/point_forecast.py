@@ -0,0 +1,231 @@
+# weather/point_forecast.py
+#
+# Point forecasts ("what will CAPE be at my house") from the stored model fields.
+#
+# Every SavedLocation gets the nearest cell of each model grid it's sampled on,
+# found with one KD-tree query (grid_cache.find_nearest_grid_cells) and kept in
+# LocationGridCell so it's only recomputed when a location moves or a new grid
+# shows up. A meteogram is then one gather per stored field (field_store), for
+# one location or every saved location at once.
+#
+# As frames are ingested, sample_frames_at_locations() also gathers every saved
+# location's value from each new field in one fancy-indexing pass and keeps them
+# in LocationForecastValue, so threshold checks ("CAPE > 2500 at any of my
+# locations in the next 24h") are a single indexed query instead of field reads.
+#
+# Nearest cell rather than bilinear weights: the NAM grid is Lambert conformal
+# and the stored values are already at the resolution we plot, so the nearest
+# cell is within a few km of the location and needs no interpolation weights.
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.utils import timezone as django_utils_tz
+
+from accounts.models import SavedLocation
+
+from .models import LocationGridCell, LocationForecastValue, ModelFrame
+from .grid_cache import find_nearest_grid_cells, list_model_grid_keys
+from .field_store import load_field
+from .plot_manifest import get_plot_manifest, get_param_timeline
+
+# A location farther than this from every grid point is outside the model domain
+MAX_CELL_DISTANCE_KM = 50.0
+LOCATION_BATCH_SIZE = 2000
+SAMPLE_INSERT_BATCH_SIZE = 5000
+
+
+def get_location_grid_cells(grid_key, locations):
+    """
+    Returns {location_id: (row, col)} on a grid, with (-1, -1) for locations outside it.
+    Stored cells are reused; missing ones (new or moved locations) are computed in one
+    batch and saved.
+    """
+    locations = list(locations)
+    stored_cells = {cell.location_id: cell for cell in
+                    LocationGridCell.objects.filter(grid_key=grid_key, location_id__in=[location.pk for location in locations])}
+
+    cells = {}
+    locations_to_compute = []
+    for location in locations:
+        cell = stored_cells.get(location.pk)
+        if cell is not None and cell.latitude == location.latitude and cell.longitude == location.longitude:
+            cells[location.pk] = (cell.row, cell.col)
+        else:
+            locations_to_compute.append(location)
+
+    if locations_to_compute:
+        rows, cols, distances_km = find_nearest_grid_cells(
+            grid_key,
+            [float(location.latitude) for location in locations_to_compute],
+            [float(location.longitude) for location in locations_to_compute],
+            max_distance_km=MAX_CELL_DISTANCE_KM)
+        new_cells = []
+        for location, row, col, distance_km in zip(locations_to_compute, rows, cols, distances_km):
+            cells[location.pk] = (int(row), int(col))
+            new_cells.append(LocationGridCell(
+                location=location, grid_key=grid_key, row=int(row), col=int(col),
+                distance_km=float(distance_km) if np.isfinite(distance_km) else None,
+                latitude=location.latitude, longitude=location.longitude))
+        LocationGridCell.objects.bulk_create(
+            new_cells, update_conflicts=True, unique_fields=['location', 'grid_key'],
+            update_fields=['row', 'col', 'distance_km', 'latitude', 'longitude', 'updated_at'])
+    return cells
+
+
+def _get_grid_cell_arrays(grid_key, locations):
+    """(rows, cols, inside_grid) arrays aligned with locations, for one fancy-index gather per field."""
+    cells = get_location_grid_cells(grid_key, locations)
+    rows = np.array([cells[location.pk][0] for location in locations], dtype=np.intp)
+    cols = np.array([cells[location.pk][1] for location in locations], dtype=np.intp)
+    return rows, cols, rows >= 0
+
+
+def refresh_location_grid_cells(model_key, for_console_output=None):
+    """
+    Makes sure every SavedLocation has its cell on each of a model's cached grids.
+    Run after an ingestion tick, so point forecast requests never have to compute cells.
+    Returns the number of locations checked per grid.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    location_count = 0
+    for grid_key in list_model_grid_keys(model_key):
+        location_count = 0
+        batch = []
+        for location in SavedLocation.objects.only('pk', 'latitude', 'longitude').iterator(chunk_size=LOCATION_BATCH_SIZE):
+            batch.append(location)
+            if len(batch) == LOCATION_BATCH_SIZE:
+                get_location_grid_cells(grid_key, batch)
+                location_count += len(batch)
+                batch = []
+        if batch:
+            get_location_grid_cells(grid_key, batch)
+            location_count += len(batch)
+        for_console_output(f"  INFO (point_forecast): Grid cells up to date for {location_count} location(s) on {grid_key}.")
+    return location_count
+
+
+def get_point_forecast(model_key, locations, output_file_prefixes):
+    """
+    Samples the newest run of each param at each location:
+        {'model', 'params': {prefix: {'run', 'run_datetime_utc', 'units', 'fhrs', 'valid_times_utc',
+                                      'values': {location_id: [value or None per fhr]}}}}
+    Only forecast hours whose field is stored are included.
+    """
+    locations = list(locations)
+    manifest = get_plot_manifest(model_key)
+    params = {}
+    for output_file_prefix in output_file_prefixes:
+        run, frames = get_param_timeline(manifest, output_file_prefix)
+        stored_frames = []
+        if run is not None:
+            for frame in frames:
+                stored_field = load_field(model_key, run['run_date'], run['run_hour'], output_file_prefix, frame['fhr'])
+                if stored_field is not None:
+                    stored_frames.append((frame['fhr'], stored_field))
+        if not stored_frames:
+            params[output_file_prefix] = {'run': None, 'run_datetime_utc': None, 'units': None,
+                                          'fhrs': [], 'valid_times_utc': [], 'values': {}}
+            continue
+
+        # (locations x fhrs), filled one column per stored field
+        series = np.full((len(locations), len(stored_frames)), np.nan, dtype=np.float32)
+        cells_by_grid = {}
+        for fhr_index, (fhr, stored_field) in enumerate(stored_frames):
+            if stored_field.grid_key not in cells_by_grid:
+                cells_by_grid[stored_field.grid_key] = _get_grid_cell_arrays(stored_field.grid_key, locations)
+            rows, cols, inside_grid = cells_by_grid[stored_field.grid_key]
+            if inside_grid.any():
+                series[inside_grid, fhr_index] = stored_field.decode_points(rows[inside_grid], cols[inside_grid])
+
+        run_datetime_utc = datetime.fromisoformat(run['run_datetime_utc'])
+        params[output_file_prefix] = {
+            'run': f"{run['run_date']} {run['run_hour']}Z",
+            'run_datetime_utc': run['run_datetime_utc'],
+            'units': stored_frames[0][1].metadata.get('units'),
+            'fhrs': [fhr for fhr, _ in stored_frames],
+            'valid_times_utc': [(run_datetime_utc + timedelta(hours=int(fhr))).isoformat() for fhr, _ in stored_frames],
+            'values': {
+                location.pk: [None if np.isnan(value) else round(float(value), 2) for value in series[location_index]]
+                for location_index, location in enumerate(locations)
+            },
+        }
+
+    return {'model': model_key, 'params': params}
+
+
+def sample_frames_at_locations(cycle, frames, for_console_output=None):
+    """
+    Samples every SavedLocation from the stored fields of a cycle's newly done frames
+    and saves the values to LocationForecastValue (replacing any from an earlier render).
+    Returns the number of values saved.
+    """
+    if for_console_output is None:
+        for_console_output = print
+
+    done_frames = [frame for frame in frames if frame.status == ModelFrame.STATUS_DONE]
+    locations = list(SavedLocation.objects.only('pk', 'latitude', 'longitude'))
+    if not done_frames or not locations:
+        return 0
+
+    location_ids = np.array([location.pk for location in locations], dtype=np.int64)
+    run_datetime_utc = datetime.strptime(f"{cycle.run_date}{cycle.run_hour}", "%Y%m%d%H").replace(tzinfo=timezone.utc)
+    cells_by_grid = {}
+    samples = []
+    for frame in done_frames:
+        stored_field = load_field(cycle.model_key, cycle.run_date, cycle.run_hour, frame.param, frame.fhr)
+        if stored_field is None:
+            continue
+        if stored_field.grid_key not in cells_by_grid:
+            cells_by_grid[stored_field.grid_key] = _get_grid_cell_arrays(stored_field.grid_key, locations)
+        rows, cols, inside_grid = cells_by_grid[stored_field.grid_key]
+
+        # One gather for all locations; only the ones with a value become rows
+        values = np.full(len(locations), np.nan, dtype=np.float32)
+        values[inside_grid] = stored_field.decode_points(rows[inside_grid], cols[inside_grid])
+        has_value = np.isfinite(values)
+        valid_time = run_datetime_utc + timedelta(hours=int(frame.fhr))
+        samples.extend(
+            LocationForecastValue(location_id=location_id, cycle=cycle, param=frame.param, fhr=int(frame.fhr),
+                                  valid_time=valid_time, value=value)
+            for location_id, value in zip(location_ids[has_value].tolist(), values[has_value].tolist())
+        )
+
+    if samples:
+        LocationForecastValue.objects.bulk_create(
+            samples, batch_size=SAMPLE_INSERT_BATCH_SIZE, update_conflicts=True,
+            unique_fields=['location', 'cycle', 'param', 'fhr'], update_fields=['valid_time', 'value'])
+    for_console_output(f"  INFO (point_forecast): Sampled {len(locations)} location(s) from {len(done_frames)} frame(s) "
+                       f"of {cycle.model_key.upper()} {cycle.run_date} {cycle.run_hour}Z ({len(samples)} values).")
+    return len(samples)
+
+
+def find_locations_exceeding(model_key, output_file_prefix, threshold, locations=None, within_hours=24):
+    """
+    Locations where a param goes over threshold in the next within_hours, from the newest
+    run that has the param. Returns {location_id: (first valid_time, value)}.
+    """
+    run, _ = get_param_timeline(get_plot_manifest(model_key), output_file_prefix)
+    if run is None:
+        return {}
+
+    now = django_utils_tz.now()
+    exceeding_values = (LocationForecastValue.objects
+                        .filter(cycle__model_key=model_key, cycle__run_date=run['run_date'], cycle__run_hour=run['run_hour'],
+                                param=output_file_prefix, valid_time__gte=now,
+                                valid_time__lte=now + timedelta(hours=within_hours), value__gt=threshold)
+                        .order_by('valid_time')
+                        .values_list('location_id', 'valid_time', 'value'))
+    if locations is not None:
+        exceeding_values = exceeding_values.filter(location__in=locations)
+
+    exceedances = {}
+    for location_id, valid_time, value in exceeding_values:
+        exceedances.setdefault(location_id, (valid_time, value))
+    return exceedances
+
+
+def delete_cycle_samples(cycle_ids):
+    """Drops the location samples of expired cycles."""
+    return LocationForecastValue.objects.filter(cycle_id__in=cycle_ids).delete()[0]
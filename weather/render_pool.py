@@ -0,0 +1,208 @@
+# weather/render_pool.py
+#
+# Parallel rendering engine for a whole model cycle.
+#
+# A cycle is split into (fhr, param) render jobs. Downloads run on a small thread
+# pool (network bound, capped separately so we don't hammer NOMADS), and each
+# downloaded hour is decoded once and fanned out to a process pool that renders
+# the plots (CPU bound matplotlib/cartopy work) on every core of the machine.
+import os
+import multiprocessing
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+
+from django.conf import settings
+
+from .grib_processing import (
+    MODEL_PLOT_SETTINGS,
+    format_model_forecast_hour,
+    get_params_needing_plots,
+    download_and_extract_forecast_hour,
+    render_model_plot,
+)
+
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 4
+
+
+def get_max_render_workers():
+    """Render processes to use: MODEL_RENDER_MAX_WORKERS from settings, else one per core."""
+    return getattr(settings, 'MODEL_RENDER_MAX_WORKERS', None) or os.cpu_count() or 1
+
+
+def get_max_concurrent_downloads():
+    return getattr(settings, 'MODEL_MAX_CONCURRENT_DOWNLOADS', DEFAULT_MAX_CONCURRENT_DOWNLOADS)
+
+
+def _init_render_worker():
+    """Render workers are spawned fresh (no fork while download threads hold locks), so set Django up."""
+    import django
+    django.setup()
+
+
+def _render_job(model_key, run_date_str, model_run_hour_str, current_fhr_fmt, param_details, field, output_image_full_path):
+    """
+    Runs in a render worker process. Returns (success, content-addressed image path, error_message).
+    Must stay a module-level function so ProcessPoolExecutor can pickle it.
+    """
+    try:
+        published_image_path = render_model_plot(model_key, run_date_str, model_run_hour_str, current_fhr_fmt,
+                                                 param_details, field, output_image_full_path, print)
+        return True, published_image_path, None
+    except Exception as e:
+        traceback.print_exc()
+        return False, None, str(e)
+
+
+def _make_render_executor(max_render_workers, for_console_output):
+    """
+    Returns a ProcessPoolExecutor for rendering, or None to render serially.
+    Daemonic processes (e.g. Django-Q workers with daemonize_workers=True) can't have children.
+    """
+    if max_render_workers <= 1:
+        return None
+    if multiprocessing.current_process().daemon:
+        for_console_output("  WARNING (render_pool): Running inside a daemonic process, so render workers can't be spawned. "
+                           "Set Q_CLUSTER['daemonize_workers'] = False to enable parallel rendering. Rendering serially.")
+        return None
+    return ProcessPoolExecutor(max_workers=max_render_workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_render_worker)
+
+
+def render_model_cycle(
+    model_key, run_date_str, model_run_hour_str,
+    forecast_hours_to_generate, parameters_to_plot,
+    max_render_workers=None, max_concurrent_downloads=None,
+    for_console_output=None
+):
+    """
+    Generates every (forecast hour, parameter) plot of one model run in parallel.
+
+    Returns a list of per-job result dicts:
+        {'fhr', 'param', 'success', 'skipped', 'image_path', 'error'}
+    """
+    if for_console_output is None:
+        for_console_output = print
+    model_name = MODEL_PLOT_SETTINGS[model_key]['display_name']
+    max_render_workers = max_render_workers or get_max_render_workers()
+    max_concurrent_downloads = max_concurrent_downloads or get_max_concurrent_downloads()
+
+    job_results = []
+    job_results_lock = threading.Lock()
+
+    def record_result(fhr_fmt, param_details, success, image_path=None, error=None, skipped=False):
+        with job_results_lock:
+            job_results.append({
+                'fhr': fhr_fmt,
+                'param': param_details.get('output_file_prefix'),
+                'success': success,
+                'skipped': skipped,
+                'image_path': image_path,
+                'error': error,
+            })
+
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, 'model_plots'), exist_ok=True)
+    render_executor = _make_render_executor(max_render_workers, for_console_output)
+    # Each queued render job holds a decoded field in memory; don't let downloads run too far ahead
+    render_slots = threading.BoundedSemaphore(max(2, max_render_workers * 2))
+    render_futures = []
+    render_futures_lock = threading.Lock()
+    serial_render_lock = threading.Lock()
+
+    def render_done_callback(fhr_fmt, param_details):
+        def callback(future):
+            render_slots.release()
+            try:
+                success, image_path, error = future.result()
+            except Exception as e: # Worker process died, pickling failed, etc.
+                success, image_path, error = False, None, str(e)
+            record_result(fhr_fmt, param_details, success, image_path, error)
+            status = "OK" if success else f"FAILED ({error})"
+            for_console_output(f"    [render_pool] {model_name} {param_details.get('output_file_prefix')} F{fhr_fmt}: {status}")
+        return callback
+
+    def run_download_stage(fhr_fmt, handled_prefixes):
+        """Download, decode and queue renders for one hour, adding each param to handled_prefixes once it has a result (or a render job)."""
+        existing_results, params_to_generate = get_params_needing_plots(
+            parameters_to_plot, run_date_str, model_run_hour_str, fhr_fmt, for_console_output)
+        for param_details in parameters_to_plot:
+            if param_details.get('output_file_prefix') in existing_results:
+                record_result(fhr_fmt, param_details, True, existing_results[param_details.get('output_file_prefix')][1], skipped=True)
+                handled_prefixes.add(param_details.get('output_file_prefix'))
+        if not params_to_generate:
+            return
+
+        fields = download_and_extract_forecast_hour(model_key, run_date_str, model_run_hour_str, fhr_fmt,
+                                                    [p for p, _ in params_to_generate], for_console_output)
+
+        for param_details, output_image_full_path in params_to_generate:
+            handled_prefixes.add(param_details.get('output_file_prefix'))
+            field = fields.get(param_details.get('output_file_prefix'))
+            if field is None:
+                record_result(fhr_fmt, param_details, False, error="GRIB download or decode failed")
+                continue
+
+            job_args = (model_key, run_date_str, model_run_hour_str, fhr_fmt, param_details, field, output_image_full_path)
+            if render_executor is None:
+                with serial_render_lock: # matplotlib isn't guaranteed thread safe; downloads still overlap with rendering
+                    success, image_path, error = _render_job(*job_args)
+                record_result(fhr_fmt, param_details, success, image_path, error)
+                continue
+
+            render_slots.acquire()
+            try:
+                future = render_executor.submit(_render_job, *job_args)
+            except Exception as e:
+                render_slots.release()
+                record_result(fhr_fmt, param_details, False, error=str(e))
+                continue
+            future.add_done_callback(render_done_callback(fhr_fmt, param_details))
+            with render_futures_lock:
+                render_futures.append(future)
+
+    def download_stage(fhr_str):
+        try:
+            fhr_fmt = format_model_forecast_hour(model_key, fhr_str)
+        except ValueError as e:
+            for_console_output(f"    ERROR: Invalid forecast hour '{fhr_str}' for {model_name}: {e}")
+            for param_details in parameters_to_plot:
+                record_result(fhr_str, param_details, False, error=str(e))
+            return
+
+        handled_prefixes = set()
+        try:
+            run_download_stage(fhr_fmt, handled_prefixes)
+        except Exception as e:
+            # Every param of the hour still gets a result, so callers see the real error
+            for_console_output(f"    ERROR (render_pool): {model_name} F{fhr_fmt} download stage failed: {e}")
+            traceback.print_exc()
+            for param_details in parameters_to_plot:
+                if param_details.get('output_file_prefix') not in handled_prefixes:
+                    record_result(fhr_fmt, param_details, False, error=str(e))
+
+    start_time = time.monotonic()
+    for_console_output(f"  [render_pool] {model_name} {run_date_str} {model_run_hour_str}Z: {len(forecast_hours_to_generate)} hour(s) x "
+                       f"{len(parameters_to_plot)} param(s), {max_concurrent_downloads} download thread(s), "
+                       f"{max_render_workers if render_executor else 1} render worker(s)")
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrent_downloads) as download_executor:
+            download_futures = [download_executor.submit(download_stage, fhr_str) for fhr_str in forecast_hours_to_generate]
+            for future in download_futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    for_console_output(f"    ERROR (render_pool): Download stage crashed: {e}")
+                    traceback.print_exc()
+        with render_futures_lock:
+            pending_render_futures = list(render_futures)
+        wait(pending_render_futures)
+    finally:
+        if render_executor is not None:
+            render_executor.shutdown(wait=True)
+
+    succeeded = sum(1 for result in job_results if result['success'])
+    for_console_output(f"  [render_pool] {model_name} {run_date_str} {model_run_hour_str}Z finished in {time.monotonic() - start_time:.1f}s: "
+                       f"{succeeded} OK, {len(job_results) - succeeded} failed.")
+    return job_results
@@ -0,0 +1,171 @@
+# weather/run_discovery.py
+#
+# Finds which model cycles and forecast hours are actually posted on NOMADS.
+#
+# Instead of guessing the newest run from a fixed wall-clock offset, we send
+# cheap HEAD requests for the .idx inventory files (NOMADS writes the .idx after
+# its GRIB file is complete, so an .idx means that hour is ready). Hours of a
+# cycle are posted in order, so the newest posted hour is found with a binary
+# search: ~6 HEAD requests for the 53 NAM hours. Results are cached for a
+# couple of minutes so views and tasks can call this freely.
+#
+# When NOMADS is slow or down the probes would each wait out their timeout,
+# so one probe_model_runs() call gets PROBE_TIME_BUDGET_SECONDS in total, and
+# "nothing found" is cached too (for DISCOVERY_NOT_FOUND_TTL_SECONDS) so page
+# views don't all probe again.
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from .grib_processing import MODEL_PLOT_SETTINGS, format_model_forecast_hour
+
+DISCOVERY_CACHE_TTL_SECONDS = 120
+DISCOVERY_NOT_FOUND_TTL_SECONDS = 30
+DISCOVERY_NOT_FOUND = 'not_found' # Cached in place of None, which the cache can't tell from a miss
+HEAD_REQUEST_TIMEOUT_SECONDS = 10
+PROBE_TIME_BUDGET_SECONDS = 15 # All HEADs of one probe_model_runs() call together
+CYCLE_INTERVAL_HOURS = 6
+CYCLES_TO_SEARCH = 5 # Look back ~1 day of 6-hourly cycles
+
+
+class ProbeTimeBudgetExceeded(Exception):
+    pass
+
+
+def _get_discovery_cache_key(model_key):
+    return f"model_run_discovery_{model_key}"
+
+
+def _get_cycle_starts(now_utc, cycles_to_search=CYCLES_TO_SEARCH):
+    """Returns the most recent cycle start times (newest first)."""
+    newest_cycle = now_utc.replace(minute=0, second=0, microsecond=0)
+    newest_cycle -= timedelta(hours=newest_cycle.hour % CYCLE_INTERVAL_HOURS)
+    return [newest_cycle - timedelta(hours=CYCLE_INTERVAL_HOURS * i) for i in range(cycles_to_search)]
+
+
+def _forecast_hour_is_posted(model_key, run_date_str, run_hour_str, fhr_str, session, deadline):
+    """
+    HEADs the .idx for one forecast hour. Any error counts as 'not posted'.
+    Raises ProbeTimeBudgetExceeded once time.monotonic() passes deadline.
+    """
+    remaining_seconds = deadline - time.monotonic()
+    if remaining_seconds <= 0:
+        raise ProbeTimeBudgetExceeded()
+    model_settings = MODEL_PLOT_SETTINGS[model_key]
+    grib_url = model_settings['url_template'].format(
+        run_date=run_date_str, run_hour=run_hour_str, fhr=format_model_forecast_hour(model_key, fhr_str))
+    try:
+        response = session.head(f"{grib_url}.idx", timeout=min(HEAD_REQUEST_TIMEOUT_SECONDS, remaining_seconds),
+                                allow_redirects=True)
+        return response.status_code == 200
+    except requests.exceptions.Timeout:
+        if time.monotonic() >= deadline:
+            raise ProbeTimeBudgetExceeded()
+        return False
+    except requests.exceptions.RequestException:
+        return False
+
+
+def _count_posted_forecast_hours(model_key, run_date_str, run_hour_str, forecast_hours, session, deadline):
+    """
+    Returns how many of forecast_hours (in posting order) are available,
+    using a binary search over the HEAD probes.
+    """
+    low, high = 0, len(forecast_hours) # Invariant: hours[:low] posted, hours[high:] not posted
+    while low < high:
+        middle = (low + high) // 2
+        if _forecast_hour_is_posted(model_key, run_date_str, run_hour_str, forecast_hours[middle], session, deadline):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def probe_model_runs(model_key, forecast_hours=None, for_console_output=None):
+    """
+    Probes NOMADS for the newest cycle of a model. Returns a dict:
+        {
+          'run_date': 'YYYYMMDD', 'run_hour': 'HH',       # newest cycle with any hours posted
+          'available_fhrs': [...],                        # its forecast hours posted so far
+          'is_complete': bool,                            # all forecast_hours posted?
+          'latest_complete_run': ('YYYYMMDD', 'HH') or None,
+          'probed_at': ISO timestamp,
+          'probe_timed_out': bool,                        # budget ran out before latest_complete_run was settled
+        }
+    or None if no recent cycle could be found within PROBE_TIME_BUDGET_SECONDS.
+    """
+    if for_console_output is None:
+        for_console_output = print
+    if forecast_hours is None:
+        forecast_hours = MODEL_PLOT_SETTINGS[model_key]['forecast_hours']
+
+    admin_email = getattr(settings, 'ADMIN_EMAIL_FOR_NWS_USER_AGENT', 'DjangoWeatherApp/1.0')
+    now_utc = datetime.now(timezone.utc)
+    deadline = time.monotonic() + PROBE_TIME_BUDGET_SECONDS
+    discovery = None
+
+    with requests.Session() as session:
+        session.headers['User-Agent'] = f"WeatherAppRunDiscovery/1.0 ({admin_email})"
+        try:
+            for cycle_start in _get_cycle_starts(now_utc):
+                run_date_str, run_hour_str = cycle_start.strftime("%Y%m%d"), cycle_start.strftime("%H")
+
+                if discovery is None:
+                    posted_count = _count_posted_forecast_hours(model_key, run_date_str, run_hour_str, forecast_hours, session, deadline)
+                    if posted_count == 0:
+                        continue
+                    discovery = {
+                        'run_date': run_date_str,
+                        'run_hour': run_hour_str,
+                        'available_fhrs': list(forecast_hours[:posted_count]),
+                        'is_complete': posted_count == len(forecast_hours),
+                        'latest_complete_run': None,
+                        'probed_at': now_utc.isoformat(),
+                        'probe_timed_out': False,
+                    }
+                    if discovery['is_complete']:
+                        discovery['latest_complete_run'] = (run_date_str, run_hour_str)
+                        break
+                elif _forecast_hour_is_posted(model_key, run_date_str, run_hour_str, forecast_hours[-1], session, deadline):
+                    # Older cycle: it's complete if its last hour is there
+                    discovery['latest_complete_run'] = (run_date_str, run_hour_str)
+                    break
+        except ProbeTimeBudgetExceeded:
+            # A cycle found before the budget ran out is still right; only the complete-cycle search is cut short
+            if discovery is not None:
+                discovery['probe_timed_out'] = True
+            for_console_output(f"  WARNING (run_discovery): {model_key.upper()} probe stopped after {PROBE_TIME_BUDGET_SECONDS}s; NOMADS is slow or down.")
+
+    if discovery:
+        for_console_output(f"  DEBUG (run_discovery): {model_key.upper()} newest cycle {discovery['run_date']} {discovery['run_hour']}Z, "
+                           f"{len(discovery['available_fhrs'])}/{len(forecast_hours)} hours posted; "
+                           f"latest complete cycle: {discovery['latest_complete_run']}")
+    else:
+        for_console_output(f"  WARNING (run_discovery): No {model_key.upper()} cycle found on NOMADS in the last {CYCLES_TO_SEARCH} cycles.")
+    return discovery
+
+
+def discover_latest_model_run(model_key, for_console_output=None, use_cache=True):
+    """Cached wrapper around probe_model_runs() (see DISCOVERY_CACHE_TTL_SECONDS)."""
+    if for_console_output is None:
+        for_console_output = print
+
+    cache_key = _get_discovery_cache_key(model_key)
+    if use_cache:
+        cached_discovery = cache.get(cache_key)
+        if cached_discovery == DISCOVERY_NOT_FOUND:
+            return None
+        if cached_discovery is not None:
+            return cached_discovery
+
+    discovery = probe_model_runs(model_key, for_console_output=for_console_output)
+    if discovery is not None:
+        # A cut-short probe is only kept as long as "not found", so a better answer replaces it soon
+        cache_ttl_seconds = DISCOVERY_NOT_FOUND_TTL_SECONDS if discovery['probe_timed_out'] else DISCOVERY_CACHE_TTL_SECONDS
+        cache.set(cache_key, discovery, cache_ttl_seconds)
+    else:
+        cache.set(cache_key, DISCOVERY_NOT_FOUND, DISCOVERY_NOT_FOUND_TTL_SECONDS)
+    return discovery
@@ -101,6 +101,55 @@ document.addEventListener('DOMContentLoaded', function () {
         };
     }
 
+    // --- Loop data: every frame of the param's newest run, fetched once per param ---
+    // With it, scrubbing the slider is answered locally instead of one API call per frame.
+    const loopDataByParam = {};
+
+    function loadModelLoop(paramCode) {
+        if (typeof jsLoopApiUrl === 'undefined' || !jsLoopApiUrl || loopDataByParam[paramCode]) return;
+        loopDataByParam[paramCode] = 'loading';
+        fetch(`${jsLoopApiUrl}?param=${paramCode}`)
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                if (!data) { delete loopDataByParam[paramCode]; return; }
+                loopDataByParam[paramCode] = data;
+                console.log(`Loop loaded for ${paramCode}: ${data.frames.filter(f => f.available).length} frame(s) of run ${data.run}`);
+                preloadNeighboringImages(currentSelectedFHR, currentSelectedParamCode);
+            })
+            .catch(error => {
+                console.warn("Could not load model loop:", error);
+                delete loopDataByParam[paramCode];
+            });
+    }
+
+    function getLoopFrame(paramCode, fhr) {
+        const loop = loopDataByParam[paramCode];
+        if (!loop || loop === 'loading') return null;
+        return loop.frames.find(frame => frame.available && parseInt(frame.fhr, 10) === parseInt(fhr, 10)) || null;
+    }
+
+    function getLoopFrameData(fhr, paramCode) {
+        // Same shape as the per-frame API response, built locally from the loop data
+        const frame = getLoopFrame(paramCode, fhr);
+        if (!frame) return null;
+        const loop = loopDataByParam[paramCode];
+        return {
+            image_exists: true, image_url: frame.image_url,
+            status_message: `Run: ${loop.formatted_run_time_local} | Forecast F${frame.fhr} Valid: ${frame.formatted_valid_time_local}`,
+            page_title: `GFS ${loop.param_name} - F${frame.fhr} (${loop.run.slice(-3)})`,
+            main_heading: `GFS ${loop.param_name} - F${frame.fhr}`,
+            formatted_run_time_local: loop.formatted_run_time_local,
+            formatted_valid_time_local: frame.formatted_valid_time_local,
+            current_fhr: frame.fhr, current_param_code: paramCode
+        };
+    }
+
+    function getPreloadUrl(paramCode, paramPrefix, fhr) {
+        const loopFrame = getLoopFrame(paramCode, fhr);
+        if (loopFrame) return loopFrame.image_url;
+        return buildImageUrl(paramPrefix, gfsRunDateStrGlobal, gfsModelRunHourStrGlobal, fhr);
+    }
+
     function preloadNeighboringImages(targetFHR, targetParamCode, numNeighbors = 2) {
         console.log(`Preloading neighbors for GFS - FHR: ${targetFHR}, Param: ${targetParamCode}`);
         const paramPrefix = getParameterPrefix(targetParamCode);
@@ -118,11 +167,11 @@ document.addEventListener('DOMContentLoaded', function () {
         for (let i = 1; i <= numNeighbors; i++) {
             if (currentIndex - i >= 0) {
                 const prevFHR = availableFHRsList[currentIndex - i];
-                actualPreloadImage(buildImageUrl(paramPrefix, gfsRunDateStrGlobal, gfsModelRunHourStrGlobal, prevFHR));
+                actualPreloadImage(getPreloadUrl(targetParamCode, paramPrefix, prevFHR));
             }
             if (currentIndex + i < availableFHRsList.length) {
                 const nextFHR = availableFHRsList[currentIndex + i];
-                actualPreloadImage(buildImageUrl(paramPrefix, gfsRunDateStrGlobal, gfsModelRunHourStrGlobal, nextFHR));
+                actualPreloadImage(getPreloadUrl(targetParamCode, paramPrefix, nextFHR));
             }
         }
     }
@@ -191,7 +240,9 @@ document.addEventListener('DOMContentLoaded', function () {
         const urlToFetch = `${jsApiUrl}?fhr=${fhr}&param=${paramCode}`;
         console.log("Constructed URL for fetch:", urlToFetch);
 
-        fetch(urlToFetch)
+        // Frames already in the loop data don't need a round trip
+        const loopFrameData = getLoopFrameData(fhr, paramCode);
+        const modelDataPromise = loopFrameData ? Promise.resolve(loopFrameData) : fetch(urlToFetch)
             .then(response => {
                 if (!response.ok) {
                     return response.text().then(text => {
@@ -199,7 +250,9 @@ document.addEventListener('DOMContentLoaded', function () {
                     });
                 }
                 return response.json();
-            })
+            });
+
+        modelDataPromise
             .then(data => {
                 console.log("API JSON Response:", data);
                 currentSelectedFHR = data.current_fhr; // API provides correctly padded string
@@ -214,6 +267,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
                 // --- Trigger preloading after successful fetch and state update ---
                 preloadNeighboringImages(currentSelectedFHR, currentSelectedParamCode);
+                loadModelLoop(currentSelectedParamCode);
 
                 const restoreScroll = () => window.scrollTo(0, currentScrollY);
 
@@ -315,6 +369,7 @@ document.addEventListener('DOMContentLoaded', function () {
         if (modelValidTimeDisplayElement) modelValidTimeDisplayElement.textContent = initialValidTime;
         updateActiveButtons();
         preloadNeighboringImages(initialFHR, initialParamCode);
+        loadModelLoop(initialParamCode);
     } else if (initialParamCode && initialFHR && jsApiUrl) {
         console.log("No initial image visible/valid from Django, or initial params require JS fetch. Fetching and then preloading.");
         fetchModelPlot(initialFHR, initialParamCode);
@@ -1,228 +1,37 @@
 # weather/tasks.py
 
-from weather.grib_processing import (
-    get_latest_gfs_rundate_and_hour, 
-    generate_gfs_parameter_plot, # Or generate_model_parameter_plot if you renamed the GFS one
-    get_latest_nam_rundate_and_hour,    # <<< NEW IMPORT
-    generate_nam_parameter_plot     # <<< NEW IMPORT
-)
+from weather.ingestion import ingest_model_updates
+from weather.model_params import get_model_parameters
 
-try:
-    import numpy as np
-except ImportError:
-    print("WARNING: NumPy not imported in tasks.py, but grib_processing might need it for plot_levels.")
-    np = None # Fallback, though grib_processing defines its own levels
+from datetime import datetime, timezone
 
+# Parameter definitions live in the shared registry (weather/model_params.py)
+GFS_PARAMETERS_TO_PLOT = get_model_parameters('gfs')
+NAM_PARAMETERS_TO_PLOT = get_model_parameters('nam')
 
-from weather.grib_processing import get_latest_gfs_rundate_and_hour, generate_gfs_parameter_plot
-from django_q.tasks import schedule, Schedule # For potential re-scheduling or checking
-from datetime import datetime, timezone, timedelta
-import os
-from django.conf import settings
 
 def automated_gfs_plot_generation(*args, **kwargs): # Added *args, **kwargs
+    """
+    One GFS ingestion tick (scheduled every few minutes in apps.py).
+    Renders only the frames whose forecast hours were posted since the last tick;
+    the per-cycle manifest lives in the ModelCycle/ModelFrame tables.
+    """
     print(f"[{datetime.now(timezone.utc).isoformat()}] Task: automated_gfs_plot_generation starting...")
 
-    run_date_str, model_run_hour_str = get_latest_gfs_rundate_and_hour(print)
-
-    forecast_hours_to_generate = [f"{h:03d}" for h in range(0, 144, 3)] # e.g., F000, F006, ... F120
-#    forecast_hours_to_generate = ["06"]
-    # --- DEFINE PARAMETERS TO PLOT ---
-    parameters_to_plot = [
-        {
-            'grib_short_name': '2t', 'grib_level': 2, 'grib_type_of_level': 'heightAboveGround',
-            'output_file_prefix': 'gfs_t2m', 'plot_title_param_name': '2m Temperature',
-            'plot_unit_label': 'Temperature (deg F)', 'plot_cmap': 'jet',
-            'plot_levels': np.arange(0, 105, 5) if np else None, # Use np if available
-            'needs_conversion_to_F': True
-        },
-        {
-            'grib_short_name': 'cape', 'grib_level': 0, 'grib_type_of_level': 'surface', # Surface Based CAPE
-            'output_file_prefix': 'gfs_sbcape', 'plot_title_param_name': 'Surface CAPE',
-            'plot_unit_label': 'SBCAPE (J/kg)', 'plot_cmap': 'magma_r', # Or 'viridis', 'plasma'
-            'plot_levels': np.arange(0, 5001, 250) if np else None, # Levels for CAPE
-            'needs_conversion_to_F': False
-        },
-        { # --- ADD OR VERIFY THIS ENTRY FOR COMPOSITE REFLECTIVITY ---
-           'grib_short_name': 'refc', 
-           'grib_level': 0, 
-           'grib_type_of_level': 'atmosphere', # Was 'entireAtmosphereConsideredAsASingleLayer'
-           'output_file_prefix': 'gfs_refc', 
-           'plot_title_param_name': 'Sim. Comp. Reflectivity',
-           'plot_unit_label': 'Reflectivity (dBZ)', 
-           'plot_cmap': 'turbo', # Or 'turbo'
-           'plot_levels': list(range(5, 76, 5)) if np is None else np.arange(5, 76, 5),
-           'needs_conversion_to_F': False
-       }
-    # --- END REFLECTIVITY ENTRY ---
-
-    ]
-    # --- END PARAMETER DEFINITIONS ---
-
-    print(f"  Target GFS Run: {run_date_str} {model_run_hour_str}Z")
-    print(f"  Will attempt to generate plots for FHRs: {forecast_hours_to_generate}")
-    print(f"  For parameters: {[p['plot_title_param_name'] for p in parameters_to_plot]}")
-
-    generated_count_total = 0
-    failed_count_total = 0
-
-    for param_config in parameters_to_plot:
-        print(f"\n  Processing Parameter: {param_config['plot_title_param_name']}")
-        current_param_generated = 0
-        current_param_failed = 0
-        for fhr_str in forecast_hours_to_generate:
-            # Check if image for this specific run, param, and fhr already exists
-            output_image_name_check = f"{param_config['output_file_prefix']}_{run_date_str}_{model_run_hour_str}z_f{fhr_str}.png"
-            output_image_full_path_check = os.path.join(settings.MEDIA_ROOT, 'model_plots', output_image_name_check)
-
-            if os.path.exists(output_image_full_path_check):
-                print(f"    Plot for {param_config['plot_title_param_name']} F{fhr_str} (Run: {run_date_str} {model_run_hour_str}Z) already exists. Skipping.")
-                current_param_generated +=1
-                continue
-
-            print(f"    Generating {param_config['plot_title_param_name']} plot for F{fhr_str}...")
-            # Ensure generate_gfs_parameter_plot is correctly imported if it's in grib_processing.py
-            success, _ = generate_gfs_parameter_plot( # Call the generic plot function
-                run_date_str,
-                model_run_hour_str,
-                fhr_str,
-                param_config, # Pass the whole details dictionary
-                print 
-            )
-            if success:
-                current_param_generated += 1
-            else:
-                current_param_failed += 1
-
-        generated_count_total += current_param_generated
-        failed_count_total += current_param_failed
-        print(f"  Finished processing for {param_config['plot_title_param_name']}. Generated: {current_param_generated}, Failed: {current_param_failed}")
-
-    print(f"[{datetime.now(timezone.utc).isoformat()}] Task: automated_gfs_plot_generation finished. Total Generated: {generated_count_total}, Total Failed: {failed_count_total} for run {run_date_str} {model_run_hour_str}Z.")
+    summary = ingest_model_updates('gfs', GFS_PARAMETERS_TO_PLOT, print)
 
+    print(f"[{datetime.now(timezone.utc).isoformat()}] Task: automated_gfs_plot_generation finished. New frames: {summary['claimed']}, "
+          f"Generated: {summary['done']}, Failed: {summary['failed']} (newest run {summary['run']}).")
+    # Django-Q stores the return value with the task, so each tick's outcome is visible in the admin
+    return summary
 
 
 def automated_nam_plot_generation(*args, **kwargs): # Accept args for scheduler
+    """One NAM ingestion tick; see automated_gfs_plot_generation. MODEL_CYCLE_EXECUTORS = {'nam': 'dask'} renders it as one dask graph (cycle_graph.py)."""
     print(f"[{datetime.now(timezone.utc).isoformat()}] Task: automated_nam_plot_generation starting...")
 
-    run_date_str, model_run_hour_str = get_latest_nam_rundate_and_hour(print)
-
-    # NAM forecast hours: Hourly out to F36, then 3-hourly out to F84 for awphys products.
-    # Let's generate a selection: e.g., F00, F01, F02, F03, then every 3 hours.
-    forecast_hours_to_generate = []
-    for h in range(0, 37): # Hourly from 00 to 36
-        forecast_hours_to_generate.append(f"{h:02d}")
-    for h in range(39, 85, 3): # 3-hourly from 39 to 84
-        forecast_hours_to_generate.append(f"{h:02d}")
-    # Remove duplicates if any and sort (though above logic should be fine)
-    # forecast_hours_to_generate = sorted(list(set(forecast_hours_to_generate)))
-
-    # --- DEFINE NAM PARAMETERS TO PLOT ---
-    # For now, just Simulated Composite Reflectivity
-    # Ensure numpy (np) is imported at the top of tasks.py if using np.arange here
-    nam_parameters_to_plot = [
-        { 
-           'grib_short_name': 'refc', 
-           'grib_level': 0, 
-           'grib_type_of_level': 'atmosphereSingleLayer', # Was 'entireAtmosphereConsideredAsASingleLayer'
-           'output_file_prefix': 'nam_refc', 
-           'plot_title_param_name': 'Sim. Comp. Reflectivity',
-           'plot_unit_label': 'Reflectivity (dBZ)', 
-           'plot_cmap': 'gist_ncar', 
-           'plot_levels': list(range(5, 76, 5)) if np is None else np.arange(5, 76, 5),
-           'needs_conversion_to_F': False 
-        },
-        { 
-            'grib_short_name': 'cape', 'grib_level': 0, 'grib_type_of_level': 'surface',
-            'output_file_prefix': 'nam_sbcape', 'plot_title_param_name': 'Surface CAPE',
-            'plot_unit_label': 'SBCAPE (J/kg)', 'plot_cmap': 'magma_r',
-            'plot_levels': np.arange(0, 5001, 250),
-            'needs_conversion_to_F': False
-        },
-        { 
-            'grib_short_name': '2d', #was 2d 
-            'grib_level': 2, 
-            'grib_type_of_level': 'heightAboveGround',
-            'output_file_prefix': 'nam_dewp2m', 
-            'plot_title_param_name': '2m Dew Point',
-            'plot_unit_label': 'Dew Point (°F)', 
-            'plot_cmap': 'BuGn', # Colormap
-            'plot_levels': np.arange(0, 91, 2), # 0°F to 90°F in steps of 2°F
-            'needs_conversion_to_F': True 
-        },
-        {
-            # You can choose to select by shortName or full name.
-            # The robust selection logic in grib_processing.py will handle either.
-            'grib_short_name': 'hlcy',                 # From GRIB dump
-            # 'select_by_name': 'Storm relative helicity', # Alternative, also from GRIB dump
-
-            'grib_level': 3000,                        # From 'level' field in GRIB dump
-            'grib_type_of_level': 'heightAboveGroundLayer', # From GRIB dump
-            'grib_top_level': 3000,                    # From GRIB dump (convert to int)
-            'grib_bottom_level': 0,                     # From GRIB dump (convert to int)
-
-            'output_file_prefix': 'nam_srh_3km',       # As per your current logs
-            'plot_title_param_name': 'NAM 3km Storm Relative Helicity', # Or "NAM 0-3km SRH"
-            'plot_unit_label': 'SRH (m²/s²)',          # 'units' from GRIB dump is 'm**2 s**-2'
-            'plot_cmap': 'BuPu',
-            'plot_levels': np.arange(50, 601, 50) if 'np' in globals() else list(range(50, 601, 50)),
-            'needs_conversion_to_F': False
-        },
-        {
-            'grib_short_name': 'ltng',
-            'grib_level': 0,
-            'grib_type_of_level': 'surface',
-            'output_file_prefix': 'nam_ltng_sfc', # sfc for surface
-            'plot_title_param_name': 'NAM Surface Lightning',
-            'plot_unit_label': 'Lightning Activity', # We will confirm units from GRIB dump
-            'plot_cmap': 'hot_r',                   # 'inferno', 'magma', 'plasma' are also good for activity
-            'plot_levels': np.arange(0, 11, 1) if np else list(range(0,11,1)), # GUESS: If it's an index or low count. Adjust based on data.
-            'needs_conversion_to_F': False
-        }
-
-
-    ]
-
-
-    # --- END NAM PARAMETER DEFINITIONS ---
-
-    print(f"  Target NAM Run: {run_date_str} {model_run_hour_str}Z")
-    print(f"  Will attempt to generate NAM plots for FHRs: {forecast_hours_to_generate}")
-    print(f"  For NAM parameters: {[p['plot_title_param_name'] for p in nam_parameters_to_plot]}")
-
-    generated_count_total = 0
-    failed_count_total = 0
-
-    for param_config in nam_parameters_to_plot:
-        print(f"\n  Processing NAM Parameter: {param_config['plot_title_param_name']}")
-        current_param_generated = 0
-        current_param_failed = 0
-        for fhr_str in forecast_hours_to_generate:
-            # Check if image for this specific run, param, and fhr already exists
-            output_image_name_check = f"{param_config['output_file_prefix']}_{run_date_str}_{model_run_hour_str}z_f{fhr_str}.png"
-            output_image_full_path_check = os.path.join(settings.MEDIA_ROOT, 'model_plots', output_image_name_check)
-
-            if os.path.exists(output_image_full_path_check):
-                print(f"    Plot for NAM {param_config['plot_title_param_name']} F{fhr_str} (Run {run_date_str} {model_run_hour_str}Z) already exists. Skipping.")
-                current_param_generated +=1
-                continue
-
-            print(f"    Generating NAM {param_config['plot_title_param_name']} plot for F{fhr_str}...")
-
-            success, _ = generate_nam_parameter_plot( # Call the NAM-specific plot function
-                run_date_str,
-                model_run_hour_str,
-                fhr_str,        # This is the argument for forecast_hour_str_arg
-                param_config,   # Pass the whole details dictionary
-                print           # Pass print for logging
-            )
-            if success:
-                current_param_generated += 1
-            else:
-                current_param_failed += 1
-
-        generated_count_total += current_param_generated
-        failed_count_total += current_param_failed
-        print(f"  Finished processing for NAM {param_config['plot_title_param_name']}. Generated this run: {current_param_generated}, Failed this run: {current_param_failed}")
+    summary = ingest_model_updates('nam', NAM_PARAMETERS_TO_PLOT, print)
 
-    print(f"[{datetime.now(timezone.utc).isoformat()}] Task: automated_nam_plot_generation finished. Total new/updated NAM plots: {generated_count_total}, Total failed: {failed_count_total} for run {run_date_str} {model_run_hour_str}Z.")
+    print(f"[{datetime.now(timezone.utc).isoformat()}] Task: automated_nam_plot_generation finished. New frames: {summary['claimed']}, "
+          f"Generated: {summary['done']}, Failed: {summary['failed']} (newest run {summary['run']}).")
+    return summary
@@ -1,3 +1,945 @@
-from django.test import TestCase
+import os
+import re
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as python_dt_timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import SavedLocation
+
+from .grib_fetch import parse_grib_idx, merge_byte_ranges, download_grib_subset, download_grib_file
+from .derived_fields import KT_PER_MS, _bulk_shear, _dewpoint_depression, _significant_tornado_parameter
+from .grib_processing import MODEL_PLOT_SETTINGS, decode_grib_file
+from .field_store import DATA_ALIGNMENT_BYTES, FIELD_FILE_MAGIC, load_field, store_field
+from .field_transforms import apply_field_transforms
+from .ingestion import (MAX_FRAME_ATTEMPTS, CYCLE_EXPIRY_HOURS, sync_cycle_manifest, claim_ready_frames,
+                        update_cycle_status, expire_old_cycles)
+from .models import ModelCycle, ModelFrame
+from .plot_output import IMMUTABLE_PLOT_DIR, save_figure_atomically, get_published_plot_path, delete_run_plots
+from . import grid_cache, plot_manifest
+from .model_loops import build_model_loop
+from .point_forecast import get_point_forecast, sample_frames_at_locations, find_locations_exceeding
+from .run_discovery import (PROBE_TIME_BUDGET_SECONDS, _get_cycle_starts, _get_discovery_cache_key, probe_model_runs,
+                            discover_latest_model_run)
+from .model_params import get_grib_parameters
+from .management.commands.benchmark_grib_engines import get_default_fixture_path
+
+
+def make_fixture_grib_message(variable, size):
+    """A stand-in GRIB2 message: right framing ('GRIB' ... '7777'), padded to size bytes."""
+    body = f"{variable}:".encode()
+    return b'GRIB' + body + b'\0' * (size - len(body) - 8) + b'7777'
+
+
+# (variable, level, size) of each message in the fixture file, in file order
+FIXTURE_GRIB_MESSAGES = [
+    ('TMP', '2 m above ground', 1000),
+    ('DPT', '2 m above ground', 1200),
+    ('CAPE', 'surface', 800),
+    ('REFC', 'entire atmosphere', 600),
+    ('HGT', '500 mb', 300 * 1024), # Bigger than RANGE_MERGE_GAP_BYTES, so what's either side of it is fetched separately
+    ('PRMSL', 'mean sea level', 900),
+]
+
+
+def make_fixture_grib_and_idx():
+    """Returns (grib bytes, .idx text) for FIXTURE_GRIB_MESSAGES, laid out like a NOMADS file."""
+    grib_bytes = b''
+    idx_lines = []
+    for message_number, (variable, level, size) in enumerate(FIXTURE_GRIB_MESSAGES, start=1):
+        idx_lines.append(f"{message_number}:{len(grib_bytes)}:d=2025060112:{variable}:{level}:anl:")
+        grib_bytes += make_fixture_grib_message(variable, size)
+    return grib_bytes, '\n'.join(idx_lines) + '\n'
+
+
+class FixtureGribHandler(BaseHTTPRequestHandler):
+    """Serves the server's 'files' ({path: bytes}), honoring single Range requests unless told not to."""
+
+    def do_GET(self):
+        self.server.requests_seen.append((self.path, self.headers.get('Range')))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        range_match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if range_match and self.server.honor_ranges:
+            start_byte = int(range_match.group(1))
+            end_byte = int(range_match.group(2)) if range_match.group(2) else len(content) - 1
+            content = content[start_byte:end_byte + 1]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GribFetchTests(SimpleTestCase):
+    """weather/grib_fetch.py against a local stand-in for NOMADS."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.grib_bytes, cls.idx_text = make_fixture_grib_and_idx()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureGribHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.files = {'/gfs.t12z.f000': self.grib_bytes, '/gfs.t12z.f000.idx': self.idx_text.encode()}
+        self.server.honor_ranges = True
+        self.server.requests_seen = []
+        self.temp_dir = tempfile.mkdtemp()
+        self.local_grib_filename = os.path.join(self.temp_dir, 'subset.grib2')
+        self.grib_url = f"{self.base_url}/gfs.t12z.f000"
+        self.console_lines = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_params(self, *codes):
+        params = {
+            't2m': {'output_file_prefix': 't2m', 'grib_short_name': '2t', 'grib_type_of_level': 'heightAboveGround', 'grib_level': 2},
+            'dewp': {'output_file_prefix': 'dewp', 'grib_short_name': '2d', 'grib_type_of_level': 'heightAboveGround', 'grib_level': 2},
+            'refc': {'output_file_prefix': 'refc', 'grib_short_name': 'refc', 'grib_type_of_level': 'atmosphere'},
+            'mslp': {'output_file_prefix': 'mslp', 'grib_short_name': 'prmsl', 'grib_type_of_level': 'meanSea'},
+            'ltng': {'output_file_prefix': 'ltng', 'grib_short_name': 'ltng', 'grib_type_of_level': 'atmosphere'},
+        }
+        return [params[code] for code in codes]
+
+    def expected_bytes(self, *message_indices):
+        offsets = [0]
+        for _, _, size in FIXTURE_GRIB_MESSAGES:
+            offsets.append(offsets[-1] + size)
+        return b''.join(self.grib_bytes[offsets[i]:offsets[i + 1]] for i in message_indices)
+
+    def test_parse_grib_idx_ranges(self):
+        entries = parse_grib_idx(self.idx_text)
+        self.assertEqual([entry['variable'] for entry in entries], ['TMP', 'DPT', 'CAPE', 'REFC', 'HGT', 'PRMSL'])
+        self.assertEqual((entries[0]['start_byte'], entries[0]['end_byte']), (0, 999))
+        self.assertEqual((entries[1]['start_byte'], entries[1]['end_byte']), (1000, 2199))
+        self.assertEqual(entries[3]['level'], 'entire atmosphere')
+        # The last message runs to the end of the file
+        self.assertEqual((entries[-1]['start_byte'], entries[-1]['end_byte']), (3600 + 300 * 1024, None))
+
+    def test_parse_grib_idx_sub_messages_and_junk(self):
+        entries = parse_grib_idx("1:0:d=2025060112:UGRD:10 m above ground:anl:\n"
+                                 "1.2:0:d=2025060112:VGRD:10 m above ground:anl:\n"
+                                 "not an idx line\n\n"
+                                 "2:500:d=2025060112:TMP:2 m above ground:anl:\n")
+        self.assertEqual(len(entries), 3)
+        # Sub-messages share their parent's offset, so both end before the next message
+        self.assertEqual([entry['end_byte'] for entry in entries], [499, 499, None])
+
+    def test_merge_byte_ranges_gaps(self):
+        entries = [{'start_byte': 0, 'end_byte': 99}, {'start_byte': 100, 'end_byte': 199},
+                   {'start_byte': 250, 'end_byte': 299}, {'start_byte': 1000, 'end_byte': 1099}]
+        # Touching ranges always merge; the 50-byte gap only when it's within max_gap_bytes
+        self.assertEqual(merge_byte_ranges(entries, max_gap_bytes=0), [(0, 199), (250, 299), (1000, 1099)])
+        self.assertEqual(merge_byte_ranges(entries, max_gap_bytes=50), [(0, 299), (1000, 1099)])
+        self.assertEqual(merge_byte_ranges(entries, max_gap_bytes=10000), [(0, 1099)])
+
+    def test_merge_byte_ranges_open_ended(self):
+        entries = [{'start_byte': 500, 'end_byte': None}, {'start_byte': 0, 'end_byte': 99},
+                   {'start_byte': 0, 'end_byte': 99}]
+        self.assertEqual(merge_byte_ranges(entries, max_gap_bytes=0), [(0, 99), (500, None)])
+        self.assertEqual(merge_byte_ranges(entries, max_gap_bytes=1000), [(0, None)])
+
+    def test_download_grib_subset(self):
+        success, message_positions = download_grib_subset(
+            self.grib_url, self.get_params('dewp', 'mslp'), self.local_grib_filename, self.console_lines.append)
+        self.assertTrue(success)
+        self.assertEqual(message_positions, {'dewp': 1, 'mslp': 2})
+        with open(self.local_grib_filename, 'rb') as f:
+            self.assertEqual(f.read(), self.expected_bytes(1, 5))
+        range_headers = [range_header for path, range_header in self.server.requests_seen if path == '/gfs.t12z.f000']
+        self.assertEqual(range_headers, ['bytes=1000-2199', f'bytes={3600 + 300 * 1024}-'])
+
+    def test_download_grib_subset_merges_nearby_messages(self):
+        # TMP and REFC are 2000 bytes apart, under RANGE_MERGE_GAP_BYTES: one request, with DPT and CAPE in between
+        success, message_positions = download_grib_subset(
+            self.grib_url, self.get_params('t2m', 'refc'), self.local_grib_filename, self.console_lines.append)
+        self.assertTrue(success)
+        self.assertEqual(message_positions, {'t2m': 1, 'refc': 4})
+        with open(self.local_grib_filename, 'rb') as f:
+            self.assertEqual(f.read(), self.expected_bytes(0, 1, 2, 3))
+
+    def test_download_grib_subset_rejects_non_206(self):
+        self.server.honor_ranges = False
+        success, message_positions = download_grib_subset(
+            self.grib_url, self.get_params('dewp'), self.local_grib_filename, self.console_lines.append)
+        self.assertEqual((success, message_positions), (False, {}))
+        self.assertFalse(os.path.exists(self.local_grib_filename))
+        self.assertTrue(any('instead of 206' in line for line in self.console_lines))
+
+    def test_download_grib_subset_without_idx(self):
+        del self.server.files['/gfs.t12z.f000.idx']
+        success, message_positions = download_grib_subset(
+            self.grib_url, self.get_params('dewp'), self.local_grib_filename, self.console_lines.append)
+        self.assertEqual((success, message_positions), (False, {}))
+
+    def assert_full_download(self, params):
+        message_positions = download_grib_file(self.grib_url, params, self.local_grib_filename,
+                                               for_console_output=self.console_lines.append)
+        self.assertEqual(message_positions, {}) # Positions are unknown in a full file
+        with open(self.local_grib_filename, 'rb') as f:
+            self.assertEqual(f.read(), self.grib_bytes)
+        self.assertIn(('/gfs.t12z.f000', None), self.server.requests_seen)
+
+    def test_download_grib_file_falls_back_without_idx(self):
+        del self.server.files['/gfs.t12z.f000.idx']
+        self.assert_full_download(self.get_params('dewp'))
+
+    def test_download_grib_file_falls_back_without_206(self):
+        self.server.honor_ranges = False
+        self.assert_full_download(self.get_params('dewp'))
+
+    def test_download_grib_file_subsets_when_a_param_is_missing_from_idx(self):
+        # LTNG isn't in the .idx: the rest still comes as a subset, and LTNG is left out to fail on its own
+        message_positions = download_grib_file(self.grib_url, self.get_params('dewp', 'ltng'), self.local_grib_filename,
+                                               for_console_output=self.console_lines.append)
+        self.assertEqual(message_positions, {'dewp': 1})
+        with open(self.local_grib_filename, 'rb') as f:
+            self.assertEqual(f.read(), self.expected_bytes(1))
+        self.assertNotIn(('/gfs.t12z.f000', None), self.server.requests_seen)
+
+    def test_download_grib_file_falls_back_when_no_param_is_in_idx(self):
+        self.assert_full_download(self.get_params('ltng'))
+
+    def test_download_grib_file_uses_subset(self):
+        message_positions = download_grib_file(self.grib_url, self.get_params('t2m', 'mslp'), self.local_grib_filename,
+                                               for_console_output=self.console_lines.append)
+        self.assertEqual(message_positions, {'t2m': 1, 'mslp': 2})
+        self.assertNotIn(('/gfs.t12z.f000', None), self.server.requests_seen)
+
+
+class DecodeEngineTests(SimpleTestCase):
+    """pygrib and cfgrib decoding the committed fixtures (weather/test_data/grib) the same way."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        media_override = override_settings(MEDIA_ROOT=os.path.join(self.temp_dir, 'media'))
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assert_engines_agree(self, model_key):
+        # A copy, so cfgrib's index files aren't written into the source tree
+        grib_file = shutil.copy(get_default_fixture_path(model_key), self.temp_dir)
+        param_details_list = get_grib_parameters(model_key)
+        quiet = lambda *args, **kwargs: None
+        pygrib_fields = decode_grib_file(model_key, grib_file, param_details_list, engine='pygrib', for_console_output=quiet)
+        cfgrib_fields = decode_grib_file(model_key, grib_file, param_details_list, engine='cfgrib', for_console_output=quiet)
+
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), sorted(['media', os.path.basename(grib_file)])) # Index files removed
+        for param_details in param_details_list:
+            prefix = param_details['output_file_prefix']
+            with self.subTest(prefix=prefix):
+                self.assertIsNotNone(pygrib_fields[prefix])
+                self.assertIsNotNone(cfgrib_fields[prefix])
+                # Same grid definition from both engines, so one grid cache entry
+                self.assertEqual(pygrib_fields[prefix]['grid_key'], cfgrib_fields[prefix]['grid_key'])
+                np.testing.assert_allclose(pygrib_fields[prefix]['values'], cfgrib_fields[prefix]['values'], rtol=1e-6)
+
+    def test_pygrib_skips_params_missing_from_a_subset(self):
+        param_details_list = get_grib_parameters('gfs')
+        first_prefix = param_details_list[0]['output_file_prefix']
+        fields = decode_grib_file('gfs', get_default_fixture_path('gfs'), param_details_list, {first_prefix: 1},
+                                  engine='pygrib', for_console_output=lambda *args, **kwargs: None)
+        self.assertIsNotNone(fields[first_prefix])
+        self.assertEqual([prefix for prefix, field in fields.items() if field is None],
+                         [param_details['output_file_prefix'] for param_details in param_details_list[1:]])
+
+    def test_gfs_engines_agree(self):
+        self.assert_engines_agree('gfs')
+
+    def test_nam_engines_agree(self):
+        self.assert_engines_agree('nam')
+
+
+class DerivedFieldTests(SimpleTestCase):
+    """The pure math of weather/derived_fields.py."""
+
+    def stp(self, sbcape, srh_1km, shear_6km_ms, dewpoint_depression_f):
+        as_array = lambda values: np.array(values, dtype=np.float32)
+        t2m = as_array([70.0] * len(sbcape))
+        return _significant_tornado_parameter(as_array(sbcape), as_array(srh_1km), as_array(shear_6km_ms) * np.float32(KT_PER_MS),
+                                              t2m, t2m - as_array(dewpoint_depression_f))
+
+    def test_dewpoint_depression(self):
+        np.testing.assert_allclose(_dewpoint_depression(np.array([75.0, 60.0]), np.array([70.0, 60.0])), [5.0, 0.0])
+
+    def test_bulk_shear_in_knots(self):
+        shear = _bulk_shear(np.array([3.0, 0.0], dtype=np.float32), np.array([4.0, -10.0], dtype=np.float32))
+        np.testing.assert_allclose(shear, [5 * KT_PER_MS, 10 * KT_PER_MS], rtol=1e-6)
+
+    def test_stp_reference_values(self):
+        # Every term 1: CAPE 1500, SRH 150, 20 m/s of shear and an LCL under 1000 m (10F spread ~ 700 m)
+        np.testing.assert_allclose(self.stp([1500], [150], [20], [10]), [1.0], rtol=1e-5)
+        np.testing.assert_allclose(self.stp([3000], [300], [20], [10]), [4.0], rtol=1e-5)
+
+    def test_stp_lcl_term(self):
+        # 21.6F spread ~ 1500 m LCL: half; 30F ~ 2080 m: zero
+        np.testing.assert_allclose(self.stp([1500, 1500], [150, 150], [20, 20], [21.6, 30]), [0.5, 0.0], atol=1e-3)
+
+    def test_stp_shear_term(self):
+        # Under 12.5 m/s: zero; 15 m/s: 0.75; capped at 1.5 from 30 m/s up
+        np.testing.assert_allclose(self.stp([1500] * 4, [150] * 4, [12, 15, 30, 40], [10] * 4), [0.0, 0.75, 1.5, 1.5], rtol=1e-5)
+
+    def test_stp_never_negative_and_keeps_nan(self):
+        stp = self.stp([1500, np.nan], [-150, 150], [20, 20], [10, 10])
+        self.assertEqual(stp[0], 0.0)
+        self.assertTrue(np.isnan(stp[1]))
+        self.assertEqual(stp.dtype, np.float32)
+
+
+class FieldStoreTests(SimpleTestCase):
+    """weather/field_store.py: what's stored decodes back to the plotted values."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        media_override = override_settings(MEDIA_ROOT=self.temp_dir)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def store_and_load(self, values, encoding='quantized16'):
+        param_details = {'output_file_prefix': 't2m', 'store_encoding': encoding}
+        field = {'values': values, 'units': 'F', 'grid_key': 'test-grid'}
+        store_field('gfs', '20250601', '12', '006', param_details, field, for_console_output=lambda *args, **kwargs: None)
+        return load_field('gfs', '20250601', '12', 't2m', '006')
+
+    def make_values(self):
+        rows, cols = np.mgrid[0:40, 0:60]
+        return (np.sin(cols / 7.0) * np.cos(rows / 5.0) * 40 + 60).astype(np.float32)
+
+    def test_quantized16_round_trip(self):
+        values = self.make_values()
+        stored = self.store_and_load(values)
+        self.assertEqual(stored.metadata['encoding'], 'quantized16')
+        self.assertEqual(stored.grid_key, 'test-grid')
+        # Within half a quantization step (80 F range / 65534 steps)
+        np.testing.assert_allclose(stored.decode(), values, atol=80 / 65534)
+
+    def test_float16_round_trip(self):
+        values = self.make_values()
+        stored = self.store_and_load(values, encoding='float16')
+        self.assertEqual(stored.raw.dtype, np.dtype('<f2'))
+        np.testing.assert_allclose(stored.decode(), values, rtol=1e-3)
+
+    def test_missing_values(self):
+        # Both masked cells and NaNs are missing
+        data = self.make_values()
+        data[0, :5] = np.nan
+        values = np.ma.masked_greater(data, 90)
+        missing = np.isnan(data) | np.ma.getmaskarray(values)
+        self.assertTrue(np.ma.getmaskarray(values).any())
+        for encoding in ('quantized16', 'float16'):
+            with self.subTest(encoding=encoding):
+                decoded = self.store_and_load(values, encoding=encoding).decode()
+                np.testing.assert_array_equal(np.isnan(decoded), missing)
+                np.testing.assert_allclose(decoded[~missing], data[~missing], rtol=1e-3)
+
+    def test_all_missing(self):
+        for encoding in ('quantized16', 'float16'):
+            with self.subTest(encoding=encoding):
+                stored = self.store_and_load(np.full((4, 5), np.nan), encoding=encoding)
+                self.assertTrue(np.isnan(stored.decode()).all())
+                self.assertIsNone(stored.value_at(2, 3))
+
+    def test_constant_field(self):
+        stored = self.store_and_load(np.full((4, 5), 42.5))
+        self.assertEqual(stored.metadata['scale'], 1.0) # Not 0, which would lose the value
+        np.testing.assert_array_equal(stored.decode(), np.full((4, 5), 42.5, dtype=np.float32))
+        self.assertEqual(stored.value_at(1, 1), 42.5)
+
+    def test_data_is_aligned(self):
+        stored = self.store_and_load(self.make_values())
+        with open(stored.path, 'rb') as f:
+            self.assertEqual(f.read(len(FIELD_FILE_MAGIC)), FIELD_FILE_MAGIC)
+        self.assertEqual(stored.raw.offset % DATA_ALIGNMENT_BYTES, 0)
+        self.assertEqual(os.path.getsize(stored.path) - stored.raw.offset, stored.raw.nbytes)
+
+    def test_slices_and_points_match_full_decode(self):
+        values = self.make_values()
+        values[3, 4] = np.nan
+        for encoding in ('quantized16', 'float16'):
+            with self.subTest(encoding=encoding):
+                stored = self.store_and_load(values, encoding=encoding)
+                full = stored.decode()
+                np.testing.assert_array_equal(stored.decode(slice(10, 20), slice(5, 50, 3)), full[10:20, 5:50:3])
+                rows, cols = [0, 3, 39, 17], [0, 4, 59, 17]
+                np.testing.assert_array_equal(stored.decode_points(rows, cols), full[rows, cols])
+                self.assertIsNone(stored.value_at(3, 4))
+                self.assertEqual(stored.value_at(17, 17), float(full[17, 17]))
+
+    def test_missing_file(self):
+        self.assertIsNone(load_field('gfs', '20250601', '12', 'nope', '006'))
+
+
+class IngestionTests(TestCase):
+    """weather/ingestion.py: the ModelCycle/ModelFrame manifest and frame claiming."""
+
+    PARAMETERS = [{'output_file_prefix': 'gfs_t2m'}, {'output_file_prefix': 'gfs_refc'}]
+    FORECAST_HOURS = MODEL_PLOT_SETTINGS['gfs']['forecast_hours']
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        media_override = override_settings(MEDIA_ROOT=self.temp_dir)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.quiet = lambda *args, **kwargs: None
+
+    def sync(self, posted_fhrs, run_date_str='20250601', run_hour_str='12'):
+        return sync_cycle_manifest('gfs', run_date_str, run_hour_str, posted_fhrs, self.PARAMETERS)
+
+    def claimed_keys(self, claims):
+        return [(frame.fhr, frame.param) for _, frames in claims for frame in frames]
+
+    def test_sync_cycle_manifest(self):
+        cycle = self.sync(['000', '003'])
+        self.assertEqual(cycle.posted_fhrs, ['000', '003'])
+        self.assertEqual(cycle.frames.count(), len(self.FORECAST_HOURS) * len(self.PARAMETERS))
+        self.assertTrue(all(frame.status == ModelFrame.STATUS_PENDING for frame in cycle.frames.all()))
+
+        # Another tick: the same cycle, new hours appended, no duplicate frames
+        cycle.frames.filter(fhr='000').update(status=ModelFrame.STATUS_DONE)
+        same_cycle = self.sync(['000', '003', '006'])
+        self.assertEqual(same_cycle.pk, cycle.pk)
+        self.assertEqual(same_cycle.posted_fhrs, ['000', '003', '006'])
+        self.assertEqual(same_cycle.frames.count(), len(self.FORECAST_HOURS) * len(self.PARAMETERS))
+        self.assertEqual(same_cycle.frames.filter(status=ModelFrame.STATUS_DONE).count(), len(self.PARAMETERS))
+
+    def test_sync_cycle_manifest_reopens_a_complete_cycle(self):
+        cycle = self.sync(['000'])
+        ModelCycle.objects.filter(pk=cycle.pk).update(status=ModelCycle.STATUS_COMPLETE)
+        self.assertEqual(self.sync(['000']).status, ModelCycle.STATUS_COMPLETE) # Nothing new
+        self.assertEqual(self.sync(['000', '003']).status, ModelCycle.STATUS_ACTIVE)
+
+    def test_claim_ready_frames_only_posted_hours(self):
+        self.sync(['000', '003'])
+        claims = claim_ready_frames('gfs')
+        self.assertEqual(self.claimed_keys(claims), [('000', 'gfs_refc'), ('000', 'gfs_t2m'),
+                                                     ('003', 'gfs_refc'), ('003', 'gfs_t2m')])
+        for frame in ModelFrame.objects.filter(fhr__in=['000', '003']):
+            self.assertEqual((frame.status, frame.attempts), (ModelFrame.STATUS_RUNNING, 1))
+            self.assertIsNotNone(frame.claimed_at)
+        self.assertFalse(ModelFrame.objects.exclude(fhr__in=['000', '003']).exclude(status=ModelFrame.STATUS_PENDING).exists())
+        # Claimed frames aren't handed to an overlapping tick
+        self.assertEqual(claim_ready_frames('gfs'), [])
+
+    def test_claim_ready_frames_nothing_posted(self):
+        self.sync([])
+        self.assertEqual(claim_ready_frames('gfs'), [])
+
+    def test_claim_ready_frames_retry_limit(self):
+        cycle = self.sync(['000'])
+        cycle.frames.filter(param='gfs_t2m').update(status=ModelFrame.STATUS_FAILED, attempts=MAX_FRAME_ATTEMPTS - 1)
+        cycle.frames.filter(param='gfs_refc').update(status=ModelFrame.STATUS_FAILED, attempts=MAX_FRAME_ATTEMPTS)
+        self.assertEqual(self.claimed_keys(claim_ready_frames('gfs')), [('000', 'gfs_t2m')])
+        self.assertEqual(cycle.frames.get(fhr='000', param='gfs_t2m').attempts, MAX_FRAME_ATTEMPTS)
+
+    def test_claim_ready_frames_reclaims_stale_claims_without_an_attempt(self):
+        cycle = self.sync(['000'])
+        long_ago = timezone.now() - timedelta(days=1)
+        cycle.frames.filter(param='gfs_t2m').update(status=ModelFrame.STATUS_RUNNING, attempts=1, claimed_at=long_ago)
+        cycle.frames.filter(param='gfs_refc').update(status=ModelFrame.STATUS_RUNNING, attempts=1, claimed_at=timezone.now())
+        self.assertEqual(self.claimed_keys(claim_ready_frames('gfs')), [('000', 'gfs_t2m')])
+        reclaimed = cycle.frames.get(fhr='000', param='gfs_t2m')
+        self.assertEqual(reclaimed.attempts, 1)
+        self.assertGreater(reclaimed.claimed_at, long_ago)
+
+    def test_claim_ready_frames_cap(self):
+        self.sync(['000', '003', '006'])
+        with override_settings(MODEL_MAX_FRAMES_PER_TICK=3):
+            first_tick = self.claimed_keys(claim_ready_frames('gfs'))
+        self.assertEqual(first_tick, [('000', 'gfs_refc'), ('000', 'gfs_t2m'), ('003', 'gfs_refc')])
+        second_tick = self.claimed_keys(claim_ready_frames('gfs', max_frames=10))
+        self.assertEqual(second_tick, [('003', 'gfs_t2m'), ('006', 'gfs_refc'), ('006', 'gfs_t2m')])
+
+    def test_claim_ready_frames_skips_inactive_cycles(self):
+        cycle = self.sync(['000'])
+        ModelCycle.objects.filter(pk=cycle.pk).update(status=ModelCycle.STATUS_EXPIRED)
+        self.assertEqual(claim_ready_frames('gfs'), [])
+
+    def test_update_cycle_status(self):
+        cycle = self.sync(self.FORECAST_HOURS[:-1])
+        cycle.frames.update(status=ModelFrame.STATUS_DONE)
+        self.assertFalse(update_cycle_status(cycle)) # The last hour isn't posted
+
+        cycle = self.sync(self.FORECAST_HOURS)
+        last_frame = cycle.frames.filter(fhr=self.FORECAST_HOURS[-1]).first()
+        ModelFrame.objects.filter(pk=last_frame.pk).update(status=ModelFrame.STATUS_FAILED, attempts=1)
+        self.assertFalse(update_cycle_status(cycle)) # Its other frames are pending; this one may still succeed
+
+        cycle.frames.exclude(pk=last_frame.pk).update(status=ModelFrame.STATUS_DONE)
+        self.assertFalse(update_cycle_status(cycle))
+        ModelFrame.objects.filter(pk=last_frame.pk).update(attempts=MAX_FRAME_ATTEMPTS) # Failed for good
+        self.assertTrue(update_cycle_status(cycle))
+        self.assertEqual(ModelCycle.objects.get(pk=cycle.pk).status, ModelCycle.STATUS_COMPLETE)
+        self.assertFalse(update_cycle_status(cycle)) # Only completes once
+
+    def test_expire_old_cycles(self):
+        old_cycle = self.sync(self.FORECAST_HOURS, run_date_str='20250530', run_hour_str='00')
+        recent_cycle = self.sync(['000'], run_date_str='20250531', run_hour_str='18')
+        newest_cycle = self.sync(['000'], run_date_str='20250601', run_hour_str='00')
+        too_old = timezone.now() - timedelta(hours=CYCLE_EXPIRY_HOURS + 1)
+        ModelCycle.objects.filter(pk__in=[old_cycle.pk, newest_cycle.pk]).update(created_at=too_old)
+
+        field = {'values': np.ones((2, 2)), 'grid_key': 'test-grid'}
+        old_field_path = store_field('gfs', '20250530', '00', '000', self.PARAMETERS[0], field, self.quiet)
+        recent_field_path = store_field('gfs', '20250531', '18', '000', self.PARAMETERS[0], field, self.quiet)
+        old_plot_path = os.path.join(self.temp_dir, 'model_plots', 'gfs_t2m_20250530_00z_f000.png')
+        os.makedirs(os.path.dirname(old_plot_path))
+        open(old_plot_path, 'wb').close()
+
+        self.assertEqual(expire_old_cycles('gfs', newest_cycle, self.quiet), 1)
+        statuses = dict(ModelCycle.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {old_cycle.pk: ModelCycle.STATUS_EXPIRED, recent_cycle.pk: ModelCycle.STATUS_ACTIVE,
+                                    newest_cycle.pk: ModelCycle.STATUS_ACTIVE})
+        self.assertFalse(os.path.exists(old_field_path))
+        self.assertFalse(os.path.exists(old_plot_path))
+        self.assertTrue(os.path.exists(recent_field_path))
+        self.assertEqual(expire_old_cycles('gfs', newest_cycle, self.quiet), 0) # Already expired
+
+
+class PlotOutputTests(SimpleTestCase):
+    """weather/plot_output.py: plots appear whole or not at all, under content-addressed names."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        media_override = override_settings(MEDIA_ROOT=self.temp_dir)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.plot_dir = os.path.join(self.temp_dir, 'model_plots')
+        self.immutable_dir = os.path.join(self.temp_dir, IMMUTABLE_PLOT_DIR)
+
+    def make_figure(self, value):
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(1, 1))
+        fig.add_subplot().imshow(np.full((2, 2), value), vmin=0, vmax=1)
+        return fig
+
+    def plot_path(self, fhr='000'):
+        return os.path.join(self.plot_dir, f"gfs_t2m_20250601_12z_f{fhr}.png")
+
+    def list_dir(self, path):
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def test_failed_render_leaves_nothing(self):
+        fig = self.make_figure(0.5)
+
+        def partial_savefig(path, **kwargs):
+            with open(path, 'wb') as f:
+                f.write(b'\x89PNG half a plot')
+            raise RuntimeError('renderer died')
+
+        fig.savefig = partial_savefig
+        with self.assertRaises(RuntimeError):
+            save_figure_atomically(fig, self.plot_path())
+        self.assertEqual(self.list_dir(self.plot_dir), []) # Neither the plot nor its temp file
+
+    def test_failed_render_keeps_the_previous_plot(self):
+        published_path = save_figure_atomically(self.make_figure(0.5), self.plot_path())
+        fig = self.make_figure(0.9)
+        fig.savefig = mock.Mock(side_effect=RuntimeError('renderer died'))
+        with self.assertRaises(RuntimeError):
+            save_figure_atomically(fig, self.plot_path())
+        self.assertTrue(os.path.samefile(self.plot_path(), published_path))
+        self.assertEqual(self.list_dir(self.immutable_dir), [os.path.basename(published_path)])
+
+    def test_content_addressed_names(self):
+        first = save_figure_atomically(self.make_figure(0.5), self.plot_path())
+        self.assertEqual(os.path.dirname(first), self.immutable_dir)
+        self.assertRegex(os.path.basename(first), r'^gfs_t2m_20250601_12z_f000_[0-9a-f]{20}\.png$')
+        self.assertTrue(os.path.samefile(self.plot_path(), first)) # The stable name is a hard link to it
+        self.assertEqual(os.stat(first).st_mode & 0o777, 0o644)
+
+        # Same picture again: same name, nothing new written; a different one gets its own name
+        self.assertEqual(save_figure_atomically(self.make_figure(0.5), self.plot_path()), first)
+        self.assertEqual(self.list_dir(self.immutable_dir), [os.path.basename(first)])
+        second = save_figure_atomically(self.make_figure(0.9), self.plot_path())
+        self.assertNotEqual(second, first)
+        self.assertTrue(os.path.samefile(self.plot_path(), second))
+        self.assertEqual(self.list_dir(self.plot_dir), ['gfs_t2m_20250601_12z_f000.png', 'immutable']) # No temp files
+
+    def test_existing_plot_is_published(self):
+        # A plot rendered before plots were content-addressed
+        os.makedirs(self.plot_dir)
+        self.make_figure(0.5).savefig(self.plot_path(), format='png')
+        published_path = get_published_plot_path(self.plot_path())
+        self.assertTrue(os.path.samefile(self.plot_path(), published_path))
+        self.assertEqual(get_published_plot_path(self.plot_path()), published_path)
+
+    def test_delete_run_plots(self):
+        save_figure_atomically(self.make_figure(0.5), self.plot_path('000'))
+        save_figure_atomically(self.make_figure(0.9), self.plot_path('003'))
+        other_run = save_figure_atomically(self.make_figure(0.5), os.path.join(self.plot_dir, 'gfs_t2m_20250601_18z_f000.png'))
+        self.assertEqual(delete_run_plots('gfs_t2m', '20250601', '12'), 4)
+        self.assertEqual(self.list_dir(self.plot_dir), ['gfs_t2m_20250601_18z_f000.png', 'immutable'])
+        self.assertEqual(self.list_dir(self.immutable_dir), [os.path.basename(other_run)])
+
+
+class FakeGribMessage:
+    """Just enough of a GRIB message for grid_cache to build a grid from."""
+
+    def __init__(self, lats, lons):
+        self.lats, self.lons = lats, lons
+
+    def latlons(self):
+        return self.lats, self.lons
+
+
+class StoredRunMixin:
+    """
+    A GFS run in the tables, the manifest and the field store: TEST_PREFIX rendered at TEST_FHRS on a
+    5x5 quarter-degree grid over Oklahoma City, with value 1000 * (fhr index) + 10 * row + col.
+    """
+
+    TEST_GRID_KEY = 'gfs_test_5x5'
+    TEST_PREFIX = 'gfs_sbcape'
+    TEST_FHRS = ['000', '003', '006']
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        media_override = override_settings(MEDIA_ROOT=self.temp_dir)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.addCleanup(self.forget_cached_state)
+        self.forget_cached_state()
+        self.quiet = lambda *args, **kwargs: None
+
+        lats, lons = np.meshgrid(np.arange(35.0, 36.01, 0.25), np.arange(-98.0, -96.99, 0.25), indexing='ij')
+        grid_cache._build_grid_files(os.path.join(grid_cache.get_grid_cache_dir(), self.TEST_GRID_KEY),
+                                     FakeGribMessage(lats, lons), {'gridType': 'test'}, (-98.0, -97.0, 35.0, 36.0), self.quiet)
+
+        # Started an hour ago, so F000 is in the past and the later hours are ahead
+        self.run_datetime = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        self.cycle = ModelCycle.objects.create(model_key='gfs', run_date=self.run_datetime.strftime('%Y%m%d'),
+                                               run_hour=self.run_datetime.strftime('%H'), posted_fhrs=self.TEST_FHRS)
+        self.frames = [self.add_frame(fhr_index, fhr) for fhr_index, fhr in enumerate(self.TEST_FHRS)]
+
+    def forget_cached_state(self):
+        plot_manifest._manifests_in_memory.clear()
+        grid_cache._loaded_grids.pop(self.TEST_GRID_KEY, None)
+        grid_cache._grid_trees.pop(self.TEST_GRID_KEY, None)
+
+    def add_frame(self, fhr_index, fhr, image_path=None):
+        rows, cols = np.mgrid[0:5, 0:5]
+        store_field('gfs', self.cycle.run_date, self.cycle.run_hour, fhr, {'output_file_prefix': self.TEST_PREFIX},
+                    {'values': 1000.0 * fhr_index + 10 * rows + cols, 'units': 'J/kg', 'grid_key': self.TEST_GRID_KEY},
+                    self.quiet)
+        frame, _ = ModelFrame.objects.update_or_create(
+            cycle=self.cycle, param=self.TEST_PREFIX, fhr=fhr,
+            defaults={'status': ModelFrame.STATUS_DONE,
+                      'image_path': image_path or f"model_plots/immutable/{self.TEST_PREFIX}_f{fhr}_0.png"})
+        plot_manifest._manifests_in_memory.clear()
+        return frame
+
+
+class PointForecastTests(StoredRunMixin, TestCase):
+    """weather/point_forecast.py and the point forecast API, on a small stored run."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='dana', email='dana@example.com', password='x')
+        # Oklahoma City is nearest cell (2, 2); Tulsa is ~90 km east of the grid, so outside it
+        self.okc = SavedLocation.objects.create(profile=self.user.profile, location_name='OKC',
+                                                latitude='35.470000', longitude='-97.520000')
+        self.tulsa = SavedLocation.objects.create(profile=self.user.profile, location_name='Tulsa',
+                                                  latitude='36.150000', longitude='-95.990000')
+
+    def test_point_forecast_samples_the_nearest_cell(self):
+        forecast = get_point_forecast('gfs', [self.okc, self.tulsa], [self.TEST_PREFIX, 'gfs_t2m'])
+        sbcape = forecast['params'][self.TEST_PREFIX]
+        self.assertEqual(sbcape['run'], f"{self.cycle.run_date} {self.cycle.run_hour}Z")
+        self.assertEqual(sbcape['units'], 'J/kg')
+        self.assertEqual(sbcape['fhrs'], self.TEST_FHRS)
+        self.assertEqual(sbcape['valid_times_utc'][1], (self.run_datetime + timedelta(hours=3)).isoformat())
+        np.testing.assert_allclose(sbcape['values'][self.okc.pk], [22, 1022, 2022], atol=0.01)
+        self.assertEqual(sbcape['values'][self.tulsa.pk], [None, None, None])
+        self.assertEqual(forecast['params']['gfs_t2m']['fhrs'], []) # Nothing rendered
+
+    def test_point_forecast_skips_hours_without_a_stored_field(self):
+        os.remove(load_field('gfs', self.cycle.run_date, self.cycle.run_hour, self.TEST_PREFIX, '003').path)
+        sbcape = get_point_forecast('gfs', [self.okc], [self.TEST_PREFIX])['params'][self.TEST_PREFIX]
+        self.assertEqual(sbcape['fhrs'], ['000', '006'])
+        np.testing.assert_allclose(sbcape['values'][self.okc.pk], [22, 2022], atol=0.01)
+
+    def test_find_locations_exceeding(self):
+        self.assertEqual(sample_frames_at_locations(self.cycle, self.frames, self.quiet), 3) # Only OKC is on the grid
+        # F000 (22) is in the past anyway; F003 (1022) is the first over 1000
+        exceeding = find_locations_exceeding('gfs', self.TEST_PREFIX, 1000)
+        self.assertEqual(list(exceeding), [self.okc.pk])
+        valid_time, value = exceeding[self.okc.pk]
+        self.assertEqual(valid_time, self.run_datetime + timedelta(hours=3))
+        self.assertAlmostEqual(value, 1022, places=1)
+
+        self.assertEqual(find_locations_exceeding('gfs', self.TEST_PREFIX, 1500)[self.okc.pk][0], self.run_datetime + timedelta(hours=6))
+        self.assertEqual(find_locations_exceeding('gfs', self.TEST_PREFIX, 1500, within_hours=4), {}) # F006 is over 4 hours out
+        self.assertEqual(find_locations_exceeding('gfs', self.TEST_PREFIX, 5000), {})
+        self.assertEqual(find_locations_exceeding('gfs', self.TEST_PREFIX, 1000, locations=[self.tulsa]), {})
+        self.assertEqual(find_locations_exceeding('gfs', 'gfs_t2m', 0), {})
+
+    def get_api(self, **params):
+        self.client.force_login(self.user)
+        return self.client.get(reverse('weather:api_gfs_point_forecast'), params)
+
+    def test_api_needs_a_subscription(self):
+        self.assertEqual(self.get_api().status_code, 403)
+
+    def test_api_validates_the_threshold(self):
+        self.user.is_superuser = True
+        self.user.save()
+        for params in ({'above': '1000'}, {'param': 'sbcape', 'above': 'lots'}, {'param': 'sbcape', 'above': '1000', 'hours': 'x'},
+                       {'param': 'sbcape', 'above': '1000', 'hours': '0'}, {'param': 'sbcape', 'above': '1000', 'hours': '385'},
+                       {'param': 'nope'}, {'location_id': 'home'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get_api(**params).status_code, 400)
+
+    def test_api_returns_the_forecast(self):
+        self.user.is_superuser = True
+        self.user.save()
+        data = self.get_api(param='sbcape').json()
+        self.assertEqual([location['id'] for location in data['locations']], [self.okc.pk, self.tulsa.pk])
+        self.assertEqual(data['params']['sbcape']['param_name'], 'Surface CAPE')
+        np.testing.assert_allclose(data['params']['sbcape']['values'][str(self.okc.pk)], [22, 1022, 2022], atol=0.01)
+        self.assertNotIn('exceedances', data)
+
+        data = self.get_api(location_id=str(self.tulsa.pk)).json()
+        self.assertEqual([location['id'] for location in data['locations']], [self.tulsa.pk])
+        self.assertEqual(sorted(data['params']), ['refc', 'sbcape', 't2m'])
+
+    def test_api_returns_exceedances(self):
+        self.user.is_superuser = True
+        self.user.save()
+        sample_frames_at_locations(self.cycle, self.frames, self.quiet)
+        data = self.get_api(param='sbcape', above='1000', hours='24').json()
+        self.assertEqual(len(data['exceedances']), 1)
+        self.assertEqual(data['exceedances'][0]['location_id'], self.okc.pk)
+        self.assertEqual(data['exceedances'][0]['first_valid_time_utc'], (self.run_datetime + timedelta(hours=3)).isoformat())
+        self.assertEqual(self.get_api(param='sbcape', above='1000', location_id=str(self.tulsa.pk)).json()['exceedances'], [])
+
+
+class RunDiscoveryTests(SimpleTestCase):
+    """weather/run_discovery.py against stand-in HEAD responses for the NOMADS .idx files."""
+
+    NOW = datetime(2025, 6, 1, 14, 30, tzinfo=python_dt_timezone.utc) # Newest cycle: 12Z
+    SECONDS_PER_HEAD = 0.1
+
+    def setUp(self):
+        cache.delete(_get_discovery_cache_key('nam'))
+        self.addCleanup(cache.delete, _get_discovery_cache_key('nam'))
+        self.forecast_hours = MODEL_PLOT_SETTINGS['nam']['forecast_hours']
+        self.cycles = [(cycle_start.strftime('%Y%m%d'), cycle_start.strftime('%H')) for cycle_start in _get_cycle_starts(self.NOW)]
+        # .idx URL -> (cycle index, forecast hour index) for every hour of every cycle searched
+        url_template = MODEL_PLOT_SETTINGS['nam']['url_template']
+        self.idx_urls = {
+            url_template.format(run_date=run_date, run_hour=run_hour, fhr=fhr) + '.idx': (cycle_index, fhr_index)
+            for cycle_index, (run_date, run_hour) in enumerate(self.cycles)
+            for fhr_index, fhr in enumerate(self.forecast_hours)
+        }
+        self.posted_counts = {} # cycle index -> hours posted
+        self.probed = []
+        self.clock = 1000.0
+
+        for target, replacement in (('weather.run_discovery.requests.Session.head', self.fake_head),
+                                    ('weather.run_discovery.time.monotonic', lambda: self.clock)):
+            patcher = mock.patch(target, side_effect=replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        datetime_patcher = mock.patch('weather.run_discovery.datetime')
+        datetime_patcher.start().now.return_value = self.NOW
+        self.addCleanup(datetime_patcher.stop)
+
+    def fake_head(self, url, **kwargs):
+        self.clock += self.SECONDS_PER_HEAD
+        cycle_index, fhr_index = self.idx_urls[url]
+        self.probed.append((cycle_index, fhr_index))
+        return mock.Mock(status_code=200 if fhr_index < self.posted_counts.get(cycle_index, 0) else 404)
+
+    def probe(self):
+        return probe_model_runs('nam', for_console_output=lambda *args, **kwargs: None)
+
+    def test_newest_cycle_still_posting(self):
+        self.posted_counts = {0: 20, 1: len(self.forecast_hours)}
+        discovery = self.probe()
+        self.assertEqual((discovery['run_date'], discovery['run_hour']), ('20250601', '12'))
+        self.assertEqual(discovery['available_fhrs'], self.forecast_hours[:20])
+        self.assertFalse(discovery['is_complete'])
+        self.assertEqual(discovery['latest_complete_run'], ('20250601', '06'))
+        self.assertFalse(discovery['probe_timed_out'])
+        # A binary search over the 53 hours (F26, F13, F20, F17, F19), then only the previous cycle's last hour
+        self.assertEqual([fhr_index for cycle_index, fhr_index in self.probed if cycle_index == 0], [26, 13, 20, 17, 19])
+        self.assertEqual(len(self.probed), 6)
+        self.assertEqual(self.probed[-1], (1, len(self.forecast_hours) - 1))
+
+    def test_newest_cycle_not_started(self):
+        self.posted_counts = {1: len(self.forecast_hours)}
+        discovery = self.probe()
+        self.assertEqual((discovery['run_date'], discovery['run_hour']), ('20250601', '06'))
+        self.assertTrue(discovery['is_complete'])
+        self.assertEqual(discovery['latest_complete_run'], ('20250601', '06'))
+        self.assertEqual(len(self.probed), 6 + 5) # Two binary searches; no need to look further back
+
+    def test_older_cycles_searched_for_a_complete_one(self):
+        self.posted_counts = {0: 1, 1: 52, 2: len(self.forecast_hours)}
+        discovery = self.probe()
+        self.assertEqual(discovery['available_fhrs'], self.forecast_hours[:1])
+        self.assertEqual(discovery['latest_complete_run'], ('20250601', '00'))
+        self.assertEqual(self.probed[-2:], [(1, 52), (2, 52)])
+
+    def test_nothing_posted(self):
+        self.assertIsNone(self.probe())
+        self.assertEqual(len(self.probed), 6 * len(self.cycles))
+
+    def test_time_budget(self):
+        self.SECONDS_PER_HEAD = 4.0 # NOMADS crawling
+        self.assertIsNone(self.probe())
+        self.assertEqual(len(self.probed), int(PROBE_TIME_BUDGET_SECONDS // self.SECONDS_PER_HEAD) + 1)
+
+    def test_time_budget_keeps_a_found_cycle(self):
+        self.SECONDS_PER_HEAD = 2.0
+        self.posted_counts = {0: 20} # 6 HEADs (12 s) find it; the search for a complete one runs out of time
+        discovery = self.probe()
+        self.assertEqual(discovery['available_fhrs'], self.forecast_hours[:20])
+        self.assertIsNone(discovery['latest_complete_run'])
+        self.assertTrue(discovery['probe_timed_out'])
+
+    def test_not_found_is_cached(self):
+        quiet = lambda *args, **kwargs: None
+        self.assertIsNone(discover_latest_model_run('nam', quiet))
+        probe_count = len(self.probed)
+        self.assertIsNone(discover_latest_model_run('nam', quiet))
+        self.assertEqual(len(self.probed), probe_count) # Answered from the cache
+
+        self.posted_counts = {0: len(self.forecast_hours)}
+        self.assertIsNotNone(discover_latest_model_run('nam', quiet, use_cache=False)) # An ingestion tick looks again
+        probe_count = len(self.probed)
+        self.assertEqual(discover_latest_model_run('nam', quiet)['run_hour'], '12')
+        self.assertEqual(len(self.probed), probe_count)
+
+
+class ModelLoopTests(StoredRunMixin, TestCase):
+    """weather/model_loops.py and the loop API: one response per loop, revalidated by ETag."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(get_user_model().objects.create_superuser(username='erin', email='erin@example.com', password='x'))
+
+    def test_loop_lists_every_configured_hour(self):
+        loop = build_model_loop('gfs', self.TEST_PREFIX)
+        self.assertEqual(loop['run'], f"{self.cycle.run_date} {self.cycle.run_hour}Z")
+        self.assertEqual([frame['fhr'] for frame in loop['frames']], MODEL_PLOT_SETTINGS['gfs']['forecast_hours'])
+        available = [frame['fhr'] for frame in loop['frames'] if frame['available']]
+        self.assertEqual(available, self.TEST_FHRS)
+        self.assertEqual(loop['frames'][1]['image_url'], f"/media/model_plots/immutable/{self.TEST_PREFIX}_f003_0.png")
+        self.assertEqual(build_model_loop('gfs', 'gfs_t2m')['etag'], 'empty')
+
+    def test_loop_etag_changes_with_its_frames(self):
+        etag = build_model_loop('gfs', self.TEST_PREFIX)['etag']
+        plot_manifest._manifests_in_memory.clear()
+        self.assertEqual(build_model_loop('gfs', self.TEST_PREFIX)['etag'], etag) # Nothing changed
+
+        self.add_frame(1, '003', image_path=f"model_plots/immutable/{self.TEST_PREFIX}_f003_1.png") # Re-rendered
+        rerendered_etag = build_model_loop('gfs', self.TEST_PREFIX)['etag']
+        self.assertNotEqual(rerendered_etag, etag)
+
+        self.add_frame(3, '009') # Newly posted hour
+        self.assertNotIn(build_model_loop('gfs', self.TEST_PREFIX)['etag'], (etag, rerendered_etag))
+
+    def get_loop(self, **headers):
+        return self.client.get(reverse('weather:api_gfs_model_loop'), {'param': 'sbcape'}, headers=headers)
+
+    def test_api_not_modified(self):
+        response = self.get_loop()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(response['ETag'], f'"{build_model_loop("gfs", self.TEST_PREFIX)["etag"]}"')
+        self.assertEqual(len(response.json()['frames']), len(MODEL_PLOT_SETTINGS['gfs']['forecast_hours']))
+        self.assertNotIn('image_path', response.json()['frames'][0])
+
+        self.assertEqual(self.get_loop(if_none_match=response['ETag']).status_code, 304)
+        self.add_frame(3, '009')
+        changed = self.get_loop(if_none_match=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+
+class FieldTransformTests(SimpleTestCase):
+    """weather/field_transforms.py: the declarative, in-place value transforms."""
+
+    def transform(self, values, source_units='K', **param_details):
+        values = np.array(values, dtype=np.float32)
+        console_lines = []
+        transformed, units = apply_field_transforms(values, {'output_file_prefix': 'test', **param_details}, source_units,
+                                                    for_console_output=console_lines.append)
+        self.assertIs(transformed, values) # In place
+        self.assertEqual(transformed.dtype, np.float32)
+        return transformed, units, console_lines
+
+    def test_K_to_degF(self):
+        values, units, _ = self.transform([273.15, 373.15, 255.372], unit_conversion='K_to_degF')
+        np.testing.assert_allclose(values, [32.0, 212.0, 0.0], atol=1e-3)
+        self.assertEqual(units, 'degF')
+        values, units, _ = self.transform([273.15], needs_conversion_to_F=True) # Older configs
+        np.testing.assert_allclose(values, [32.0], atol=1e-3)
+        self.assertEqual(units, 'degF')
+
+    def test_conversion_skipped_when_units_differ(self):
+        values, units, console_lines = self.transform([20.0], source_units='degC', unit_conversion='K_to_degF')
+        self.assertEqual(values.tolist(), [20.0])
+        self.assertEqual(units, 'degC')
+        self.assertIn('Keeping raw data', console_lines[0])
+
+    def test_scale_and_offset(self):
+        values, units, _ = self.transform([100000.0], source_units='Pa', scale=0.01, offset=-1000, output_units='hPa anomaly')
+        np.testing.assert_allclose(values, [0.0], atol=1e-3)
+        self.assertEqual(units, 'hPa anomaly')
+
+    def test_fill_values(self):
+        values, _, _ = self.transform([9999.0, 1.0, -9999.0, 2.0], source_units='1', fill_values=[9999.0, -9999.0])
+        self.assertEqual(np.isnan(values).tolist(), [True, False, True, False])
+
+    def test_valid_range(self):
+        values, _, _ = self.transform([-5.0, 0.0, 50.0, 100.0, 101.0, np.nan], source_units='%', valid_range=(0, 100))
+        self.assertEqual(np.isnan(values).tolist(), [True, False, False, False, True, True])
+
+    def test_valid_range_after_conversion(self):
+        # The range is in the converted units
+        values, _, _ = self.transform([200.0, 300.0], unit_conversion='K_to_degF', valid_range=(-80, 140))
+        self.assertTrue(np.isnan(values[0]))
+        np.testing.assert_allclose(values[1], 80.33, atol=1e-2)
+
+    def test_clip_to_plot_levels(self):
+        values, _, _ = self.transform([-10.0, 5.0, 80.0, np.nan], source_units='dBZ', clip_to_plot_levels=True,
+                                      plot_levels=np.arange(0, 75, 5))
+        self.assertEqual(values[:3].tolist(), [0.0, 5.0, 70.0])
+        self.assertTrue(np.isnan(values[3]))
+        values, _, _ = self.transform([80.0], source_units='dBZ', plot_levels=np.arange(0, 75, 5)) # Not asked for
+        self.assertEqual(values.tolist(), [80.0])
@@ -14,8 +14,12 @@ urlpatterns = [
     # 2. Page for displaying specific GFS model parameters (Temp, CAPE, etc.)
     path('models/gfs/', views.gfs_model_page_view, name='gfs_model_page'),
     path('api/gfs-model-data/', views.get_gfs_model_api_data, name='api_gfs_model_data'),
+    path('api/gfs-model-loop/', views.get_model_loop_api_data, {'model_key': 'gfs'}, name='api_gfs_model_loop'),
+    path('api/gfs-point-forecast/', views.get_point_forecast_api_data, {'model_key': 'gfs'}, name='api_gfs_point_forecast'),
 
     path('models/nam/', views.nam_model_page_view, name='nam_model_page'),
     path('api/nam-model-data/', views.get_nam_model_api_data, name='api_nam_model_data'),
+    path('api/nam-model-loop/', views.get_model_loop_api_data, {'model_key': 'nam'}, name='api_nam_model_loop'),
+    path('api/nam-point-forecast/', views.get_point_forecast_api_data, {'model_key': 'nam'}, name='api_nam_point_forecast'),
 
 ]
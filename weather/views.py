@@ -11,35 +11,41 @@ from decimal import Decimal
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404, HttpResponseNotModified
+from django.views.static import serve as static_serve
 from datetime import datetime, timedelta, timezone as python_dt_timezone # Alias for datetime.timezone
 from django.utils import timezone as django_utils_tz # Alias for django.utils.timezone
 
 # Your other imports
-from .grib_processing import get_gfs_image_details_with_fallback, get_latest_nam_rundate_and_hour
+from .grib_processing import get_gfs_image_details_with_fallback
+from .plot_manifest import get_plot_manifest, get_param_timeline, get_model_image_details
+from .model_loops import build_model_loop, get_loop_animation_url
+from .model_tiles import tiles_enabled, get_tile_zoom_levels
+from .point_forecast import get_point_forecast, find_locations_exceeding
+from .model_params import get_param_configs
+from .plot_output import IMMUTABLE_PLOT_DIR, IMMUTABLE_CACHE_CONTROL
+from accounts.models import SavedLocation
 from subscriptions.models import Subscription # Assuming this is your model
 from subscriptions.tasks import fetch_alerts_by_zone_or_point, get_nws_zone_for_coords # Assuming this is where it is
+from subscriptions.alert_snapshot import get_alert_snapshot
 
 # --- Configuration Dictionaries ---
-AVAILABLE_GFS_PARAMETERS_CONFIG = {
-    't2m': {'name_display': '2m Temperature', 'output_file_prefix': 'gfs_t2m'},
-    'sbcape': {'name_display': 'Surface CAPE', 'output_file_prefix': 'gfs_sbcape'},
-    'refc': {'name_display': 'Sim. Comp. Reflectivity', 'output_file_prefix': 'gfs_refc'}
-}
-
-AVAILABLE_NAM_PARAMETERS_CONFIG = {
-    'refc': {'name_display': 'Sim. Comp. Reflectivity', 'output_file_prefix': 'nam_refc'},
-    'sbcape': {'name_display': 'Surface CAPE', 'output_file_prefix': 'nam_sbcape'},
-    'dewp2m': {'name_display': 'NAM 2m Dew Point', 'output_file_prefix': 'nam_dewp2m'},
-    'nam_srh_3km': { # Storm Relative Helicity 0-3 km
-        'name_display': 'Storm Relative Helicity 0-3km',
-        'output_file_prefix': 'nam_srh_3km' # Example prefix
-    },
-    'ltng_sfc': { # This is the 'code' your JavaScript will use from the param selector
-        'name_display': 'NAM Surface Lightning', # Text displayed in the button/dropdown
-        'output_file_prefix': 'nam_ltng_sfc' # MUST MATCH the prefix used in tasks.py to save the image
-    }
+# {code: param} from the shared parameter registry (weather/model_params.py)
+AVAILABLE_GFS_PARAMETERS_CONFIG = get_param_configs('gfs')
+AVAILABLE_NAM_PARAMETERS_CONFIG = get_param_configs('nam')
+
+def _get_param_timeline_for_api(model_key, output_file_prefix):
+    """Every available frame of a param's newest run, so the page can preload the whole loop in one response."""
+    run, frames = get_param_timeline(get_plot_manifest(model_key), output_file_prefix)
+    if run is None:
+        return {'run': None, 'frames': []}
+    return {'run': f"{run['run_date']} {run['run_hour']}Z", 'run_datetime_utc': run['run_datetime_utc'], 'frames': frames}
+
+MODEL_PARAMETER_CONFIGS = {
+    'gfs': AVAILABLE_GFS_PARAMETERS_CONFIG,
+    'nam': AVAILABLE_NAM_PARAMETERS_CONFIG,
 }
+MAX_EXCEEDANCE_HOURS = 384 # Longest GFS forecast
 
 # --- Your get_weather_alerts function (from response #316) ---
 # Make sure all its imports and helper calls are correct.
@@ -126,15 +132,23 @@ def get_weather_alerts(request): # This view is public
         nws_alerts_api_url = f"https://api.weather.gov/alerts/active?point={current_latitude},{current_longitude}"
         fetch_method_for_log = f"POINT {current_latitude},{current_longitude}"
     
-    print(f"  Fetching NWS alerts using {fetch_method_for_log}: {nws_alerts_api_url}")
-
     try:
-        alerts_response = requests.get(nws_alerts_api_url, headers=nws_headers, timeout=20)
-        alerts_response.raise_for_status()
-        alerts_data_json = alerts_response.json()
-        
-        # Assign to raw_alert_features (which was initialized as [] above)
-        raw_alert_features = alerts_data_json.get('features', []) 
+        alert_snapshot = get_alert_snapshot()
+        if alert_snapshot is not None:
+            # The shared national snapshot (subscriptions/alert_snapshot.py); NWS is only asked directly without one
+            print(f"  Reading alerts for {fetch_method_for_log} from the alert snapshot of {alert_snapshot.fetched_at}")
+            if target_alert_zone:
+                raw_alert_features = alert_snapshot.features_for_zone(target_alert_zone)
+            else:
+                raw_alert_features = alert_snapshot.features_at_point(current_latitude, current_longitude)
+        else:
+            print(f"  Fetching NWS alerts using {fetch_method_for_log}: {nws_alerts_api_url}")
+            alerts_response = requests.get(nws_alerts_api_url, headers=nws_headers, timeout=20)
+            alerts_response.raise_for_status()
+            alerts_data_json = alerts_response.json()
+
+            # Assign to raw_alert_features (which was initialized as [] above)
+            raw_alert_features = alerts_data_json.get('features', [])
         
         # --- DEBUG: Print details of received raw alert features ---
         # This is inside the try block, after raw_alert_features is assigned
@@ -280,6 +294,7 @@ def gfs_model_page_view(request):
         'current_param_code_initial': requested_param_code, 
         'available_fhrs': available_fhrs_list,
         'available_parameters': parameter_options_for_template, 
+        'loop_api_url_for_js': reverse('weather:api_gfs_model_loop'), # Whole loop in one request
         'api_url_for_js': reverse('weather:api_gfs_model_data') 
     }
     return render(request, 'weather/gfs_model_page.html', context)
@@ -326,7 +341,8 @@ def get_gfs_model_api_data(request):
         'main_heading': main_heading_text,
         'formatted_run_time_local': formatted_run_time_local, 
         'formatted_valid_time_local': formatted_valid_time_local, 
-        'current_fhr': image_info['actual_fhr'], 'current_param_code': requested_param_code 
+        'current_fhr': image_info['actual_fhr'], 'current_param_code': requested_param_code,
+        'timeline': _get_param_timeline_for_api('gfs', param_config['output_file_prefix'])
     }
     return JsonResponse(data_to_return)
 
@@ -362,23 +378,12 @@ def nam_model_page_view(request):
             fhr_validated_int = fhr_int_val
     except ValueError: pass 
 
-    nam_run_date_str, nam_model_run_hour_str = get_latest_nam_rundate_and_hour(print) # From grib_processing
-    
-    # Directly determine image existence and details for THIS run for NAM
-    expected_nam_image_filename = f"{param_config['output_file_prefix']}_{nam_run_date_str}_{nam_model_run_hour_str}z_f{fhr_validated_str}.png"
-    nam_image_fs_path = os.path.join(settings.MEDIA_ROOT, 'model_plots', expected_nam_image_filename)
-    nam_image_url = settings.MEDIA_URL + os.path.join('model_plots', expected_nam_image_filename)
-    nam_image_exists = os.path.exists(nam_image_fs_path)
-
-    run_datetime_utc = None
-    try:
-        run_datetime_utc = datetime(
-            int(nam_run_date_str[:4]), int(nam_run_date_str[4:6]), int(nam_run_date_str[6:8]),
-            int(nam_model_run_hour_str), 
-            tzinfo=python_dt_timezone.utc # CORRECTED ALIAS
-        )
-    except ValueError:
-        print(f"Error parsing run datetime for NAM: {nam_run_date_str} {nam_model_run_hour_str}Z")
+    # Answered from the in-memory plot manifest (newest run that has this frame), no file checks
+    image_info = get_model_image_details('nam', param_config['output_file_prefix'], fhr_validated_str, model_label="NAM")
+    nam_image_url = image_info['image_url']
+    nam_image_exists = image_info['image_exists']
+    nam_model_run_hour_str = image_info['actual_run_hour']
+    run_datetime_utc = image_info['run_datetime_utc']
     
     param_name_display = param_config['name_display']
     formatted_run_time_local = "Run: N/A"; formatted_valid_time_local = "Valid: N/A"
@@ -415,6 +420,7 @@ def nam_model_page_view(request):
         'current_param_code_initial': requested_param_code, 
         'available_fhrs': available_fhrs_list_nam,
         'available_parameters': parameter_options_for_template_nam, 
+        'loop_api_url_for_js': reverse('weather:api_nam_model_loop'), # Whole loop in one request
         'api_url_for_js': reverse('weather:api_nam_model_data') # URL for NAM API
     }
     return render(request, 'weather/nam_model_page.html', context) # Ensure this template exists
@@ -431,24 +437,17 @@ def get_nam_model_api_data(request):
     param_config = AVAILABLE_NAM_PARAMETERS_CONFIG.get(requested_param_code)
     if not param_config: return JsonResponse({'error': 'Invalid NAM parameter'}, status=400)
 
-    run_date_str, model_run_hour_str = get_latest_nam_rundate_and_hour(print)
-    
     fhr_validated_str = "00"
     try:
         fhr_int_val = int(requested_fhr)
         if 0 <= fhr_int_val <= 84: fhr_validated_str = f"{fhr_int_val:02d}"
     except ValueError: pass
     
-    expected_image_filename = f"{param_config['output_file_prefix']}_{run_date_str}_{model_run_hour_str}z_f{fhr_validated_str}.png"
-    image_fs_path = os.path.join(settings.MEDIA_ROOT, 'model_plots', expected_image_filename)
-    image_url_path = settings.MEDIA_URL + os.path.join('model_plots', expected_image_filename)
-    image_exists = os.path.exists(image_fs_path)
-    
-    run_datetime_utc = None
-    try:
-        run_datetime_utc = datetime(int(run_date_str[:4]), int(run_date_str[4:6]), int(run_date_str[6:8]),
-                                   int(model_run_hour_str), tzinfo=python_dt_timezone.utc) # CORRECTED
-    except ValueError: pass
+    image_info = get_model_image_details('nam', param_config['output_file_prefix'], fhr_validated_str, model_label="NAM")
+    image_url_path = image_info['image_url']
+    image_exists = image_info['image_exists']
+    model_run_hour_str = image_info['actual_run_hour']
+    run_datetime_utc = image_info['run_datetime_utc']
 
     param_name_display = param_config['name_display']
     formatted_run_time_local = "Run: N/A"; formatted_valid_time_local = "Valid: N/A"
@@ -476,10 +475,119 @@ def get_nam_model_api_data(request):
         'main_heading': main_heading_text,
         'formatted_run_time_local': formatted_run_time_local, 
         'formatted_valid_time_local': formatted_valid_time_local, 
-        'current_fhr': fhr_validated_str, 'current_param_code': requested_param_code 
+        'current_fhr': fhr_validated_str, 'current_param_code': requested_param_code,
+        'timeline': _get_param_timeline_for_api('nam', param_config['output_file_prefix'])
     }
     return JsonResponse(data_to_return)
 
+@login_required
+def get_model_loop_api_data(request, model_key):
+    """
+    Every forecast hour of a parameter's newest run in one response (URL, valid time,
+    availability and ETag per frame), so the page can prefetch and animate the whole loop.
+    ?animation=webp also returns 'animation_url', one animated WebP of the frames, or null
+    until it has been built (weather/model_loops.py builds it once the run completes).
+    """
+    if not (hasattr(request.user, 'subscription') and request.user.subscription and request.user.subscription.is_active()) and not request.user.is_superuser:
+        return JsonResponse({'error': 'Subscription required'}, status=403)
+
+    param_configs = MODEL_PARAMETER_CONFIGS.get(model_key)
+    if param_configs is None:
+        raise Http404("Unknown model")
+
+    requested_param_code = request.GET.get('param', next(iter(param_configs))).strip().lower()
+    param_config = param_configs.get(requested_param_code)
+    if not param_config: return JsonResponse({'error': f'Invalid {model_key.upper()} parameter'}, status=400)
+
+    want_animation = request.GET.get('animation', '').strip().lower() == 'webp'
+    loop = build_model_loop(model_key, param_config['output_file_prefix'])
+    response_etag = f'"{loop["etag"]}{"-webp" if want_animation else ""}"'
+    if request.headers.get('If-None-Match') == response_etag:
+        return HttpResponseNotModified()
+
+    data_to_return = {
+        'model': model_key, 'param_code': requested_param_code, 'param_name': param_config['name_display'],
+        'run': loop['run'], 'run_datetime_utc': loop['run_datetime_utc'],
+        'formatted_run_time_local': loop['formatted_run_time_local'],
+        'frames': [{key: value for key, value in frame.items() if key != 'image_path'} for frame in loop['frames']],
+        # Map clients load frame['tile_url_template'] as a raster source at these zooms (overzoom past the last one)
+        'tile_zoom_levels': get_tile_zoom_levels() if tiles_enabled() else [],
+    }
+    if want_animation:
+        data_to_return['animation_url'] = get_loop_animation_url(param_config['output_file_prefix'], loop)
+
+    response = JsonResponse(data_to_return)
+    response['ETag'] = response_etag
+    response['Cache-Control'] = 'private, no-cache' # Always revalidate; unchanged loops are a 304
+    return response
+
+@login_required
+def get_point_forecast_api_data(request, model_key):
+    """
+    Point forecast (meteogram) at the user's saved locations, sampled from the stored model fields.
+    ?location_id=<id> for one location (default 'all'), ?param=<code> for one parameter (default: every parameter).
+    ?param=<code>&above=<threshold>[&hours=<n>] also returns 'exceedances': the locations where the
+    parameter goes over threshold in the next n hours (default 24), with the first time it does.
+    """
+    if not (hasattr(request.user, 'subscription') and request.user.subscription and request.user.subscription.is_active()) and not request.user.is_superuser:
+        return JsonResponse({'error': 'Subscription required'}, status=403)
+
+    param_configs = MODEL_PARAMETER_CONFIGS.get(model_key)
+    if param_configs is None:
+        raise Http404("Unknown model")
+
+    requested_param_code = request.GET.get('param', '').strip().lower()
+    if requested_param_code:
+        if requested_param_code not in param_configs:
+            return JsonResponse({'error': f'Invalid {model_key.upper()} parameter'}, status=400)
+        selected_param_configs = {requested_param_code: param_configs[requested_param_code]}
+    else:
+        selected_param_configs = param_configs
+
+    locations = SavedLocation.objects.filter(profile__user=request.user)
+    requested_location_id = request.GET.get('location_id', 'all').strip().lower()
+    if requested_location_id != 'all':
+        try:
+            locations = locations.filter(pk=int(requested_location_id))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid location_id'}, status=400)
+    locations = list(locations)
+    if not locations:
+        return JsonResponse({'error': 'No saved locations found'}, status=404)
+
+    threshold_str = request.GET.get('above', '').strip()
+    if threshold_str:
+        if not requested_param_code:
+            return JsonResponse({'error': "'above' needs a 'param'"}, status=400)
+        try:
+            threshold = float(threshold_str)
+            within_hours = int(request.GET.get('hours', '24'))
+        except ValueError:
+            return JsonResponse({'error': "Invalid 'above' or 'hours'"}, status=400)
+        if not 1 <= within_hours <= MAX_EXCEEDANCE_HOURS:
+            return JsonResponse({'error': f"'hours' must be between 1 and {MAX_EXCEEDANCE_HOURS}"}, status=400)
+
+    forecast = get_point_forecast(model_key, locations,
+                                  [param_config['output_file_prefix'] for param_config in selected_param_configs.values()])
+    data_to_return = {
+        'model': model_key,
+        'locations': [{'id': location.pk, 'name': location.location_name,
+                       'latitude': float(location.latitude), 'longitude': float(location.longitude)} for location in locations],
+        'params': {
+            param_code: {'param_name': param_config['name_display'], **forecast['params'][param_config['output_file_prefix']]}
+            for param_code, param_config in selected_param_configs.items()
+        },
+    }
+    if threshold_str:
+        # One indexed query over the samples taken at ingestion (weather/point_forecast.py)
+        exceedances = find_locations_exceeding(model_key, selected_param_configs[requested_param_code]['output_file_prefix'],
+                                               threshold, locations=locations, within_hours=within_hours)
+        data_to_return['exceedances'] = [
+            {'location_id': location_id, 'first_valid_time_utc': valid_time.isoformat(), 'value': value}
+            for location_id, (valid_time, value) in exceedances.items()
+        ]
+    return JsonResponse(data_to_return)
+
 @login_required
 def premium_radar_view(request):
     # ... (Your existing premium_radar_view code from response #316) ...
@@ -497,3 +605,13 @@ def premium_radar_view(request):
     else:
         messages.warning(request, "Access to Premium Radar requires an active subscription.")
         return redirect('subscriptions:plan_selection')
+
+
+def serve_immutable_plot(request, path):
+    """
+    Serves a content-addressed plot (see plot_output.py) with far-future cache headers.
+    Only routed when DEBUG; in production the web server serving MEDIA_URL does this.
+    """
+    response = static_serve(request, path, document_root=os.path.join(settings.MEDIA_ROOT, IMMUTABLE_PLOT_DIR))
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -236,8 +236,26 @@ Q_CLUSTER = {
     'bulk': 10, 
     'orm': 'default', 
     'catch_up': True, 
+    'daemonize_workers': False, # Model plot tasks spawn their own render worker processes
 }
 
+# --- Model plot rendering (weather/render_pool.py) ---
+MODEL_RENDER_MAX_WORKERS = env.int('MODEL_RENDER_MAX_WORKERS', default=os.cpu_count() or 1) # Render processes per cycle
+MODEL_MAX_CONCURRENT_DOWNLOADS = env.int('MODEL_MAX_CONCURRENT_DOWNLOADS', default=4) # Parallel NOMADS downloads per cycle
+MODEL_INGEST_POLL_MINUTES = env.int('MODEL_INGEST_POLL_MINUTES', default=5) # How often GFS/NAM ingestion ticks look for new hours
+MODEL_MAX_FRAMES_PER_TICK = env.int('MODEL_MAX_FRAMES_PER_TICK', default=120) # Frames one tick claims; keep its renders well inside Q_CLUSTER['timeout']
+MODEL_FIELD_STORE_ENABLED = env.bool('MODEL_FIELD_STORE_ENABLED', default=True) # Keep decoded fields (weather/field_store.py)
+MODEL_TILES_ENABLED = env.bool('MODEL_TILES_ENABLED', default=True) # Also cut each plot into XYZ map tiles (weather/model_tiles.py)
+MODEL_TILE_ZOOM_LEVELS = [3, 4, 5, 6] # z6 is ~2 km/pixel over CONUS, already finer than the GFS/NAM grids
+MODEL_PROFILING = env.bool('MODEL_PROFILING', default=False) # Log per-field statistics while extracting (weather/field_transforms.py)
+MODEL_DECODE_ENGINES = {} # Per-model GRIB decode engine override, e.g. {'nam': 'cfgrib'} (see manage.py benchmark_grib_engines)
+MODEL_CYCLE_EXECUTORS = {} # Per-model cycle executor: 'pool' (default) or 'dask' (weather/cycle_graph.py), e.g. {'nam': 'dask'}
+MODEL_DASK_MEMORY_BUDGET_MB = env.int('MODEL_DASK_MEMORY_BUDGET_MB', default=4096) # Caps dask cycle worker processes
+
+# --- NWS alerts (subscriptions/alert_snapshot.py) ---
+NWS_ALERT_SNAPSHOT_PATH = env('NWS_ALERT_SNAPSHOT_PATH', default='') # Shared active-alerts snapshot; empty = MEDIA_ROOT/alerts/active_alerts.json
+NWS_ZONE_GEOMETRY_PATH = env('NWS_ZONE_GEOMETRY_PATH', default='') # Simplified zone boundaries (subscriptions/zone_geometry.py); empty = MEDIA_ROOT/alerts/zone_geometries.npz
+
 
 # --- Internationalization ---
 LANGUAGE_CODE = 'en-us'
@@ -15,7 +15,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from accounts import views as accounts_views # Import accounts views
 from accounts.views import ServiceWorkerView
 from django.views.generic import TemplateView
@@ -54,6 +54,10 @@ urlpatterns = [
 
 
 if settings.DEBUG:
+    from weather.plot_output import IMMUTABLE_PLOT_URL_PREFIX
+    from weather.views import serve_immutable_plot
+    # Before the generic media route, so content-addressed plots get their far-future cache headers
+    urlpatterns.append(re_path(rf"^{IMMUTABLE_PLOT_URL_PREFIX.lstrip('/')}(?P<path>.*)$", serve_immutable_plot))
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 